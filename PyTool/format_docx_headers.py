@@ -3,46 +3,39 @@ Script để format lại headers trong file DOCX:
 - Giữ nguyên Title ở Header 1
 - Chuyển các "Chương" từ Header 1 sang Header 2
 - Thêm page break trước mỗi chương nếu chưa có
+
+File lớn được xử lý ở chế độ streaming: word/document.xml được đọc bằng parser
+tăng dần (expat) và ghi lại ngay trong một lượt - chỉ sửa pStyle của tiêu đề chương
+và chèn paragraph page break, phần XML còn lại + các file khác trong zip giữ nguyên byte.
 """
 
 from docx import Document
 from docx.shared import Pt
 from docx.enum.text import WD_BREAK
-import re
 import os
+import posixpath
+import re
+import shutil
+import sys
+import zipfile
+import xml.etree.ElementTree as ET
 from pathlib import Path
+from xml.parsers import expat
+from xml.sax.saxutils import quoteattr
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "core"))
 
-def is_chapter_heading(text):
-    """
-    Kiểm tra xem đoạn text có phải là tiêu đề chương không.
-    Các pattern phổ biến:
-    - Chương 1
-    - Chương I
-    - Chương 001
-    - Chapter 1
-    - CHƯƠNG 1
-    """
-    if not text:
-        return False
-    
-    text = text.strip()
-    
-    # Pattern cho các dạng chương
-    patterns = [
-        r'^Chương\s+\d+',  # Chương 1, Chương 2, ...
-        r'^CHƯƠNG\s+\d+',  # CHƯƠNG 1, CHƯƠNG 2, ...
-        r'^Chương\s+[IVXLCDM]+',  # Chương I, Chương II, ... (số La Mã)
-        r'^CHƯƠNG\s+[IVXLCDM]+',  # CHƯƠNG I, CHƯƠNG II, ...
-        r'^Chapter\s+\d+',  # Chapter 1, Chapter 2, ...
-        r'^CHAPTER\s+\d+',  # CHAPTER 1, CHAPTER 2, ...
-    ]
-    
-    for pattern in patterns:
-        if re.match(pattern, text, re.IGNORECASE):
-            return True
-    
-    return False
+# Nhận diện tiêu đề chương dùng chung (Chương 1, Chương I, CHƯƠNG 001, Chapter 1...)
+from chapter_index import is_chapter_heading
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+# expat (namespace_separator=' ') trả tên dạng "<namespace> <local>"
+_W = W_NS + " "
+
+# File DOCX từ kích thước này trở lên xử lý bằng chế độ streaming
+STREAMING_MIN_BYTES = 64 * 1024
+READ_BLOCK_BYTES = 1024 * 1024
 
 
 def has_page_break_before(paragraph):
@@ -74,7 +67,284 @@ def add_page_break_before(paragraph):
     run.add_break(WD_BREAK.PAGE)
 
 
-def format_docx_headers(input_file, output_file=None):
+def _resolve_part(zf, rels_path, base_dir, rel_type_suffix, default):
+    """Đường dẫn part trong zip theo file .rels (ví dụ officeDocument, styles)"""
+    try:
+        root = ET.fromstring(zf.read(rels_path))
+    except (KeyError, ET.ParseError):
+        return default
+    for rel in root.findall(f"{{{REL_NS}}}Relationship"):
+        if rel.get("Type", "").endswith(rel_type_suffix):
+            target = rel.get("Target", "")
+            if target.startswith("/"):
+                return target.lstrip("/")
+            return posixpath.normpath(posixpath.join(base_dir, target))
+    return default
+
+
+def _read_paragraph_styles(zf, styles_path):
+    """
+    Đọc styles.xml.
+
+    Returns:
+        (heading1_ids, heading2_id, default_id, paragraph_style_ids)
+    """
+    heading1_ids = set()
+    heading2_id = None
+    default_id = None
+    style_ids = set()
+    try:
+        root = ET.fromstring(zf.read(styles_path))
+    except (KeyError, ET.ParseError):
+        return {"Heading1"}, "Heading2", None, {"Heading1", "Heading2"}
+    for style in root.findall(f"{{{W_NS}}}style"):
+        if style.get(f"{{{W_NS}}}type") != "paragraph":
+            continue
+        style_id = style.get(f"{{{W_NS}}}styleId")
+        style_ids.add(style_id)
+        name = style.find(f"{{{W_NS}}}name")
+        name = (name.get(f"{{{W_NS}}}val", "") if name is not None else "").lower()
+        if name == "heading 1":
+            heading1_ids.add(style_id)
+        elif name == "heading 2" and heading2_id is None:
+            heading2_id = style_id
+        if style.get(f"{{{W_NS}}}default") in ("1", "true", "on") and default_id is None:
+            default_id = style_id
+    return heading1_ids, heading2_id or "Heading2", default_id, style_ids
+
+
+class _BodyParagraph:
+    """Thông tin thu được khi parse một paragraph cấp body"""
+
+    def __init__(self, start, depth):
+        self.start = start              # Offset byte của thẻ <w:p>
+        self.depth = depth
+        self.style_id = None
+        self.style_pos = None           # Offset thẻ <w:pStyle>
+        self.ppr_pos = None             # Offset thẻ <w:pPr>
+        self.in_ppr = False
+        self.text = []
+        self.in_text = False
+        self.run_depth = None           # Đang trong run trực tiếp của paragraph
+        self.run_page_break = False     # Có <w:br w:type="page"/> trong run trực tiếp
+        self.page_break_before = False  # Có <w:pageBreakBefore/> trong pPr
+
+
+class _DocumentXmlRewriter:
+    """
+    Ghi lại document.xml trong một lượt: expat báo offset byte của từng thẻ nên phần
+    không đổi được chép nguyên văn, chỉ các paragraph tiêu đề chương bị sửa.
+    """
+
+    def __init__(self, out, styles, stats):
+        self.out = out
+        self.heading1_ids, self.heading2_id, self.default_style_id, self.style_ids = styles
+        self.stats = stats
+        self.parser = expat.ParserCreate(namespace_separator=" ")
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self._start
+        self.parser.EndElementHandler = self._end
+        self.parser.CharacterDataHandler = self._characters
+        self.buf = bytearray()
+        self.buf_start = 0      # Offset byte của buf[0]
+        self.written = 0        # Đã ghi ra đến offset này
+        self.safe = 0           # Trước offset này: đã parse xong, không thuộc paragraph đang mở
+        self.depth = 0
+        self.body_depth = None
+        self.para = None
+        self.index = 0
+        self.previous = None    # (text, run_page_break) của paragraph cấp body trước
+
+    def feed(self, data, final=False):
+        self.buf += data
+        self.parser.Parse(data, final)
+        self._flush(len(self.buf) + self.buf_start if final else self.safe)
+
+    def _flush(self, end):
+        if end > self.written:
+            self.out.write(self.buf[self.written - self.buf_start:end - self.buf_start])
+            self.written = end
+        del self.buf[:self.written - self.buf_start]
+        self.buf_start = self.written
+
+    def _bytes(self, start, end):
+        return bytes(self.buf[start - self.buf_start:end - self.buf_start])
+
+    def _tag_end(self, pos):
+        """Offset ngay sau dấu '>' của thẻ bắt đầu tại pos"""
+        return self.buf.index(b">", pos - self.buf_start) + 1 + self.buf_start
+
+    def _start(self, name, attrs):
+        position = self.parser.CurrentByteIndex
+        self.depth += 1
+        para = self.para
+        if para is None:
+            if name == _W + "body" and self.body_depth is None:
+                self.body_depth = self.depth
+            elif name == _W + "p" and self.body_depth is not None and self.depth == self.body_depth + 1:
+                self.para = _BodyParagraph(position, self.depth)
+                return
+            self.safe = position
+            return
+
+        relative = self.depth - para.depth
+        if name == _W + "pPr" and relative == 1 and para.ppr_pos is None:
+            para.ppr_pos = position
+            para.in_ppr = True
+        elif name == _W + "pStyle" and relative == 2 and para.in_ppr:
+            para.style_id = attrs.get(_W + "val")
+            para.style_pos = position
+        elif name == _W + "pageBreakBefore" and para.in_ppr:
+            para.page_break_before = True
+        elif name == _W + "r" and relative == 1:
+            para.run_depth = self.depth
+        elif name == _W + "t":
+            para.in_text = True
+        elif name in (_W + "tab", _W + "ptab"):
+            para.text.append("\t")
+        elif name == _W + "cr":
+            para.text.append("\n")
+        elif name == _W + "br":
+            if attrs.get(_W + "type", "textWrapping") == "textWrapping":
+                para.text.append("\n")
+            elif attrs.get(_W + "type") == "page" and para.run_depth is not None:
+                para.run_page_break = True
+
+    def _end(self, name):
+        para = self.para
+        self.depth -= 1
+        if para is None:
+            if self.depth < (self.body_depth or 0):
+                self.body_depth = None
+            return
+        if name == _W + "t":
+            para.in_text = False
+        elif name == _W + "pPr" and self.depth == para.depth:
+            para.in_ppr = False
+        elif name == _W + "r" and self.depth + 1 == para.run_depth:
+            para.run_depth = None
+        if self.depth + 1 == para.depth:
+            end = self._tag_end(self.parser.CurrentByteIndex)
+            self._finish_paragraph(para, end)
+            self.para = None
+            self.safe = end
+
+    def _characters(self, data):
+        if self.para is not None and self.para.in_text:
+            self.para.text.append(data)
+
+    def _finish_paragraph(self, para, end):
+        stats = self.stats
+        stats['total_paragraphs'] += 1
+        index = self.index
+        self.index += 1
+        text = "".join(para.text).strip()
+        previous = self.previous
+        self.previous = (text, para.run_page_break)
+
+        style_id = para.style_id if para.style_id in self.style_ids else self.default_style_id
+        if style_id not in self.heading1_ids:
+            return
+        stats['header1_found'] += 1
+        if not is_chapter_heading(text):
+            # Không phải chương, giữ nguyên Header 1 (Title)
+            stats['titles_kept'] += 1
+            print(f"  Giữ nguyên title: {text}")
+            return
+
+        print(f"  Tìm thấy chương: {text}")
+        stats['chapters_converted'] += 1
+        data = self._bytes(para.start, end)
+        prefix = re.match(rb"<([\w.-]+:)?", data).group(1) or b""
+
+        # Chép phần trước paragraph, chèn page break nếu cần (không thêm cho paragraph đầu tiên)
+        self._flush(para.start)
+        if index > 0 and not (para.run_page_break or para.page_break_before):
+            previous_text, previous_break = previous
+            if previous_text != '' or not previous_break:
+                self.out.write(b"<%sp><%sr><%sbr %stype=\"page\"/></%sr></%sp>"
+                               % (prefix, prefix, prefix, prefix, prefix, prefix))
+                stats['page_breaks_added'] += 1
+                print(f"    → Đã thêm page break")
+
+        # Chuyển sang Header 2
+        style_value = quoteattr(self.heading2_id).encode("utf-8")
+        if para.style_pos is not None:
+            tag_start = para.style_pos - para.start
+            tag_end = self._tag_end(para.style_pos) - para.start
+            tag = re.sub(rb":?val\s*=\s*(\"[^\"]*\"|'[^']*')",
+                         lambda m: m.group(0).split(b"=")[0] + b"=" + style_value, data[tag_start:tag_end], count=1)
+            data = data[:tag_start] + tag + data[tag_end:]
+        else:
+            style_tag = b"<%spStyle %sval=%s/>" % (prefix, prefix, style_value)
+            if para.ppr_pos is not None:
+                insert_at = self._tag_end(para.ppr_pos) - para.start
+                if data[insert_at - 2:insert_at] == b"/>":
+                    # <w:pPr/> -> <w:pPr><w:pStyle .../></w:pPr>
+                    data = (data[:insert_at - 2] + b">" + style_tag + b"</%spPr>" % prefix + data[insert_at:])
+                else:
+                    data = data[:insert_at] + style_tag + data[insert_at:]
+            else:
+                insert_at = self._tag_end(para.start) - para.start
+                data = data[:insert_at] + b"<%spPr>%s</%spPr>" % (prefix, style_tag, prefix) + data[insert_at:]
+        self.out.write(data)
+        self.written = end
+        print(f"    → Đã chuyển sang Header 2")
+
+
+def format_docx_headers_streaming(input_file, output_file=None):
+    """
+    Như format_docx_headers nhưng không dựng cả document bằng python-docx:
+    document.xml được parse tăng dần và ghi lại trong một lượt, các file khác
+    trong zip được chép nguyên vẹn. Bộ nhớ không phụ thuộc số paragraph.
+
+    Returns:
+        dict: Thống kê
+    """
+    if output_file is None:
+        output_file = input_file
+    stats = {
+        'total_paragraphs': 0,
+        'header1_found': 0,
+        'chapters_converted': 0,
+        'page_breaks_added': 0,
+        'titles_kept': 0
+    }
+
+    temp_path = f"{output_file}.tmp"
+    try:
+        with zipfile.ZipFile(input_file) as src, \
+                zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as dst:
+            document_path = _resolve_part(src, "_rels/.rels", "", "/officeDocument", "word/document.xml")
+            document_dir, document_name = posixpath.split(document_path)
+            styles_path = _resolve_part(src, posixpath.join(document_dir, "_rels", document_name + ".rels"),
+                                        document_dir, "/styles", posixpath.join(document_dir, "styles.xml"))
+            styles = _read_paragraph_styles(src, styles_path)
+
+            for item in src.infolist():
+                with src.open(item) as source:
+                    if item.filename != document_path:
+                        with dst.open(item, "w", force_zip64=item.file_size > 0x7fffffff) as target:
+                            shutil.copyfileobj(source, target, READ_BLOCK_BYTES)
+                        continue
+                    target_info = zipfile.ZipInfo(item.filename, item.date_time)
+                    target_info.compress_type = zipfile.ZIP_DEFLATED
+                    with dst.open(target_info, "w", force_zip64=True) as target:
+                        rewriter = _DocumentXmlRewriter(target, styles, stats)
+                        while True:
+                            block = source.read(READ_BLOCK_BYTES)
+                            rewriter.feed(block, final=not block)
+                            if not block:
+                                break
+        os.replace(temp_path, output_file)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return stats
+
+
+def format_docx_headers(input_file, output_file=None, streaming=None):
     """
     Format lại headers trong file DOCX:
     - Giữ nguyên Title ở Header 1
@@ -84,9 +354,19 @@ def format_docx_headers(input_file, output_file=None):
     Args:
         input_file: Đường dẫn file DOCX đầu vào
         output_file: Đường dẫn file DOCX đầu ra (nếu None, sẽ ghi đè file gốc)
+        streaming: True = xử lý streaming (format_docx_headers_streaming), False = python-docx,
+            None = streaming nếu file >= STREAMING_MIN_BYTES
     """
     print(f"Đang xử lý file: {input_file}")
     
+    if streaming is None:
+        streaming = os.path.getsize(input_file) >= STREAMING_MIN_BYTES
+    if streaming:
+        print("  (Chế độ streaming)")
+        stats = format_docx_headers_streaming(input_file, output_file)
+        print_stats(output_file or input_file, stats)
+        return
+    
     # Mở document
     doc = Document(input_file)
     
@@ -151,6 +431,11 @@ def format_docx_headers(input_file, output_file=None):
     # Lưu document
     doc.save(output_file)
     
+    print_stats(output_file, stats)
+
+
+def print_stats(output_file, stats):
+    """In kết quả format"""
     print(f"\n✓ Hoàn thành!")
     print(f"  File output: {output_file}")
     print(f"\nThống kê:")
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Engine gộp file .txt dùng chung cho merge_txt_files.py và merge_txt_file_no_header_name_file.py
+
+- Encoding của mọi file được phát hiện song song (thread pool) từ một mẫu byte:
+  BOM -> thống kê byte 0 (UTF-16 không BOM) -> decoder tăng dần (không lỗi khi
+  mẫu cắt ngang ký tự nhiều byte). File lớn hơn mẫu (không có BOM) được kiểm tra
+  tiếp cả file bằng decoder tăng dần, lỗi thì chuyển sang encoding kế tiếp, nên
+  file cp1252 có 64 KB đầu toàn ASCII không bị đọc nhầm thành UTF-8.
+- Nội dung được chuyển mã theo từng khối và ghi thẳng vào file output (UTF-8,
+  không BOM, xuống dòng \\n) nên bộ nhớ không tăng theo số file / kích thước file.
+- Số dòng được đếm trong lúc ghi và in ra ngay sau mỗi file.
+"""
+
+import codecs
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Số byte mẫu dùng để phát hiện encoding
+SAMPLE_BYTES = 64 * 1024
+# Số ký tự mỗi khối khi chuyển mã
+BLOCK_CHARS = 1024 * 1024
+# Tỷ lệ byte 0 ở vị trí chẵn/lẻ để coi là UTF-16 không BOM (văn bản ASCII/Latin trong UTF-16)
+UTF16_ZERO_RATIO = 0.3
+
+HEADER_LINE = "=" * 80
+
+_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),   # Phải kiểm tra trước UTF-16 LE (cùng tiền tố FF FE)
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+)
+
+
+def _decodes(sample, encoding, complete):
+    """Mẫu có decode được không (complete=False: bỏ qua ký tự bị cắt ở cuối mẫu)"""
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(sample, final=complete)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def detect_encoding_from_sample(sample, complete=True):
+    """
+    Phát hiện encoding từ mẫu byte đầu file
+
+    Args:
+        sample: Các byte đầu file
+        complete: Mẫu là toàn bộ file (False = có thể bị cắt ngang một ký tự ở cuối)
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    if not sample:
+        return 'utf-8'
+
+    # UTF-16 không BOM: văn bản chữ Latin có byte 0 xen kẽ ở vị trí lẻ (LE) hoặc chẵn (BE)
+    half = len(sample) // 2
+    if half:
+        zeros_even = sample[0:half * 2:2].count(0)
+        zeros_odd = sample[1:half * 2:2].count(0)
+        if zeros_odd > half * UTF16_ZERO_RATIO and zeros_even < half * 0.05 and _decodes(sample, 'utf-16-le', complete):
+            return 'utf-16-le'
+        if zeros_even > half * UTF16_ZERO_RATIO and zeros_odd < half * 0.05 and _decodes(sample, 'utf-16-be', complete):
+            return 'utf-16-be'
+
+    for encoding in ('utf-8', 'cp1252'):
+        if _decodes(sample, encoding, complete):
+            return encoding
+    # latin-1 decode được mọi byte
+    return 'latin-1'
+
+
+# Thứ tự thử lại khi encoding đoán từ mẫu không decode được cả file
+_FALLBACK_ENCODINGS = ('utf-8', 'cp1252')
+
+
+def _file_decodes(f, encoding):
+    """Cả file (đọc lại từ đầu theo khối) có decode được bằng encoding không"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    f.seek(0)
+    try:
+        for block in iter(lambda: f.read(SAMPLE_BYTES), b''):
+            decoder.decode(block)
+        decoder.decode(b'', final=True)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def detect_encoding(file_path, sample_size=SAMPLE_BYTES):
+    """
+    Phát hiện encoding của file (UTF-8/16/32, cp1252, latin-1)
+    Đoán từ mẫu byte đầu file; nếu file dài hơn mẫu thì kiểm tra cả file trước khi dùng
+    """
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+        complete = len(sample) < sample_size
+        encoding = detect_encoding_from_sample(sample, complete=complete)
+        if complete or encoding == 'latin-1' or any(sample.startswith(bom) for bom, _ in _BOMS):
+            return encoding
+
+        # Mẫu đúng chưa chắc cả file đúng (ví dụ phần đầu toàn ASCII)
+        if encoding in _FALLBACK_ENCODINGS:
+            candidates = _FALLBACK_ENCODINGS[_FALLBACK_ENCODINGS.index(encoding):]
+        else:
+            candidates = (encoding,) + _FALLBACK_ENCODINGS
+        for candidate in candidates:
+            if _file_decodes(f, candidate):
+                return candidate
+    return 'latin-1'
+
+
+def _iter_text_blocks(file_path, encoding):
+    """Đọc file theo khối text (xuống dòng \\r\\n, \\r đã chuyển thành \\n)"""
+    with open(file_path, 'r', encoding=encoding, errors='replace', newline=None) as f:
+        first = True
+        while True:
+            block = f.read(BLOCK_CHARS)
+            if not block:
+                return
+            # Loại bỏ BOM nếu còn sót lại (ví dụ utf-32-le có BOM)
+            if first and block.startswith('\ufeff'):
+                block = block[1:]
+            first = False
+            yield block
+
+
+def _write_file_content(out, file_path, encoding, separator, header):
+    """
+    Ghi nội dung một file (đã strip đầu/cuối) sau dấu phân cách + header.
+
+    Returns:
+        Số dòng của header + nội dung ("\\n" + 1), hoặc None nếu file rỗng (không ghi gì)
+    """
+    started = False
+    held = ''       # Khoảng trắng cuối khối - chỉ ghi khi còn nội dung phía sau
+    newlines = 0
+    for block in _iter_text_blocks(file_path, encoding):
+        if not started:
+            block = block.lstrip()
+            if not block:
+                continue
+            started = True
+            out.write(separator + header)
+            newlines += header.count('\n')
+        text = held + block
+        body = text.rstrip()
+        held = text[len(body):]
+        if body:
+            out.write(body)
+            newlines += body.count('\n')
+    return newlines + 1 if started else None
+
+
+def merge_text_files(txt_files, output_path, separator='\n\n', add_file_header=True, workers=None):
+    """
+    Gộp các file theo thứ tự vào output_path (ghi ra <output>.tmp rồi đổi tên khi xong).
+
+    Args:
+        txt_files: Danh sách file theo thứ tự gộp
+        output_path: File output
+        separator: Chuỗi phân cách giữa các file
+        add_file_header: Thêm tên file (không đuôi) làm tiêu đề trước nội dung
+        workers: Số thread phát hiện encoding (None = tự chọn)
+
+    Returns:
+        dict thống kê: success, errors, skipped, lines
+    """
+    stats = {"success": 0, "errors": 0, "skipped": 0, "lines": 0}
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    temp_path = f"{output_path}.tmp"
+    output_real = os.path.realpath(output_path)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+                open(temp_path, 'w', encoding='utf-8', newline='\n') as out:
+            files = [path for path in txt_files if os.path.realpath(path) != output_real]
+            detections = [executor.submit(detect_encoding, path) for path in files]
+
+            for txt_file, detection in zip(files, detections):
+                file_name = os.path.basename(txt_file)
+                position = out.tell()
+                try:
+                    encoding = detection.result()
+                    header = ''
+                    if add_file_header:
+                        file_title = os.path.splitext(file_name)[0]
+                        header = f"{HEADER_LINE}\n{file_title}\n{HEADER_LINE}\n\n"
+                    lines = _write_file_content(out, txt_file, encoding,
+                                                separator if stats["success"] else '', header)
+                    if lines is None:
+                        print(f"⚠️  {file_name} (rỗng - bỏ qua)")
+                        stats["skipped"] += 1
+                        continue
+                    stats["success"] += 1
+                    stats["lines"] += lines
+                    print(f"✅ {file_name} ({encoding}, {lines:,} dòng - tổng {stats['lines']:,})")
+                except Exception as e:
+                    # Bỏ phần đã ghi dở của file lỗi
+                    out.seek(position)
+                    out.truncate()
+                    print(f"❌ Lỗi khi đọc {file_name}: {str(e)}")
+                    stats["errors"] += 1
+
+        if stats["success"]:
+            os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return stats
@@ -7,51 +7,105 @@ Hỗ trợ xử lý nhiều file cùng lúc
 """
 
 import os
+import sys
 import glob
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
 from docx import Document
 from docx.shared import Pt, Inches
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "core"))
 
-def detect_encoding(file_path):
+from chapter_index import INTRO_TITLE, load_chapter_index, read_chapter_text, render_chapters, resolve_workers
+from docx_writer import write_docx, paragraph_xml, run_xml, heading_xml
+# Phát hiện encoding từ một mẫu byte (dùng chung với tool gộp file)
+from merge_engine import detect_encoding
+
+# Encoding tương thích ASCII (tách dòng theo byte b'\n' được) -> có thể chia file theo chỉ mục chương
+INDEXABLE_ENCODINGS = ('utf-8', 'utf-8-sig', 'ascii', 'cp1252', 'latin-1')
+
+# File báo cáo của chế độ batch (không dùng đuôi .txt để lần chạy sau không coi là file đầu vào)
+REPORT_FILE_NAME = "txt_to_word_report.log"
+
+
+def is_sub_heading(lines):
+    """Dòng đơn và ngắn (< 100 ký tự), không kết thúc bằng dấu câu -> tiêu đề phụ"""
+    return len(lines) == 1 and len(lines[0]) < 100 and not lines[0].endswith(('.', ',', '!', '?', ';'))
+
+
+def render_paragraphs_xml(text):
+    """XML các đoạn văn của một phần văn bản (cùng định dạng với txt_to_word)"""
+    parts = []
+    for para_text in text.split('\n\n'):
+        if not para_text.strip():
+            continue
+        lines = para_text.strip().split('\n')
+        if is_sub_heading(lines):
+            parts.append(heading_xml(lines[0], 2))
+        else:
+            # Giữ nguyên các dòng ngắt trong đoạn văn
+            runs = "".join(
+                ('<w:r><w:br/></w:r>' if i > 0 else '') + run_xml(line.strip(), font_size=12)
+                for i, line in enumerate(lines) if line.strip()
+            )
+            parts.append(paragraph_xml(runs, line_spacing=1.5, space_after=6, first_line_indent=0.5))
+    return "".join(parts)
+
+
+def render_chapter_range(txt_path, index, entry, encoding):
+    """Render một chương theo chỉ mục (chạy trong process pool)"""
+    text = read_chapter_text(txt_path, entry, encoding).replace('\r\n', '\n').replace('\r', '\n')
+    if entry["title"] and entry["title"] != INTRO_TITLE:
+        # Nội dung chương bắt đầu ngay sau tiêu đề (kể cả ký tự xuống dòng của dòng tiêu đề):
+        # ghép lại đúng như trong file để chia đoạn giống hệt chế độ tuần tự
+        text = entry["title"] + text
+    return render_paragraphs_xml(text)
+
+
+def txt_to_word_parallel(txt_path, docx_path, file_name, encoding, workers=None, use_index_cache=True):
     """
-    Phát hiện encoding của file
+    Ghi DOCX bằng cách chia file theo chỉ mục chương và render XML từng chương
+    trong process pool, rồi ghép theo thứ tự vào document.xml.
     """
-    # Kiểm tra BOM trước
-    with open(file_path, 'rb') as f:
-        raw = f.read(4)
-        if raw.startswith(b'\xff\xfe\x00\x00'):
-            return 'utf-32-le'
-        elif raw.startswith(b'\x00\x00\xfe\xff'):
-            return 'utf-32-be'
-        elif raw.startswith(b'\xff\xfe') or raw.startswith(b'\xfe\xff'):
-            return 'utf-16'
-        elif raw.startswith(b'\xef\xbb\xbf'):
-            return 'utf-8-sig'
-    
-    # Thử các encoding phổ biến
-    encodings = ['utf-8', 'utf-8-sig', 'utf-16', 'utf-16-le', 'utf-16-be', 
-                 'cp1252', 'latin-1', 'ascii']
-    
-    for encoding in encodings:
-        try:
-            with open(file_path, 'r', encoding=encoding) as f:
-                sample = f.read(8192)
-                if sample:
-                    return encoding
-        except (UnicodeDecodeError, UnicodeError, LookupError):
-            continue
-    
-    return 'utf-8'
+    entries = load_chapter_index(txt_path, encoding=encoding, use_cache=use_index_cache)
+    if not entries:
+        return False, None, "File rỗng"
+
+    def body():
+        # Tiêu đề (tên file) + một dòng trống
+        yield heading_xml(file_name, 1, align="center")
+        yield paragraph_xml()
+        for _, xml in render_chapters(txt_path, entries, render_chapter_range, args=(encoding,), workers=workers):
+            yield xml
+
+    write_docx(docx_path, body(), margin_inches=1)
+    return True, docx_path, None
+
+
+def get_docx_path(txt_path, output_folder=None):
+    """Đường dẫn file .docx tương ứng (None = cùng thư mục với file gốc)"""
+    file_name = os.path.splitext(os.path.basename(txt_path))[0]
+    return os.path.join(output_folder or os.path.dirname(txt_path), f"{file_name}.docx")
+
+
+def is_up_to_date(txt_path, docx_path):
+    """File Word đã tồn tại và không cũ hơn file TXT"""
+    return os.path.exists(docx_path) and os.path.getmtime(docx_path) >= os.path.getmtime(txt_path)
 
 
-def txt_to_word(txt_path, output_folder=None):
+def txt_to_word(txt_path, output_folder=None, workers=1, direct_xml=False):
     """
     Chuyển đổi file .txt sang .docx
     
     Args:
         txt_path (str): Đường dẫn đến file .txt
         output_folder (str): Thư mục lưu file output (None = cùng thư mục với file gốc)
+        workers (int): Số process render chương (1 = tuần tự bằng python-docx,
+                None = tự chọn theo kích thước file)
+        direct_xml (bool): Ghi thẳng XML (docx_writer) kể cả khi render tuần tự -
+                nhanh hơn python-docx, dùng trong chế độ batch
     
     Returns:
         tuple: (success, docx_path, error_message)
@@ -67,12 +121,17 @@ def txt_to_word(txt_path, output_folder=None):
         # Xác định đường dẫn output
         if output_folder:
             os.makedirs(output_folder, exist_ok=True)
-            docx_path = os.path.join(output_folder, f"{file_name}.docx")
-        else:
-            docx_path = os.path.join(os.path.dirname(txt_path), f"{file_name}.docx")
+        docx_path = get_docx_path(txt_path, output_folder)
         
         # Đọc nội dung file
         encoding = detect_encoding(txt_path)
+        if encoding in INDEXABLE_ENCODINGS:
+            render_workers = resolve_workers(txt_path, workers)
+            if render_workers > 1 or direct_xml:
+                # Batch nhiều file nhỏ: không lưu <file>.chapters.json cạnh từng file
+                return txt_to_word_parallel(txt_path, docx_path, file_name, encoding, render_workers,
+                                            use_index_cache=not direct_xml)
+        
         with open(txt_path, 'r', encoding=encoding, errors='replace') as f:
             content = f.read()
         
@@ -112,7 +171,7 @@ def txt_to_word(txt_path, output_folder=None):
                 lines = para_text.strip().split('\n')
                 
                 # Nếu là dòng đơn và ngắn (< 100 ký tự), có thể là tiêu đề phụ
-                if len(lines) == 1 and len(lines[0]) < 100 and not lines[0].endswith(('.', ',', '!', '?', ';')):
+                if is_sub_heading(lines):
                     # Thêm như heading level 2
                     doc.add_heading(lines[0], level=2)
                 else:
@@ -141,13 +200,50 @@ def txt_to_word(txt_path, output_folder=None):
         return False, None, str(e)
 
 
-def convert_multiple_files(input_path, output_folder=None):
+def _convert_task(txt_path, output_folder):
+    """Chuyển một file trong process pool của chế độ batch"""
+    start_time = time.time()
+    success, docx_path, error = txt_to_word(txt_path, output_folder, workers=1, direct_xml=True)
+    return success, docx_path, error, time.time() - start_time
+
+
+def write_report(report_path, results, elapsed):
+    """
+    Ghi báo cáo batch.
+
+    Args:
+        results: List (file_name, status, docx_path, error, seconds) - status: ok / skipped / error
+    """
+    counts = {status: sum(1 for r in results if r[1] == status) for status in ("ok", "skipped", "error")}
+    lines = [
+        f"Báo cáo chuyển đổi TXT sang Word - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"Thành công: {counts['ok']} | Bỏ qua (đã mới nhất): {counts['skipped']} | Lỗi: {counts['error']}",
+        f"Tổng thời gian: {elapsed:.1f}s",
+        "",
+    ]
+    for file_name, status, docx_path, error, seconds in results:
+        if status == "ok":
+            lines.append(f"[OK]      {file_name} -> {os.path.basename(docx_path)} ({seconds:.2f}s)")
+        elif status == "skipped":
+            lines.append(f"[BỎ QUA]  {file_name} -> {os.path.basename(docx_path)}")
+        else:
+            lines.append(f"[LỖI]     {file_name}: {error}")
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def convert_multiple_files(input_path, output_folder=None, workers=None, force=False):
     """
     Convert nhiều file txt sang word
     
+    Nhiều file: chia file cho process pool (mỗi process chuyển trọn một file), bỏ qua
+    file Word đã mới hơn file TXT và ghi báo cáo REPORT_FILE_NAME vào thư mục output.
+    
     Args:
         input_path (str): Đường dẫn đến file hoặc thư mục
         output_folder (str): Thư mục lưu output
+        workers (int): Số process tối đa (None = số CPU)
+        force (bool): Chuyển lại cả file Word đã mới nhất
     """
     print("="*80)
     print(" "*20 + "CHUYỂN ĐỔI TXT SANG WORD")
@@ -178,45 +274,88 @@ def convert_multiple_files(input_path, output_folder=None):
     print(f"📁 Tìm thấy {len(txt_files)} file .txt")
     print(f"📝 Đang chuyển đổi...\n")
     
-    # Convert từng file
-    success_count = 0
-    error_count = 0
-    results = []
+    start_time = time.time()
+    results = {}   # txt_file -> (file_name, status, docx_path, error, seconds)
+    
+    # Bỏ qua file Word đã mới hơn file TXT
+    pending = []
+    for txt_file in txt_files:
+        docx_path = get_docx_path(txt_file, output_folder)
+        if not force and is_up_to_date(txt_file, docx_path):
+            results[txt_file] = (os.path.basename(txt_file), "skipped", docx_path, None, 0.0)
+        else:
+            pending.append(txt_file)
+    if len(pending) < len(txt_files):
+        print(f"⏭️  Bỏ qua {len(txt_files) - len(pending)} file (file Word đã mới nhất)")
     
-    for i, txt_file in enumerate(txt_files, 1):
+    def record(txt_file, success, docx_path, error, seconds):
         file_name = os.path.basename(txt_file)
-        print(f"[{i}/{len(txt_files)}] Đang xử lý: {file_name}", end=' ... ')
-        
-        success, docx_path, error = txt_to_word(txt_file, output_folder)
-        
+        done = sum(1 for r in results.values() if r[1] != "skipped") + 1
         if success:
-            print(f"✅ Thành công")
-            success_count += 1
-            results.append((file_name, docx_path, True))
+            print(f"[{done}/{len(pending)}] ✅ {file_name} ({seconds:.1f}s)")
+            results[txt_file] = (file_name, "ok", docx_path, None, seconds)
         else:
-            print(f"❌ Lỗi: {error}")
-            error_count += 1
-            results.append((file_name, None, False))
+            print(f"[{done}/{len(pending)}] ❌ {file_name}: {error}")
+            results[txt_file] = (file_name, "error", None, error, seconds)
+    
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pending))) if pending else 1
+    if len(pending) == 1:
+        # Một file lớn: render song song theo chương
+        txt_file = pending[0]
+        task_start = time.time()
+        success, docx_path, error = txt_to_word(txt_file, output_folder, workers=None)
+        record(txt_file, success, docx_path, error, time.time() - task_start)
+    elif workers == 1:
+        for txt_file in pending:
+            record(txt_file, *_convert_task(txt_file, output_folder))
+    elif pending:
+        # Nhiều file: mỗi process chuyển trọn một file, số process bị giới hạn
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_convert_task, txt_file, output_folder): txt_file for txt_file in pending}
+            for future in as_completed(futures):
+                try:
+                    record(futures[future], *future.result())
+                except Exception as e:
+                    record(futures[future], False, None, str(e), 0.0)
+    
+    elapsed = time.time() - start_time
+    ordered = [results[txt_file] for txt_file in txt_files]
+    success_count = sum(1 for r in ordered if r[1] == "ok")
+    skipped_count = sum(1 for r in ordered if r[1] == "skipped")
+    error_count = sum(1 for r in ordered if r[1] == "error")
+    
+    # Ghi báo cáo
+    report_folder = output_folder or (input_path if os.path.isdir(input_path) else os.path.dirname(input_path))
+    report_path = os.path.join(report_folder, REPORT_FILE_NAME)
+    try:
+        write_report(report_path, ordered, elapsed)
+    except OSError as e:
+        print(f"⚠️ Không thể ghi báo cáo: {e}")
+        report_path = None
     
     # Hiển thị kết quả
     print(f"\n{'='*80}")
     print(f"✨ Hoàn thành!")
     print(f"📊 Thống kê:")
     print(f"   - Thành công: {success_count} file")
+    print(f"   - Bỏ qua (đã mới nhất): {skipped_count} file")
     print(f"   - Lỗi: {error_count} file")
+    print(f"   - Thời gian: {elapsed:.1f}s ({workers} process)")
     
     if output_folder:
         print(f"📁 Thư mục output: {os.path.abspath(output_folder)}")
+    if report_path:
+        print(f"📋 Báo cáo: {report_path}")
     
     print(f"\n📄 Danh sách file đã tạo:")
-    for file_name, docx_path, success in results:
-        if success:
+    for file_name, status, docx_path, _, _ in ordered:
+        if status == "ok":
             print(f"   ✅ {file_name} → {os.path.basename(docx_path)}")
     
     if error_count > 0:
         print(f"\n❌ File lỗi:")
-        for file_name, _, success in results:
-            if not success:
+        for file_name, status, _, _, _ in ordered:
+            if status == "error":
                 print(f"   ❌ {file_name}")
     
     print(f"{'='*80}")
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark thời gian import (khởi động GUI/CLI) và kiểm tra ngân sách khởi động
+
+Mỗi module được import trong một process Python mới (không có cache sys.modules),
+đo bằng time.perf_counter, lặp nhiều lần và lấy trung vị. Ngoài thời gian, script
+kiểm tra hai điều kiện khác của ngân sách:
+- Không module nặng nào (requests, docx/lxml, google.generativeai...) được import
+  lúc khởi động - chúng chỉ được import ở lần dùng đầu tiên.
+- Import không có side effect in ra console (không print lúc import).
+
+Exit code 1 nếu có module vượt ngân sách - dùng được trong CI / trước khi build exe.
+
+Ví dụ:
+    python benchmark_startup.py                         # tất cả module với ngân sách mặc định
+    python benchmark_startup.py --target src.core.translate --runs 10
+    python benchmark_startup.py --budget-ms 200 --json startup.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# Import theo gói src.* như bản đóng gói (run_gui.py / build_exe.py)
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Module -> ngân sách thời gian import (ms, trung vị)
+DEFAULT_BUDGETS_MS = {
+    "src.core.translate": 250,
+    "src.core": 350,
+    "src.gui.gui_simple": 500,
+    "src.gui.gui_modern": 1500,
+}
+
+# Module chỉ được import khi thật sự dùng (tên gốc hoặc tiền tố gói)
+HEAVY_MODULES = (
+    "requests",
+    "urllib3",
+    "docx",
+    "lxml",
+    "google.generativeai",
+    "google.genai",
+    "zstandard",
+)
+
+# Chạy trong process con: import target, in kết quả dạng JSON ở dòng cuối
+_PROBE = r"""
+import contextlib, importlib, io, json, sys, time
+sys.path.insert(0, {root!r})
+heavy = {heavy!r}
+captured = io.StringIO()
+start = time.perf_counter()
+try:
+    with contextlib.redirect_stdout(captured):
+        importlib.import_module({target!r})
+except ImportError as e:
+    print(json.dumps({{"skipped": str(e)}}))
+    sys.exit(0)
+seconds = time.perf_counter() - start
+loaded = sorted(m for m in sys.modules if any(m == h or m.startswith(h + ".") for h in heavy))
+print(json.dumps({{"seconds": seconds, "heavy": loaded, "output": captured.getvalue()}}))
+"""
+
+
+def probe(target):
+    """Import target trong process mới, trả về dict kết quả"""
+    code = _PROBE.format(root=ROOT_DIR, heavy=HEAVY_MODULES, target=target)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            encoding="utf-8", errors="replace", cwd=ROOT_DIR)
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return {"error": (result.stderr or result.stdout).strip().splitlines()[-1:] or ["unknown"]}
+    return json.loads(lines[-1])
+
+
+def run_target(target, runs, budget_ms):
+    """Đo một module, trả về dict kết quả (status: ok / over_budget / heavy_import / import_output / skipped / error)"""
+    samples = []
+    heavy = set()
+    output = ""
+    for _ in range(runs):
+        result = probe(target)
+        if "skipped" in result:
+            return {"target": target, "status": "skipped", "reason": result["skipped"]}
+        if "error" in result:
+            return {"target": target, "status": "error", "reason": result["error"][0]}
+        samples.append(result["seconds"] * 1000)
+        heavy.update(result["heavy"])
+        output = output or result["output"]
+
+    median_ms = statistics.median(samples)
+    if heavy:
+        status = "heavy_import"
+    elif output.strip():
+        status = "import_output"
+    elif median_ms > budget_ms:
+        status = "over_budget"
+    else:
+        status = "ok"
+    return {
+        "target": target,
+        "status": status,
+        "median_ms": round(median_ms, 1),
+        "min_ms": round(min(samples), 1),
+        "max_ms": round(max(samples), 1),
+        "budget_ms": budget_ms,
+        "heavy_modules": sorted(heavy),
+        "import_output": output.strip()[:500],
+    }
+
+
+def print_result(result):
+    status = result["status"]
+    target = result["target"]
+    if status in ("skipped", "error"):
+        icon = "⏭️ " if status == "skipped" else "❌"
+        print(f"{icon} {target}: {status} ({result['reason']})")
+        return
+    icon = "✅" if status == "ok" else "❌"
+    print(f"{icon} {target}: {result['median_ms']:.1f} ms trung vị "
+          f"(min {result['min_ms']:.1f}, max {result['max_ms']:.1f}, ngân sách {result['budget_ms']} ms)")
+    if result["heavy_modules"]:
+        packages = sorted({name for name in HEAVY_MODULES
+                           if any(m == name or m.startswith(name + ".") for m in result["heavy_modules"])})
+        print(f"   ⚠️ Module nặng bị import lúc khởi động: {', '.join(packages)}")
+    if result["import_output"]:
+        print(f"   ⚠️ Import có in ra console: {result['import_output'].splitlines()[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark thời gian import và kiểm tra ngân sách khởi động")
+    parser.add_argument("--target", action="append", help="Module cần đo (lặp lại được, mặc định: tất cả)")
+    parser.add_argument("--runs", type=int, default=5, help="Số lần đo mỗi module (mặc định: 5)")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Ngân sách chung (ms) thay cho mặc định từng module")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    targets = args.target or list(DEFAULT_BUDGETS_MS)
+    print(f"🚀 Đo thời gian import ({args.runs} lần/module, Python {sys.version.split()[0]})\n")
+    results = []
+    for target in targets:
+        budget = args.budget_ms if args.budget_ms is not None else DEFAULT_BUDGETS_MS.get(target, 500)
+        result = run_target(target, max(1, args.runs), budget)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 Đã ghi kết quả: {args.json}")
+
+    failed = [r for r in results if r["status"] not in ("ok", "skipped")]
+    if failed:
+        print(f"\n❌ {len(failed)} module vượt ngân sách khởi động")
+        return 1
+    print("\n✅ Tất cả module trong ngân sách khởi động")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
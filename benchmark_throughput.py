@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark throughput end-to-end cho translate_file_optimized với mock provider
+
+Chạy toàn bộ pipeline dịch (chia chunk, thread pool, retry, ghi output/progress)
+trên file truyện giả lập, provider là MockBackend (không tốn quota, kết quả tất định
+theo seed). Dùng để so sánh trước/sau khi tối ưu retry, hedging, số threads...
+
+Ví dụ:
+    python benchmark_throughput.py                          # chạy tất cả kịch bản mẫu
+    python benchmark_throughput.py --scenario flaky --workers 16
+    python benchmark_throughput.py --scenario custom --latency exp:2.0 --error-503 0.1 --http
+    python benchmark_throughput.py --json results.json
+
+Lưu ý: time_scale chỉ tăng tốc latency/cửa sổ RPM của mock; thời gian chờ backoff
+khi gặp lỗi 429/503 trong pipeline vẫn là thời gian thật.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "core"))
+
+import translate
+from mock_provider import MockBackend, set_mock_backend, start_mock_server
+
+
+# Kịch bản mẫu: tham số cho MockBackend
+SCENARIOS = {
+    "baseline": {"latency": "lognormal:-0.5:0.4"},
+    "tail": {"latency": "lognormal:-0.5:1.2"},
+    "flaky": {"latency": "lognormal:-0.5:0.4", "error_503_rate": 0.05, "truncation_rate": 0.03, "refusal_rate": 0.02},
+    "rate-limited": {"latency": "lognormal:-0.5:0.4", "rpm": 30, "quota_scope": "project"},
+}
+
+
+def generate_input_file(path, num_chunks, chunk_size, chapter_every=10):
+    """Tạo file truyện giả: mỗi dòng kết thúc bằng dấu câu, có tiêu đề chương định kỳ"""
+    with open(path, "w", encoding="utf-8") as f:
+        line_no = 0
+        for chunk in range(num_chunks):
+            for i in range(chunk_size):
+                if i == 0 and chunk % chapter_every == 0:
+                    f.write(f"Chapter {chunk // chapter_every + 1}\n")
+                else:
+                    f.write(f"Line {line_no}: the hero walked through the quiet village at dusk, thinking about chunk {chunk}.\n")
+                line_no += 1
+
+
+def run_scenario(name, backend_kwargs, args):
+    """Chạy một kịch bản, trả về dict kết quả"""
+    backend = MockBackend(seed=args.seed, time_scale=args.time_scale, **backend_kwargs)
+    set_mock_backend(backend)
+
+    keys = [f"mock-key-{i + 1}" for i in range(args.keys)]
+    model_settings = {"hedging": args.hedging}
+    provider = "Mock"
+    server = None
+    if args.http:
+        server, base_url = start_mock_server(backend)
+        provider = "OpenAI Compatible"
+        model_settings["base_url"] = base_url
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+        input_file = os.path.join(tmp, "input.txt")
+        output_file = os.path.join(tmp, "output.txt")
+        generate_input_file(input_file, args.chunks, args.chunk_size)
+
+        log = open(os.devnull, "w", encoding="utf-8") if not args.verbose else None
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(log) if log else contextlib.nullcontext():
+                success = translate.translate_file_optimized(
+                    input_file, output_file,
+                    api_key=keys if len(keys) > 1 and not args.http else keys[0],
+                    model_name="mock-model",
+                    num_workers=args.workers,
+                    chunk_size_lines=args.chunk_size,
+                    provider=provider,
+                    model_settings=model_settings,
+                )
+        finally:
+            elapsed = time.perf_counter() - start
+            if log:
+                log.close()
+            if server:
+                server.shutdown()
+
+        error_chunks = 0
+        if os.path.exists(output_file):
+            with open(output_file, "r", encoding="utf-8") as f:
+                error_chunks = sum(1 for line in f if translate.is_error_chunk_text(line))
+
+    stats = backend.get_stats()
+    return {
+        "scenario": name,
+        "success": bool(success),
+        "provider": provider,
+        "chunks": args.chunks,
+        "workers": args.workers,
+        "wall_time": elapsed,
+        "chunks_per_sec": args.chunks / elapsed if elapsed > 0 else 0.0,
+        "requests": stats["requests"],
+        "retries": max(0, stats["requests"] - args.chunks),
+        "wasted_requests": stats["wasted_requests"],
+        "duplicate_successes": stats["duplicate_successes"],
+        "outcomes": stats["outcomes"],
+        "error_chunks": error_chunks,
+        # Latency quy về giây thật (đã nhân time_scale)
+        "latency_p50": stats["latency_p50"] * args.time_scale,
+        "latency_p95": stats["latency_p95"] * args.time_scale,
+        "latency_p99": stats["latency_p99"] * args.time_scale,
+        "requests_by_key": stats["requests_by_key"],
+    }
+
+
+def print_result(result):
+    print(f"\n📊 Kịch bản: {result['scenario']} ({result['provider']}, {result['workers']} threads)")
+    print(f"   {'✅' if result['success'] else '❌'} {result['chunks']} chunks trong {result['wall_time']:.2f}s "
+          f"→ {result['chunks_per_sec']:.2f} chunks/s")
+    print(f"   📨 Requests: {result['requests']} (retries {result['retries']}, lãng phí {result['wasted_requests']}, "
+          f"trùng {result['duplicate_successes']})")
+    print(f"   🔍 Outcomes: {result['outcomes']}")
+    print(f"   ⏱️ Latency p50/p95/p99: {result['latency_p50']:.3f}s / {result['latency_p95']:.3f}s / {result['latency_p99']:.3f}s")
+    if result["error_chunks"]:
+        print(f"   ⚠️ Chunks lỗi trong output: {result['error_chunks']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark throughput pipeline dịch với mock provider")
+    parser.add_argument("--scenario", default="all", choices=["all", "custom"] + sorted(SCENARIOS),
+                        help="Kịch bản mẫu; 'custom' dùng các tham số bên dưới")
+    parser.add_argument("--chunks", type=int, default=40, help="Số chunks (mặc định 40)")
+    parser.add_argument("--chunk-size", type=int, default=20, help="Số dòng mỗi chunk (mặc định 20)")
+    parser.add_argument("--workers", type=int, default=8, help="Số threads (mặc định 8)")
+    parser.add_argument("--keys", type=int, default=1, help="Số API key giả (mặc định 1)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-scale", type=float, default=0.05,
+                        help="Hệ số thời gian cho latency/RPM của mock (mặc định 0.05)")
+    parser.add_argument("--latency", default="lognormal:-0.5:0.4",
+                        help="fixed:S | uniform:A:B | lognormal:MU:SIGMA | exp:MEAN (giây)")
+    parser.add_argument("--rpm", type=int, default=None)
+    parser.add_argument("--quota-scope", default="project", choices=["project", "key"])
+    parser.add_argument("--error-429", type=float, default=0.0)
+    parser.add_argument("--error-503", type=float, default=0.0)
+    parser.add_argument("--truncation", type=float, default=0.0)
+    parser.add_argument("--refusal", type=float, default=0.0)
+    parser.add_argument("--http", action="store_true", help="Chạy qua mock HTTP server (provider OpenAI Compatible)")
+    parser.add_argument("--hedging", action="store_true", help="Bật hedged requests")
+    parser.add_argument("--verbose", action="store_true", help="Hiện log của pipeline dịch")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    if args.scenario == "custom":
+        scenarios = {"custom": {
+            "latency": args.latency, "rpm": args.rpm, "quota_scope": args.quota_scope,
+            "error_429_rate": args.error_429, "error_503_rate": args.error_503,
+            "truncation_rate": args.truncation, "refusal_rate": args.refusal,
+        }}
+    elif args.scenario == "all":
+        scenarios = SCENARIOS
+    else:
+        scenarios = {args.scenario: SCENARIOS[args.scenario]}
+
+    print("🚀 BENCHMARK THROUGHPUT (mock provider)")
+    print("=" * 70)
+    results = []
+    for name, backend_kwargs in scenarios.items():
+        result = run_scenario(name, backend_kwargs, args)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Đã lưu kết quả: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
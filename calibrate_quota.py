@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Calibrate rate limit thực tế cho các API keys và ghi rate_limits_profile.json
+(mặc định trong thư mục cấu hình người dùng; file khác thì trỏ model_settings["limits_profile"] tới --output)
+
+Ví dụ:
+    python calibrate_quota.py --keys KEY1,KEY2,KEY3 --model gemini-2.5-flash
+    python calibrate_quota.py --keys-file keys.txt --model gemini-2.0-flash --max-rpm 40 --tpm-tokens 20000
+    python calibrate_quota.py --mock --mock-rpm 10 --mock-scope key      # chạy thử với mock, không tốn quota
+
+Tool dùng một phần quota (vài chục đến vài trăm requests) và mất vài phút
+(đợi cửa sổ 60s giữa các pha). Chạy lại khi đổi tier/tài khoản.
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "core"))
+
+from quota_calibration import calibrate_limits, default_profile_path, make_probe, save_limits_profile
+
+
+def read_keys(args):
+    keys = []
+    if args.keys:
+        keys.extend(k.strip() for k in args.keys.split(","))
+    if args.keys_file:
+        with open(args.keys_file, "r", encoding="utf-8") as f:
+            keys.extend(line.strip() for line in f)
+    return [k for k in keys if k and not k.startswith("#")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo RPM/TPM thực tế và phạm vi limit (per-key / per-project)")
+    parser.add_argument("--provider", default="Google AI", help="Provider (mặc định Google AI)")
+    parser.add_argument("--model", default="gemini-2.5-flash", help="Model cần đo")
+    parser.add_argument("--keys", help="Danh sách key, phân cách bằng dấu phẩy")
+    parser.add_argument("--keys-file", help="File chứa key (mỗi dòng 1 key)")
+    parser.add_argument("--base-url", help="base_url cho provider OpenAI Compatible")
+    parser.add_argument("--max-rpm", type=int, default=30,
+                        help="Số requests tối đa của burst đo RPM (nên lớn hơn RPM dự kiến, mặc định 30)")
+    parser.add_argument("--tpm-tokens", type=int, default=0,
+                        help="Tokens mỗi request khi đo TPM (0 = không đo TPM)")
+    parser.add_argument("--scope-keys", type=int, default=3, help="Số keys dùng để đo phạm vi limit (mặc định 3)")
+    parser.add_argument("--output", help=f"File profile (mặc định {default_profile_path()})")
+    parser.add_argument("--mock", action="store_true", help="Chạy thử với mock provider + đồng hồ ảo")
+    parser.add_argument("--mock-rpm", type=int, default=10)
+    parser.add_argument("--mock-scope", default="project", choices=["project", "key"])
+    args = parser.parse_args()
+
+    clock_kwargs = {}
+    if args.mock:
+        from clock import VirtualClock
+        from mock_provider import MockBackend, set_mock_backend
+        clock = VirtualClock()
+        set_mock_backend(MockBackend(latency="fixed:0", rpm=args.mock_rpm, quota_scope=args.mock_scope,
+                                     clock=clock.monotonic, sleep=clock.sleep))
+        args.provider, args.model = "Mock", "mock-model"
+        keys = read_keys(args) or ["mock-key-1", "mock-key-2", "mock-key-3"]
+        clock_kwargs["clock"] = clock
+    else:
+        keys = read_keys(args)
+
+    if not keys:
+        parser.error("Cần --keys hoặc --keys-file")
+
+    model_settings = {"base_url": args.base_url} if args.base_url else None
+    probe = make_probe(args.provider, args.model, model_settings)
+
+    print("📐 CALIBRATE RATE LIMIT")
+    print("=" * 70)
+    print(f"   Provider: {args.provider}, Model: {args.model}, Keys: {len(keys)}")
+    try:
+        result = calibrate_limits(probe, keys, max_rpm=args.max_rpm, tpm_probe_tokens=args.tpm_tokens,
+                                  max_scope_keys=args.scope_keys, **clock_kwargs)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+
+    print("=" * 70)
+    print(f"✅ RPM: {result['rpm']}{'' if result['rpm_exact'] else '+ (cận dưới)'}")
+    if result["tpm"] is not None:
+        print(f"✅ TPM: {result['tpm']:,}{'' if result['tpm_exact'] else '+ (cận dưới)'}")
+    print(f"✅ Phạm vi: {result['scope']}")
+    print(f"   Requests đã dùng: {result['requests_used']}")
+
+    path = save_limits_profile(args.provider, args.model, result, args.output)
+    print(f"💾 Đã lưu: {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
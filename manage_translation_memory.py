@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Xem / xóa mục trong translation memory (file .translation_memory.jsonl)
+
+Ví dụ:
+    python manage_translation_memory.py series.tm.jsonl                                  # thống kê theo file nguồn
+    python manage_translation_memory.py series.tm.jsonl --forget-file tap-03.txt         # xóa mọi mục học từ tập 3
+    python manage_translation_memory.py series.tm.jsonl --forget-file tap-03.txt --lines 401:500
+    python manage_translation_memory.py series.tm.jsonl --forget-contains "Lâm Phong"    # xóa mục có tên dịch sai
+
+Mục cũ (trước khi TM ghi nguồn) hiển thị với nguồn "(không rõ)" và chỉ xóa được bằng --forget-contains.
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "core"))
+
+from translation_memory import TranslationMemory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xem nguồn và xóa mục sai trong translation memory")
+    parser.add_argument("path", help="File translation memory (.jsonl)")
+    parser.add_argument("--forget-file", help="Xóa mục học từ file nguồn này (tên file như lúc dịch)")
+    parser.add_argument("--lines", help="Chỉ xóa mục của chunk này (ví dụ 401:500), dùng cùng --forget-file")
+    parser.add_argument("--forget-contains", help="Xóa mục mà bản gốc hoặc bản dịch chứa chuỗi này")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"❌ Không tìm thấy {args.path}")
+        return 1
+    if args.lines and not args.forget_file:
+        parser.error("--lines cần dùng cùng --forget-file")
+
+    memory = TranslationMemory(args.path)
+    if args.forget_file or args.forget_contains:
+        removed = memory.forget(source_file=args.forget_file, line_range=args.lines,
+                                contains=args.forget_contains)
+        print(f"🗑️ Đã xóa {removed} mục khỏi {args.path}")
+
+    print(f"\n📚 {args.path}:")
+    for (source_file, kind), count in sorted(memory.sources().items(), key=lambda item: (item[0][0] or "", item[0][1])):
+        print(f"   {source_file or '(không rõ)'} [{kind}]: {count}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
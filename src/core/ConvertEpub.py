@@ -1,8 +1,11 @@
 import os
-import re
 import subprocess 
-from docx import Document 
-from docx.enum.section import WD_SECTION 
+try:
+    from .chapter_index import INTRO_TITLE, load_chapter_index, read_chapter_text, render_chapters, resolve_workers
+    from .docx_writer import write_docx, render_indexed_docx_chapter
+except ImportError:
+    from chapter_index import INTRO_TITLE, load_chapter_index, read_chapter_text, render_chapters, resolve_workers
+    from docx_writer import write_docx, render_indexed_docx_chapter
 # from docx.shared import Inches # Đã bỏ comment vì không sử dụng
 
 # Định nghĩa các hằng số để tránh lỗi f-string với backslash
@@ -17,7 +20,30 @@ BREAK_TAG = "<br/>"
 PANDOC_PATH = r"C:\Users\vinhd\AppData\Local\Pandoc\pandoc.exe" # <--- CHỈNH SỬA DÒNG NÀY!
 
 
-def txt_to_docx(txt_path, docx_path, book_title, chapter_pattern):
+def txt_to_docx_parallel(txt_path, docx_path, book_title, chapter_pattern, workers=None):
+    """
+    Như txt_to_docx nhưng chia file theo chỉ mục chương, render XML từng chương trong
+    process pool rồi ghép vào document.xml theo thứ tự (không dựng Document trong bộ nhớ).
+
+    Args:
+        workers (int): Số process (None = số CPU)
+    Returns:
+        bool: True nếu thành công, False nếu thất bại.
+    """
+    try:
+        entries = load_chapter_index(txt_path, chapter_pattern)
+        print(f"  Đã lập chỉ mục {len(entries)} chương, đang render song song...")
+        rendered = render_chapters(txt_path, entries, render_indexed_docx_chapter,
+                                   args=(book_title,), workers=workers)
+        write_docx(docx_path, (xml for _, xml in rendered))
+        print(f"  Thành công! File DOCX đã được tạo tại: {docx_path}")
+        return True
+    except Exception as e:
+        print(f"  Lỗi khi ghi file DOCX: {e}")
+        return False
+
+
+def txt_to_docx(txt_path, docx_path, book_title, chapter_pattern, workers=1):
     """
     Chuyển đổi file .txt sang .docx, tự động nhận diện chương và tạo header
     với page break.
@@ -27,6 +53,8 @@ def txt_to_docx(txt_path, docx_path, book_title, chapter_pattern):
         docx_path (str): Đường dẫn đến file .docx đích.
         book_title (str): Tiêu đề của sách (sẽ dùng cho tiêu đề H1 nếu không có intro).
         chapter_pattern (str): Biểu thức chính quy (regex) để nhận diện các chương.
+        workers (int): Số process render chương (1 = tuần tự bằng python-docx,
+            None = tự chọn theo kích thước file).
     Returns:
         bool: True nếu thành công, False nếu thất bại.
     """
@@ -36,81 +64,59 @@ def txt_to_docx(txt_path, docx_path, book_title, chapter_pattern):
         print(f"  Lỗi: Không tìm thấy file .txt tại đường dẫn '{txt_path}'")
         return False
 
-    # 1. Đọc nội dung file .txt
+    if resolve_workers(txt_path, workers) > 1:
+        return txt_to_docx_parallel(txt_path, docx_path, book_title, chapter_pattern, workers)
+
+    # 1. Lập chỉ mục chương (dùng lại <file>.chapters.json nếu file chưa đổi)
     try:
-        with open(txt_path, 'r', encoding='utf-8') as f:
-            full_text = f.read()
-        print("  Đã đọc xong file .txt.")
+        entries = load_chapter_index(txt_path, chapter_pattern)
+        print("  Đã lập chỉ mục chương của file .txt.")
     except Exception as e:
         print(f"  Lỗi khi đọc file .txt: {e}")
         return False
 
-    # 2. Khởi tạo tài liệu DOCX
+    # 2. Khởi tạo tài liệu DOCX (python-docx chỉ được import khi thật sự dùng)
+    from docx import Document
     document = Document()
     # document.sections[0].left_margin = Inches(1) # Ví dụ: thiết lập lề
     # document.sections[0].right_margin = Inches(1)
     # document.sections[0].top_margin = Inches(1)
     # document.sections[0].bottom_margin = Inches(1)
 
-    # 3. Tìm kiếm các chương bằng regex
-    matches = list(re.finditer(chapter_pattern, full_text, re.MULTILINE))
-    total_chapters = len(matches)
+    def add_paragraphs(text):
+        for para in text.strip().split('\n\n'):
+            if para.strip():
+                document.add_paragraph(para.replace(NEWLINE_CHAR, ' '))
+
+    # 3. Đọc từng chương theo offset trong chỉ mục
+    chapters = [entry for entry in entries if entry["title"] is not None]
+    total_chapters = len(chapters) - (1 if chapters and chapters[0]["title"] == INTRO_TITLE else 0)
 
-    if total_chapters == 0 and full_text.strip():
+    if not chapters and entries:
         print("  Không tìm thấy định dạng chương nào. Toàn bộ file sẽ được coi là một trang DOCX duy nhất.")
         document.add_heading(book_title, level=1)
-        paragraphs = full_text.strip().split('\n\n')
-        for para in paragraphs:
-            if para.strip():
-                document.add_paragraph(para.replace(NEWLINE_CHAR, ' ')) 
+        add_paragraphs(read_chapter_text(txt_path, entries[0]))
 
     else:
         print(f"  Đã tìm thấy {total_chapters} chương. Đang tạo nội dung DOCX...")
-        
-        intro_text_handled = False
-        # Xử lý phần giới thiệu (nếu có) trước chương đầu tiên
-        if matches and matches[0].start() > 0:
-            intro_text = full_text[0:matches[0].start()].strip()
-            if intro_text:
-                print("  Đang xử lý phần Mở Đầu...")
-                document.add_heading('Mở Đầu', level=1)
-                paragraphs = intro_text.split('\n\n')
-                for para in paragraphs:
-                    if para.strip():
-                        document.add_paragraph(para.replace(NEWLINE_CHAR, ' '))
-                # Thêm page break sau phần mở đầu
-                document.add_page_break()
-                print("  Đã xử lý xong phần Mở Đầu.")
-                intro_text_handled = True
-
-        # Xử lý từng chương
-        for i, match in enumerate(matches):
-            chapter_title = match.group(0).strip()
-            start_index = match.end()
 
-            if i + 1 < len(matches):
-                end_index = matches[i+1].start()
-            else:
-                end_index = len(full_text)
+        for i, entry in enumerate(chapters):
+            chapter_title = entry["title"]
+            chapter_content = read_chapter_text(txt_path, entry).strip()
 
-            chapter_content = full_text[start_index:end_index].strip()
-
-            # Thêm page break trước mỗi chương (trừ chương đầu tiên nếu nó là chương đầu tiên của tài liệu
-            # và không có phần giới thiệu đi trước nó)
-            if i > 0 or intro_text_handled: 
+            # Page break trước mỗi chương trừ trang đầu tiên của tài liệu
+            # (phần Mở Đầu, nếu có, luôn đứng trước chương đầu tiên)
+            if i > 0:
                 document.add_page_break()
 
             # Thêm tiêu đề chương (Heading 1)
             document.add_heading(chapter_title, level=1)
-            
+
             # Thêm nội dung chương
             if chapter_content:
-                paragraphs = chapter_content.split('\n\n')
-                for para in paragraphs:
-                    if para.strip():
-                        document.add_paragraph(para.replace(NEWLINE_CHAR, ' ')) 
+                add_paragraphs(chapter_content)
 
-            print(f"\r  - Đã xử lý chương {i+1}/{total_chapters}: {chapter_title[:50]}...", end='')
+            print(f"\r  - Đã xử lý chương {i+1}/{len(chapters)}: {chapter_title[:50]}...", end='')
         print("\n  Đã xử lý xong tất cả các chương.")
 
     # 4. Ghi file DOCX
@@ -5,16 +5,21 @@ Contains the main translation engine and utility functions:
 - translate.py: Google Gemini AI translation engine
 - reformat.py: Text formatting utilities
 - ConvertEpub.py: EPUB conversion functionality
+- epub_writer.py: Native streaming TXT → EPUB3 writer
+- chapter_index.py: Chapter offset index and parallel chapter rendering
+- docx_writer.py: Direct WordprocessingML assembly for DOCX export
 """
 
 from .translate import translate_file_optimized, generate_output_filename
 from .reformat import fix_text_format
 from .ConvertEpub import txt_to_docx, docx_to_epub
+from .epub_writer import txt_to_epub
 
 __all__ = [
     'translate_file_optimized',
     'generate_output_filename', 
     'fix_text_format',
     'txt_to_docx',
-    'docx_to_epub'
+    'docx_to_epub',
+    'txt_to_epub'
 ] 
\ No newline at end of file
@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch mode - dịch offline qua batch job của provider cho sách rất lớn
+
+Với sách 10k+ chunks khi không cần kết quả ngay, vòng lặp request đồng bộ
+từng chunk là cách chạy đắt nhất và bị rate limit nhiều nhất. Batch mode:
+1. Ghi các chunk chưa dịch ra file batch job (JSONL, mỗi dòng một request)
+2. Submit job lên provider, poll đến khi job kết thúc
+3. Nhận kết quả, kiểm tra bằng is_bad_translation như chế độ thường
+4. Ghi kết quả vào progress store (file output + .progress.json), chunk nào
+   lỗi thì submit lại riêng các chunk đó ở vòng sau
+
+Trạng thái job được lưu trong <input>.batch.json: nếu dừng giữa chừng, lần chạy
+sau tiếp tục poll job cũ thay vì submit lại.
+
+LocalBatchService: batch service giả lập trong process, chạy toàn bộ luồng
+submit/poll/ingest/resubmit mà không cần mạng.
+"""
+
+import os
+import json
+import time
+import threading
+
+try:
+    from .key_validation import validate_api_keys
+    from .translate import (
+        PROGRESS_FILE_SUFFIX, OutputWriter, check_api_key_access, format_error_chunk, generate_output_filename,
+        is_bad_translation, is_translation_stopped, load_progress_with_info, save_progress_with_line_info
+    )
+except ImportError:
+    from key_validation import validate_api_keys
+    from translate import (
+        PROGRESS_FILE_SUFFIX, OutputWriter, check_api_key_access, format_error_chunk, generate_output_filename,
+        is_bad_translation, is_translation_stopped, load_progress_with_info, save_progress_with_line_info
+    )
+
+
+BATCH_STATE_SUFFIX = ".batch.json"
+BATCH_INPUT_SUFFIX = ".batch_input.jsonl"
+
+DEFAULT_POLL_INTERVAL = 60     # Giây giữa 2 lần poll
+DEFAULT_MAX_ROUNDS = 3         # Số lần submit tối đa mỗi chunk (lần đầu + các lần submit lại khi lỗi)
+DEFAULT_MAX_JOB_CHUNKS = 5000  # Số request tối đa trong một batch job
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+TERMINAL_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+BATCH_PROVIDERS = ("Google AI",)
+
+DEFAULT_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "topP": 0.95,
+    "topK": 40,
+    "maxOutputTokens": 8192,
+}
+
+SAFETY_SETTINGS = [
+    {"category": category, "threshold": "BLOCK_NONE"}
+    for category in ("HARM_CATEGORY_HARASSMENT", "HARM_CATEGORY_HATE_SPEECH",
+                     "HARM_CATEGORY_SEXUALLY_EXPLICIT", "HARM_CATEGORY_DANGEROUS_CONTENT")
+]
+
+
+def chunk_key(chunk_index):
+    return f"chunk-{chunk_index}"
+
+
+def parse_chunk_key(key):
+    try:
+        return int(str(key).rsplit("-", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def build_batch_request(system_instruction, chunk_text, generation_config=None):
+    """
+    GenerateContentRequest cho một chunk. System instruction và văn bản là 2 parts
+    riêng (provider ghép lại), giống prompt "{system_instruction}\\n\\n{text}" của chế độ thường.
+    """
+    return {
+        "contents": [{
+            "role": "user",
+            "parts": [{"text": system_instruction}, {"text": chunk_text}],
+        }],
+        "generationConfig": dict(generation_config or DEFAULT_GENERATION_CONFIG),
+        "safetySettings": SAFETY_SETTINGS,
+    }
+
+
+def write_batch_file(path, requests_by_key):
+    """Ghi batch job file: mỗi dòng {"key": ..., "request": ...}"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for key, request in requests_by_key.items():
+            f.write(json.dumps({"key": key, "request": request}, ensure_ascii=False) + "\n")
+    return path
+
+
+def extract_response_text(response):
+    """Lấy text từ GenerateContentResponse (dict). Trả về (text, error)."""
+    candidates = (response or {}).get("candidates") or []
+    if not candidates:
+        block_reason = ((response or {}).get("promptFeedback") or {}).get("blockReason")
+        return None, f"không có candidates{f' (blockReason: {block_reason})' if block_reason else ''}"
+    candidate = candidates[0]
+    parts = (candidate.get("content") or {}).get("parts") or []
+    text = "".join(part.get("text", "") for part in parts if not part.get("thought"))
+    finish_reason = candidate.get("finishReason")
+    if finish_reason == "MAX_TOKENS":
+        return None, "bị cắt do vượt quá max tokens"
+    if finish_reason in ("SAFETY", "PROHIBITED_CONTENT", "BLOCKLIST"):
+        return None, f"bị chặn ({finish_reason})"
+    return text, None
+
+
+class BatchService:
+    """
+    Interface cho batch service của provider.
+
+    submit(batch_file, display_name) -> job_id
+    poll(job_id) -> JOB_PENDING / JOB_RUNNING / JOB_SUCCEEDED / JOB_FAILED
+    fetch_results(job_id) -> {key: (text, error)}
+    """
+
+    name = "batch"
+
+    def submit(self, batch_file, display_name):
+        raise NotImplementedError
+
+    def poll(self, job_id):
+        raise NotImplementedError
+
+    def fetch_results(self, job_id):
+        raise NotImplementedError
+
+
+class GeminiBatchService(BatchService):
+    """
+    Gemini Batch API (REST): upload batch file qua Files API, tạo job bằng
+    models/{model}:batchGenerateContent, poll batches/{id}, tải file kết quả.
+    """
+
+    name = "Gemini Batch"
+    BASE_URL = "https://generativelanguage.googleapis.com"
+
+    def __init__(self, api_key, model_name, timeout=120):
+        self.api_key = api_key
+        self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        self.timeout = timeout
+
+    def _headers(self, extra=None):
+        headers = {"x-goog-api-key": self.api_key}
+        headers.update(extra or {})
+        return headers
+
+    @staticmethod
+    def _check(response, action):
+        if response.status_code != 200:
+            raise RuntimeError(f"{action} thất bại (HTTP {response.status_code}): {response.text[:500]}")
+        return response
+
+    def _upload(self, batch_file, display_name):
+        import requests
+        size = os.path.getsize(batch_file)
+        start = self._check(requests.post(
+            f"{self.BASE_URL}/upload/v1beta/files",
+            headers=self._headers({
+                "X-Goog-Upload-Protocol": "resumable",
+                "X-Goog-Upload-Command": "start",
+                "X-Goog-Upload-Header-Content-Length": str(size),
+                "X-Goog-Upload-Header-Content-Type": "application/jsonl",
+                "Content-Type": "application/json",
+            }),
+            json={"file": {"display_name": display_name}},
+            timeout=self.timeout,
+        ), "Khởi tạo upload batch file")
+        upload_url = start.headers.get("X-Goog-Upload-URL") or start.headers.get("x-goog-upload-url")
+        if not upload_url:
+            raise RuntimeError("Files API không trả về upload URL")
+
+        with open(batch_file, 'rb') as f:
+            uploaded = self._check(requests.post(
+                upload_url,
+                headers={
+                    "Content-Length": str(size),
+                    "X-Goog-Upload-Offset": "0",
+                    "X-Goog-Upload-Command": "upload, finalize",
+                },
+                data=f,
+                timeout=max(self.timeout, size // 100000),
+            ), "Upload batch file")
+        return uploaded.json()["file"]["name"]
+
+    def submit(self, batch_file, display_name):
+        import requests
+        file_name = self._upload(batch_file, display_name)
+        response = self._check(requests.post(
+            f"{self.BASE_URL}/v1beta/{self.model_name}:batchGenerateContent",
+            headers=self._headers({"Content-Type": "application/json"}),
+            json={"batch": {"display_name": display_name, "input_config": {"file_name": file_name}}},
+            timeout=self.timeout,
+        ), "Tạo batch job")
+        return response.json()["name"]
+
+    def _get(self, job_id):
+        import requests
+        return self._check(requests.get(
+            f"{self.BASE_URL}/v1beta/{job_id}", headers=self._headers(), timeout=self.timeout
+        ), "Poll batch job").json()
+
+    def poll(self, job_id):
+        operation = self._get(job_id)
+        state = str((operation.get("metadata") or {}).get("state") or operation.get("state") or "")
+        if state.endswith("SUCCEEDED"):
+            return JOB_SUCCEEDED
+        if state.endswith(("FAILED", "CANCELLED", "EXPIRED")):
+            return JOB_FAILED
+        if state.endswith("RUNNING"):
+            return JOB_RUNNING
+        return JOB_PENDING
+
+    def fetch_results(self, job_id):
+        import requests
+        operation = self._get(job_id)
+        output = operation.get("response") or (operation.get("metadata") or {}).get("output") or {}
+        results = {}
+
+        responses_file = output.get("responsesFile")
+        if responses_file:
+            download = self._check(requests.get(
+                f"{self.BASE_URL}/download/v1beta/{responses_file}:download",
+                params={"alt": "media"}, headers=self._headers(), timeout=max(self.timeout, 600),
+            ), "Tải kết quả batch")
+            lines = download.content.decode("utf-8").splitlines()
+            records = [json.loads(line) for line in lines if line.strip()]
+        else:
+            records = (output.get("inlinedResponses") or {}).get("inlinedResponses") or []
+
+        for record in records:
+            key = record.get("key") or (record.get("metadata") or {}).get("key")
+            if "error" in record:
+                results[key] = (None, str(record["error"].get("message", record["error"])))
+            else:
+                results[key] = extract_response_text(record.get("response"))
+        return results
+
+
+class LocalBatchService(BatchService):
+    """
+    Batch service giả lập (offline). Job xong sau `polls_to_complete` lần poll;
+    handler(key, request) -> text tạo bản dịch (mặc định trả lại văn bản gốc).
+
+    fail_first: tập key trả lỗi ở lần submit đầu tiên, để kiểm tra luồng submit lại.
+    """
+
+    name = "Local Batch"
+
+    def __init__(self, handler=None, polls_to_complete=1, fail_first=None):
+        self.handler = handler or (lambda key, request: request["contents"][0]["parts"][-1]["text"])
+        self.polls_to_complete = polls_to_complete
+        self.fail_first = set(fail_first or ())
+        self.lock = threading.Lock()
+        self.jobs = {}        # {job_id: {"records": [...], "polls": int}}
+        self.submitted = []   # Số request của từng job (thống kê/kiểm tra)
+        self._failed_once = set()
+
+    def submit(self, batch_file, display_name):
+        with open(batch_file, 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        with self.lock:
+            job_id = f"batches/local-{len(self.jobs) + 1}"
+            self.jobs[job_id] = {"records": records, "polls": 0}
+            self.submitted.append(len(records))
+        return job_id
+
+    def poll(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return JOB_FAILED
+            job["polls"] += 1
+            return JOB_SUCCEEDED if job["polls"] >= self.polls_to_complete else JOB_RUNNING
+
+    def fetch_results(self, job_id):
+        results = {}
+        for record in self.jobs[job_id]["records"]:
+            key = record["key"]
+            with self.lock:
+                fail = key in self.fail_first and key not in self._failed_once
+                if fail:
+                    self._failed_once.add(key)
+            if fail:
+                results[key] = (None, "lỗi giả lập")
+            else:
+                try:
+                    results[key] = (self.handler(key, record["request"]), None)
+                except Exception as e:
+                    results[key] = (None, str(e))
+        return results
+
+
+def create_batch_service(provider, api_key, model_name, model_settings=None):
+    """
+    Batch service cho provider. model_settings["batch_service"] = "local" dùng service giả lập.
+
+    Returns:
+        BatchService hoặc None nếu provider không hỗ trợ batch
+    """
+    model_settings = model_settings or {}
+    if model_settings.get("batch_service") == "local":
+        return LocalBatchService()
+    if provider in BATCH_PROVIDERS:
+        key = first_valid_key(api_key, model_name, provider, model_settings)
+        if key is None:
+            print("❌ Không có API key hợp lệ cho batch mode")
+            return None
+        return GeminiBatchService(key, model_name)
+    return None
+
+
+def first_valid_key(api_key, model_name, provider, model_settings=None):
+    """
+    Key đầu tiên không bị loại khi validate (cùng cache với translate_file_optimized nên
+    key vừa kiểm tra không bị validate lại). Key chỉ lỗi tạm thời vẫn được dùng nếu không còn key nào khác.
+    """
+    if not isinstance(api_key, list):
+        return api_key
+    results = validate_api_keys(api_key, model_name, provider, check_api_key_access, model_settings)
+    for result in results:
+        if result.is_valid:
+            return result.api_key
+    usable = [result.api_key for result in results if not result.is_invalid]
+    return usable[0] if usable else None
+
+
+class BatchProgressStore:
+    """
+    Lưu kết quả batch vào progress store của chế độ thường.
+
+    Kết quả về không theo thứ tự: chunk đã nhận nhưng chưa ghi được (còn chờ chunk
+    trước) được giữ trong <input>.batch.json; các chunk liên tiếp từ completed_chunks
+    được ghi ngay vào file output và .progress.json (chế độ thường có thể tiếp tục từ đó).
+    Ghi qua OutputWriter như chế độ thường (reformat từng chunk, dựng EPUB song song).
+    """
+
+    def __init__(self, input_file, output_file, chunks, model_settings=None):
+        self.input_file = input_file
+        self.output_file = output_file
+        self.chunks = chunks
+        self.progress_file_path = f"{input_file}{PROGRESS_FILE_SUFFIX}"
+        self.state_path = f"{input_file}{BATCH_STATE_SUFFIX}"
+
+        progress_data = load_progress_with_info(self.progress_file_path)
+        self.completed_chunks = progress_data.get('completed_chunks', 0)
+        self.writer = OutputWriter(output_file, model_settings or {}, self.completed_chunks,
+                                   progress_data.get('current_chunk', {}))
+        self.results = {}   # {chunk_index: text} chưa ghi
+        self.attempts = {}  # {chunk_index: số lần đã submit}
+        self.errors = {}    # {chunk_index: lỗi gần nhất}
+        self.job = None     # {"id", "keys"}
+        self._load_state()
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.results = {int(idx): text for idx, text in state.get("results", {}).items()
+                            if int(idx) >= self.completed_chunks}
+            self.attempts = {int(idx): n for idx, n in state.get("attempts", {}).items()}
+            self.errors = {int(idx): error for idx, error in state.get("errors", {}).items()}
+            self.job = state.get("job")
+        except (ValueError, OSError) as e:
+            print(f"⚠️ File trạng thái batch bị hỏng ({e}) - bỏ qua")
+
+    def save_state(self):
+        try:
+            with open(self.state_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "results": {str(idx): text for idx, text in self.results.items()},
+                    "attempts": {str(idx): n for idx, n in self.attempts.items()},
+                    "errors": {str(idx): error for idx, error in self.errors.items()},
+                    "job": self.job,
+                }, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"⚠️ Lỗi khi lưu trạng thái batch: {e}")
+
+    def pending_indices(self):
+        return [idx for idx in range(self.completed_chunks, len(self.chunks)) if idx not in self.results]
+
+    def add(self, chunk_index, text):
+        if chunk_index >= self.completed_chunks:
+            self.results[chunk_index] = text
+
+    def flush(self):
+        """Ghi các chunk liên tiếp đã có kết quả vào output + progress. Trả về số chunk vừa ghi."""
+        written = 0
+        if self.completed_chunks not in self.results:
+            return 0
+        with self.writer:
+            while self.completed_chunks in self.results:
+                self.writer.write_chunk(self.results.pop(self.completed_chunks))
+                self.completed_chunks += 1
+                written += 1
+
+        _, chunk_lines, start = self.chunks[self.completed_chunks - 1]
+        save_progress_with_line_info(self.progress_file_path, self.completed_chunks, self.writer.add_states({
+            'chunk_index': self.completed_chunks - 1,
+            'line_range': f"{start + 1}:{start + len(chunk_lines)}",
+            'lines_count': len(chunk_lines),
+        }))
+        return written
+
+    def finish(self):
+        with self.writer:
+            self.writer.finish()
+        for path in (self.progress_file_path, self.state_path, f"{self.input_file}{BATCH_INPUT_SUFFIX}"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _wait_for_job(service, job_id, poll_interval, sleep):
+    """Poll đến khi job kết thúc. Trả về state, hoặc None nếu người dùng dừng."""
+    last_state = None
+    while True:
+        state = service.poll(job_id)
+        if state != last_state:
+            print(f"📦 Batch job {job_id}: {state}")
+            last_state = state
+        if state in TERMINAL_STATES:
+            return state
+        if is_translation_stopped():
+            return None
+        sleep(poll_interval)
+
+
+def translate_file_batch(input_file, output_file=None, api_key=None, model_name="gemini-2.0-flash",
+                         system_instruction=None, chunk_size_lines=100, provider="Google AI",
+                         model_settings=None, batch_service=None, sleep=time.sleep):
+    """
+    Dịch file qua batch job (không đồng bộ). Chia chunk giống translate_file_optimized
+    nên progress dùng chung với chế độ thường.
+
+    Keys hỗ trợ trong model_settings:
+        batch_poll_interval: giây giữa 2 lần poll (mặc định 60)
+        batch_max_rounds: số lần submit tối đa cho mỗi chunk, gồm các lần submit lại khi lỗi (mặc định 3)
+        batch_max_job_chunks: số chunk tối đa mỗi job (mặc định 5000)
+        batch_service: "local" để dùng service giả lập
+
+    Returns:
+        True nếu dịch xong, False nếu bị dừng / lỗi (trạng thái được lưu để chạy tiếp)
+    """
+    model_settings = model_settings or {}
+    service = batch_service or create_batch_service(provider, api_key, model_name, model_settings)
+    if service is None:
+        if provider not in BATCH_PROVIDERS:
+            print(f"❌ Provider {provider} chưa hỗ trợ batch mode")
+        return False
+
+    poll_interval = float(model_settings.get("batch_poll_interval", DEFAULT_POLL_INTERVAL))
+    max_rounds = max(1, int(model_settings.get("batch_max_rounds", DEFAULT_MAX_ROUNDS)))
+    max_job_chunks = max(1, int(model_settings.get("batch_max_job_chunks", DEFAULT_MAX_JOB_CHUNKS)))
+    system_instruction = system_instruction or "Dịch văn bản sau sang tiếng Việt. CHỈ TRẢ VỀ BẢN DỊCH."
+
+    if output_file is None:
+        output_file = generate_output_filename(input_file)
+
+    try:
+        with open(input_file, 'r', encoding='utf-8', errors='replace') as infile:
+            all_lines = infile.readlines()
+    except FileNotFoundError:
+        print(f"❌ Lỗi: Không tìm thấy file đầu vào '{input_file}'.")
+        return False
+
+    chunks = []
+    for i in range(0, len(all_lines), chunk_size_lines):
+        chunks.append((len(chunks), all_lines[i:i + chunk_size_lines], i))
+
+    store = BatchProgressStore(input_file, output_file, chunks, model_settings)
+    print(f"📦 Batch mode ({service.name}): {len(chunks)} chunks, đã xong {store.completed_chunks}, "
+          f"đã nhận {len(store.results)} kết quả chưa ghi")
+
+    start_time = time.time()
+    while True:
+        if store.job is None:
+            # Chunk trống không cần gọi API (giống translate_chunk)
+            for idx in store.pending_indices():
+                if not "".join(chunks[idx][1]).strip():
+                    store.add(idx, "")
+
+            # Chunk đã lỗi đủ max_rounds lần: ghi kèm nội dung gốc (như chế độ thường) để không chặn các chunk sau
+            pending = []
+            for idx in store.pending_indices():
+                if store.attempts.get(idx, 0) >= max_rounds:
+                    _, chunk_lines, start = chunks[idx]
+                    line_range = f"{start + 1}:{start + len(chunk_lines)}"
+                    store.add(idx, format_error_chunk("BATCH", store.errors.get(idx, "chưa được dịch"), chunk_lines, line_range))
+                    print(f"⚠️ Chunk {idx + 1}: vẫn lỗi sau {max_rounds} lần submit - ghi kèm nội dung gốc")
+                else:
+                    pending.append(idx)
+            store.flush()
+            if not pending:
+                break
+
+            pending = pending[:max_job_chunks]
+            requests_by_key = {}
+            for idx in pending:
+                chunk_text = "".join(chunks[idx][1])
+                requests_by_key[chunk_key(idx)] = build_batch_request(system_instruction, chunk_text)
+
+            batch_file = write_batch_file(f"{input_file}{BATCH_INPUT_SUFFIX}", requests_by_key)
+            display_name = f"{os.path.basename(input_file)}-{int(time.time())}"
+            try:
+                job_id = service.submit(batch_file, display_name)
+            except Exception as e:
+                print(f"❌ Không thể submit batch job: {e}")
+                store.save_state()
+                return False
+            for idx in pending:
+                store.attempts[idx] = store.attempts.get(idx, 0) + 1
+            store.job = {"id": job_id, "keys": list(requests_by_key)}
+            store.save_state()
+            resubmitted = sum(1 for idx in pending if store.attempts[idx] > 1)
+            print(f"📤 Đã submit {len(pending)} chunks (job {job_id}, {resubmitted} chunks submit lại)")
+        else:
+            print(f"🔁 Tiếp tục poll batch job {store.job['id']}")
+
+        try:
+            state = _wait_for_job(service, store.job["id"], poll_interval, sleep)
+        except Exception as e:
+            print(f"❌ Lỗi khi poll batch job: {e} - trạng thái đã lưu, chạy lại để tiếp tục")
+            return False
+        if state is None:
+            print("🛑 Đã dừng - batch job vẫn chạy phía provider, chạy lại để nhận kết quả")
+            return False
+
+        results = {}
+        if state == JOB_SUCCEEDED:
+            try:
+                results = service.fetch_results(store.job["id"])
+            except Exception as e:
+                print(f"❌ Không thể tải kết quả batch: {e} - trạng thái đã lưu, chạy lại để tiếp tục")
+                return False
+        else:
+            print(f"⚠️ Batch job {store.job['id']} thất bại - các chunks của job sẽ được submit lại")
+
+        # Ingest: kiểm tra bằng is_bad_translation như chế độ thường, chỉ giữ bản dịch đạt
+        accepted = 0
+        failed = 0
+        for key in store.job["keys"]:
+            idx = parse_chunk_key(key)
+            text, error = results.get(key, (None, "không có kết quả"))
+            if error is None and is_bad_translation(text, "".join(chunks[idx][1])):
+                error = "bản dịch không đạt (is_bad_translation)"
+            if error is None:
+                store.add(idx, text)
+                store.errors.pop(idx, None)
+                accepted += 1
+            else:
+                store.errors[idx] = error
+                failed += 1
+
+        store.job = None
+        written = store.flush()
+        store.save_state()
+        print(f"📥 Đã nhận kết quả: {accepted} chunks đạt, {failed} chunks lỗi, đã ghi thêm {written} chunks")
+
+    failed_chunks = len(store.errors)
+    store.finish()
+
+    total_time = time.time() - start_time
+    print(f"✅ Batch mode hoàn thành: {len(chunks)} chunks trong {total_time:.1f}s, file: {output_file}")
+    if failed_chunks:
+        print(f"⚠️ {failed_chunks} chunks lỗi được ghi kèm nội dung gốc")
+    return failed_chunks == 0
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chỉ mục chương (offset theo byte) cho file TXT và render song song theo chương
+
+build_chapter_index quét file một lần (đọc nhị phân từng dòng) và trả về danh sách
+chương với tiêu đề + khoảng byte của nội dung. Exporter (EPUB/DOCX) chia file theo
+các khoảng này, render từng chương trong process pool (render_chapters) và ghi
+kết quả theo đúng thứ tự - mỗi process tự seek + đọc khoảng của mình nên chỉ
+offset được gửi qua lại giữa các process.
+
+Quy tắc nhận diện giống ConvertEpub.txt_to_docx: regex (re.MULTILINE) khớp trên từng
+dòng, phần trước chương đầu là "Mở Đầu", không có chương nào -> cả file là một
+chương không tên (title None, người gọi dùng tên sách).
+
+load_chapter_index lưu chỉ mục cạnh file (<file>.chapters.json) và chỉ quét lại khi
+file đổi (kích thước, mtime hoặc hash phần đầu/cuối khác) hoặc đổi regex/encoding.
+"""
+
+import hashlib
+import json
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_CHAPTER_PATTERN = r"^Chương\s+\d+(?::\s+.*)?$"
+INTRO_TITLE = "Mở Đầu"
+
+# Số lô đang render tối đa cho mỗi worker (giới hạn bộ nhớ khi lô đầu chậm)
+PENDING_PER_WORKER = 4
+MAX_BATCH_CHAPTERS = 32
+# File nhỏ hơn ngưỡng này render tuần tự (khởi động process pool tốn hơn phần tiết kiệm được)
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+
+INDEX_CACHE_SUFFIX = ".chapters.json"
+INDEX_CACHE_VERSION = 1
+INDEX_FIELDS = ("number", "title", "start", "end", "line", "end_line")
+# Số byte đầu/cuối file dùng để tính hash nhận diện file (không đọc cả file)
+FINGERPRINT_BYTES = 64 * 1024
+
+# Tiêu đề chương ở đầu một đoạn văn (không phân biệt hoa thường): Chương 1, CHƯƠNG IV, Chapter 2
+CHAPTER_HEADING_PATTERN = re.compile(r'^(?:chương\s+(?:\d+|[ivxlcdm]+)|chapter\s+\d+)', re.IGNORECASE)
+# Tiêu đề chương/phần/tập trên text đã lower() (kiểm tra bản dịch)
+SECTION_HEADING_PATTERN = re.compile(r'^(?:chương\s+(?:\d+|[ivxlc]+)|chapter\s+\d+|第\d+章|phần\s+\d+|tập\s+\d+)')
+_CHAPTER_NUMBER = re.compile(r'\d+')
+
+
+def is_chapter_heading(text):
+    """Đoạn text có phải tiêu đề chương không (Chương 1, Chương I, CHƯƠNG 001, Chapter 1...)"""
+    if not text:
+        return False
+    return CHAPTER_HEADING_PATTERN.match(text.strip()) is not None
+
+
+def parse_chapter_number(title):
+    """Số chương trong tiêu đề ("Chương 12: ..." -> 12), None nếu không có số"""
+    match = _CHAPTER_NUMBER.search(title or "")
+    return int(match.group(0)) if match else None
+
+
+def split_paragraphs(lines):
+    """Gom các dòng thành đoạn văn (phân cách bằng dòng trống, các dòng trong đoạn nối bằng dấu cách)"""
+    paragraphs = []
+    current = []
+    for line in lines:
+        stripped = line.strip()
+        if stripped:
+            current.append(stripped)
+        elif current:
+            paragraphs.append(" ".join(current))
+            current = []
+    if current:
+        paragraphs.append(" ".join(current))
+    return paragraphs
+
+
+class ChapterSplitter:
+    """
+    Chia chương dạng push: nhận từng dòng, trả về chương vừa hoàn thành
+    (khi gặp tiêu đề chương kế tiếp). Dùng cho iter_chapters và cho việc dựng
+    EPUB trong lúc đang dịch (epub_writer.IncrementalEpubBuilder).
+    """
+
+    def __init__(self, chapter_pattern=DEFAULT_CHAPTER_PATTERN, title=None, found_chapter=False, lines=None):
+        self.pattern = re.compile(chapter_pattern, re.MULTILINE)
+        self.title = title
+        self.found_chapter = found_chapter
+        self.lines = list(lines or [])
+        self.heading_remainder = None   # Phần sau tiêu đề trên dòng tiêu đề gần nhất
+
+    def feed_line(self, line):
+        """
+        Nhận một dòng (không gồm ký tự xuống dòng).
+
+        Returns:
+            (title, paragraphs) của chương vừa kết thúc, hoặc None
+        """
+        match = self.pattern.search(line)
+        if not (match and match.group(0).strip()):
+            self.lines.append(line)
+            return None
+
+        # Phần trước tiêu đề trên cùng dòng thuộc chương trước
+        self.lines.append(line[:match.start()])
+        paragraphs = split_paragraphs(self.lines)
+        if self.found_chapter:
+            completed = (self.title, paragraphs)
+        else:
+            completed = (INTRO_TITLE, paragraphs) if paragraphs else None
+        self.found_chapter = True
+        self.title = match.group(0).strip()
+        self.heading_remainder = line[match.end():]
+        self.lines = [self.heading_remainder]
+        return completed
+
+    def finish(self):
+        """Chương cuối (title None nếu không có chương nào), hoặc None nếu không còn nội dung"""
+        paragraphs = split_paragraphs(self.lines)
+        self.lines = []
+        if self.found_chapter:
+            return self.title, paragraphs
+        return (None, paragraphs) if paragraphs else None
+
+
+def iter_chapters(lines, chapter_pattern=DEFAULT_CHAPTER_PATTERN):
+    """
+    Chia các dòng của file TXT thành chương (một lượt, không cần chỉ mục).
+
+    Args:
+        lines: Iterable các dòng (ví dụ file object)
+        chapter_pattern: Regex nhận diện dòng tiêu đề chương
+
+    Yields:
+        (title, paragraphs): title là None nếu file không có chương nào
+        (người gọi dùng tên sách); paragraphs là list đoạn văn.
+    """
+    splitter = ChapterSplitter(chapter_pattern)
+    for line in lines:
+        completed = splitter.feed_line(line.rstrip("\r\n"))
+        if completed:
+            yield completed
+    completed = splitter.finish()
+    if completed:
+        yield completed
+
+
+def build_chapter_index(txt_path, chapter_pattern=DEFAULT_CHAPTER_PATTERN, encoding="utf-8"):
+    """
+    Quét file một lần, trả về chỉ mục chương.
+
+    Args:
+        txt_path: File TXT
+        chapter_pattern: Regex nhận diện dòng tiêu đề chương
+        encoding: Encoding của file (phải tương thích ASCII: utf-8, cp1252, latin-1...)
+
+    Returns:
+        List[{"number", "title", "start", "end", "line", "end_line"}]:
+        start/end là offset byte của nội dung chương (sau tiêu đề), line/end_line là
+        chỉ số dòng (từ 0) chứa điểm bắt đầu/kết thúc đó, number là số chương trong
+        tiêu đề (None nếu không có). Phần mở đầu chỉ có mặt nếu có nội dung.
+    """
+    pattern = re.compile(chapter_pattern, re.MULTILINE)
+    if encoding.lower().replace("_", "-") == "utf-8-sig":
+        encoding = "utf-8"
+    entries = []
+    title = None
+    found_chapter = False
+    start = 0
+    has_content = False   # Phần mở đầu có nội dung (khác khoảng trắng) không
+    offset = 0
+    line_no = 0
+    start_line = 0
+
+    def add_entry(entry_title, end, end_line):
+        entries.append({"number": parse_chapter_number(entry_title) if found_chapter else None,
+                        "title": entry_title, "start": start, "end": end,
+                        "line": start_line, "end_line": end_line})
+
+    def byte_length(text):
+        return len(text.encode(encoding, errors='surrogateescape'))
+
+    with open(txt_path, 'rb') as f:
+        for raw in f:
+            if offset == 0 and raw.startswith(b'\xef\xbb\xbf'):
+                # Bỏ BOM: offset vẫn tính theo byte thật của file
+                offset = start = 3
+                raw = raw[3:]
+            # surrogateescape: byte lỗi giữ nguyên độ dài khi encode lại -> offset chính xác
+            text = raw.decode(encoding, errors='surrogateescape').rstrip("\r\n")
+            match = pattern.search(text)
+            if match and match.group(0).strip():
+                heading_start = offset + byte_length(text[:match.start()])
+                if found_chapter:
+                    add_entry(title, heading_start, line_no)
+                elif has_content or text[:match.start()].strip():
+                    add_entry(INTRO_TITLE, heading_start, line_no)
+                found_chapter = True
+                title = match.group(0).strip().encode(encoding, errors='surrogateescape').decode(encoding, errors='replace')
+                start = offset + byte_length(text[:match.end()])
+                start_line = line_no
+            elif not found_chapter and text.strip():
+                has_content = True
+            offset += len(raw)
+            line_no += 1
+
+    if found_chapter or has_content:
+        add_entry(title, offset, line_no)
+    return entries
+
+
+def file_fingerprint(txt_path):
+    """Kích thước, mtime và hash (phần đầu + cuối) của file - dùng để biết chỉ mục đã cũ chưa"""
+    stat = os.stat(txt_path)
+    digest = hashlib.sha1()
+    with open(txt_path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if stat.st_size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, stat.st_size - FINGERPRINT_BYTES))
+            digest.update(f.read())
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": digest.hexdigest()}
+
+
+def _read_index_cache(cache_path, chapter_pattern, encoding, fingerprint):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (data.get("version") != INDEX_CACHE_VERSION or data.get("pattern") != chapter_pattern
+            or data.get("encoding") != encoding or data.get("file") != fingerprint
+            or data.get("fields") != list(INDEX_FIELDS)):
+        return None
+    return [dict(zip(INDEX_FIELDS, row)) for row in data.get("entries", [])]
+
+
+def _write_index_cache(cache_path, chapter_pattern, encoding, fingerprint, entries):
+    data = {
+        "version": INDEX_CACHE_VERSION,
+        "pattern": chapter_pattern,
+        "encoding": encoding,
+        "file": fingerprint,
+        "fields": list(INDEX_FIELDS),
+        # Mỗi chương một dòng [number, title, start, end, line, end_line] cho gọn
+        "entries": [[entry[field] for field in INDEX_FIELDS] for entry in entries],
+    }
+    temp_path = f"{cache_path}.tmp"
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"⚠️ Không thể lưu chỉ mục chương {cache_path}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def load_chapter_index(txt_path, chapter_pattern=DEFAULT_CHAPTER_PATTERN, encoding="utf-8", use_cache=True):
+    """
+    Chỉ mục chương của file, đọc từ <file>.chapters.json nếu còn khớp, nếu không thì
+    quét lại (build_chapter_index) và lưu đè.
+
+    Args:
+        txt_path: File TXT
+        chapter_pattern: Regex nhận diện dòng tiêu đề chương
+        encoding: Encoding của file
+        use_cache: False = luôn quét lại, không đọc/ghi file chỉ mục
+
+    Returns:
+        List chương như build_chapter_index
+    """
+    if not use_cache:
+        return build_chapter_index(txt_path, chapter_pattern, encoding)
+    cache_path = txt_path + INDEX_CACHE_SUFFIX
+    fingerprint = file_fingerprint(txt_path)
+    entries = _read_index_cache(cache_path, chapter_pattern, encoding, fingerprint)
+    if entries is not None:
+        return entries
+    entries = build_chapter_index(txt_path, chapter_pattern, encoding)
+    # File bị sửa trong lúc quét -> không lưu chỉ mục có thể sai
+    if file_fingerprint(txt_path) == fingerprint:
+        _write_index_cache(cache_path, chapter_pattern, encoding, fingerprint, entries)
+    return entries
+
+
+def read_chapter_text(txt_path, entry, encoding="utf-8"):
+    """Đọc nội dung (text) một chương theo chỉ mục"""
+    if encoding.lower().replace("_", "-") == "utf-8-sig":
+        encoding = "utf-8"  # BOM đã được bỏ qua trong chỉ mục
+    with open(txt_path, 'rb') as f:
+        f.seek(entry["start"])
+        data = f.read(entry["end"] - entry["start"])
+    return data.decode(encoding, errors='replace')
+
+
+def read_chapter_paragraphs(txt_path, entry, encoding="utf-8"):
+    """Đọc các đoạn văn của một chương theo chỉ mục"""
+    return split_paragraphs(read_chapter_text(txt_path, entry, encoding).split("\n"))
+
+
+def resolve_workers(txt_path, workers=None):
+    """Số process nên dùng: workers=None -> số CPU, nhưng 1 nếu file nhỏ"""
+    if workers is None:
+        if os.path.getsize(txt_path) < PARALLEL_MIN_BYTES:
+            return 1
+        return os.cpu_count() or 1
+    return max(1, workers)
+
+
+def _render_batch(render_fn, txt_path, items, args):
+    return [render_fn(txt_path, index, entry, *args) for index, entry in items]
+
+
+def render_chapters(txt_path, entries, render_fn, args=(), workers=None):
+    """
+    Render các chương song song, trả kết quả theo đúng thứ tự.
+
+    Các chương được gom thành lô (nhiều chương nhỏ / một task) để giảm chi phí
+    gửi task giữa các process; số lô đang chờ được giới hạn để bộ nhớ không
+    tăng theo kích thước sách khi một lô phía trước chạy chậm.
+
+    Args:
+        txt_path: File TXT
+        entries: Chỉ mục từ build_chapter_index / load_chapter_index
+        render_fn: Hàm cấp module render_fn(txt_path, index, entry, *args) (phải pickle được)
+        args: Tham số thêm cho render_fn
+        workers: Số process (None = số CPU, <= 1 = render tuần tự trong process hiện tại)
+
+    Yields:
+        (entry, kết quả render_fn) theo thứ tự chương
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(entries) <= 1:
+        for index, entry in enumerate(entries):
+            yield entry, render_fn(txt_path, index, entry, *args)
+        return
+
+    batch_size = max(1, min(MAX_BATCH_CHAPTERS, len(entries) // (workers * PENDING_PER_WORKER)))
+    indexed = list(enumerate(entries))
+    batches = [indexed[i:i + batch_size] for i in range(0, len(indexed), batch_size)]
+    max_pending = workers * PENDING_PER_WORKER
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        def drain_one():
+            items, future = pending.popleft()
+            for (_, entry), result in zip(items, future.result()):
+                yield entry, result
+
+        for items in batches:
+            pending.append((items, executor.submit(_render_batch, render_fn, txt_path, items, args)))
+            if len(pending) >= max_pending:
+                yield from drain_one()
+        while pending:
+            yield from drain_one()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bỏ qua API cho chunk tầm thường và dedup chunk trùng lặp trong một lần dịch
+
+- Passthrough: chunk chỉ gồm số, dòng phân cách, URL (hoặc pattern tự cấu hình)
+  được giữ nguyên, không tốn request.
+- Singleflight: các chunk có nội dung giống nhau (sau khi chuẩn hóa) chỉ được
+  dịch một lần; chunk đến sau chờ kết quả của chunk đang dịch thay vì gọi API.
+  Chỉ kết quả dịch thành công mới được chia sẻ.
+- Bản dịch đã xong được giữ trong LRU có giới hạn (chunk lặp lại thường là đoạn
+  boilerplate gần nhau), nên bộ nhớ không tăng theo độ dài truyện.
+
+Tắt mặc định (model_settings["chunk_dedup"] = True để bật).
+"""
+
+import re
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+DEFAULT_PASSTHROUGH_PATTERNS = [
+    r'^[\d\s.,:;/()\-–—+%#]+$',                        # Chỉ có số (số trang, số chương đơn lẻ...)
+    r'^[\s\-=_*~#.·•—–+<>|/\\○●◆◇■□★☆※]{3,}$',         # Dòng phân cách (-----, ＊＊＊, ~~~)
+    r'^(https?://|www\.)\S+$',                          # URL đứng một mình
+]
+
+# Số bản dịch đã xong được giữ lại để dùng cho chunk trùng đến sau
+DEFAULT_DONE_CACHE_SIZE = 128
+
+
+def normalize_chunk_text(chunk_lines):
+    """
+    Chuẩn hóa chunk để so sánh trùng lặp: NFKC, gộp khoảng trắng, bỏ dòng trống đầu/cuối.
+    """
+    text = unicodedata.normalize("NFKC", "".join(chunk_lines))
+    lines = [re.sub(r'\s+', ' ', line).strip() for line in text.splitlines()]
+    while lines and not lines[0]:
+        lines.pop(0)
+    while lines and not lines[-1]:
+        lines.pop()
+    return "\n".join(lines)
+
+
+class _Flight:
+    """Một chunk đang được dịch (leader); các chunk trùng chờ trên event"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.text = None  # Bản dịch thành công (None nếu leader lỗi)
+
+
+class ChunkDeduplicator:
+    """
+    Bọc hàm dịch chunk (process_chunk / process_chunk_routed) với passthrough + singleflight.
+
+    Dùng:
+        dedup = ChunkDeduplicator(is_error=is_error_chunk_text)
+        result = dedup.run(chunk_data, process_chunk, *args, **kwargs)
+    """
+
+    def __init__(self, passthrough_patterns=None, is_error=None, stop_check=None, cache_size=DEFAULT_DONE_CACHE_SIZE):
+        """
+        Args:
+            passthrough_patterns: Regex bổ sung cho dòng được giữ nguyên (áp dụng trên từng dòng đã strip)
+            is_error: Callable(text) -> bool, nhận diện error chunk (không chia sẻ kết quả lỗi)
+            stop_check: Callable() -> bool, dừng chờ khi người dùng dừng dịch
+            cache_size: Số bản dịch đã xong giữ lại (LRU)
+        """
+        patterns = DEFAULT_PASSTHROUGH_PATTERNS + list(passthrough_patterns or [])
+        self.passthrough_regexes = []
+        for pattern in patterns:
+            try:
+                self.passthrough_regexes.append(re.compile(pattern))
+            except re.error as e:
+                print(f"⚠️ Passthrough pattern không hợp lệ '{pattern}': {e}")
+
+        self.is_error = is_error or (lambda text: False)
+        self.stop_check = stop_check
+
+        self.lock = threading.Lock()
+        self._inflight = {}  # {key: _Flight}
+        self._done = OrderedDict()   # {key: bản dịch thành công} - LRU, tối đa cache_size
+        self.cache_size = max(0, int(cache_size))
+
+        self.passthrough_count = 0
+        self.shared_count = 0
+
+    def is_passthrough(self, chunk_lines):
+        """Chunk không cần dịch: mọi dòng không trống đều khớp một passthrough pattern"""
+        for line in chunk_lines:
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if not any(regex.match(stripped) for regex in self.passthrough_regexes):
+                return False
+        return True
+
+    @staticmethod
+    def _key(chunk_lines):
+        return hashlib.sha1(normalize_chunk_text(chunk_lines).encode("utf-8")).hexdigest()
+
+    def _wait(self, flight, cancel_event=None):
+        """Chờ leader xong; trả về False nếu bị dừng/hủy trong lúc chờ"""
+        while not flight.event.wait(1.0):
+            if self.stop_check is not None and self.stop_check():
+                return False
+            if cancel_event is not None and cancel_event.is_set():
+                return False
+        return True
+
+    def run(self, chunk_data, fn, *args, **kwargs):
+        """
+        Dịch chunk qua fn(*args, **kwargs) trừ khi chunk là passthrough hoặc trùng chunk khác.
+
+        Returns:
+            (chunk_index, translated_text, lines_count, line_range) như process_chunk
+        """
+        chunk_index, chunk_lines, chunk_start_line_index = chunk_data
+        line_range = f"{chunk_start_line_index + 1}:{chunk_start_line_index + len(chunk_lines)}"
+
+        if self.is_passthrough(chunk_lines):
+            with self.lock:
+                self.passthrough_count += 1
+            print(f"⏭️ Chunk {chunk_index + 1}: chỉ có số/phân cách/URL - giữ nguyên, không gọi API")
+            return (chunk_index, "".join(chunk_lines), len(chunk_lines), line_range)
+
+        key = self._key(chunk_lines)
+        with self.lock:
+            if key in self._done:
+                self._done.move_to_end(key)
+                self.shared_count += 1
+                print(f"♻️ Chunk {chunk_index + 1}: trùng nội dung đã dịch - dùng lại bản dịch")
+                return (chunk_index, self._done[key], len(chunk_lines), line_range)
+            flight = self._inflight.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+
+        if not is_leader:
+            print(f"⏳ Chunk {chunk_index + 1}: trùng chunk đang dịch - chờ kết quả")
+            if self._wait(flight, kwargs.get("cancel_event")) and flight.text is not None:
+                with self.lock:
+                    self.shared_count += 1
+                return (chunk_index, flight.text, len(chunk_lines), line_range)
+            # Leader lỗi hoặc bị dừng -> tự dịch
+            return fn(*args, **kwargs)
+
+        result = None
+        try:
+            result = fn(*args, **kwargs)
+            return result
+        finally:
+            with self.lock:
+                if result is not None and not self.is_error(result[1]):
+                    flight.text = result[1]
+                    if self.cache_size:
+                        self._done[key] = result[1]
+                        while len(self._done) > self.cache_size:
+                            self._done.popitem(last=False)
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def print_stats(self):
+        if self.passthrough_count or self.shared_count:
+            print(f"\n♻️ Dedup: {self.passthrough_count} chunks giữ nguyên (passthrough), "
+                  f"{self.shared_count} chunks dùng lại bản dịch trùng")
+
+
+def create_chunk_deduplicator(model_settings, is_error=None, stop_check=None):
+    """
+    Tạo ChunkDeduplicator từ model_settings.
+
+    Keys hỗ trợ:
+        chunk_dedup: bool - bật passthrough + dedup (mặc định False)
+        passthrough_patterns: list regex bổ sung cho dòng giữ nguyên không dịch
+        chunk_dedup_cache_size: số bản dịch đã xong giữ lại cho chunk trùng (mặc định 128)
+
+    Returns:
+        ChunkDeduplicator hoặc None nếu tắt
+    """
+    model_settings = model_settings or {}
+    if not model_settings.get("chunk_dedup", False):
+        return None
+    return ChunkDeduplicator(
+        passthrough_patterns=model_settings.get("passthrough_patterns"),
+        is_error=is_error,
+        stop_check=stop_check,
+        cache_size=model_settings.get("chunk_dedup_cache_size", DEFAULT_DONE_CACHE_SIZE),
+    )
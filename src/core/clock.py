@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Clock có thể inject cho rate limiter / thread manager
+
+- SystemClock: thời gian thật (time.time, datetime.now, time.sleep) - mặc định
+- VirtualClock: thời gian ảo cho simulator. Nhiều thread "tham gia" cùng dùng một
+  đồng hồ; thời gian chỉ nhảy tới mốc thức dậy gần nhất khi TẤT CẢ thread tham gia
+  đang sleep, nên cửa sổ 60s hay cooldown 30s trôi qua gần như tức thì mà thứ tự
+  sự kiện giữa các thread vẫn đúng.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+
+class SystemClock:
+    """Đồng hồ thật"""
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+SYSTEM_CLOCK = SystemClock()
+
+
+class VirtualClock:
+    """
+    Đồng hồ ảo (discrete-event).
+
+    Dùng:
+        clock = VirtualClock()
+        def worker():
+            with clock.participant():
+                limiter.acquire()      # sleep bên trong là sleep ảo
+                clock.sleep(latency)   # giả lập thời gian request
+
+    Thread không đăng ký participant mà gọi sleep() sẽ nhảy thời gian ngay (chạy đơn luồng).
+    """
+
+    def __init__(self, start=0.0, epoch=datetime(2025, 1, 1)):
+        self._now = float(start)
+        self._epoch = epoch
+        self._epoch_ts = epoch.timestamp()
+        self._cond = threading.Condition()
+        self._participants = 0
+        self._wakes = []  # Mốc thức dậy của các thread đang sleep
+
+    def time(self):
+        return self._epoch_ts + self._now
+
+    def monotonic(self):
+        return self._now
+
+    def now(self):
+        return self._epoch + timedelta(seconds=self._now)
+
+    @property
+    def elapsed(self):
+        """Số giây ảo đã trôi qua"""
+        return self._now
+
+    def register(self):
+        with self._cond:
+            self._participants += 1
+
+    def unregister(self):
+        with self._cond:
+            self._participants -= 1
+            self._maybe_advance()
+
+    @contextmanager
+    def participant(self):
+        self.register()
+        try:
+            yield self
+        finally:
+            self.unregister()
+
+    def advance(self, seconds):
+        """Nhảy thời gian thủ công (chỉ dùng khi không có participant)"""
+        with self._cond:
+            self._now += max(0.0, seconds)
+            self._cond.notify_all()
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        with self._cond:
+            wake = self._now + seconds
+            if self._participants <= 0:
+                self._now = wake
+                return
+            self._wakes.append(wake)
+            self._maybe_advance()
+            while self._now < wake:
+                self._cond.wait()
+            self._wakes.remove(wake)
+
+    def _maybe_advance(self):
+        """Gọi khi đang giữ lock: mọi participant đều sleep -> nhảy tới mốc thức dậy gần nhất"""
+        if self._wakes and len(self._wakes) >= self._participants:
+            self._now = max(self._now, min(self._wakes))
+            self._cond.notify_all()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ghi debug responses bất đồng bộ
+
+Worker dịch chỉ đẩy text vào queue có giới hạn (không bao giờ chờ I/O đĩa);
+một thread nền gom nhiều bản ghi và ghi một lần, xoay vòng file theo kích thước
+(<file>.1, <file>.2, ...) và có thể nén file cũ (gzip, hoặc zstd nếu có zstandard).
+Queue đầy -> bỏ bản ghi và đếm số bị bỏ thay vì làm chậm worker.
+"""
+
+import os
+import gzip
+import queue
+import atexit
+import shutil
+import threading
+
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024   # Xoay vòng khi file vượt 50MB
+DEFAULT_BACKUP_COUNT = 3
+DEFAULT_QUEUE_SIZE = 2000
+BATCH_MAX_RECORDS = 200
+
+_COMPRESSION_SUFFIX = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def _compress_file(path, compression):
+    """Nén file -> path + suffix, xóa file gốc. Trả về đường dẫn mới."""
+    target = path + _COMPRESSION_SUFFIX[compression]
+    if compression == "zstd":
+        import zstandard
+        with open(path, "rb") as src, open(target, "wb") as dst:
+            zstandard.ZstdCompressor(level=10).copy_stream(src, dst)
+    else:
+        with open(path, "rb") as src, gzip.open(target, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+    os.remove(path)
+    return target
+
+
+class AsyncDebugWriter:
+    """Writer nền cho một file debug"""
+
+    _STOP = object()
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT,
+                 compression=None, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        Args:
+            path: File debug
+            max_bytes: Kích thước xoay vòng (0 = không xoay vòng)
+            backup_count: Số file cũ giữ lại
+            compression: None, "gzip" hoặc "zstd" (nén file cũ khi xoay vòng)
+            queue_size: Số bản ghi tối đa đang chờ ghi
+        """
+        if compression == "zstd":
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                print("⚠️ Không có zstandard, nén debug log bằng gzip")
+                compression = "gzip"
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compression = compression if compression in _COMPRESSION_SUFFIX else None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._file = None
+        self._thread = threading.Thread(target=self._run, name=f"debug-writer-{os.path.basename(path)}", daemon=True)
+        self._thread.start()
+
+    def write(self, text):
+        """Đưa text vào queue - không block; trả về False nếu queue đầy (bản ghi bị bỏ)"""
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            batch = []
+            stop = item is self._STOP
+            if not stop:
+                batch.append(item)
+            # Gom các bản ghi đang chờ để ghi một lần
+            while not stop and len(batch) < BATCH_MAX_RECORDS:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            if batch:
+                self._write_batch("".join(batch))
+                self.written += len(batch)
+            if stop:
+                self._close_file()
+                return
+
+    def _write_batch(self, data):
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(data)
+            self._file.flush()
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except Exception as e:
+            print(f"⚠️ Lỗi khi ghi debug response: {e}")
+
+    def _backup_name(self, index):
+        return f"{self.path}.{index}" + (_COMPRESSION_SUFFIX[self.compression] if self.compression else "")
+
+    def _rotate(self):
+        self._close_file()
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        oldest = self._backup_name(self.backup_count)
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for index in range(self.backup_count - 1, 0, -1):
+            source = self._backup_name(index)
+            if os.path.exists(source):
+                os.replace(source, self._backup_name(index + 1))
+        rotated = f"{self.path}.1"
+        os.replace(self.path, rotated)
+        if self.compression:
+            _compress_file(rotated, self.compression)
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self, timeout=10.0):
+        """Ghi hết queue rồi dừng thread"""
+        if not self._thread.is_alive():
+            return
+        self.queue.put(self._STOP)
+        self._thread.join(timeout)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+_writer_options = {}
+
+
+def configure_debug_writers(model_settings):
+    """
+    Cấu hình cho các writer tạo sau đó.
+
+    Keys hỗ trợ:
+        debug_max_mb: kích thước xoay vòng (MB, mặc định 50, 0 = không xoay vòng)
+        debug_backup_count: số file cũ giữ lại (mặc định 3)
+        debug_compression: "gzip" / "zstd" / None (mặc định không nén)
+    """
+    model_settings = model_settings or {}
+    options = {}
+    if model_settings.get("debug_max_mb") is not None:
+        options["max_bytes"] = int(float(model_settings["debug_max_mb"]) * 1024 * 1024)
+    if model_settings.get("debug_backup_count") is not None:
+        options["backup_count"] = int(model_settings["debug_backup_count"])
+    if model_settings.get("debug_compression"):
+        options["compression"] = model_settings["debug_compression"]
+    with _writers_lock:
+        _writer_options.clear()
+        _writer_options.update(options)
+
+
+def get_debug_writer(path):
+    """Writer dùng chung cho một file debug (tạo khi cần)"""
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = AsyncDebugWriter(path, **_writer_options)
+            _writers[path] = writer
+        return writer
+
+
+def close_debug_writers():
+    """Ghi hết và đóng mọi writer (cuối phiên dịch / khi thoát)"""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+        if writer.dropped:
+            print(f"⚠️ Debug log {os.path.basename(writer.path)}: bỏ {writer.dropped} bản ghi do queue đầy")
+
+
+atexit.register(close_debug_writers)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ghi DOCX bằng cách ghép trực tiếp WordprocessingML
+
+Thay vì thêm từng paragraph qua python-docx (chậm, giữ toàn bộ cây XML trong bộ nhớ),
+nội dung được render thành các đoạn XML (<w:p>...) - có thể render song song theo
+chương trong process pool (chapter_index.render_chapters) - rồi ghi lần lượt vào
+word/document.xml của template mặc định của python-docx (giữ styles Heading 1/2...).
+
+XML tạo ra giống python-docx: add_heading -> pStyle HeadingN, add_page_break ->
+<w:br w:type="page"/>, run có "\\n" -> <w:br/>.
+"""
+
+import io
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+try:
+    from .chapter_index import read_chapter_paragraphs
+except ImportError:
+    from chapter_index import read_chapter_paragraphs
+
+# Ký tự điều khiển không hợp lệ trong XML 1.0 (python-docx báo lỗi với các ký tự này)
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+PAGE_BREAK_XML = '<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+
+TWIPS_PER_INCH = 1440
+
+
+def xml_text(text):
+    """Escape text cho <w:t>"""
+    return escape(_INVALID_XML_CHARS.sub('', text))
+
+
+def run_xml(text, font_size=None):
+    """Một run; "\\n" trong text thành <w:br/>. font_size tính bằng pt."""
+    props = f'<w:rPr><w:sz w:val="{int(font_size * 2)}"/></w:rPr>' if font_size else ''
+    pieces = []
+    for i, line in enumerate(text.split('\n')):
+        if i > 0:
+            pieces.append('<w:br/>')
+        if line:
+            pieces.append(f'<w:t xml:space="preserve">{xml_text(line)}</w:t>')
+    return f'<w:r>{props}{"".join(pieces)}</w:r>'
+
+
+def paragraph_xml(runs="", style=None, align=None, line_spacing=None, space_after=None, first_line_indent=None):
+    """
+    Một paragraph.
+
+    Args:
+        runs: XML các run (run_xml)
+        style: styleId (ví dụ "Heading1")
+        align: "center", "left", "right", "both"
+        line_spacing: Hệ số giãn dòng (1.5 = 1.5 dòng)
+        space_after: Khoảng cách sau đoạn (pt)
+        first_line_indent: Thụt dòng đầu (inch)
+    """
+    props = []
+    if style:
+        props.append(f'<w:pStyle w:val="{style}"/>')
+    if line_spacing is not None or space_after is not None:
+        spacing = ''
+        if space_after is not None:
+            spacing += f' w:after="{int(space_after * 20)}"'
+        if line_spacing is not None:
+            spacing += f' w:line="{int(line_spacing * 240)}" w:lineRule="auto"'
+        props.append(f'<w:spacing{spacing}/>')
+    if first_line_indent is not None:
+        props.append(f'<w:ind w:firstLine="{int(first_line_indent * TWIPS_PER_INCH)}"/>')
+    if align:
+        props.append(f'<w:jc w:val="{align}"/>')
+    ppr = f'<w:pPr>{"".join(props)}</w:pPr>' if props else ''
+    return f'<w:p>{ppr}{runs}</w:p>'
+
+
+def heading_xml(text, level=1, align=None):
+    """Giống Document.add_heading(text, level)"""
+    return paragraph_xml(run_xml(text), style=f"Heading{level}", align=align)
+
+
+def render_docx_chapter(title, paragraphs, page_break_before=False):
+    """XML một chương theo bố cục của ConvertEpub.txt_to_docx: page break, Heading 1, các đoạn văn"""
+    parts = [PAGE_BREAK_XML] if page_break_before else []
+    parts.append(heading_xml(title, 1))
+    parts.extend(paragraph_xml(run_xml(paragraph)) for paragraph in paragraphs)
+    return "".join(parts)
+
+
+def render_indexed_docx_chapter(txt_path, index, entry, book_title):
+    """Render một chương theo chỉ mục (chạy trong process pool); page break trước mọi chương trừ chương đầu"""
+    return render_docx_chapter(entry["title"] or book_title, read_chapter_paragraphs(txt_path, entry),
+                               page_break_before=index > 0)
+
+
+def _set_page_margins(document_xml, margin_twips):
+    def replace(match):
+        tag = match.group(0)
+        for side in ("top", "bottom", "left", "right"):
+            tag = re.sub(rf'w:{side}="-?\d+"', f'w:{side}="{margin_twips}"', tag)
+        return tag
+    return re.sub(r'<w:pgMar\b[^>]*/>', replace, document_xml)
+
+
+def write_docx(docx_path, body_parts, margin_inches=None):
+    """
+    Ghi file DOCX từ các đoạn XML body (iterable, ghi lần lượt - không giữ cả văn bản trong bộ nhớ).
+
+    File được ghi ra <docx>.tmp rồi os.replace khi xong.
+
+    Args:
+        docx_path: File đích
+        body_parts: Iterable các chuỗi XML (<w:p>...)
+        margin_inches: Lề trang (inch) cho cả 4 cạnh, None = giữ lề của template
+    """
+    from docx import Document
+
+    template = io.BytesIO()
+    Document().save(template)
+    temp_path = f"{docx_path}.tmp"
+    try:
+        with zipfile.ZipFile(template) as src, \
+                zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as dst:
+            document_xml = src.read("word/document.xml").decode("utf-8")
+            for item in src.infolist():
+                if item.filename != "word/document.xml":
+                    dst.writestr(item, src.read(item.filename))
+
+            if margin_inches is not None:
+                document_xml = _set_page_margins(document_xml, int(margin_inches * TWIPS_PER_INCH))
+            # Nội dung mới được chèn trước <w:sectPr> cuối body (giống python-docx add_paragraph)
+            insert_at = document_xml.rfind("<w:sectPr")
+            if insert_at == -1:
+                insert_at = document_xml.rfind("</w:body>")
+            with dst.open("word/document.xml", "w", force_zip64=True) as out:
+                out.write(document_xml[:insert_at].encode("utf-8"))
+                for part in body_parts:
+                    out.write(part.encode("utf-8"))
+                out.write(document_xml[insert_at:].encode("utf-8"))
+        os.replace(temp_path, docx_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -11,6 +11,11 @@ from collections import deque
 from datetime import datetime, timedelta
 import hashlib
 
+try:
+    from .clock import SYSTEM_CLOCK
+except ImportError:
+    from clock import SYSTEM_CLOCK
+
 
 class EnhancedRateLimiter:
     """
@@ -18,7 +23,7 @@ class EnhancedRateLimiter:
     """
     
     def __init__(self, requests_per_minute=10, tokens_per_minute=None, 
-                 requests_per_day=None, window_seconds=60):
+                 requests_per_day=None, window_seconds=60, clock=None):
         """
         Initialize enhanced rate limiter
         
@@ -27,7 +32,10 @@ class EnhancedRateLimiter:
             tokens_per_minute: Số tokens tối đa mỗi phút (optional)
             requests_per_day: Số requests tối đa mỗi ngày (optional)
             window_seconds: Kích thước cửa sổ thời gian (mặc định 60s)
+            clock: Đồng hồ (mặc định SYSTEM_CLOCK; VirtualClock cho simulator)
         """
+        self.clock = clock or SYSTEM_CLOCK
+        
         # RPM tracking (existing)
         self.base_max_requests = requests_per_minute
         self.max_requests = requests_per_minute
@@ -73,7 +81,7 @@ class EnhancedRateLimiter:
         
         while attempt < max_attempts:
             with self.lock:
-                now = datetime.now()
+                now = self.clock.now()
                 self._cleanup_old_requests(now)
                 
                 # Kiểm tra RPM slot
@@ -118,11 +126,11 @@ class EnhancedRateLimiter:
                 elif attempt % 5 == 0:
                     print(f"⏳ Vẫn chờ rate limit... attempt {attempt}/{max_attempts}")
                 
-                time.sleep(actual_sleep)
+                self.clock.sleep(actual_sleep)
             else:
                 # Ngay cả khi wait_time <= 0, vẫn sleep một chút với jitter
                 small_jitter = (thread_id % 50) / 1000.0  # 0-50ms
-                time.sleep(0.05 + small_jitter)
+                self.clock.sleep(0.05 + small_jitter)
             
             attempt += 1
         
@@ -130,7 +138,7 @@ class EnhancedRateLimiter:
         print(f"⚠️ Fallback acquire after {max_attempts} attempts - FORCING slot")
         with self.lock:
             # Cleanup trước khi force
-            now = datetime.now()
+            now = self.clock.now()
             self._cleanup_old_requests(now)
             
             # Nếu vẫn full, xóa request cũ nhất
@@ -144,7 +152,7 @@ class EnhancedRateLimiter:
     def _check_tpm(self, estimated_tokens):
         """Check xem còn TPM quota không"""
         with self.token_lock:
-            now = datetime.now()
+            now = self.clock.now()
             self._cleanup_old_tokens(now)
             
             current_tpm = sum(t[1] for t in self.tokens_used)
@@ -153,7 +161,7 @@ class EnhancedRateLimiter:
     def _record_tpm(self, tokens):
         """Ghi nhận tokens đã sử dụng"""
         with self.token_lock:
-            self.tokens_used.append((datetime.now(), tokens))
+            self.tokens_used.append((self.clock.now(), tokens))
     
     def _cleanup_old_tokens(self, now):
         """Xóa token records ngoài window"""
@@ -167,7 +175,7 @@ class EnhancedRateLimiter:
             return True
         
         with self.daily_lock:
-            today = datetime.now().strftime("%Y-%m-%d")
+            today = self.clock.now().strftime("%Y-%m-%d")
             if today not in self.daily_requests:
                 self.daily_requests = {today: 0}  # Reset
             
@@ -179,7 +187,7 @@ class EnhancedRateLimiter:
             return
         
         with self.daily_lock:
-            today = datetime.now().strftime("%Y-%m-%d")
+            today = self.clock.now().strftime("%Y-%m-%d")
             self.daily_requests[today] = self.daily_requests.get(today, 0) + 1
     
     def get_rpd_remaining(self):
@@ -188,7 +196,7 @@ class EnhancedRateLimiter:
             return float('inf')
         
         with self.daily_lock:
-            today = datetime.now().strftime("%Y-%m-%d")
+            today = self.clock.now().strftime("%Y-%m-%d")
             used = self.daily_requests.get(today, 0)
             return max(0, self.max_daily_requests - used)
     
@@ -204,12 +212,12 @@ class EnhancedRateLimiter:
             rpm_usage = len(self.requests)
         
         with self.token_lock:
-            now = datetime.now()
+            now = self.clock.now()
             self._cleanup_old_tokens(now)
             tpm_usage = sum(t[1] for t in self.tokens_used)
         
         with self.daily_lock:
-            today = datetime.now().strftime("%Y-%m-%d")
+            today = self.clock.now().strftime("%Y-%m-%d")
             rpd_usage = self.daily_requests.get(today, 0)
         
         return {
@@ -249,7 +257,7 @@ class EnhancedRateLimiter:
     def debug_state(self):
         """Print detailed debug state (for troubleshooting)"""
         with self.lock:
-            now = datetime.now()
+            now = self.clock.now()
             self._cleanup_old_requests(now)
             
             print("\n" + "🔍"*30)
@@ -275,13 +283,13 @@ class EnhancedRateLimiter:
         
         if self.max_tokens:
             with self.token_lock:
-                now = datetime.now()
+                now = self.clock.now()
                 self._cleanup_old_tokens(now)
                 tpm_usage = sum(t[1] for t in self.tokens_used)
                 print(f"🔤 TPM Usage: {tpm_usage:,}/{self.max_tokens:,}")
         
         with self.daily_lock:
-            today = datetime.now().strftime("%Y-%m-%d")
+            today = self.clock.now().strftime("%Y-%m-%d")
             rpd_usage = self.daily_requests.get(today, 0)
             if self.max_daily_requests:
                 print(f"📆 RPD Usage: {rpd_usage}/{self.max_daily_requests}")
@@ -296,7 +304,7 @@ class EnhancedRateLimiter:
         """Gọi khi gặp rate limit error để adaptive throttling"""
         with self.lock:
             self.consecutive_errors += 1
-            self.last_error_time = datetime.now()
+            self.last_error_time = self.clock.now()
             
             # Giảm throttle factor
             if self.consecutive_errors == 1:
@@ -318,7 +326,7 @@ class EnhancedRateLimiter:
         with self.lock:
             if self.consecutive_errors > 0:
                 # Chỉ recovery sau 30s không có lỗi
-                if self.last_error_time and (datetime.now() - self.last_error_time).total_seconds() > 30:
+                if self.last_error_time and (self.clock.now() - self.last_error_time).total_seconds() > 30:
                     self.consecutive_errors = max(0, self.consecutive_errors - 1)
                     
                     # Tăng dần throttle factor
@@ -361,7 +369,8 @@ class ImprovedKeyRotator:
                 'last_used': None,
                 'last_error': None,
                 'is_healthy': True,
-                'consecutive_errors': 0
+                'consecutive_errors': 0,
+                'invalid': False  # Key lỗi thật (401, hết credit...) - không bao giờ dùng lại
             }
             for key in api_keys
         }
@@ -385,7 +394,7 @@ class ImprovedKeyRotator:
                         self.key_stats[k]['error_count'],
                         -self.key_stats[k]['success_count']  # Ưu tiên key có nhiều success
                     ),
-                    default=self.api_keys[0]  # Fallback
+                    default=self._fallback_key()
                 )
                 
                 self.key_stats[best_key]['last_used'] = datetime.now()
@@ -409,7 +418,20 @@ class ImprovedKeyRotator:
                 
                 # Fallback: Return first key (even if unhealthy)
                 print("⚠️ Warning: All keys unhealthy, using first key as fallback")
-                return self.api_keys[0]
+                return self._fallback_key()
+    
+    def _fallback_key(self):
+        """Key đầu tiên không bị đánh dấu invalid (gọi khi đang giữ lock)"""
+        return next((k for k in self.api_keys if not self.key_stats[k]['invalid']), self.api_keys[0])
+    
+    def mark_invalid(self, key, reason=None):
+        """Loại key lỗi thật (validate thất bại: 401, hết credit...) khỏi rotation"""
+        with self.lock:
+            if key in self.key_stats:
+                self.key_stats[key]['is_healthy'] = False
+                self.key_stats[key]['invalid'] = True
+                self.key_stats[key]['last_error'] = datetime.now()
+                print(f"⚠️ Key ***{key[-8:]} bị loại khỏi rotation: {reason or 'invalid'}")
     
     def report_success(self, key):
         """Báo cáo key hoạt động tốt"""
@@ -419,7 +441,7 @@ class ImprovedKeyRotator:
                 self.key_stats[key]['consecutive_errors'] = 0
                 
                 # Recovery: Mark healthy nếu có successes sau lỗi
-                if self.key_stats[key]['error_count'] > 0:
+                if self.key_stats[key]['error_count'] > 0 and not self.key_stats[key]['invalid']:
                     success_ratio = self.key_stats[key]['success_count'] / (
                         self.key_stats[key]['success_count'] + self.key_stats[key]['error_count']
                     )
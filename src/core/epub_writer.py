@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ghi EPUB3 trực tiếp từ file TXT (không cần python-docx / Pandoc)
+
+File TXT được đọc từng dòng; mỗi chương được render thành một file XHTML và ghi
+ngay vào container zip rồi bỏ khỏi bộ nhớ (bộ nhớ O(chương)). Mục lục (nav.xhtml,
+toc.ncx) và content.opf chỉ cần danh sách tiêu đề nên được ghi ở cuối.
+Với workers > 1, file được chia theo chỉ mục chương (chapter_index) và các chương
+được render song song trong process pool, rồi ghi vào zip theo thứ tự.
+
+Nhận diện chương giống ConvertEpub.txt_to_docx: regex (re.MULTILINE) khớp trên từng dòng,
+phần trước chương đầu là "Mở Đầu", không có chương nào -> cả file là một chương
+mang tên sách; đoạn văn phân cách bằng dòng trống.
+
+    txt_to_epub("truyen.txt", "truyen.epub", "Tên truyện", "Tác giả", r"^Chương\\s+\\d+(?::\\s+.*)?$")
+"""
+
+import os
+import html
+import json
+import time
+import uuid
+import shutil
+import codecs
+import zipfile
+
+try:
+    from .chapter_index import (DEFAULT_CHAPTER_PATTERN, ChapterSplitter, iter_chapters, load_chapter_index,
+                                read_chapter_paragraphs, render_chapters, resolve_workers)
+except ImportError:
+    from chapter_index import (DEFAULT_CHAPTER_PATTERN, ChapterSplitter, iter_chapters, load_chapter_index,
+                               read_chapter_paragraphs, render_chapters, resolve_workers)
+
+STAGING_SUFFIX = ".staging"
+PREVIEW_SUFFIX = ".preview.epub"
+STAGED_TITLES_FILE = "chapters.jsonl"
+DEFAULT_PREVIEW_INTERVAL = 300   # Giây giữa 2 lần ghi bản xem trước (0 = tắt)
+
+_CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="EPUB/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+_STYLESHEET = """body { margin: 0 5%; text-align: justify; }
+h1 { text-align: center; page-break-before: always; margin: 1em 0; }
+p { text-indent: 1.5em; margin: 0 0 0.6em 0; }
+"""
+
+
+def render_chapter_xhtml(title, paragraphs, language="vi"):
+    """Render một chương thành XHTML (EPUB3)"""
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n',
+        f'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" '
+        f'lang="{language}" xml:lang="{language}">\n',
+        f'<head>\n<meta charset="UTF-8"/>\n<title>{html.escape(title)}</title>\n',
+        '<link rel="stylesheet" type="text/css" href="style.css"/>\n</head>\n<body>\n<section epub:type="chapter">\n',
+        f'<h1>{html.escape(title)}</h1>\n',
+    ]
+    for paragraph in paragraphs:
+        parts.append(f'<p>{html.escape(paragraph, quote=False)}</p>\n')
+    parts.append('</section>\n</body>\n</html>\n')
+    return "".join(parts)
+
+
+class EpubWriter:
+    """
+    Ghi file EPUB3 từng chương một.
+
+        with EpubWriter("out.epub", "Tên truyện", "Tác giả") as writer:
+            writer.add_chapter("Chương 1", ["Đoạn 1", "Đoạn 2"])
+
+    File được ghi ra <epub>.tmp và chỉ thay file đích khi close() thành công.
+    """
+
+    def __init__(self, epub_path, title, author="Unknown Author", language="vi", identifier=None):
+        self.epub_path = epub_path
+        self.title = title
+        self.author = author
+        self.language = language
+        self.identifier = identifier or f"urn:uuid:{uuid.uuid4()}"
+        self.chapters = []   # [(file_name, title)] - chỉ giữ tiêu đề cho mục lục
+        self._temp_path = f"{epub_path}.tmp"
+        self._zip = zipfile.ZipFile(self._temp_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+        # mimetype phải là entry đầu tiên và không nén
+        self._zip.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        self._zip.writestr("META-INF/container.xml", _CONTAINER_XML)
+        self._zip.writestr("EPUB/style.css", _STYLESHEET)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def next_file_name(self):
+        return f"chapter_{len(self.chapters) + 1:05d}.xhtml"
+
+    def add_chapter(self, title, paragraphs):
+        """Render và ghi một chương vào zip"""
+        self.add_rendered_chapter(title, render_chapter_xhtml(title, paragraphs, self.language))
+
+    def add_rendered_chapter(self, title, xhtml):
+        """Ghi một chương đã render sẵn (XHTML) vào zip"""
+        file_name = self.next_file_name()
+        self._zip.writestr(f"EPUB/{file_name}", xhtml)
+        self.chapters.append((file_name, title))
+
+    def _nav_xhtml(self):
+        items = "".join(
+            f'      <li><a href="{file_name}">{html.escape(title)}</a></li>\n'
+            for file_name, title in self.chapters
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+            f'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" '
+            f'lang="{self.language}" xml:lang="{self.language}">\n'
+            f'<head>\n<meta charset="UTF-8"/>\n<title>{html.escape(self.title)}</title>\n</head>\n<body>\n'
+            '  <nav epub:type="toc" id="toc">\n'
+            f'    <h1>{html.escape(self.title)}</h1>\n    <ol>\n{items}    </ol>\n  </nav>\n'
+            '</body>\n</html>\n'
+        )
+
+    def _toc_ncx(self):
+        points = "".join(
+            f'    <navPoint id="navpoint-{index}" playOrder="{index}">\n'
+            f'      <navLabel><text>{html.escape(title)}</text></navLabel>\n'
+            f'      <content src="{file_name}"/>\n    </navPoint>\n'
+            for index, (file_name, title) in enumerate(self.chapters, 1)
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">\n'
+            f'  <head><meta name="dtb:uid" content="{html.escape(self.identifier)}"/></head>\n'
+            f'  <docTitle><text>{html.escape(self.title)}</text></docTitle>\n'
+            f'  <navMap>\n{points}  </navMap>\n</ncx>\n'
+        )
+
+    def _content_opf(self):
+        manifest = "".join(
+            f'    <item id="ch{index}" href="{file_name}" media-type="application/xhtml+xml"/>\n'
+            for index, (file_name, _) in enumerate(self.chapters, 1)
+        )
+        spine = "".join(f'    <itemref idref="ch{index}"/>\n' for index in range(1, len(self.chapters) + 1))
+        modified = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">\n'
+            '  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            f'    <dc:identifier id="book-id">{html.escape(self.identifier)}</dc:identifier>\n'
+            f'    <dc:title>{html.escape(self.title)}</dc:title>\n'
+            f'    <dc:creator>{html.escape(self.author)}</dc:creator>\n'
+            f'    <dc:language>{self.language}</dc:language>\n'
+            f'    <meta property="dcterms:modified">{modified}</meta>\n'
+            '  </metadata>\n  <manifest>\n'
+            '    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>\n'
+            '    <item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>\n'
+            '    <item id="css" href="style.css" media-type="text/css"/>\n'
+            f'{manifest}  </manifest>\n'
+            f'  <spine toc="ncx">\n{spine}  </spine>\n</package>\n'
+        )
+
+    def close(self):
+        """Ghi mục lục + OPF, đóng zip và thay file đích"""
+        if self._zip is None:
+            return
+        self._zip.writestr("EPUB/nav.xhtml", self._nav_xhtml())
+        self._zip.writestr("EPUB/toc.ncx", self._toc_ncx())
+        self._zip.writestr("EPUB/content.opf", self._content_opf())
+        self._zip.close()
+        self._zip = None
+        os.replace(self._temp_path, self.epub_path)
+
+    def abort(self):
+        """Bỏ file tạm khi lỗi giữa chừng"""
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+def render_indexed_chapter(txt_path, index, entry, book_title, language):
+    """Render một chương theo chỉ mục (chạy trong process pool)"""
+    title = entry["title"] or book_title
+    return render_chapter_xhtml(title, read_chapter_paragraphs(txt_path, entry), language)
+
+
+def txt_to_epub(txt_path, epub_path, book_title, book_author="Unknown Author",
+                chapter_pattern=DEFAULT_CHAPTER_PATTERN, language="vi", workers=None):
+    """
+    Chuyển đổi trực tiếp file .txt sang .epub (EPUB3).
+
+    Args:
+        txt_path (str): Đường dẫn đến file .txt nguồn.
+        epub_path (str): Đường dẫn đến file .epub đích.
+        book_title (str): Tiêu đề sách (dùng làm tiêu đề chương nếu file không có chương).
+        book_author (str): Tác giả.
+        chapter_pattern (str): Regex nhận diện chương.
+        workers (int): Số process render chương (1 = tuần tự một lượt đọc,
+            None = tự chọn: tuần tự với file nhỏ, số CPU với file lớn).
+    Returns:
+        bool: True nếu thành công, False nếu thất bại.
+    """
+    print(f"Bắt đầu chuyển đổi TXT sang EPUB tại '{epub_path}'...")
+
+    if not os.path.exists(txt_path):
+        print(f"  Lỗi: Không tìm thấy file .txt tại đường dẫn '{txt_path}'")
+        return False
+
+    start_time = time.time()
+    workers = resolve_workers(txt_path, workers)
+    try:
+        with EpubWriter(epub_path, book_title, book_author, language) as writer:
+            if workers == 1:
+                with open(txt_path, 'r', encoding='utf-8') as f:
+                    for title, paragraphs in iter_chapters(f, chapter_pattern):
+                        writer.add_chapter(title or book_title, paragraphs)
+                        if len(writer.chapters) % 100 == 0:
+                            print(f"\r  - Đã ghi {len(writer.chapters)} chương...", end='')
+            else:
+                entries = load_chapter_index(txt_path, chapter_pattern)
+                print(f"  Đã lập chỉ mục {len(entries)} chương, đang render song song...")
+                rendered = render_chapters(txt_path, entries, render_indexed_chapter,
+                                           args=(book_title, language), workers=workers)
+                for entry, xhtml in rendered:
+                    writer.add_rendered_chapter(entry["title"] or book_title, xhtml)
+                    if len(writer.chapters) % 100 == 0:
+                        print(f"\r  - Đã ghi {len(writer.chapters)} chương...", end='')
+            if not writer.chapters:
+                writer.add_chapter(book_title, [])  # EPUB cần ít nhất một trang trong spine
+        print(f"\r  Đã ghi {len(writer.chapters)} chương trong {time.time() - start_time:.1f}s")
+        print(f"  Thành công! File EPUB đã được tạo tại: {epub_path}")
+        return True
+    except Exception as e:
+        print(f"  Lỗi khi tạo file EPUB: {e}")
+        return False
+
+
+class IncrementalEpubBuilder:
+    """
+    Dựng EPUB song song với quá trình dịch.
+
+    translate_file_optimized đưa vào đúng phần text vừa ghi ra file output (feed);
+    chương nào đã kết thúc (gặp tiêu đề chương kế tiếp) được render ngay thành
+    XHTML trong thư mục staging (<epub>.staging). Định kỳ ghép các chương đã có
+    thành bản xem trước (<tên>.preview.epub); finish() render chương cuối và ghép
+    EPUB hoàn chỉnh - chỉ là nén các file đã render nên xong ngay sau chunk cuối.
+
+    get_state() được lưu cùng file tiến độ; khi dịch tiếp, resume() đọc lại phần
+    output của chương đang dở (từ offset đã lưu) để khôi phục. Offset là số byte
+    UTF-8 của text đã feed, nên file output phải mở với newline="\n" (không đổi
+    \n thành \r\n trên Windows) để khớp với vị trí thật trong file.
+    """
+
+    def __init__(self, epub_path, title, author="Unknown Author", chapter_pattern=DEFAULT_CHAPTER_PATTERN,
+                 language="vi", preview_interval=DEFAULT_PREVIEW_INTERVAL, clock=time.monotonic):
+        self.epub_path = epub_path
+        self.title = title
+        self.author = author
+        self.language = language
+        self.chapter_pattern = chapter_pattern
+        self.preview_interval = preview_interval
+        self.preview_path = os.path.splitext(epub_path)[0] + PREVIEW_SUFFIX
+        self.staging_dir = epub_path + STAGING_SUFFIX
+        self.identifier = f"urn:uuid:{uuid.uuid5(uuid.NAMESPACE_URL, os.path.abspath(epub_path))}"
+        self.clock = clock
+        self.last_preview = clock()
+        self.failed = False
+
+        self.titles = []             # Tiêu đề các chương đã render trong staging
+        self.splitter = ChapterSplitter(chapter_pattern)
+        self.offset = 0              # Số byte đã nhận (= vị trí trong file output)
+        self.chapter_offset = 0      # Offset ngay sau dòng tiêu đề của chương đang dở
+        self.heading_remainder = ""  # Phần sau tiêu đề trên dòng tiêu đề đó
+        self.partial = ""            # Dòng chưa kết thúc
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def _staged_file(self, index):
+        return os.path.join(self.staging_dir, f"chapter_{index:05d}.xhtml")
+
+    def _stage(self, title, paragraphs):
+        title = title or self.title
+        index = len(self.titles) + 1
+        with open(self._staged_file(index), "w", encoding="utf-8") as f:
+            f.write(render_chapter_xhtml(title, paragraphs, self.language))
+        with open(os.path.join(self.staging_dir, STAGED_TITLES_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps(title, ensure_ascii=False) + "\n")
+        self.titles.append(title)
+
+        if self.preview_interval and self.clock() - self.last_preview >= self.preview_interval:
+            self.last_preview = self.clock()
+            self._assemble(self.preview_path)
+            print(f"📖 Bản xem trước EPUB: {len(self.titles)} chương -> {os.path.basename(self.preview_path)}")
+
+    def _assemble(self, path):
+        with EpubWriter(path, self.title, self.author, self.language, self.identifier) as writer:
+            for index, title in enumerate(self.titles, 1):
+                with open(self._staged_file(index), "rb") as f:
+                    writer.add_rendered_chapter(title, f.read())
+
+    def _feed(self, text):
+        position = self.offset - len(self.partial.encode("utf-8"))
+        self.offset += len(text.encode("utf-8"))
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        for line in lines:
+            position += len(line.encode("utf-8")) + 1
+            self.splitter.heading_remainder = None
+            completed = self.splitter.feed_line(line.rstrip("\r"))
+            if self.splitter.heading_remainder is not None:
+                self.chapter_offset = position
+                self.heading_remainder = self.splitter.heading_remainder
+            if completed:
+                self._stage(*completed)
+
+    def feed(self, text):
+        """Nhận phần text vừa ghi ra file output"""
+        if self.failed or not text:
+            return
+        try:
+            self._feed(text)
+        except OSError as e:
+            self.failed = True
+            print(f"⚠️ Lỗi khi dựng EPUB trong lúc dịch ({e}) - bỏ qua, có thể convert EPUB sau khi dịch xong")
+
+    def get_state(self):
+        """Trạng thái cần lưu cùng tiến độ để resume"""
+        return {
+            "chapters": len(self.titles),
+            "offset": self.chapter_offset,
+            "found": self.splitter.found_chapter,
+            "title": self.splitter.title,
+            "remainder": self.heading_remainder,
+        }
+
+    def resume(self, output_file, state):
+        """
+        Khôi phục sau khi dịch tiếp: giữ các chương đã render theo state, đọc lại
+        phần output của chương đang dở. Không có state -> dựng lại từ đầu file output.
+        """
+        state = state or {}
+        titles_path = os.path.join(self.staging_dir, STAGED_TITLES_FILE)
+        titles = []
+        if os.path.exists(titles_path):
+            with open(titles_path, "r", encoding="utf-8") as f:
+                titles = [json.loads(line) for line in f if line.strip()]
+        chapters = state.get("chapters", 0)
+        if chapters > len(titles) or any(not os.path.exists(self._staged_file(i)) for i in range(1, chapters + 1)):
+            state, chapters = {}, 0   # Staging không khớp -> dựng lại từ đầu
+
+        self.titles = titles[:chapters]
+        with open(titles_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(title, ensure_ascii=False) + "\n" for title in self.titles)
+        found = bool(state.get("found"))
+        self.heading_remainder = state.get("remainder") or ""
+        self.splitter = ChapterSplitter(self.chapter_pattern, title=state.get("title"), found_chapter=found,
+                                        lines=[self.heading_remainder] if found else [])
+        self.offset = self.chapter_offset = state.get("offset", 0)
+        self.partial = ""
+
+        if os.path.exists(output_file):
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            with open(output_file, "rb") as f:
+                f.seek(self.offset)
+                while True:
+                    block = f.read(1024 * 1024)
+                    if not block:
+                        break
+                    self.feed(decoder.decode(block))
+                self.feed(decoder.decode(b"", final=True))
+        print(f"📖 EPUB đang dựng: {len(self.titles)} chương đã có trong staging")
+
+    def finish(self):
+        """Render chương cuối, ghép EPUB hoàn chỉnh, xóa staging + bản xem trước. Trả về đường dẫn EPUB."""
+        if self.failed:
+            return None
+        if self.partial:
+            completed = self.splitter.feed_line(self.partial.rstrip("\r"))
+            self.partial = ""
+            if completed:
+                self._stage(*completed)
+        completed = self.splitter.finish()
+        if completed:
+            self._stage(*completed)
+        if not self.titles:
+            self._stage(self.title, [])   # EPUB cần ít nhất một trang trong spine
+
+        self._assemble(self.epub_path)
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        if os.path.exists(self.preview_path):
+            os.remove(self.preview_path)
+        print(f"📚 EPUB hoàn thành ({len(self.titles)} chương): {self.epub_path}")
+        return self.epub_path
+
+
+def create_incremental_epub_builder(model_settings, output_file):
+    """
+    Tạo IncrementalEpubBuilder từ model_settings.
+
+    Keys hỗ trợ:
+        incremental_epub: bool - dựng EPUB trong lúc dịch (mặc định False)
+        epub_path: file EPUB (mặc định <output>.epub)
+        epub_title / epub_author: metadata (mặc định tên file / "Unknown Author")
+        epub_chapter_pattern: regex nhận diện chương
+        epub_preview_interval: giây giữa 2 lần ghi bản xem trước (mặc định 300, 0 = tắt)
+
+    Returns:
+        IncrementalEpubBuilder hoặc None nếu tắt
+    """
+    if not model_settings or not model_settings.get("incremental_epub", False):
+        return None
+    base_name = os.path.splitext(output_file)[0]
+    try:
+        return IncrementalEpubBuilder(
+            model_settings.get("epub_path") or f"{base_name}.epub",
+            model_settings.get("epub_title") or os.path.basename(base_name),
+            model_settings.get("epub_author") or "Unknown Author",
+            model_settings.get("epub_chapter_pattern") or DEFAULT_CHAPTER_PATTERN,
+            preview_interval=float(model_settings.get("epub_preview_interval", DEFAULT_PREVIEW_INTERVAL)),
+        )
+    except OSError as e:
+        print(f"⚠️ Không thể tạo thư mục staging EPUB: {e}")
+        return None
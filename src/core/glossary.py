@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Glossary (bảng tên riêng / thuật ngữ) với lọc theo từng chunk
+
+Thay vì nhét toàn bộ glossary vào system_instruction cho mọi request, glossary
+được index bằng automaton Aho-Corasick trên các thuật ngữ gốc. Mỗi chunk chỉ
+nhận các mục thực sự xuất hiện trong chunk đó, ở dạng gọn "gốc=dịch".
+
+Định dạng file glossary:
+- .json: {"林动": "Lâm Động", ...} hoặc [{"source": "...", "target": "...", "note": "..."}]
+- Text (.txt/.tsv/...): mỗi dòng "gốc=dịch" hoặc "gốc<TAB>dịch", dòng bắt đầu bằng # là comment
+"""
+
+import os
+import json
+import threading
+from collections import deque
+
+
+MAX_GLOSSARY_ENTRIES_PER_CHUNK = 60
+
+
+class AhoCorasick:
+    """
+    Automaton Aho-Corasick thuần Python: tìm tất cả thuật ngữ trong một lần quét text.
+    """
+
+    def __init__(self, terms=None):
+        self.goto = [{}]      # Trạng thái -> {ký tự: trạng thái}
+        self.fail = [0]
+        self.output = [[]]    # Trạng thái -> [term kết thúc tại đây]
+        self._built = False
+        for term in terms or []:
+            self.add(term)
+
+    def add(self, term):
+        if not term:
+            return
+        state = 0
+        for char in term:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append(term)
+        self._built = False
+
+    def build(self):
+        """Tính failure links (BFS)"""
+        queue = deque()
+        for state in self.goto[0].values():
+            self.fail[state] = 0
+            queue.append(state)
+        while queue:
+            current = queue.popleft()
+            for char, next_state in self.goto[current].items():
+                queue.append(next_state)
+                fallback = self.fail[current]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+        self._built = True
+
+    def iter_matches(self, text):
+        """
+        Yield (start_index, term) cho mỗi lần xuất hiện của term trong text.
+        """
+        if not self._built:
+            self.build()
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for term in self.output[state]:
+                yield (i - len(term) + 1, term)
+
+
+def _is_word_char(char):
+    # Chỉ kiểm tra ranh giới từ cho chữ Latin/số; CJK không có khoảng trắng giữa các từ
+    return char.isascii() and (char.isalnum() or char == '_')
+
+
+class Glossary:
+    """
+    Glossary đã index, dùng build_block(text) để lấy khối glossary cho một chunk.
+    """
+
+    def __init__(self, entries):
+        """
+        Args:
+            entries: list (source, target, note)
+        """
+        self.entries = {}
+        for source, target, note in entries:
+            source = (source or "").strip()
+            target = (target or "").strip()
+            if source and target:
+                self.entries[source.casefold()] = (source, target, note)
+
+        self.automaton = AhoCorasick(self.entries.keys())
+        self.automaton.build()
+
+        self.injected_entries = 0
+        self.chunks_with_entries = 0
+        self.stats_lock = threading.Lock()  # build_block được gọi từ nhiều worker thread
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find_entries(self, text):
+        """
+        Các mục glossary xuất hiện trong text, theo thứ tự xuất hiện đầu tiên.
+        Thuật ngữ Latin phải khớp nguyên từ ("Al" không khớp "Also"). Các lần khớp chồng nhau
+        chỉ giữ lần khớp dài nhất (bắt đầu sớm nhất): "林动" không kéo theo "林" và "动".
+        """
+        folded = text.casefold()
+        candidates = []
+        for start, key in self.automaton.iter_matches(folded):
+            end = start + len(key)
+            if _is_word_char(key[0]) and start > 0 and _is_word_char(folded[start - 1]):
+                continue
+            if _is_word_char(key[-1]) and end < len(folded) and _is_word_char(folded[end]):
+                continue
+            candidates.append((start, -len(key), key))
+
+        seen = set()
+        found = []
+        covered_until = 0
+        for start, negative_length, key in sorted(candidates):
+            if start < covered_until:
+                continue
+            covered_until = start - negative_length
+            if key not in seen:
+                seen.add(key)
+                found.append(self.entries[key])
+        return found
+
+    def build_block(self, text):
+        """
+        Khối glossary gọn cho chunk (chỉ các mục xuất hiện), hoặc "" nếu không có mục nào.
+        """
+        found = self.find_entries(text)
+        if not found:
+            return ""
+        found = found[:MAX_GLOSSARY_ENTRIES_PER_CHUNK]
+        with self.stats_lock:
+            self.injected_entries += len(found)
+            self.chunks_with_entries += 1
+
+        items = []
+        for source, target, note in found:
+            items.append(f"{source}={target}" + (f" ({note})" if note else ""))
+        return "GLOSSARY (bắt buộc dùng đúng cách dịch): " + "; ".join(items)
+
+    def print_stats(self):
+        with self.stats_lock:
+            injected_entries, chunks_with_entries = self.injected_entries, self.chunks_with_entries
+        if chunks_with_entries:
+            avg = injected_entries / chunks_with_entries
+            print(f"\n📖 Glossary: {len(self)} mục, trung bình {avg:.1f} mục/chunk được chèn vào prompt "
+                  f"({chunks_with_entries} chunks)")
+
+
+def load_glossary(path):
+    """
+    Đọc file glossary (JSON hoặc text). Trả về Glossary hoặc None nếu lỗi / rỗng.
+    """
+    if not path or not os.path.exists(path):
+        print(f"⚠️ Không tìm thấy file glossary: {path}")
+        return None
+
+    entries = []
+    try:
+        if path.lower().endswith(".json"):
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                entries = [(source, target, None) for source, target in data.items()]
+            elif isinstance(data, list):
+                for item in data:
+                    if isinstance(item, dict):
+                        entries.append((item.get("source"), item.get("target"), item.get("note")))
+        else:
+            with open(path, 'r', encoding='utf-8-sig') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith("#"):
+                        continue
+                    if "\t" in line:
+                        parts = line.split("\t")
+                    elif "=" in line:
+                        parts = line.split("=", 1)
+                    else:
+                        continue
+                    note = parts[2].strip() if len(parts) > 2 else None
+                    entries.append((parts[0], parts[1], note))
+    except Exception as e:
+        print(f"⚠️ Lỗi khi đọc glossary {os.path.basename(path)}: {e}")
+        return None
+
+    glossary = Glossary(entries)
+    if not len(glossary):
+        print(f"⚠️ Glossary {os.path.basename(path)} không có mục hợp lệ")
+        return None
+    print(f"📖 Glossary: đã tải {len(glossary)} mục từ {os.path.basename(path)}")
+    return glossary
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Hedged requests cho các chunk bị chậm (tail latency)
+
+Output được ghi theo đúng thứ tự chunk, nên một request chậm ở đầu hàng
+(head-of-line) sẽ giữ lại toàn bộ các chunk phía sau. Khi chunk đầu hàng chạy
+lâu hơn percentile latency đo được trong run hiện tại, HedgeController gửi thêm
+một request trùng lặp (key khác qua key rotator), lấy kết quả về trước và hủy
+request còn lại.
+
+Hedge vẫn đi qua process_chunk nên vẫn bị tính vào rate limiter (RPM/TPM/RPD);
+ngoài ra số hedge bị giới hạn theo tỷ lệ so với số request đã hoàn thành.
+"""
+
+import time
+import threading
+import concurrent.futures
+from collections import deque
+
+
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_MIN_SAMPLES = 10
+DEFAULT_HEDGE_MAX_RATIO = 0.1      # Tối đa 10% số request là hedge
+DEFAULT_HEDGE_MIN_DELAY = 5.0      # Không hedge chunk chạy chưa được 5s
+HEDGE_POLL_INTERVAL = 1.0          # Chu kỳ kiểm tra chunk đầu hàng (giây)
+
+
+class LatencyTracker:
+    """
+    Lưu latency của các request gần nhất để tính percentile (sliding window)
+    """
+
+    def __init__(self, window_size=200):
+        self.samples = deque(maxlen=window_size)
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.samples.append(latency)
+
+    def count(self):
+        with self.lock:
+            return len(self.samples)
+
+    def percentile(self, p):
+        """
+        Tính percentile p (0-100) của các latency đã ghi nhận.
+
+        Returns:
+            latency (giây) hoặc None nếu chưa có mẫu nào
+        """
+        with self.lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        rank = (len(ordered) - 1) * max(0.0, min(p, 100.0)) / 100.0
+        lower = int(rank)
+        upper = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+class HedgeController:
+    """
+    Quản lý các lần thử (primary + hedge) cho từng chunk.
+
+    Mỗi lần thử được submit qua controller.submit() để controller biết thời điểm
+    bắt đầu, và nhận một cancel_event riêng để lần thử thua có thể dừng sớm.
+    Khi có kết quả, gọi controller.resolve() để biết nên ghi hay bỏ qua.
+    """
+
+    def __init__(self, percentile=DEFAULT_HEDGE_PERCENTILE, min_samples=DEFAULT_HEDGE_MIN_SAMPLES,
+                 max_hedge_ratio=DEFAULT_HEDGE_MAX_RATIO, min_delay=DEFAULT_HEDGE_MIN_DELAY,
+                 budget_check=None, clock=time.monotonic):
+        """
+        Args:
+            percentile: Percentile latency để kích hoạt hedge (ví dụ 95 = p95)
+            min_samples: Số request tối thiểu đã hoàn thành trước khi cho phép hedge
+            max_hedge_ratio: Tỷ lệ hedge tối đa so với số request đã hoàn thành
+            min_delay: Thời gian chạy tối thiểu của chunk trước khi hedge (giây)
+            budget_check: Callable() -> bool, trả về False khi rate limit không còn dư
+            clock: Hàm thời gian monotonic
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.min_delay = min_delay
+        self.budget_check = budget_check
+        self.clock = clock
+
+        self.latency = LatencyTracker()
+        self.lock = threading.Lock()
+
+        self._attempts = {}      # {chunk_index: [(future, cancel_event, is_hedge)]}
+        self._start_times = {}   # {chunk_index: thời điểm lần thử đầu tiên bắt đầu chạy}
+        self._committed = set()
+        self._deferred = {}      # {chunk_index: kết quả lỗi chờ hedge còn lại}
+
+        self.completed_requests = 0
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+
+    def submit(self, executor, chunk_index, fn, *args, is_hedge=False, **kwargs):
+        """
+        Submit một lần thử cho chunk. fn phải nhận keyword cancel_event.
+
+        Returns:
+            concurrent.futures.Future
+        """
+        cancel_event = threading.Event()
+        future = executor.submit(self._run, chunk_index, cancel_event, fn, args, kwargs)
+        with self.lock:
+            self._attempts.setdefault(chunk_index, []).append((future, cancel_event, is_hedge))
+            if is_hedge:
+                self.hedges_sent += 1
+        return future
+
+    def _run(self, chunk_index, cancel_event, fn, args, kwargs):
+        start = self.clock()
+        with self.lock:
+            self._start_times.setdefault(chunk_index, start)
+        try:
+            return fn(*args, cancel_event=cancel_event, **kwargs)
+        finally:
+            # Lần thử bị hủy không phản ánh latency thực
+            if not cancel_event.is_set():
+                self.latency.record(self.clock() - start)
+                with self.lock:
+                    self.completed_requests += 1
+
+    def should_hedge(self, chunk_index):
+        """
+        Kiểm tra chunk đầu hàng có nên được hedge không.
+        """
+        with self.lock:
+            if chunk_index in self._committed or chunk_index not in self._start_times:
+                return False
+            attempts = self._attempts.get(chunk_index, [])
+            if any(is_hedge for _, _, is_hedge in attempts):
+                return False  # Mỗi chunk chỉ hedge 1 lần
+            started = self._start_times[chunk_index]
+            completed = self.completed_requests
+            hedges_sent = self.hedges_sent
+
+        if completed < self.min_samples:
+            return False
+        if hedges_sent + 1 > max(1, int(completed * self.max_hedge_ratio)):
+            return False
+
+        threshold = self.latency.percentile(self.percentile)
+        if threshold is None:
+            return False
+        elapsed = self.clock() - started
+        if elapsed < max(threshold, self.min_delay):
+            return False
+
+        if self.budget_check is not None and not self.budget_check():
+            return False
+
+        print(f"🪁 Hedge chunk {chunk_index + 1}: đã chạy {elapsed:.1f}s > p{self.percentile:g} = {threshold:.1f}s")
+        return True
+
+    def resolve(self, chunk_index, future, result, is_error=False):
+        """
+        Quyết định xử lý kết quả của một lần thử.
+
+        Args:
+            chunk_index: Chunk index
+            future: Future vừa hoàn thành
+            result: Kết quả của process_chunk (None nếu lần thử raise exception)
+            is_error: Kết quả là error chunk
+
+        Returns:
+            Kết quả cần ghi vào output, hoặc None nếu bỏ qua (đã có kết quả khác
+            hoặc đang chờ lần thử còn lại)
+        """
+        with self.lock:
+            if chunk_index in self._committed:
+                return None
+
+            attempts = self._attempts.get(chunk_index, [])
+            others_pending = [(f, e) for f, e, _ in attempts if f is not future and not f.done()]
+
+            # Lỗi trong khi lần thử kia vẫn đang chạy -> chờ lần thử kia
+            if (is_error or result is None) and others_pending:
+                if result is not None:
+                    self._deferred.setdefault(chunk_index, result)
+                return None
+
+            deferred = self._deferred.pop(chunk_index, None)
+            if result is None:
+                result = deferred
+                if result is None:
+                    return None
+            elif is_error and deferred is not None:
+                result = deferred  # Cả hai đều lỗi: giữ lỗi về trước
+
+            self._committed.add(chunk_index)
+            self._attempts.pop(chunk_index, None)
+            self._start_times.pop(chunk_index, None)
+
+            if any(f is future and is_hedge for f, _, is_hedge in attempts):
+                self.hedge_wins += 1
+                print(f"🪁 Hedge thắng ở chunk {chunk_index + 1}")
+
+        # Hủy lần thử thua (ngoài lock)
+        for other_future, cancel_event in others_pending:
+            cancel_event.set()
+            other_future.cancel()
+
+        return result
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'completed_requests': self.completed_requests,
+                'hedges_sent': self.hedges_sent,
+                'hedge_wins': self.hedge_wins,
+                'threshold': self.latency.percentile(self.percentile),
+            }
+
+    def print_stats(self):
+        stats = self.get_stats()
+        if stats['hedges_sent'] == 0:
+            return
+        print(f"\n🪁 Hedging: {stats['hedges_sent']} hedge đã gửi, {stats['hedge_wins']} lần thắng "
+              f"({stats['completed_requests']} requests hoàn thành)")
+
+
+def iter_completed(futures, on_idle=None, poll_interval=HEDGE_POLL_INTERVAL):
+    """
+    Giống concurrent.futures.as_completed nhưng gọi on_idle() định kỳ trong lúc chờ.
+    on_idle() có thể trả về danh sách future mới (ví dụ hedge) để theo dõi tiếp.
+    """
+    pending = set(futures)
+    while pending:
+        done, pending = concurrent.futures.wait(
+            pending,
+            timeout=poll_interval if on_idle else None,
+            return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in done:
+            yield future
+        if on_idle:
+            new_futures = on_idle() or []
+            pending.update(new_futures)
+
+
+def create_hedge_controller(model_settings, budget_check=None):
+    """
+    Tạo HedgeController từ model_settings.
+
+    Keys hỗ trợ:
+        hedging: bool - bật hedging
+        hedge_percentile: percentile kích hoạt (mặc định 95)
+        hedge_min_samples: số request tối thiểu trước khi hedge (mặc định 10)
+        hedge_max_ratio: tỷ lệ hedge tối đa (mặc định 0.1)
+        hedge_min_delay: giây tối thiểu trước khi hedge (mặc định 5)
+
+    Returns:
+        HedgeController hoặc None nếu hedging tắt
+    """
+    if not model_settings or not model_settings.get("hedging", False):
+        return None
+
+    try:
+        return HedgeController(
+            percentile=float(model_settings.get("hedge_percentile", DEFAULT_HEDGE_PERCENTILE)),
+            min_samples=int(model_settings.get("hedge_min_samples", DEFAULT_HEDGE_MIN_SAMPLES)),
+            max_hedge_ratio=float(model_settings.get("hedge_max_ratio", DEFAULT_HEDGE_MAX_RATIO)),
+            min_delay=float(model_settings.get("hedge_min_delay", DEFAULT_HEDGE_MIN_DELAY)),
+            budget_check=budget_check,
+        )
+    except (ValueError, TypeError):
+        print("⚠️ Cấu hình hedging không hợp lệ, dùng giá trị mặc định")
+        return HedgeController(budget_check=budget_check)
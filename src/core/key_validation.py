@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Kiểm tra API key song song + cache kết quả khi bắt đầu dịch
+
+- Các key được validate song song (tối đa key_validation_workers key cùng lúc) thay vì
+  lần lượt từng key. translate.py dùng request metadata (models.get, /key, /models) nên
+  việc kiểm tra không tốn RPM/RPD sinh nội dung của key.
+- Kết quả được cache theo (provider, model, base_url, hash của key) với TTL, trong
+  bộ nhớ và trong key_validation_cache.json ở thư mục cấu hình của người dùng (chỉ lưu
+  hash, không lưu key) nên resume hoặc bấm dịch lại trên GUI không validate lại key
+  vừa kiểm tra.
+- Lỗi tạm thời (429, timeout, 5xx, lỗi mạng) không được cache và không làm key bị
+  loại; key lỗi thật (401, hết credit, model không tồn tại...) được đánh dấu
+  invalid trong key rotator để không nhận request nào.
+
+model_settings:
+    key_validation_ttl: TTL (giây) của kết quả hợp lệ, 0 = không cache (mặc định 3600)
+    key_validation_cache_path: File cache (mặc định <thư mục cấu hình>/TranslateNovelAI/key_validation_cache.json)
+    key_validation_workers: Số key validate cùng lúc tối đa (mặc định 4)
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .providers import (
+        check_openrouter_rate_limit_error, check_openrouter_service_error, check_openrouter_timeout_error
+    )
+except ImportError:
+    from providers import (
+        check_openrouter_rate_limit_error, check_openrouter_service_error, check_openrouter_timeout_error
+    )
+
+
+DEFAULT_VALIDATION_TTL = 3600     # Giây - kết quả hợp lệ
+DEFAULT_INVALID_TTL = 300         # Giây - key lỗi (có thể vừa nạp thêm credit / sửa key)
+CACHE_FILE_NAME = "key_validation_cache.json"
+APP_CONFIG_DIR_NAME = "TranslateNovelAI"
+CACHE_VERSION = 1
+MAX_VALIDATION_WORKERS = 4
+
+# Lỗi mạng không nằm trong các nhóm rate limit / timeout / service
+CONNECTION_ERROR_KEYWORDS = ("lỗi kết nối", "connection", "network")
+
+
+def user_config_dir():
+    """Thư mục cấu hình của người dùng (%APPDATA% trên Windows, $XDG_CONFIG_HOME hoặc ~/.config)"""
+    base = os.environ.get("APPDATA") if os.name == "nt" else None
+    base = base or os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, APP_CONFIG_DIR_NAME)
+
+
+def default_cache_path():
+    """File cache mặc định - không ghi vào thư mục đang chạy"""
+    return os.path.join(user_config_dir(), CACHE_FILE_NAME)
+
+
+def key_fingerprint(api_key):
+    """Hash của key dùng làm khóa cache (không lưu key gốc ra file)"""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+def is_transient_failure(message):
+    """Lỗi tạm thời khi validate (429, timeout, 5xx, mạng) - key vẫn có thể dùng được"""
+    lowered = str(message).lower()
+    return (check_openrouter_rate_limit_error(message)
+            or check_openrouter_timeout_error(message)
+            or check_openrouter_service_error(message)
+            or any(keyword in lowered for keyword in CONNECTION_ERROR_KEYWORDS))
+
+
+class KeyValidationResult:
+    """Kết quả validate một key"""
+
+    def __init__(self, index, api_key, is_valid, message, cached=False):
+        self.index = index          # Vị trí key trong danh sách (bắt đầu từ 1)
+        self.api_key = api_key
+        self.is_valid = is_valid
+        self.message = message
+        self.cached = cached
+        self.transient = not is_valid and is_transient_failure(message)
+
+    @property
+    def is_invalid(self):
+        """Key chắc chắn không dùng được (không tính lỗi tạm thời)"""
+        return not self.is_valid and not self.transient
+
+
+class KeyValidationCache:
+    """Cache kết quả validate theo (provider, model, base_url, key hash) với TTL, lưu ra file JSON"""
+
+    def __init__(self, path=None, clock=time.time):
+        """path: file cache (None = default_cache_path(), "" = chỉ cache trong bộ nhớ)"""
+        self.path = default_cache_path() if path is None else path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = None         # Đọc file ở lần dùng đầu tiên
+
+    @staticmethod
+    def _entry_key(provider, model_name, api_key, base_url=""):
+        return f"{provider}::{model_name}::{base_url or ''}::{key_fingerprint(api_key)}"
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == CACHE_VERSION:
+                self.entries = dict(data.get("entries", {}))
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Không thể đọc cache validate key {self.path}: {e}")
+
+    def get(self, provider, model_name, api_key, base_url="", ttl=DEFAULT_VALIDATION_TTL):
+        """(is_valid, message) nếu còn hạn, ngược lại None"""
+        if ttl <= 0:
+            return None
+        with self.lock:
+            self._load()
+            entry = self.entries.get(self._entry_key(provider, model_name, api_key, base_url))
+        if not entry:
+            return None
+        max_age = ttl if entry["valid"] else min(ttl, DEFAULT_INVALID_TTL)
+        if self.clock() - entry["checked_at"] > max_age:
+            return None
+        return entry["valid"], entry["message"]
+
+    def put(self, provider, model_name, api_key, is_valid, message, base_url=""):
+        with self.lock:
+            self._load()
+            self.entries[self._entry_key(provider, model_name, api_key, base_url)] = {
+                "valid": bool(is_valid),
+                "message": message,
+                "checked_at": self.clock(),
+            }
+
+    def save(self):
+        """Ghi cache ra file (ghi file tạm rồi đổi tên)"""
+        if not self.path:
+            return
+        with self.lock:
+            if self.entries is None:
+                return
+            data = {"version": CACHE_VERSION, "entries": dict(self.entries)}
+        temp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ Không thể lưu cache validate key {self.path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+
+def validate_api_keys(api_keys, model_name, provider, validate_fn, model_settings=None, cache=None):
+    """
+    Validate nhiều key song song, dùng cache nếu còn hạn
+
+    Args:
+        api_keys: List key (hoặc một key)
+        model_name, provider: Model/provider cần kiểm tra
+        validate_fn: validate_fn(api_key, model_name, provider, model_settings) -> (is_valid, message)
+        model_settings: Cấu hình (key_validation_ttl, key_validation_workers, base_url...)
+        cache: KeyValidationCache (None = cache dùng chung theo key_validation_cache_path)
+
+    Returns:
+        List KeyValidationResult theo đúng thứ tự key
+    """
+    settings = model_settings or {}
+    keys = api_keys if isinstance(api_keys, list) else [api_keys]
+    ttl = settings.get("key_validation_ttl", DEFAULT_VALIDATION_TTL)
+    base_url = settings.get("base_url", "")
+    if cache is None and ttl > 0:
+        cache = get_key_validation_cache(settings.get("key_validation_cache_path"))
+
+    outcomes = {}
+    pending = []
+    for key in keys:
+        if key in outcomes or key in pending:
+            continue
+        hit = cache.get(provider, model_name, key, base_url, ttl) if cache else None
+        if hit is not None:
+            outcomes[key] = (hit[0], hit[1], True)
+        else:
+            pending.append(key)
+
+    if pending:
+        def check(key):
+            try:
+                return validate_fn(key, model_name, provider, model_settings)
+            except Exception as e:
+                return False, f"Lỗi kết nối API: {e}"
+
+        workers = max(1, min(settings.get("key_validation_workers", MAX_VALIDATION_WORKERS), len(pending)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for key, (is_valid, message) in zip(pending, executor.map(check, pending)):
+                outcomes[key] = (is_valid, message, False)
+
+        if cache:
+            for key in pending:
+                is_valid, message, _ = outcomes[key]
+                # Lỗi tạm thời: lần sau kiểm tra lại
+                if is_valid or not is_transient_failure(message):
+                    cache.put(provider, model_name, key, is_valid, message, base_url)
+            cache.save()
+
+    return [KeyValidationResult(index, key, *outcomes[key]) for index, key in enumerate(keys, 1)]
+
+
+def mark_invalid_keys(key_rotator, results):
+    """Đánh dấu các key lỗi thật (không tính lỗi tạm thời) trong key rotator. Trả về số key bị loại."""
+    if key_rotator is None or not hasattr(key_rotator, "mark_invalid"):
+        return 0
+    count = 0
+    for result in results:
+        if result.is_invalid:
+            key_rotator.mark_invalid(result.api_key, result.message)
+            count += 1
+    return count
+
+
+# Cache dùng chung cho cả process (GUI chạy nhiều lần dịch trong cùng process)
+_key_validation_cache = None
+_key_validation_lock = threading.Lock()
+
+
+def get_key_validation_cache(path=None):
+    """Lấy KeyValidationCache dùng chung (path khác file đang dùng -> tạo cache mới cho file đó)"""
+    global _key_validation_cache
+    with _key_validation_lock:
+        if _key_validation_cache is None:
+            _key_validation_cache = KeyValidationCache(path)
+        elif path is not None and _key_validation_cache.path != path:
+            _key_validation_cache = KeyValidationCache(path)
+        return _key_validation_cache
+
+
+def set_key_validation_cache(cache):
+    """Thay cache dùng chung (ví dụ KeyValidationCache(path="") để chỉ cache trong bộ nhớ)"""
+    global _key_validation_cache
+    with _key_validation_lock:
+        _key_validation_cache = cache
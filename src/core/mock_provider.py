@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mock provider - provider giả lập để đo throughput mà không tốn quota
+
+MockBackend mô phỏng một API dịch với:
+- Phân phối latency cấu hình được (fixed / uniform / lognormal / exp)
+- Rate limit RPM theo key hoặc theo project (giống Google AI free tier)
+- Tỷ lệ lỗi 429 / 503 ngẫu nhiên, response bị cắt (max tokens), từ chối dịch
+- Kết quả tất định: lỗi/latency của mỗi request chỉ phụ thuộc (seed, nội dung
+  chunk, lần thử thứ mấy), không phụ thuộc thứ tự thread
+
+Dùng trong process:   provider="Mock" (MockProvider, đăng ký vào providers registry)
+Dùng qua HTTP:        start_mock_server() -> base_url cho provider "OpenAI Compatible"
+"""
+
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from .providers import BaseProvider, ProviderResponse, register_provider
+except ImportError:
+    from providers import BaseProvider, ProviderResponse, register_provider
+
+
+REFUSAL_TEXT = "Tôi xin lỗi, tôi không thể dịch nội dung này."
+
+
+class MockAPIError(Exception):
+    """Lỗi API giả lập; message chứa status code để classify_error nhận diện"""
+
+    def __init__(self, status, message):
+        super().__init__(f"{status} {message}")
+        self.status = status
+        self.message = message
+
+
+def parse_latency(spec):
+    """
+    Phân tích chuỗi phân phối latency (giây):
+        "fixed:1.0" | "uniform:0.5:2.0" | "lognormal:0.0:0.5" (mu, sigma của ln) | "exp:1.5" (mean)
+
+    Returns:
+        Callable(rng) -> latency
+    """
+    parts = str(spec).split(":")
+    kind = parts[0].lower()
+    values = [float(v) for v in parts[1:]]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    raise ValueError(f"Phân phối latency không hợp lệ: {spec}")
+
+
+def mock_translate(text):
+    """Bản dịch giả lập: đánh dấu từng dòng, giữ dòng trống, dòng kết thúc bằng dấu câu"""
+    output = []
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if not stripped:
+            output.append(line)
+            continue
+        if stripped[-1] not in '.!?。！？"』」)）…—':
+            stripped += "."
+        output.append(f"[VI] {stripped}")
+    return "\n".join(output)
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(math.ceil(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class MockBackend:
+    """
+    API giả lập dùng chung cho MockProvider và mock HTTP server. Thread-safe.
+    """
+
+    def __init__(self, latency="lognormal:-0.5:0.6", rpm=None, quota_scope="project",
+                 error_429_rate=0.0, error_503_rate=0.0, truncation_rate=0.0, refusal_rate=0.0,
+                 seed=0, time_scale=1.0, sleep=time.sleep, clock=time.monotonic):
+        """
+        Args:
+            latency: Phân phối latency (xem parse_latency), tính theo giây "ảo"
+            rpm: Giới hạn requests/phút (None = không giới hạn); vượt quá -> 429
+            quota_scope: "project" (mọi key chia chung RPM) hoặc "key" (mỗi key RPM riêng)
+            error_429_rate / error_503_rate: Tỷ lệ lỗi ngẫu nhiên
+            truncation_rate: Tỷ lệ response bị cắt (finish_reason = length)
+            refusal_rate: Tỷ lệ response từ chối dịch
+            seed: Seed cho kết quả tất định
+            time_scale: Hệ số thời gian (0.01 = chạy nhanh gấp 100 lần; áp dụng cho latency và cửa sổ RPM)
+        """
+        self.latency_fn = parse_latency(latency)
+        self.latency_spec = latency
+        self.rpm = rpm
+        self.quota_scope = quota_scope
+        self.error_429_rate = error_429_rate
+        self.error_503_rate = error_503_rate
+        self.truncation_rate = truncation_rate
+        self.refusal_rate = refusal_rate
+        self.seed = seed
+        self.time_scale = time_scale
+        self.sleep = sleep
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        self._windows = {}    # {scope_key: deque[timestamp]}
+        self._attempts = {}   # {text_hash: số lần đã gửi}
+        self._round_robin = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.outcomes = {"ok": 0, "429": 0, "503": 0, "truncated": 0, "refused": 0}
+            self.latencies = []
+            self.successes_by_text = {}
+            self.requests_by_key = {}
+
+    def pick_key(self, api_key):
+        """Key list -> xoay vòng (mô phỏng key rotator)"""
+        if isinstance(api_key, (list, tuple)):
+            with self.lock:
+                self._round_robin += 1
+                return api_key[self._round_robin % len(api_key)] if api_key else ""
+        return api_key or ""
+
+    def _rng_for(self, text_hash):
+        with self.lock:
+            attempt = self._attempts.get(text_hash, 0)
+            self._attempts[text_hash] = attempt + 1
+        digest = hashlib.sha1(f"{self.seed}:{text_hash}:{attempt}".encode()).hexdigest()
+        return random.Random(int(digest[:16], 16))
+
+    def _check_rpm(self, api_key):
+        if not self.rpm:
+            return True
+        scope_key = api_key if self.quota_scope == "key" else "__project__"
+        window = 60.0 * self.time_scale
+        now = self.clock()
+        with self.lock:
+            timestamps = self._windows.setdefault(scope_key, deque())
+            while timestamps and now - timestamps[0] >= window:
+                timestamps.popleft()
+            if len(timestamps) >= self.rpm:
+                return False
+            timestamps.append(now)
+            return True
+
+    def _record(self, outcome, latency, api_key, text_hash=None):
+        with self.lock:
+            self.outcomes[outcome] += 1
+            self.latencies.append(latency)
+            self.requests_by_key[api_key] = self.requests_by_key.get(api_key, 0) + 1
+            if text_hash is not None:
+                self.successes_by_text[text_hash] = self.successes_by_text.get(text_hash, 0) + 1
+
+    def complete(self, api_key, text):
+        """
+        Xử lý một request dịch.
+
+        Returns:
+            (output_text, finish_reason, usage)
+
+        Raises:
+            MockAPIError: 429 (rate limit) / 503 (service unavailable)
+        """
+        text_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        rng = self._rng_for(text_hash)
+        latency = max(0.0, self.latency_fn(rng))
+        roll = rng.random()
+
+        if not self._check_rpm(api_key):
+            self._record("429", 0.0, api_key)
+            raise MockAPIError(429, "Resource exhausted: too many requests (requests per minute)")
+
+        self.sleep(latency * self.time_scale)
+
+        usage = {"prompt_tokens": max(1, len(text) // 4), "completion_tokens": 0}
+        threshold = self.error_429_rate
+        if roll < threshold:
+            self._record("429", latency, api_key)
+            raise MockAPIError(429, "Resource exhausted: too many requests")
+        threshold += self.error_503_rate
+        if roll < threshold:
+            self._record("503", latency, api_key)
+            raise MockAPIError(503, "Service unavailable")
+        threshold += self.truncation_rate
+        if roll < threshold:
+            self._record("truncated", latency, api_key)
+            output = mock_translate(text)[:max(1, len(text) // 3)]
+            usage["completion_tokens"] = len(output) // 4
+            return output, "length", usage
+        threshold += self.refusal_rate
+        if roll < threshold:
+            self._record("refused", latency, api_key)
+            usage["completion_tokens"] = len(REFUSAL_TEXT) // 4
+            return REFUSAL_TEXT, "stop", usage
+
+        output = mock_translate(text)
+        usage["completion_tokens"] = len(output) // 4
+        self._record("ok", latency, api_key, text_hash)
+        return output, "stop", usage
+
+    def get_stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            requests = sum(self.outcomes.values())
+            failed = requests - self.outcomes["ok"]
+            duplicate_successes = sum(n - 1 for n in self.successes_by_text.values() if n > 1)
+            return {
+                "requests": requests,
+                "outcomes": dict(self.outcomes),
+                "unique_chunks_ok": len(self.successes_by_text),
+                "failed_requests": failed,
+                "duplicate_successes": duplicate_successes,
+                "wasted_requests": failed + duplicate_successes,
+                "latency_p50": _percentile(latencies, 50),
+                "latency_p95": _percentile(latencies, 95),
+                "latency_p99": _percentile(latencies, 99),
+                "latency_max": latencies[-1] if latencies else 0.0,
+                "requests_by_key": dict(self.requests_by_key),
+            }
+
+
+# Backend dùng chung cho MockProvider (benchmark thay bằng set_mock_backend)
+_mock_backend = None
+_mock_backend_lock = threading.Lock()
+
+
+def get_mock_backend():
+    global _mock_backend
+    with _mock_backend_lock:
+        if _mock_backend is None:
+            _mock_backend = MockBackend()
+        return _mock_backend
+
+
+def set_mock_backend(backend):
+    global _mock_backend
+    with _mock_backend_lock:
+        _mock_backend = backend
+
+
+class MockProvider(BaseProvider):
+    """Provider "Mock" chạy trong process, gọi MockBackend dùng chung"""
+
+    name = "Mock"
+
+    def build_request(self, system_instruction, chunk_lines, context="modern", prompt_context=None):
+        return {"api_key": get_mock_backend().pick_key(self.api_key), "text": "\n".join(chunk_lines)}
+
+    def send(self, request):
+        return get_mock_backend().complete(request["api_key"], request["text"])
+
+    def parse(self, raw):
+        text, finish_reason, usage = raw
+        return ProviderResponse(text, finish_reason, prompt_tokens=usage["prompt_tokens"],
+                                completion_tokens=usage["completion_tokens"])
+
+    def validate(self):
+        # Không gửi request thử để không làm lệch thống kê của backend
+        return True, "Mock provider sẵn sàng"
+
+
+register_provider("Mock", MockProvider)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    """Endpoint OpenAI-compatible: POST /v1/chat/completions"""
+
+    backend = None
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Not found: {self.path}"}})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+
+        api_key = (self.headers.get("Authorization") or "").replace("Bearer ", "")
+        messages = request.get("messages") or []
+        text = messages[-1].get("content", "") if messages else ""
+        try:
+            output, finish_reason, usage = self.backend.complete(api_key, text)
+        except MockAPIError as e:
+            self._send_json(e.status, {"error": {"message": e.message, "code": e.status}})
+            return
+
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        self._send_json(200, {
+            "id": "mock-completion",
+            "object": "chat.completion",
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": output}, "finish_reason": finish_reason}],
+            "usage": usage,
+        })
+
+    def log_message(self, format, *args):
+        pass  # Không in access log
+
+
+def start_mock_server(backend=None, host="127.0.0.1", port=0):
+    """
+    Chạy mock HTTP server (OpenAI-compatible) trên thread nền.
+
+    Returns:
+        (server, base_url) - dùng base_url cho model_settings["base_url"]; server.shutdown() để dừng
+    """
+    handler = type("MockHandler", (_MockHandler,), {"backend": backend or get_mock_backend()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
@@ -25,13 +25,33 @@ from multiprocessing import cpu_count
 
 # Import reformat function
 try:
-    from .reformat import fix_text_format
+    try:
+        from .reformat import fix_text_format
+    except ImportError:
+        from reformat import fix_text_format
     CAN_REFORMAT = True
-    print("✅ Đã import thành công chức năng reformat")
 except ImportError:
     CAN_REFORMAT = False
     print("⚠️ Không thể import reformat.py - chức năng reformat sẽ bị tắt")
 
+# Import streaming guard (hủy sớm khi timeout/refusal/runaway)
+try:
+    from .streaming import StreamAborted, create_stream_guard, iter_guarded
+except ImportError:
+    from streaming import StreamAborted, create_stream_guard, iter_guarded
+
+# SSE reader dùng chung với OpenAICompatibleProvider
+try:
+    from .providers import iter_sse_events
+except ImportError:
+    from providers import iter_sse_events
+
+# Import prompt caching (cache_control cho prefix cố định)
+try:
+    from .prompt_cache import build_cached_text_part, get_prompt_cache_manager, needs_explicit_cache_control
+except ImportError:
+    from prompt_cache import build_cached_text_part, get_prompt_cache_manager, needs_explicit_cache_control
+
 # --- CẤU HÌNH CÁC HẰNG SỐ ---
 MAX_RETRIES_ON_SAFETY_BLOCK = 5
 MAX_RETRIES_ON_BAD_TRANSLATION = 5
@@ -168,7 +188,23 @@ def validate_chunk_size(chunk_size):
         return 100  # Default
 
 # Default values
-NUM_WORKERS = get_optimal_threads()  # Tự động tính theo máy
+_default_workers = None
+
+
+def get_default_workers():
+    """Số threads mặc định theo máy (tính ở lần dùng đầu tiên, không chạy lúc import module)"""
+    global _default_workers
+    if _default_workers is None:
+        _default_workers = get_optimal_threads()
+    return _default_workers
+
+
+def __getattr__(name):
+    # NUM_WORKERS giữ tương thích cho code bên ngoài, giá trị chỉ được tính khi truy cập
+    if name == "NUM_WORKERS":
+        return get_default_workers()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def is_bad_translation(text, input_text=None):
     """
@@ -349,25 +385,11 @@ def is_bad_translation(text, input_text=None):
     
     return False
 
-def translate_chunk(api_key, model_name, system_instruction, chunk_lines, context="modern"):
-    """
-    Dịch một chunk gồm nhiều dòng văn bản sử dụng OpenRouter API.
-    chunk_lines: danh sách các dòng văn bản
-    context: "modern" (hiện đại) hoặc "ancient" (cổ đại)
-    Trả về (translated_text, is_safety_blocked_flag, is_bad_translation_flag).
-    """
-    # Gom các dòng thành một chuỗi lớn để gửi đi
-    full_text_to_translate = "\n".join(chunk_lines)
-    
-    # Bỏ qua các chunk chỉ chứa các dòng trống hoặc chỉ trắng
-    if not full_text_to_translate.strip():
-        return ("", False, False) # Trả về chuỗi rỗng, không bị chặn, không bad translation
 
-    try:
-        # Tạo prompt khác nhau cho từng bối cảnh
-        if context == "ancient":
-            # Prompt cho bối cảnh cổ đại
-            user_prompt = f"""Dịch đoạn văn bản sau sang tiếng Việt theo phong cách CỔ ĐẠI:
+# Prompt theo bối cảnh - phần quy tắc cố định, đứng trước văn bản của chunk
+CONTEXT_PROMPTS = {
+    # Prompt cho bối cảnh cổ đại
+    "ancient": """Dịch đoạn văn bản sau sang tiếng Việt theo phong cách CỔ ĐẠI:
 
 QUY TẮC DANH XƯNG CỔ ĐẠI:
 - NGƯỜI KỂ CHUYỆN (narrator) LUÔN xưng "ta" - KHÔNG BAO GIỜ dùng "tôi", "thần", "hạ thần"
@@ -384,13 +406,9 @@ QUAN TRỌNG - OUTPUT:
 - CHỈ trả về nội dung đã dịch
 - KHÔNG thêm giải thích, phân tích, bình luận
 - KHÔNG thêm "Bản dịch:", "Kết quả:", hay bất kỳ tiêu đề nào
-- KHÔNG thêm ghi chú hay chú thích
-
-VĂN BẢN CẦN DỊCH:
-{full_text_to_translate}"""
-        else:
-            # Prompt cho bối cảnh hiện đại
-            user_prompt = f"""Dịch đoạn văn bản sau sang tiếng Việt theo phong cách HIỆN ĐẠI:
+- KHÔNG thêm ghi chú hay chú thích""",
+    # Prompt cho bối cảnh hiện đại
+    "modern": """Dịch đoạn văn bản sau sang tiếng Việt theo phong cách HIỆN ĐẠI:
 
 QUY TẮC DANH XƯNG HIỆN ĐẠI:
 - NGƯỜI KỂ CHUYỆN (narrator) LUÔN xưng "tôi" - KHÔNG BAO GIỜ dùng "ta", "ba", "bố", "con"
@@ -407,22 +425,97 @@ QUAN TRỌNG - OUTPUT:
 - CHỈ trả về nội dung đã dịch
 - KHÔNG thêm giải thích, phân tích, bình luận
 - KHÔNG thêm "Bản dịch:", "Kết quả:", hay bất kỳ tiêu đề nào
-- KHÔNG thêm ghi chú hay chú thích
-
-VĂN BẢN CẦN DỊCH:
-{full_text_to_translate}"""
-
-        # Chuẩn bị messages cho OpenRouter API
-        messages = []
-        if system_instruction:
-            messages.append({
-                "role": "system",
-                "content": system_instruction
-            })
+- KHÔNG thêm ghi chú hay chú thích""",
+}
+
+
+def build_messages(system_instruction, chunk_text, context="modern", prompt_context=None, explicit_cache=False):
+    """
+    Messages cho /chat/completions của OpenRouter (dùng chung với OpenRouterProvider).
+    Phần thay đổi theo chunk (prompt_context, văn bản) luôn đứng sau phần cố định để giữ
+    nguyên prefix giữa các request; explicit_cache đánh dấu cache_control cho phần cố định.
+    """
+    prompt_prefix = CONTEXT_PROMPTS["ancient" if context == "ancient" else "modern"]
+    chunk_prompt = f"VĂN BẢN CẦN DỊCH:\n{chunk_text}"
+    if prompt_context:
+        chunk_prompt = f"{prompt_context}\n\n{chunk_prompt}"
+
+    messages = []
+    if system_instruction:
         messages.append({
-            "role": "user",
-            "content": user_prompt
+            "role": "system",
+            "content": [build_cached_text_part(system_instruction)] if explicit_cache else system_instruction
         })
+    if explicit_cache:
+        user_content = [build_cached_text_part(prompt_prefix), {"type": "text", "text": chunk_prompt}]
+    else:
+        user_content = f"{prompt_prefix}\n\n{chunk_prompt}"
+    messages.append({
+        "role": "user",
+        "content": user_content
+    })
+    return messages
+
+
+def _consume_openrouter_stream(response, guard):
+    """
+    Đọc streaming response qua StreamGuard.
+
+    Returns:
+        (translated_text, finish_reason, usage) - usage lấy từ event cuối (stream_options.include_usage), {} nếu không có
+
+    Raises:
+        StreamAborted: khi guard quyết định hủy sớm
+        Exception: khi server trả về error event giữa stream
+    """
+    finish_reason = None
+    usage = {}
+    # Watchdog kiểm tra TTFT / idle theo timer; hủy sớm thì đóng HTTP response để thread đọc thoát
+    events = iter_guarded(lambda: iter_sse_events(response), guard, on_abort=lambda _stream: response.close())
+    for event in events:
+        if event is None:
+            guard.tick()
+            continue
+        if 'error' in event:
+            error = event['error']
+            message = error.get('message', 'Unknown error') if isinstance(error, dict) else str(error)
+            raise Exception(f"Stream error: {message}")
+        if event.get('usage'):
+            usage = event['usage']
+        choices = event.get('choices') or []
+        if not choices:
+            guard.tick()
+            continue
+        choice = choices[0]
+        delta = choice.get('delta') or {}
+        guard.feed(delta.get('content') or "")
+        if choice.get('finish_reason'):
+            finish_reason = choice['finish_reason']
+    return guard.text, finish_reason, usage
+
+
+def translate_chunk(api_key, model_name, system_instruction, chunk_lines, context="modern", stream_config=None,
+                    prompt_context=None, prompt_cache=False):
+    """
+    Dịch một chunk gồm nhiều dòng văn bản sử dụng OpenRouter API.
+    chunk_lines: danh sách các dòng văn bản
+    context: "modern" (hiện đại) hoặc "ancient" (cổ đại)
+    stream_config: cấu hình streaming (từ streaming.build_stream_config), None = tắt
+    prompt_context: phần prompt riêng của chunk (glossary, bản dịch tham khảo), đặt sau phần cố định
+    prompt_cache: đánh dấu cache_control cho phần prompt cố định (model cần breakpoint tường minh)
+    Trả về (translated_text, is_safety_blocked_flag, is_bad_translation_flag).
+    """
+    # Gom các dòng thành một chuỗi lớn để gửi đi
+    full_text_to_translate = "\n".join(chunk_lines)
+    
+    # Bỏ qua các chunk chỉ chứa các dòng trống hoặc chỉ trắng
+    if not full_text_to_translate.strip():
+        return ("", False, False) # Trả về chuỗi rỗng, không bị chặn, không bad translation
+
+    try:
+        # Phần quy tắc theo bối cảnh cố định (được cache theo prefix), phần riêng của chunk đứng sau
+        explicit_cache = prompt_cache and needs_explicit_cache_control(model_name)
+        messages = build_messages(system_instruction, full_text_to_translate, context, prompt_context, explicit_cache)
 
         # Chuẩn bị headers
         headers = {
@@ -441,8 +534,11 @@ VĂN BẢN CẦN DỊCH:
             "top_p": 1,
             "frequency_penalty": 0,
             "presence_penalty": 0,
-            "stream": False  # Đảm bảo không dùng streaming để tránh mất data
+            "stream": bool(stream_config)  # Streaming chỉ bật khi được cấu hình
         }
+        if stream_config:
+            # Usage (kể cả cached_tokens) chỉ có trong event cuối khi yêu cầu include_usage
+            payload["stream_options"] = {"include_usage": True}
 
         # Gửi request đến OpenRouter với timeout dài hơn và retry logic
         max_retries = 3
@@ -455,7 +551,15 @@ VĂN BẢN CẦN DỊCH:
         dynamic_timeout = base_timeout + (input_size // 1000) * 1
         dynamic_timeout = min(dynamic_timeout, 300)  # Tối đa 5 phút
         
-        print(f"🔄 Đang dịch chunk ({input_size} ký tự) với timeout {dynamic_timeout}s...")
+        # Streaming mode: timeout do StreamGuard quản lý (TTFT + idle), socket timeout chỉ là backstop
+        guard = None
+        if stream_config:
+            guard = create_stream_guard(stream_config, full_text_to_translate)
+            if guard.read_timeout:
+                dynamic_timeout = (10, guard.read_timeout)
+            print(f"🔄 Đang dịch chunk ({input_size} ký tự) - streaming (TTFT {guard.ttft_timeout}s, idle {guard.idle_timeout}s)...")
+        else:
+            print(f"🔄 Đang dịch chunk ({input_size} ký tự) với timeout {dynamic_timeout}s...")
         
         for attempt in range(max_retries):
             try:
@@ -472,7 +576,7 @@ VĂN BẢN CẦN DỊCH:
                     headers=headers,
                     json=payload,
                     timeout=dynamic_timeout,  # Timeout động dựa trên kích thước
-                    stream=False  # Đảm bảo không streaming
+                    stream=guard is not None
                 )
                 print(f"✅ Request thành công sau {attempt + 1} lần thử")
                 break  # Thành công thì thoát loop
@@ -482,7 +586,8 @@ VĂN BẢN CẦN DỊCH:
                 print(f"⚠️ Timeout lần {attempt + 1}/{max_retries} (timeout: {dynamic_timeout}s), thử lại sau {retry_delay}s...")
                 time.sleep(retry_delay)
                 retry_delay *= 2  # Exponential backoff
-                dynamic_timeout = min(dynamic_timeout * 1.5, 300)  # Tăng timeout cho lần thử tiếp theo
+                if guard is None:
+                    dynamic_timeout = min(dynamic_timeout * 1.5, 300)  # Tăng timeout cho lần thử tiếp theo
             except requests.exceptions.RequestException as e:
                 if attempt == max_retries - 1:
                     return (f"[LỖI REQUEST SAU {max_retries} LẦN THỬ: {e}]", False, True)
@@ -513,6 +618,29 @@ VĂN BẢN CẦN DỊCH:
         elif response.status_code != 200:
             return (f"[LỖI API HTTP {response.status_code}: {response.text}]", False, True)
 
+        if guard is not None:
+            # Streaming: đọc tokens qua guard, hủy sớm nếu cần
+            try:
+                translated_text, finish_reason, usage = _consume_openrouter_stream(response, guard)
+            except StreamAborted as e:
+                print(f"⏹️ Hủy stream sớm: {e.reason} (đã nhận {len(e.partial_text)} ký tự)")
+                return (f"[STREAM BỊ HỦY SỚM: {e.reason}]", False, True)
+            except requests.exceptions.RequestException as e:
+                return (f"[LỖI STREAM BỊ NGẮT: {e}]", False, True)
+            finally:
+                response.close()
+
+            if guard.ttft is not None:
+                print(f"⚡ TTFT: {guard.ttft:.1f}s")
+            if prompt_cache and usage:
+                details = usage.get('prompt_tokens_details') or {}
+                get_prompt_cache_manager().record_usage(usage.get('prompt_tokens', 0), details.get('cached_tokens', 0))
+            if finish_reason == 'length':
+                print(f"⚠️ Cảnh báo: Response bị cắt do vượt quá max_tokens. Finish reason: {finish_reason}")
+                return (translated_text + " [BỊ CẮT - CẦN CHUNK NHỎ HƠN]", False, True)
+            is_bad = is_bad_translation(translated_text, full_text_to_translate)
+            return (translated_text, False, is_bad)
+
         # Parse response
         try:
             response_data = response.json()
@@ -552,6 +680,11 @@ VĂN BẢN CẦN DỊCH:
             
         translated_text = choice['message']['content']
         
+        if prompt_cache:
+            usage = response_data.get('usage') or {}
+            details = usage.get('prompt_tokens_details') or {}
+            get_prompt_cache_manager().record_usage(usage.get('prompt_tokens', 0), details.get('cached_tokens', 0))
+        
         # Kiểm tra xem response có bị cắt không (finish_reason != "stop")
         finish_reason = choice.get('finish_reason', 'unknown')
         if finish_reason == 'length':
@@ -800,7 +933,7 @@ def translate_file_optimized(input_file, output_file=None, api_key=None, model_n
     
     # Validate và thiết lập parameters
     if num_workers is None:
-        num_workers = NUM_WORKERS
+        num_workers = get_default_workers()
     else:
         num_workers = validate_threads(num_workers)
         
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prompt/context caching cho phần prefix cố định của prompt
+
+Mỗi request đều gửi lại cùng một system_instruction dài vài KB. Module này:
+- Tách prompt thành prefix cố định (system_instruction) và phần thay đổi theo
+  chunk (glossary/bản dịch tham khảo + văn bản cần dịch), prefix luôn ở đầu.
+- Google AI: tạo Gemini CachedContent cho prefix, theo dõi handle với TTL và
+  refresh trước khi hết hạn (PromptCacheManager).
+- OpenRouter: đánh dấu cache_control (kiểu Anthropic) cho prefix với các model
+  cần breakpoint tường minh; các model khác (OpenAI, DeepSeek...) tự cache theo prefix.
+- Cache bị xóa phía server (hết hạn sớm, xóa tay) thì provider invalidate handle và
+  tạo lại; cuối phiên dịch release_prompt_caches() xóa các cache đã tạo.
+- LocalCacheBackend (provider "Local Cache" trong providers.py): backend giả lập chạy
+  offline để kiểm tra hành vi cache hit và số tokens tiết kiệm được.
+"""
+
+import re
+import time
+import hashlib
+import threading
+from datetime import timedelta
+
+
+DEFAULT_CACHE_TTL = 3600          # Giây
+CACHE_REFRESH_MARGIN = 300        # Refresh khi còn dưới 5 phút
+# Gemini từ chối cache nội dung quá ngắn; không tốn request tạo cache cho prefix nhỏ
+MIN_CACHEABLE_PREFIX_TOKENS = 1024
+
+# Các model trên OpenRouter cần cache_control tường minh
+EXPLICIT_CACHE_CONTROL_PREFIXES = ("anthropic/", "google/gemini")
+
+
+# Lỗi của provider khi cached content không còn tồn tại (Gemini: "CachedContent not found")
+CACHE_MISS_PATTERN = re.compile(
+    r"cached[ _]?content.*(not found|expired|does not exist|permission denied)|cache .*(không tồn tại|hết hạn)",
+    re.IGNORECASE
+)
+
+
+# Tiêu đề cuối system_instruction, ngay trước văn bản gốc ("Văn bản cần dịch:")
+TEXT_HEADER_PATTERN = re.compile(r"\s*((?:văn bản cần dịch|text to translate)\s*:)\s*$", re.IGNORECASE)
+DEFAULT_TEXT_HEADER = "Văn bản cần dịch:"
+
+
+def _estimate_tokens(text):
+    # Ước lượng thô (giống estimate_tokens trong translate.py): ~4 ký tự / token
+    return max(1, len(text or "") // 4)
+
+
+def _prefix_hash(prefix):
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+
+
+def split_text_header(system_instruction):
+    """
+    Tách tiêu đề "Văn bản cần dịch:" ở cuối system_instruction.
+
+    Returns:
+        (prefix, header) - prefix là phần cố định để cache, header rỗng nếu instruction không có tiêu đề
+    """
+    match = TEXT_HEADER_PATTERN.search(system_instruction or "")
+    if not match:
+        return system_instruction or "", ""
+    return system_instruction[:match.start()], match.group(1)
+
+
+def build_chunk_prompt(text, prompt_context=None, header=""):
+    """
+    Phần prompt thay đổi theo chunk: khối glossary / bản dịch tham khảo đứng TRƯỚC tiêu đề,
+    sau tiêu đề chỉ có văn bản gốc (model không dịch nhầm khối tham khảo vào bản dịch).
+    """
+    if not prompt_context:
+        return f"{header}\n{text}" if header else text
+    return f"{prompt_context}\n\n{header or DEFAULT_TEXT_HEADER}\n{text}"
+
+
+def needs_explicit_cache_control(model_name):
+    """Model trên OpenRouter cần đánh dấu cache_control để được cache prefix"""
+    return (model_name or "").lower().startswith(EXPLICIT_CACHE_CONTROL_PREFIXES)
+
+
+def is_cache_miss_error(error_message):
+    """Lỗi do cached content đã bị xóa / hết hạn phía server -> cần invalidate handle và tạo lại"""
+    return bool(CACHE_MISS_PATTERN.search(str(error_message)))
+
+
+def build_cached_text_part(text):
+    """Content part có cache_control (OpenRouter / Anthropic-style)"""
+    return {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+
+
+class CacheHandle:
+    """Một cached content phía provider"""
+
+    def __init__(self, key, name, ref, created_at, expires_at, prefix_tokens):
+        self.key = key
+        self.name = name
+        self.ref = ref              # Object của provider (CachedContent, ...)
+        self.created_at = created_at
+        self.expires_at = expires_at
+        self.prefix_tokens = prefix_tokens
+        self.hits = 0
+
+
+class GeminiCacheBackend:
+    """Gemini CachedContent (google.generativeai.caching)"""
+
+    def create(self, model_name, api_key, prefix, ttl):
+        import google.generativeai as genai
+        from google.generativeai import caching
+        genai.configure(api_key=api_key)
+        model_path = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        cache = caching.CachedContent.create(
+            model=model_path,
+            system_instruction=prefix,
+            ttl=timedelta(seconds=ttl),
+        )
+        return cache.name, cache
+
+    def refresh(self, handle, ttl):
+        handle.ref.update(ttl=timedelta(seconds=ttl))
+
+    def delete(self, handle):
+        handle.ref.delete()
+
+
+class LocalCacheBackend:
+    """
+    Backend cache giả lập trong bộ nhớ (offline). Dùng cùng PromptCacheManager
+    và provider "Local Cache" để test cache hit / hết hạn / refresh.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.caches = {}   # {name: (prefix, expires_at)}
+        self.lock = threading.Lock()
+        self._counter = 0
+
+    def create(self, model_name, api_key, prefix, ttl):
+        with self.lock:
+            self._counter += 1
+            name = f"cachedContents/local-{self._counter}"
+            self.caches[name] = (prefix, self.clock() + ttl)
+        return name, name
+
+    def refresh(self, handle, ttl):
+        with self.lock:
+            if handle.name not in self.caches:
+                raise KeyError(f"{handle.name} không tồn tại")
+            prefix, _ = self.caches[handle.name]
+            self.caches[handle.name] = (prefix, self.clock() + ttl)
+
+    def delete(self, handle):
+        with self.lock:
+            self.caches.pop(handle.name, None)
+
+    def lookup(self, name):
+        """Prefix của cache còn hạn, hoặc None"""
+        with self.lock:
+            entry = self.caches.get(name)
+            if entry is None or entry[1] <= self.clock():
+                return None
+            return entry[0]
+
+    def request_usage(self, prefix, suffix, cache_name=None):
+        """
+        Usage giả lập của một request gửi prefix + suffix (prefix lấy từ cache_name nếu có).
+
+        Returns:
+            {"prompt_tokens": ..., "cached_tokens": ...}
+
+        Raises:
+            KeyError: cache_name không tồn tại hoặc đã hết hạn
+        """
+        cached_prefix = self.lookup(cache_name) if cache_name else None
+        if cache_name and cached_prefix is None:
+            raise KeyError(f"Cache {cache_name} không tồn tại hoặc đã hết hạn")
+
+        prompt_tokens = _estimate_tokens(prefix) + _estimate_tokens(suffix)
+        cached_tokens = _estimate_tokens(cached_prefix) if cached_prefix is not None else 0
+        return {"prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens}
+
+
+class PromptCacheManager:
+    """
+    Quản lý cache handles theo (model, key, prefix) với TTL và refresh.
+    Thread-safe; mỗi key chỉ tạo cache một lần dù nhiều thread gọi cùng lúc.
+    """
+
+    def __init__(self, backend=None, ttl=DEFAULT_CACHE_TTL, refresh_margin=CACHE_REFRESH_MARGIN,
+                 min_prefix_tokens=MIN_CACHEABLE_PREFIX_TOKENS, clock=time.monotonic):
+        self.backend = backend or GeminiCacheBackend()
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_prefix_tokens = min_prefix_tokens
+        self.clock = clock
+
+        self.lock = threading.Lock()
+        self._handles = {}
+        self._key_locks = {}
+        self._uncacheable = set()
+
+        self.creates = 0
+        self.refreshes = 0
+        self.invalidations = 0
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def _make_key(self, model_name, api_key, prefix):
+        key_hash = hashlib.md5((api_key or "").encode()).hexdigest()[:8]
+        return (model_name, key_hash, _prefix_hash(prefix))
+
+    def get(self, model_name, api_key, prefix):
+        """
+        Lấy (hoặc tạo / refresh) cache handle cho prefix.
+
+        Returns:
+            CacheHandle hoặc None nếu prefix không cache được (quá ngắn, provider từ chối...)
+        """
+        if not prefix or _estimate_tokens(prefix) < self.min_prefix_tokens:
+            return None
+
+        key = self._make_key(model_name, api_key, prefix)
+        with self.lock:
+            if key in self._uncacheable:
+                return None
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            now = self.clock()
+            handle = self._handles.get(key)
+
+            if handle is not None and handle.expires_at - now > self.refresh_margin:
+                with self.lock:
+                    handle.hits += 1
+                    self.hits += 1
+                return handle
+
+            if handle is not None and handle.expires_at > now:
+                # Sắp hết hạn -> gia hạn TTL
+                try:
+                    self.backend.refresh(handle, self.ttl)
+                    handle.expires_at = self.clock() + self.ttl
+                    with self.lock:
+                        handle.hits += 1
+                        self.hits += 1
+                        self.refreshes += 1
+                    return handle
+                except Exception as e:
+                    print(f"⚠️ Không thể refresh prompt cache {handle.name}: {e} - tạo mới")
+
+            try:
+                name, ref = self.backend.create(model_name, api_key, prefix, self.ttl)
+            except Exception as e:
+                print(f"⚠️ Không thể tạo prompt cache cho {model_name}: {e} - gửi prefix đầy đủ")
+                with self.lock:
+                    self._uncacheable.add(key)
+                return None
+
+            created_at = self.clock()
+            handle = CacheHandle(key, name, ref, created_at, created_at + self.ttl, _estimate_tokens(prefix))
+            self._handles[key] = handle
+            with self.lock:
+                self.creates += 1
+            print(f"🗄️ Đã tạo prompt cache {name} ({handle.prefix_tokens} tokens, TTL {self.ttl}s)")
+            return handle
+
+    def invalidate(self, handle):
+        """Bỏ handle (provider báo cache không còn tồn tại) để lần get sau tạo cache mới"""
+        with self.lock:
+            # Thread khác có thể đã tạo lại cache cho cùng key - chỉ bỏ đúng handle hỏng
+            if self._handles.get(handle.key) is handle:
+                del self._handles[handle.key]
+                self.invalidations += 1
+
+    def clear(self):
+        """Xóa mọi cache đã tạo phía provider (cuối phiên dịch - Gemini tính phí lưu trữ đến hết TTL)"""
+        with self.lock:
+            handles = list(self._handles.values())
+            self._handles.clear()
+        deleted = 0
+        for handle in handles:
+            try:
+                self.backend.delete(handle)
+                deleted += 1
+            except Exception as e:
+                print(f"⚠️ Không thể xóa prompt cache {handle.name}: {e}")
+        if deleted:
+            print(f"🗑️ Đã xóa {deleted} prompt cache")
+        return deleted
+
+    def record_usage(self, prompt_tokens, cached_tokens):
+        """Ghi nhận usage từ response (prompt tokens và phần được phục vụ từ cache)"""
+        with self.lock:
+            self.prompt_tokens += int(prompt_tokens or 0)
+            self.cached_tokens += int(cached_tokens or 0)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'handles': len(self._handles),
+                'creates': self.creates,
+                'refreshes': self.refreshes,
+                'invalidations': self.invalidations,
+                'hits': self.hits,
+                'prompt_tokens': self.prompt_tokens,
+                'cached_tokens': self.cached_tokens,
+                'cached_ratio': (self.cached_tokens / self.prompt_tokens) if self.prompt_tokens else 0.0,
+            }
+
+    def print_stats(self):
+        stats = self.get_stats()
+        if not stats['creates'] and not stats['cached_tokens']:
+            return
+        print(f"\n🗄️ Prompt cache: {stats['creates']} cache tạo mới, {stats['refreshes']} lần refresh, "
+              f"{stats['invalidations']} lần tạo lại do mất cache, {stats['hits']} lần dùng lại; {stats['cached_tokens']:,}/{stats['prompt_tokens']:,} "
+              f"input tokens từ cache ({stats['cached_ratio']:.0%})")
+
+
+# Manager dùng chung cho cả process (handles theo model + key + prefix)
+_prompt_cache_manager = None
+_local_cache_manager = None
+_prompt_cache_lock = threading.Lock()
+
+
+def get_prompt_cache_manager():
+    """Lấy PromptCacheManager dùng chung (Gemini backend mặc định)"""
+    global _prompt_cache_manager
+    with _prompt_cache_lock:
+        if _prompt_cache_manager is None:
+            _prompt_cache_manager = PromptCacheManager()
+        return _prompt_cache_manager
+
+
+def set_prompt_cache_manager(manager):
+    """Thay manager dùng chung (ví dụ PromptCacheManager(LocalCacheBackend()) khi test offline)"""
+    global _prompt_cache_manager
+    with _prompt_cache_lock:
+        _prompt_cache_manager = manager
+
+
+def get_local_cache_manager():
+    """PromptCacheManager(LocalCacheBackend()) dùng chung cho provider 'Local Cache'"""
+    global _local_cache_manager
+    with _prompt_cache_lock:
+        if _local_cache_manager is None:
+            _local_cache_manager = PromptCacheManager(LocalCacheBackend())
+        return _local_cache_manager
+
+
+def _active_managers():
+    with _prompt_cache_lock:
+        return [manager for manager in (_prompt_cache_manager, _local_cache_manager) if manager is not None]
+
+
+def print_prompt_cache_stats():
+    for manager in _active_managers():
+        manager.print_stats()
+
+
+def release_prompt_caches():
+    """Cuối phiên dịch: xóa các cache đã tạo (lần chạy sau tạo lại khi cần)"""
+    for manager in _active_managers():
+        manager.clear()
+
+
+def is_prompt_cache_enabled(model_settings):
+    """model_settings["prompt_cache"]: bật context caching cho prefix cố định"""
+    return bool(model_settings and model_settings.get("prompt_cache", False))
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Provider Router - chia chunks cho nhiều provider/model cùng lúc
+
+Google AI free (RPM theo project) và OpenRouter (budget riêng) là các nguồn
+capacity độc lập. Router cho phép một lần dịch dùng đồng thời tất cả các nguồn:
+mỗi route có giới hạn concurrency riêng (semaphore), rate limiter riêng (nếu
+cấu hình RPM), key rotator riêng, và được chọn theo trọng số dựa trên
+throughput đo được (dòng/giây) và tỷ lệ lỗi gần đây.
+
+Fallback tiers: route có thuộc tính tier (0 = provider chính + extra_providers,
+1, 2, ... = model_settings["fallback_tiers"]). Router chỉ dùng các route của tier
+thấp nhất còn hoạt động. Route bị hạ cấp (demote) khi hết quota, hết RPD hoặc
+latency tăng kéo dài; khi cả tier bị hạ cấp, các chunk còn lại chuyển sang tier kế
+tiếp thay vì dừng cả lần dịch.
+
+Hạ cấp có thời hạn: cooldown lấy từ lỗi (retry delay), mốc reset RPD hoặc cửa sổ
+RPM đã calibrate. Hết cooldown, route được thử lại bằng một request (probe); thành
+công thì hoạt động lại bình thường (tier của nó lại được ưu tiên), lỗi thì bị hạ cấp
+lần nữa với cooldown gấp đôi.
+"""
+
+import re
+import random
+import threading
+
+try:
+    from .clock import SYSTEM_CLOCK
+except ImportError:
+    from clock import SYSTEM_CLOCK
+
+
+# Hệ số làm mượt EWMA cho throughput/error rate
+EWMA_ALPHA = 0.3
+# Số request tối thiểu trước khi tin vào throughput đo được (trước đó dùng prior)
+MIN_SAMPLES_FOR_SCORE = 3
+# Trọng số tối thiểu để route chậm/lỗi vẫn được thử lại thỉnh thoảng
+MIN_ROUTE_WEIGHT = 0.05
+# Latency regression: EWMA latency > baseline × factor trong N requests liên tiếp
+DEFAULT_LATENCY_FACTOR = 3.0
+DEFAULT_LATENCY_WINDOW = 5
+# Cooldown mặc định khi không biết mốc reset (giây), tăng gấp đôi mỗi lần probe thất bại
+DEFAULT_DEMOTE_COOLDOWN = 300
+MAX_DEMOTE_COOLDOWN = 6 * 3600
+# Mọi route đều đang cooldown: chờ route sớm nhất quay lại nếu không quá lâu (giây)
+MAX_RESTORE_WAIT = 120
+
+# "retry in 12.5s", "retry_delay { seconds: 31 }", "Retry-After: 20", "retryDelay": "17s"
+RETRY_DELAY_PATTERNS = (
+    re.compile(r"retry[ _-]?in\s+([\d.]+)\s*(ms|s)?", re.IGNORECASE),
+    re.compile(r"retry_?delay\W+(?:seconds\W+)?([\d.]+)\s*(ms|s)?", re.IGNORECASE),
+    re.compile(r"retry-after\W+([\d.]+)\s*(ms|s)?", re.IGNORECASE),
+)
+
+
+def parse_retry_delay(error_message):
+    """Thời gian chờ (giây) mà provider ghi trong thông báo lỗi, None nếu không có"""
+    for pattern in RETRY_DELAY_PATTERNS:
+        match = pattern.search(str(error_message or ""))
+        if match:
+            try:
+                seconds = float(match.group(1))
+            except ValueError:
+                continue
+            return seconds / 1000.0 if (match.group(2) or "").lower() == "ms" else seconds
+    return None
+
+
+class ProviderRoute:
+    """
+    Một nguồn capacity: (provider, model, keys) với concurrency và limiter riêng.
+    """
+
+    def __init__(self, name, provider, model_name, api_key, is_paid_key=False,
+                 max_concurrency=4, key_rotator=None, rate_limiter=None, model_settings=None, tier=0):
+        """
+        Args:
+            name: Tên hiển thị của route
+            provider: "Google AI" hoặc "OpenRouter"
+            model_name: Tên model
+            api_key: Key (str) hoặc key đầu tiên nếu dùng key_rotator
+            is_paid_key: Key trả phí (Google AI)
+            max_concurrency: Số request đồng thời tối đa trên route
+            key_rotator: KeyRotator cho route (nhiều Google AI keys)
+            rate_limiter: Limiter riêng của route (acquire() trước mỗi chunk), None nếu không cần
+            model_settings: Cài đặt model riêng cho route
+            tier: Tier fallback (0 = ưu tiên cao nhất)
+        """
+        self.name = name
+        self.provider = provider
+        self.model_name = model_name
+        self.api_key = api_key
+        self.is_paid_key = is_paid_key
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.key_rotator = key_rotator
+        self.rate_limiter = rate_limiter
+        self.model_settings = model_settings or {}
+        self.tier = tier
+        self.demoted_reason = None
+        self.demoted_until = None    # Mốc (clock.monotonic) được thử lại
+        self.demote_count = 0        # Số lần hạ cấp liên tiếp (cooldown gấp đôi mỗi lần)
+        self.probing = False         # Vừa hết cooldown: chỉ 1 request cho tới khi thành công
+
+        self.in_flight = 0
+        self.completed = 0
+        self.errors = 0
+        self.lines_done = 0
+        self.throughput = None   # EWMA dòng/giây cho mỗi slot
+        self.error_rate = 0.0    # EWMA tỷ lệ lỗi
+        self.latency = None      # EWMA latency (giây)
+        self.baseline_latency = None
+        self.slow_streak = 0
+
+    @property
+    def is_active(self):
+        return self.demoted_reason is None
+
+    def has_capacity(self):
+        return self.in_flight < (1 if self.probing else self.max_concurrency)
+
+    def score(self, prior_throughput):
+        """Trọng số chọn route: throughput × (1 - error_rate)"""
+        throughput = self.throughput if self.completed >= MIN_SAMPLES_FOR_SCORE else prior_throughput
+        return max(throughput * (1.0 - self.error_rate), MIN_ROUTE_WEIGHT * prior_throughput, 1e-6)
+
+    def record(self, latency, lines, is_error):
+        self.completed += 1
+        if is_error:
+            self.errors += 1
+        else:
+            self.lines_done += lines
+
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate + EWMA_ALPHA * (1.0 if is_error else 0.0)
+        if not is_error and latency > 0:
+            sample = lines / latency
+            if self.throughput is None:
+                self.throughput = sample
+            else:
+                self.throughput = (1 - EWMA_ALPHA) * self.throughput + EWMA_ALPHA * sample
+
+            self.latency = latency if self.latency is None else (1 - EWMA_ALPHA) * self.latency + EWMA_ALPHA * latency
+            # Baseline = latency tốt nhất sau khi đã đủ mẫu (chưa đủ mẫu thì chưa đánh giá)
+            if self.completed >= MIN_SAMPLES_FOR_SCORE:
+                if self.baseline_latency is None or self.latency < self.baseline_latency:
+                    self.baseline_latency = self.latency
+
+    def check_latency_regression(self, factor, window):
+        """
+        Cập nhật chuỗi request chậm và trả về True khi latency tăng kéo dài
+        (EWMA > baseline × factor trong `window` requests liên tiếp).
+        """
+        if self.baseline_latency is None or self.latency is None:
+            return False
+        if self.latency > self.baseline_latency * factor:
+            self.slow_streak += 1
+        else:
+            self.slow_streak = 0
+        return self.slow_streak >= window
+
+    def __repr__(self):
+        return f"ProviderRoute({self.name})"
+
+
+class ProviderRouter:
+    """
+    Chọn route cho từng chunk theo trọng số throughput/error rate.
+
+    Dùng:
+        route = router.acquire()
+        try:
+            ... dịch chunk bằng route ...
+        finally:
+            router.release(route, latency, lines, is_error)
+    """
+
+    def __init__(self, routes, rng=None, latency_factor=DEFAULT_LATENCY_FACTOR, latency_window=DEFAULT_LATENCY_WINDOW,
+                 clock=SYSTEM_CLOCK):
+        if not routes:
+            raise ValueError("ProviderRouter cần ít nhất 1 route")
+        self.routes = list(routes)
+        self.condition = threading.Condition(threading.RLock())
+        self.rng = rng or random.Random()
+        self.latency_factor = latency_factor
+        self.latency_window = latency_window
+        self.clock = clock
+
+    def total_concurrency(self):
+        """Số worker cần thiết: tier có tổng concurrency lớn nhất"""
+        per_tier = {}
+        for route in self.routes:
+            per_tier[route.tier] = per_tier.get(route.tier, 0) + route.max_concurrency
+        return max(per_tier.values())
+
+    def active_tier(self):
+        """Tier thấp nhất còn route hoạt động (None nếu mọi route đã bị hạ cấp)"""
+        # Condition dùng RLock: gọi lại từ demote/acquire (đang giữ lock) vẫn được
+        with self.condition:
+            self._restore_expired()
+            tiers = [route.tier for route in self.routes if route.is_active]
+            return min(tiers) if tiers else None
+
+    def _restore_expired(self):
+        """Route hết cooldown -> cho thử lại bằng một request (probe)"""
+        now = self.clock.monotonic()
+        for route in self.routes:
+            if route.demoted_until is not None and now >= route.demoted_until:
+                print(f"⬆️ Route {route.name} hết cooldown ({route.demoted_reason}) - thử lại")
+                route.demoted_reason = None
+                route.demoted_until = None
+                route.probing = True
+                route.slow_streak = 0
+
+    def _next_restore_in(self):
+        """Số giây tới khi route bị hạ cấp sớm nhất được thử lại (None nếu không có)"""
+        pending = [route.demoted_until for route in self.routes if route.demoted_until is not None]
+        return max(0.0, min(pending) - self.clock.monotonic()) if pending else None
+
+    def has_fallback(self, route):
+        """Còn route hoạt động nào khác ngoài route này không"""
+        with self.condition:
+            return any(other is not route and other.is_active for other in self.routes)
+
+    def demote(self, route, reason, cooldown=None):
+        """
+        Hạ cấp route: router không chọn route này cho tới khi hết cooldown.
+
+        Args:
+            cooldown: Số giây tới mốc reset quota (từ lỗi / RPD / RPM đã calibrate).
+                None = DEFAULT_DEMOTE_COOLDOWN. Route đang probe mà lại bị hạ cấp thì
+                cooldown ít nhất gấp đôi lần trước.
+
+        Returns:
+            True nếu route vừa bị hạ cấp, False nếu đã bị hạ cấp trước đó
+        """
+        with self.condition:
+            if not route.is_active:
+                return False
+            route.demote_count = route.demote_count + 1 if route.probing else 1
+            seconds = DEFAULT_DEMOTE_COOLDOWN if cooldown is None else cooldown
+            if route.demote_count > 1:
+                seconds = max(seconds, DEFAULT_DEMOTE_COOLDOWN * 2 ** (route.demote_count - 1))
+            seconds = min(max(float(seconds), 1.0), MAX_DEMOTE_COOLDOWN)
+            route.demoted_reason = reason
+            route.demoted_until = self.clock.monotonic() + seconds
+            route.probing = False
+            next_tier = self.active_tier()
+            self.condition.notify_all()
+
+        retry_note = f"thử lại sau {seconds:.0f}s"
+        if next_tier is None:
+            print(f"⬇️ Route {route.name} bị hạ cấp ({reason}, {retry_note}) - không còn tier fallback")
+        elif next_tier != route.tier:
+            print(f"⬇️ Route {route.name} bị hạ cấp ({reason}, {retry_note}) - chuyển sang tier {next_tier}")
+        else:
+            print(f"⬇️ Route {route.name} bị hạ cấp ({reason}, {retry_note})")
+        return True
+
+    def _prior_throughput(self):
+        measured = [r.throughput for r in self.routes if r.throughput and r.completed >= MIN_SAMPLES_FOR_SCORE]
+        # Route chưa có số liệu được coi ngang route tốt nhất để được thử
+        return max(measured) if measured else 1.0
+
+    def _candidates(self):
+        tier = self.active_tier()
+        return [route for route in self.routes
+                if route.is_active and route.tier == tier and route.has_capacity()]
+
+    def _pick(self, candidates):
+        prior = self._prior_throughput()
+        weights = [route.score(prior) for route in candidates]
+        return self.rng.choices(candidates, weights=weights, k=1)[0]
+
+    def acquire(self, timeout=None, stop_check=None):
+        """
+        Chờ đến khi có route còn slot và chọn một route theo trọng số.
+
+        Args:
+            timeout: Thời gian chờ tối đa (None = chờ mãi)
+            stop_check: Callable() -> bool, trả về True để bỏ chờ (ví dụ user dừng dịch)
+
+        Returns:
+            ProviderRoute hoặc None nếu hết thời gian chờ / bị dừng / mọi route đã bị hạ cấp
+            (và không route nào hết cooldown trong MAX_RESTORE_WAIT giây)
+        """
+        deadline = None if timeout is None else self.clock.monotonic() + timeout
+        with self.condition:
+            while True:
+                if self.active_tier() is None:
+                    restore_in = self._next_restore_in()
+                    if restore_in is None or restore_in > MAX_RESTORE_WAIT:
+                        return None
+                candidates = self._candidates()
+                if candidates:
+                    route = self._pick(candidates)
+                    route.in_flight += 1
+                    return route
+
+                if stop_check is not None and stop_check():
+                    return None
+                if deadline is not None:
+                    remaining = deadline - self.clock.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self.condition.wait(min(remaining, 1.0))
+                else:
+                    self.condition.wait(1.0)
+
+    def release(self, route, latency, lines, is_error=False, record=True):
+        """
+        Trả slot cho route và cập nhật throughput/error rate.
+
+        Args:
+            record: False để không tính request vào thống kê (ví dụ request bị hủy)
+        """
+        with self.condition:
+            route.in_flight = max(0, route.in_flight - 1)
+            slow = False
+            if record:
+                route.record(latency, lines, is_error)
+                if not is_error:
+                    slow = route.check_latency_regression(self.latency_factor, self.latency_window)
+                    if route.probing and route.is_active:
+                        route.probing = False
+                        route.demote_count = 0
+                        print(f"✅ Route {route.name} hoạt động lại bình thường")
+            self.condition.notify_all()
+
+        # Latency tăng kéo dài -> chuyển sang route/tier khác nếu còn
+        if slow and route.is_active and self.has_fallback(route):
+            self.demote(route, f"latency {route.latency:.1f}s > {self.latency_factor:g}× baseline {route.baseline_latency:.1f}s")
+
+    def get_stats(self):
+        with self.condition:
+            now = self.clock.monotonic()
+            return [{
+                'name': route.name,
+                'tier': route.tier,
+                'demoted_reason': route.demoted_reason,
+                'retry_in': max(0.0, route.demoted_until - now) if route.demoted_until is not None else None,
+                'provider': route.provider,
+                'model': route.model_name,
+                'max_concurrency': route.max_concurrency,
+                'completed': route.completed,
+                'errors': route.errors,
+                'lines_done': route.lines_done,
+                'throughput': route.throughput or 0.0,
+                'error_rate': route.error_rate,
+            } for route in self.routes]
+
+    def print_stats(self):
+        print("\n🔀 Provider Router Statistics:")
+        for stats in self.get_stats():
+            status = ""
+            if stats['demoted_reason']:
+                status = f" - hạ cấp: {stats['demoted_reason']} (thử lại sau {stats['retry_in']:.0f}s)"
+            print(f"   [tier {stats['tier']}] {stats['name']}: {stats['completed']} chunks ({stats['errors']} lỗi), "
+                  f"{stats['lines_done']} dòng, {stats['throughput']:.1f} dòng/giây/slot, "
+                  f"error rate {stats['error_rate']:.0%}, concurrency {stats['max_concurrency']}{status}")
+        print()
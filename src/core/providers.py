@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Provider interface cho dịch chunk
+
+Mỗi provider chỉ implement các hook build_request -> send -> parse (và open_stream /
+parse_stream_event nếu hỗ trợ streaming); BaseProvider.translate_chunk dùng chung phần
+streaming guard, usage, xử lý response bị cắt / bị chặn, còn classify_error phân loại lỗi
+cho retry logic của process_chunk. Thêm provider mới (ví dụ server inference tự host)
+chỉ cần đăng ký vào registry, không phải sửa vòng retry.
+
+- Google AI / OpenRouter: implementations trong translate.py
+- OpenAICompatibleProvider: endpoint /v1/chat/completions bất kỳ (llama.cpp server, vLLM,
+  text-generation-inference, LM Studio, Ollama...) qua model_settings["base_url"]
+"""
+
+import json
+import threading
+
+try:
+    from .prompt_cache import (
+        build_chunk_prompt, get_local_cache_manager, get_prompt_cache_manager, is_cache_miss_error, split_text_header
+    )
+    from .streaming import StreamAborted, create_stream_guard, iter_guarded
+except ImportError:
+    from prompt_cache import (
+        build_chunk_prompt, get_local_cache_manager, get_prompt_cache_manager, is_cache_miss_error, split_text_header
+    )
+    from streaming import StreamAborted, create_stream_guard, iter_guarded
+
+
+# Loại lỗi (classify_error)
+ERROR_QUOTA = "quota"                    # Hết quota/credit - dừng
+ERROR_AUTH = "auth"                      # Key không hợp lệ - dừng
+ERROR_RATE_LIMIT = "rate_limit"          # 429 - retry
+ERROR_MODERATION = "moderation"          # Nội dung bị chặn
+ERROR_TIMEOUT = "timeout"                # Retry
+ERROR_SERVICE = "service"                # 502/503 - retry
+ERROR_CONTEXT_LENGTH = "context_length"  # Chunk quá dài - chia nhỏ
+ERROR_OTHER = "other"
+
+RETRYABLE_ERRORS = (ERROR_RATE_LIMIT, ERROR_TIMEOUT, ERROR_SERVICE)
+
+
+def check_openrouter_rate_limit_error(error_message):
+    """Kiểm tra lỗi Rate Limit (429) - có thể retry"""
+    error_str = str(error_message).lower()
+    rate_limit_keywords = [
+        "rate limit exceeded",
+        "rate_limit_exceeded",
+        "429",
+        "too many requests",
+        "requests per minute",
+        "requests per second"
+    ]
+    return any(keyword in error_str for keyword in rate_limit_keywords)
+
+def check_openrouter_quota_error(error_message):
+    """Kiểm tra lỗi Quota/Credit Insufficient (402) - cần nạp credit"""
+    error_str = str(error_message).lower()
+    quota_keywords = [
+        "402",
+        "insufficient credits",
+        "insufficient_credits",
+        "exceeded your current quota",
+        "quota exceeded",
+        "billing",
+        "please check your plan",
+        "credits",
+        "balance"
+    ]
+    # KHÔNG BAO GỒM "429" và "rate limit" - đó là lỗi khác!
+    return any(keyword in error_str for keyword in quota_keywords)
+
+def check_openrouter_api_key_error(error_message):
+    """Kiểm tra lỗi API Key không hợp lệ (401)"""
+    error_str = str(error_message).lower()
+    api_key_keywords = [
+        "401",
+        "unauthorized",
+        "invalid credentials",
+        "invalid_credentials",
+        "api key not valid",
+        "invalid api key",
+        "authentication failed",
+        "api_key_invalid",
+        "invalid_api_key",
+        "api key is invalid",
+        "bad api key"
+    ]
+    return any(keyword in error_str for keyword in api_key_keywords)
+
+def check_openrouter_moderation_error(error_message):
+    """Kiểm tra lỗi Moderation (403) - nội dung bị cấm"""
+    error_str = str(error_message).lower()
+    moderation_keywords = [
+        "403",
+        "moderation",
+        "content policy",
+        "content_policy",
+        "policy violation",
+        "blocked content",
+        "inappropriate content"
+    ]
+    return any(keyword in error_str for keyword in moderation_keywords)
+
+def check_openrouter_timeout_error(error_message):
+    """Kiểm tra lỗi Timeout (408) - có thể retry"""
+    error_str = str(error_message).lower()
+    timeout_keywords = [
+        "408",
+        "timeout",
+        "request timeout",
+        "gateway timeout",
+        "timed out"
+    ]
+    return any(keyword in error_str for keyword in timeout_keywords)
+
+def check_openrouter_service_error(error_message):
+    """Kiểm tra lỗi Service (502, 503) - có thể retry"""
+    error_str = str(error_message).lower()
+    service_keywords = [
+        "502",
+        "503",
+        "bad gateway",
+        "service unavailable",
+        "server error",
+        "internal server error",
+        "model unavailable",
+        "provider unavailable"
+    ]
+    return any(keyword in error_str for keyword in service_keywords)
+
+def check_context_length_error(error_message):
+    """Kiểm tra lỗi chunk vượt quá context window - chia nhỏ chunk"""
+    error_str = str(error_message).lower()
+    return "context_length" in error_str or "too long" in error_str or "maximum" in error_str
+
+
+# Thống kê usage theo provider (dùng chung cho mọi instance trong process)
+_usage_lock = threading.Lock()
+_usage_stats = {}
+
+
+def get_usage_stats():
+    """{provider_name: {"requests", "prompt_tokens", "completion_tokens", "cached_tokens"}}"""
+    with _usage_lock:
+        return {name: dict(stats) for name, stats in _usage_stats.items()}
+
+
+def reset_usage_stats():
+    with _usage_lock:
+        _usage_stats.clear()
+
+
+def print_usage_stats():
+    stats = get_usage_stats()
+    if not any(s["prompt_tokens"] or s["completion_tokens"] for s in stats.values()):
+        return
+    print("\n🧾 Token usage theo provider:")
+    for name, s in stats.items():
+        cached = f", {s['cached_tokens']:,} từ cache" if s["cached_tokens"] else ""
+        print(f"   {name}: {s['requests']} requests, {s['prompt_tokens']:,} input{cached}, "
+              f"{s['completion_tokens']:,} output tokens")
+
+
+class ProviderResponse:
+    """Kết quả của một request sau parse (dùng chung cho response thường và streaming)"""
+
+    def __init__(self, text="", finish_reason=None, blocked=None,
+                 prompt_tokens=0, completion_tokens=0, cached_tokens=0):
+        self.text = text
+        self.finish_reason = finish_reason    # "length" = bị cắt do max_tokens
+        self.blocked = blocked                # Thông báo khi bị chặn (safety / không có kết quả), None nếu không
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached_tokens = cached_tokens
+
+
+class BaseProvider:
+    """
+    Interface provider. Subclass implement các hook:
+        build_request(system_instruction, chunk_lines, context, prompt_context) -> request
+        send(request) -> raw response
+        parse(raw) -> ProviderResponse
+        open_stream(request, guard) / parse_stream_event(event, response) (supports_streaming)
+    translate_chunk (streaming guard, usage, cắt max_tokens, bad translation) và
+    classify_error (retry ở process_chunk) dùng chung cho mọi provider.
+    """
+
+    name = "Provider"
+    error_label = "API ERROR"      # Loại lỗi trong format_error_chunk khi gặp ERROR_OTHER
+    supports_split = True          # Cho phép chia nhỏ chunk (recursive) khi bị cắt / bad translation
+    supports_streaming = False     # Có open_stream / parse_stream_event
+
+    def __init__(self, api_key, model_name, model_settings=None, is_bad=None):
+        """
+        Args:
+            api_key: API key (str)
+            model_name: Tên model
+            model_settings: Cài đặt model
+            is_bad: Callable(text, source_text) -> bool, kiểm tra chất lượng bản dịch (is_bad_translation)
+        """
+        self.api_key = api_key
+        self.model_name = model_name
+        self.model_settings = model_settings or {}
+        self.is_bad = is_bad or (lambda text, source_text: not (text or "").strip())
+        self.use_prompt_cache = False
+        self.cache_handle = None   # CacheHandle của prefix (provider có context caching phía server)
+
+    def setup(self, system_instruction, use_prompt_cache=False):
+        """Chuẩn bị trước khi dịch (tạo client/model). Raise ImportError nếu thiếu thư viện."""
+        self.use_prompt_cache = use_prompt_cache
+
+    def get_cache_manager(self):
+        """PromptCacheManager giữ cache handles của provider"""
+        return get_prompt_cache_manager()
+
+    def split_prompt(self, system_instruction, chunk_lines, prompt_context=None):
+        """
+        Returns (prefix, chunk_prompt): prefix cố định (system_instruction không kèm tiêu đề
+        "Văn bản cần dịch:") để provider cache được, chunk_prompt gồm glossary / bản dịch
+        tham khảo + tiêu đề + văn bản của chunk.
+        """
+        prefix, text_header = split_text_header(system_instruction)
+        return prefix, build_chunk_prompt("\n".join(chunk_lines), prompt_context, text_header)
+
+    def build_request(self, system_instruction, chunk_lines, context="modern", prompt_context=None):
+        raise NotImplementedError
+
+    def send(self, request):
+        """Gửi request, trả về raw response. Lỗi API raise Exception (message chứa status code)."""
+        raise NotImplementedError
+
+    def parse(self, raw):
+        """Returns: ProviderResponse"""
+        raise NotImplementedError
+
+    def open_stream(self, request, guard):
+        """Mở streaming request, trả về iterable các event (có close() để hủy sớm)"""
+        raise NotImplementedError
+
+    def parse_stream_event(self, event, response):
+        """Cập nhật response (usage, finish_reason, blocked) từ một event, trả về đoạn text mới"""
+        raise NotImplementedError
+
+    def translate_chunk(self, system_instruction, chunk_lines, context="modern", stream_config=None, prompt_context=None):
+        """
+        Dịch một chunk. Returns (translated_text, is_safety_blocked, is_bad) như các hàm translate_chunk cũ.
+        Lỗi API được raise dưới dạng exception để process_chunk phân loại qua classify_error.
+        """
+        source_text = "\n".join(chunk_lines)
+        if not source_text.strip():
+            return ("", False, False)
+        request = self.build_request(system_instruction, chunk_lines, context, prompt_context)
+        try:
+            return self._translate_request(request, source_text, stream_config)
+        except Exception as e:
+            if self.cache_handle is None or not is_cache_miss_error(e):
+                raise
+            # Cache bị xóa / hết hạn phía server: bỏ handle, tạo cache mới và gửi lại một lần
+            print(f"⚠️ Prompt cache {self.cache_handle.name} không còn trên server - tạo lại")
+            self.get_cache_manager().invalidate(self.cache_handle)
+            self.setup(system_instruction, self.use_prompt_cache)
+            request = self.build_request(system_instruction, chunk_lines, context, prompt_context)
+            return self._translate_request(request, source_text, stream_config)
+
+    def _translate_request(self, request, source_text, stream_config=None):
+        if stream_config and self.supports_streaming:
+            # Streaming: đọc tokens khi về, hủy sớm nếu timeout/refusal/runaway (watchdog của iter_guarded)
+            guard = create_stream_guard(stream_config, source_text)
+            response = ProviderResponse()
+            try:
+                for event in iter_guarded(lambda: self.open_stream(request, guard), guard):
+                    guard.feed(self.parse_stream_event(event, response))
+            except StreamAborted as e:
+                print(f"⏹️ Hủy stream sớm: {e.reason} (đã nhận {len(e.partial_text)} ký tự)")
+                return (f"[STREAM BỊ HỦY SỚM: {e.reason}]", False, True)
+            response.text = guard.text
+        else:
+            response = self.parse(self.send(request))
+        return self.finish(response, source_text)
+
+    def finish(self, response, source_text):
+        """Ghi usage và chuyển ProviderResponse thành (translated_text, is_safety_blocked, is_bad)"""
+        self.report_usage(response.prompt_tokens, response.completion_tokens, response.cached_tokens)
+        if self.use_prompt_cache:
+            self.get_cache_manager().record_usage(response.prompt_tokens, response.cached_tokens)
+        if response.blocked:
+            return (response.blocked, True, False)
+        if response.finish_reason == "length":
+            # Đánh dấu bad để process_chunk chia nhỏ chunk
+            print(f"⚠️ {self.name}: response bị cắt do vượt quá max_tokens")
+            return (response.text + " [BỊ CẮT - CẦN CHUNK NHỎ HƠN]", False, True)
+        return (response.text, False, self.is_bad(response.text, source_text))
+
+    def classify_error(self, error_message):
+        """Phân loại lỗi (ERROR_*) để process_chunk quyết định retry / chia nhỏ / dừng"""
+        if check_openrouter_quota_error(error_message):
+            return ERROR_QUOTA
+        if check_openrouter_api_key_error(error_message):
+            return ERROR_AUTH
+        if check_openrouter_rate_limit_error(error_message):
+            return ERROR_RATE_LIMIT
+        if check_openrouter_moderation_error(error_message):
+            return ERROR_MODERATION
+        if check_openrouter_timeout_error(error_message):
+            return ERROR_TIMEOUT
+        if check_openrouter_service_error(error_message):
+            return ERROR_SERVICE
+        if check_context_length_error(error_message):
+            return ERROR_CONTEXT_LENGTH
+        return ERROR_OTHER
+
+    def report_usage(self, prompt_tokens=0, completion_tokens=0, cached_tokens=0):
+        with _usage_lock:
+            stats = _usage_stats.setdefault(self.name, {
+                "requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0
+            })
+            stats["requests"] += 1
+            stats["prompt_tokens"] += int(prompt_tokens or 0)
+            stats["completion_tokens"] += int(completion_tokens or 0)
+            stats["cached_tokens"] += int(cached_tokens or 0)
+
+    def validate(self):
+        """Kiểm tra key/endpoint trước khi dịch. Returns (is_valid, message)."""
+        try:
+            self.setup("Test")
+            text, _, _ = self.translate_chunk("Reply with OK.", ["Test"])
+            return True, f"{self.name} hợp lệ"
+        except Exception as e:
+            return False, f"Lỗi {self.name}: {e}"
+
+
+def iter_sse_events(response):
+    """
+    Đọc Server-Sent Events từ streaming response (/chat/completions với stream=True).
+    Yield dict (payload JSON) cho mỗi event, hoặc None cho keep-alive comment
+    (": OPENROUTER PROCESSING") để caller kiểm tra timeout.
+    """
+    for raw_line in response.iter_lines(decode_unicode=True):
+        if raw_line is None:
+            continue
+        line = raw_line.strip() if isinstance(raw_line, str) else raw_line.decode('utf-8', errors='replace').strip()
+        if not line or line.startswith(':'):
+            yield None  # keep-alive
+            continue
+        if not line.startswith('data:'):
+            continue
+        data = line[5:].strip()
+        if data == '[DONE]':
+            return
+        try:
+            yield json.loads(data)
+        except json.JSONDecodeError:
+            continue
+
+
+class SSEStream:
+    """Iterable các SSE event; close() đóng HTTP response để thread đọc thoát khi hủy sớm"""
+
+    def __init__(self, response):
+        self.response = response
+
+    def __iter__(self):
+        return iter_sse_events(self.response)
+
+    def close(self):
+        self.response.close()
+
+
+# Session HTTP dùng chung theo base_url: giữ kết nối keep-alive, đủ connection cho mọi thread
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_session(base_url, pool_size):
+    import requests
+    from requests.adapters import HTTPAdapter
+    with _sessions_lock:
+        session = _sessions.get(base_url)
+        if session is None:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[base_url] = session
+        return session
+
+
+class OpenAICompatibleProvider(BaseProvider):
+    """
+    Endpoint OpenAI-compatible (/v1/chat/completions) - server inference tự host.
+
+    Các request song song (mỗi thread một chunk) đi qua một session HTTP dùng chung với
+    connection pool đủ lớn, nên server có continuous batching (vLLM, llama.cpp --parallel,
+    TGI) gom chúng vào cùng một batch thay vì nhận từng request qua kết nối mới.
+
+    Keys hỗ trợ trong model_settings:
+        base_url: ví dụ "http://localhost:8080/v1" (bắt buộc)
+        request_timeout: giây (mặc định 300 - server CPU chậm)
+        max_connections: số kết nối giữ tới server (mặc định 32, nên >= số thread)
+        temperature, top_p, max_tokens: tham số sinh
+        extra_body: dict thêm vào payload (tham số riêng của server)
+    """
+
+    name = "OpenAI Compatible"
+    supports_streaming = True
+
+    def __init__(self, api_key, model_name, model_settings=None, is_bad=None):
+        super().__init__(api_key, model_name, model_settings, is_bad)
+        self.base_url = (self.model_settings.get("base_url") or "http://localhost:8080/v1").rstrip("/")
+        self.timeout = float(self.model_settings.get("request_timeout", 300))
+        self.max_connections = int(self.model_settings.get("max_connections", 32))
+        self.name = f"{self.name} ({self.base_url})"
+
+    def build_headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def request_timeout(self, request):
+        """Timeout (giây) cho request không streaming"""
+        return self.timeout
+
+    def build_request(self, system_instruction, chunk_lines, context="modern", prompt_context=None):
+        # Tiêu đề "Văn bản cần dịch:" chuyển sang message user, sau glossary / bản dịch tham khảo
+        system_prefix, user_text = self.split_prompt(system_instruction, chunk_lines, prompt_context)
+        messages = []
+        if system_prefix:
+            messages.append({"role": "system", "content": system_prefix})
+        messages.append({"role": "user", "content": user_text})
+
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "temperature": self.model_settings.get("temperature", 0.3),
+            "top_p": self.model_settings.get("top_p", 1.0),
+            "max_tokens": self.model_settings.get("max_tokens", 8000),
+            "stream": False,
+        }
+        payload.update(self.model_settings.get("extra_body") or {})
+        return payload
+
+    def _post(self, payload, timeout, stream=False):
+        import requests
+        session = _get_session(self.base_url, self.max_connections)
+        try:
+            response = session.post(f"{self.base_url}/chat/completions", headers=self.build_headers(),
+                                    json=payload, timeout=timeout, stream=stream)
+        except requests.exceptions.Timeout as e:
+            raise Exception(f"Request timeout: {e}")
+        except requests.exceptions.ConnectionError as e:
+            # Server đang khởi động lại / quá tải - classify_error xếp vào ERROR_SERVICE để retry
+            raise Exception(f"Service unavailable (connection error): {e}")
+        if response.status_code != 200:
+            # Status code nằm trong message để classify_error nhận diện (429, 503...)
+            try:
+                raise Exception(f"HTTP {response.status_code}: {response.text[:500]}")
+            finally:
+                response.close()
+        return response
+
+    def send(self, request):
+        response = self._post(request, self.request_timeout(request))
+        try:
+            return response.json()
+        except json.JSONDecodeError:
+            raise Exception(f"Response không phải JSON: {response.text[:200]}")
+
+    def open_stream(self, request, guard):
+        # TTFT / idle do guard kiểm tra; socket read timeout chỉ là backstop
+        timeout = (10, guard.read_timeout) if guard.read_timeout else self.request_timeout(request)
+        # include_usage: server gửi usage (kể cả cached_tokens) trong event cuối của stream
+        payload = dict(request, stream=True, stream_options={"include_usage": True})
+        return SSEStream(self._post(payload, timeout, stream=True))
+
+    def _read_usage(self, raw, response):
+        usage = raw.get("usage")
+        if usage:
+            details = usage.get("prompt_tokens_details") or {}
+            response.prompt_tokens = usage.get("prompt_tokens", 0)
+            response.completion_tokens = usage.get("completion_tokens", 0)
+            response.cached_tokens = details.get("cached_tokens", 0)
+
+    def _raise_error(self, raw):
+        if "error" in raw:
+            error = raw["error"]
+            raise Exception(error.get("message", str(error)) if isinstance(error, dict) else str(error))
+
+    def parse(self, raw):
+        self._raise_error(raw)
+        response = ProviderResponse()
+        self._read_usage(raw, response)
+        choices = raw.get("choices") or []
+        if not choices or "content" not in (choices[0].get("message") or {}):
+            response.blocked = "[KHÔNG CÓ KẾT QUẢ DỊCH]"
+            return response
+        response.text = choices[0]["message"]["content"] or ""
+        response.finish_reason = choices[0].get("finish_reason")
+        return response
+
+    def parse_stream_event(self, event, response):
+        if event is None:
+            return ""  # keep-alive
+        self._raise_error(event)
+        self._read_usage(event, response)
+        choices = event.get("choices") or []
+        if not choices:
+            return ""
+        if choices[0].get("finish_reason"):
+            response.finish_reason = choices[0]["finish_reason"]
+        return (choices[0].get("delta") or {}).get("content") or ""
+
+
+class LocalCacheProvider(BaseProvider):
+    """
+    Provider offline có context caching: PromptCacheManager(LocalCacheBackend()) giữ prefix,
+    response là văn bản gốc gắn [LOCAL]. Dùng để kiểm tra cache hit / hết hạn / tạo lại
+    và số tokens tiết kiệm mà không cần mạng (model_settings["prompt_cache"] = True).
+    """
+
+    name = "Local Cache"
+
+    def get_cache_manager(self):
+        return get_local_cache_manager()
+
+    def setup(self, system_instruction, use_prompt_cache=False):
+        super().setup(system_instruction, use_prompt_cache)
+        self.cache_handle = None
+        if use_prompt_cache:
+            prefix, _ = split_text_header(system_instruction)
+            self.cache_handle = self.get_cache_manager().get(self.model_name, self.api_key, prefix)
+
+    def build_request(self, system_instruction, chunk_lines, context="modern", prompt_context=None):
+        prefix, chunk_prompt = self.split_prompt(system_instruction, chunk_lines, prompt_context)
+        return {
+            "prefix": prefix,
+            "suffix": chunk_prompt,
+            "text": "\n".join(chunk_lines),
+            "cache_name": self.cache_handle.name if self.cache_handle is not None else None,
+        }
+
+    def send(self, request):
+        backend = self.get_cache_manager().backend
+        return f"[LOCAL] {request['text']}", backend.request_usage(request["prefix"], request["suffix"], request["cache_name"])
+
+    def parse(self, raw):
+        text, usage = raw
+        return ProviderResponse(text, "stop", prompt_tokens=usage["prompt_tokens"], cached_tokens=usage["cached_tokens"])
+
+
+# Registry: tên provider -> class
+_PROVIDERS = {
+    "OpenAI Compatible": OpenAICompatibleProvider,
+    "Local Cache": LocalCacheProvider,
+}
+
+
+def register_provider(name, provider_class):
+    """Đăng ký provider mới (tên hiển thị trong model_settings / provider router)"""
+    _PROVIDERS[name] = provider_class
+
+
+def get_provider_names():
+    return list(_PROVIDERS)
+
+
+def create_provider(provider, api_key, model_name, model_settings=None, is_bad=None):
+    """
+    Tạo provider instance theo tên. Returns None nếu provider chưa được đăng ký.
+    """
+    provider_class = _PROVIDERS.get(provider)
+    if provider_class is None:
+        return None
+    return provider_class(api_key, model_name, model_settings, is_bad=is_bad)
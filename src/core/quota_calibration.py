@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Calibrate rate limit thực tế bằng cách gửi burst requests có kiểm soát
+
+Bảng RPM/TPM theo tên model trong get_enhanced_rate_limiter chỉ là giá trị
+tài liệu; limit thực tế khác nhau theo tài khoản/tier và Google tính free tier
+theo PROJECT (nhiều key cùng project chia chung RPM). Tool này đo:
+
+1. RPM: burst tới max_rpm requests nhỏ trên 1 key, đếm số request OK trước khi bị 429
+2. Phạm vi limit: burst đồng thời trên nhiều key - tổng OK ≈ RPM (chia chung,
+   "project") hay ≈ RPM × số key (độc lập, "key")
+3. TPM (tùy chọn): burst các request lớn, tổng tokens OK trước khi bị 429
+
+Giữa các pha đợi hết cửa sổ 60s. RPD không đo (sẽ đốt quota cả ngày) - vẫn dùng bảng.
+Kết quả ghi vào rate_limits_profile.json trong thư mục cấu hình của người dùng
+(hoặc file chỉ định qua model_settings["limits_profile"] / --output),
+get_enhanced_rate_limiter đọc file này thay cho bảng tĩnh.
+"""
+
+import os
+import json
+import time
+import threading
+import concurrent.futures
+
+try:
+    from .clock import SYSTEM_CLOCK
+    from .key_validation import user_config_dir
+    from .providers import create_provider, ERROR_RATE_LIMIT, ERROR_QUOTA, ERROR_AUTH
+except ImportError:
+    from clock import SYSTEM_CLOCK
+    from key_validation import user_config_dir
+    from providers import create_provider, ERROR_RATE_LIMIT, ERROR_QUOTA, ERROR_AUTH
+
+
+PROFILE_FILE_NAME = "rate_limits_profile.json"
+PROFILE_VERSION = 1
+RATE_LIMIT_WINDOW_SECONDS = 60    # Cửa sổ RPM/TPM
+
+STATUS_OK = "ok"
+STATUS_LIMITED = "limited"    # 429 / hết quota trong cửa sổ
+STATUS_AUTH = "auth"          # Key không hợp lệ - bỏ qua key
+STATUS_ERROR = "error"        # Lỗi khác (mạng, 5xx...) - không tính vào limit
+
+SCOPE_PROJECT = "project"
+SCOPE_KEY = "key"
+SCOPE_UNKNOWN = "unknown"
+
+
+def default_profile_path():
+    """File profile mặc định - không phụ thuộc thư mục đang chạy (GUI / CLI dùng chung)"""
+    return os.path.join(user_config_dir(), PROFILE_FILE_NAME)
+
+
+def _profile_key(provider, model_name):
+    return f"{provider}::{model_name}"
+
+
+def build_probe_prompt(tokens):
+    """Prompt ngắn (tokens <= 0) hoặc được độn tới ~tokens tokens (~4 ký tự/token)"""
+    prompt = "Reply with OK."
+    if tokens and tokens > 0:
+        prompt += "\n" + ("lorem ipsum " * (tokens * 4 // 12 + 1))
+    return prompt
+
+
+def make_google_probe(model_name, timeout=60):
+    """
+    Probe Google AI qua REST (generateContent, 1 output token).
+    Không dùng genai.configure vì nó là cấu hình global - không an toàn khi nhiều key gửi đồng thời.
+    """
+    model_path = model_name if model_name.startswith("models/") else f"models/{model_name}"
+    url = f"https://generativelanguage.googleapis.com/v1beta/{model_path}:generateContent"
+
+    def probe(api_key, prompt):
+        import requests
+        try:
+            response = requests.post(url, headers={"x-goog-api-key": api_key}, timeout=timeout, json={
+                "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                "generationConfig": {"maxOutputTokens": 1},
+            })
+        except Exception as e:
+            return STATUS_ERROR, 0, str(e)
+        if response.status_code == 200:
+            usage = (response.json() or {}).get("usageMetadata", {})
+            return STATUS_OK, int(usage.get("promptTokenCount", 0)), ""
+        if response.status_code == 429:
+            return STATUS_LIMITED, 0, response.text[:300]
+        if response.status_code in (400, 401, 403) and "key" in response.text.lower():
+            return STATUS_AUTH, 0, response.text[:300]
+        return STATUS_ERROR, 0, f"HTTP {response.status_code}: {response.text[:300]}"
+
+    return probe
+
+
+def make_provider_probe(provider, model_name, model_settings=None):
+    """Probe qua provider interface (build_request/send) - OpenAI Compatible, Mock..."""
+
+    def probe(api_key, prompt):
+        provider_impl = create_provider(provider, api_key, model_name, model_settings)
+        try:
+            provider_impl.setup("Reply with OK.")
+            provider_impl.send(provider_impl.build_request("Reply with OK.", [prompt]))
+            return STATUS_OK, max(1, len(prompt) // 4), ""
+        except NotImplementedError:
+            raise ValueError(f"Provider {provider} không hỗ trợ calibration (không có build_request/send)")
+        except Exception as e:
+            kind = provider_impl.classify_error(str(e))
+            if kind in (ERROR_RATE_LIMIT, ERROR_QUOTA):
+                return STATUS_LIMITED, 0, str(e)
+            if kind == ERROR_AUTH:
+                return STATUS_AUTH, 0, str(e)
+            return STATUS_ERROR, 0, str(e)
+
+    return probe
+
+
+def make_probe(provider, model_name, model_settings=None):
+    if provider == "Google AI":
+        return make_google_probe(model_name)
+    return make_provider_probe(provider, model_name, model_settings)
+
+
+def run_burst(probe, keys, per_key, prompt, concurrency=16):
+    """
+    Gửi per_key requests cho mỗi key, đan xen giữa các key, đồng thời.
+
+    Returns:
+        List[(key, status, tokens, error)]
+    """
+    jobs = [key for _ in range(per_key) for key in keys]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(jobs)))) as executor:
+        futures = [(key, executor.submit(probe, key, prompt)) for key in jobs]
+        return [(key,) + tuple(future.result()) for key, future in futures]
+
+
+def _count(results, status, key=None):
+    return sum(1 for r in results if r[1] == status and (key is None or r[0] == key))
+
+
+def calibrate_limits(probe, keys, max_rpm=60, tpm_probe_tokens=0, max_scope_keys=3,
+                     window_seconds=RATE_LIMIT_WINDOW_SECONDS, concurrency=16, clock=SYSTEM_CLOCK, log=print):
+    """
+    Đo RPM, phạm vi limit (per-key / per-project) và TPM.
+
+    Args:
+        probe: Callable(api_key, prompt) -> (status, prompt_tokens, error)
+        keys: Danh sách API keys (>= 2 key để xác định phạm vi)
+        max_rpm: Số request tối đa của burst đo RPM (nên lớn hơn RPM dự kiến)
+        tpm_probe_tokens: Số tokens mỗi request khi đo TPM (0 = bỏ qua pha TPM)
+        window_seconds: Cửa sổ rate limit (đợi giữa các pha)
+
+    Returns:
+        Dict kết quả (rpm, rpm_exact, scope, tpm, tpm_exact, ...)
+    """
+    if not keys:
+        raise ValueError("Cần ít nhất 1 API key để calibrate")
+
+    requests_used = 0
+
+    def wait_window(reason):
+        log(f"⏳ Đợi {window_seconds}s để cửa sổ rate limit reset ({reason})...")
+        clock.sleep(window_seconds + 1)
+
+    # Pha 1: RPM trên key đầu tiên
+    wait_window("trước khi đo RPM")
+    log(f"📐 Pha 1: burst {max_rpm} requests trên key #1...")
+    results = run_burst(probe, keys[:1], max_rpm, build_probe_prompt(0), concurrency)
+    requests_used += len(results)
+    if _count(results, STATUS_AUTH):
+        raise ValueError(f"Key #1 không hợp lệ: {next(r[3] for r in results if r[1] == STATUS_AUTH)[:200]}")
+    rpm = _count(results, STATUS_OK)
+    rpm_exact = _count(results, STATUS_LIMITED) > 0
+    errors = _count(results, STATUS_ERROR)
+    if rpm_exact:
+        log(f"   ✅ RPM hiệu dụng: {rpm} (bị 429 sau {rpm} requests)")
+    else:
+        log(f"   ⚠️ Không chạm limit sau {rpm} requests - RPM >= {rpm} (tăng --max-rpm để đo chính xác)")
+    if errors:
+        log(f"   ⚠️ {errors} requests lỗi khác (không tính vào limit)")
+
+    # Pha 2: phạm vi limit - burst đồng thời trên nhiều key, mỗi key gửi đủ 1 RPM
+    scope = SCOPE_UNKNOWN
+    scope_keys = keys[:max_scope_keys]
+    if len(scope_keys) >= 2 and rpm_exact and rpm > 0:
+        wait_window("trước khi đo phạm vi limit")
+        log(f"📐 Pha 2: burst {rpm} requests × {len(scope_keys)} keys đồng thời...")
+        results = run_burst(probe, scope_keys, rpm, build_probe_prompt(0), concurrency)
+        requests_used += len(results)
+        valid_keys = [k for k in scope_keys if not _count(results, STATUS_AUTH, k)]
+        total_ok = _count(results, STATUS_OK)
+        for i, key in enumerate(scope_keys, 1):
+            log(f"   🔑 Key #{i}: {_count(results, STATUS_OK, key)} OK, {_count(results, STATUS_LIMITED, key)} × 429")
+        if len(valid_keys) >= 2:
+            # Độc lập: tổng OK ≈ rpm × số key; chia chung: tổng OK ≈ rpm
+            scope = SCOPE_KEY if total_ok >= rpm * (1 + (len(valid_keys) - 1) / 2.0) else SCOPE_PROJECT
+            log(f"   ✅ Tổng OK {total_ok} / {rpm * len(valid_keys)} → limit tính theo "
+                f"{'TỪNG KEY (độc lập)' if scope == SCOPE_KEY else 'PROJECT (chia chung)'}")
+    elif len(scope_keys) < 2:
+        log("ℹ️ Chỉ có 1 key - bỏ qua pha đo phạm vi limit")
+
+    # Pha 3: TPM - request lớn, ít hơn RPM để không bị giới hạn bởi RPM
+    tpm, tpm_exact = None, False
+    if tpm_probe_tokens and tpm_probe_tokens > 0:
+        wait_window("trước khi đo TPM")
+        count = max(1, (rpm if rpm_exact else max_rpm) - 1)
+        log(f"📐 Pha 3: burst {count} requests × ~{tpm_probe_tokens:,} tokens trên key #1...")
+        results = run_burst(probe, keys[:1], count, build_probe_prompt(tpm_probe_tokens), concurrency)
+        requests_used += len(results)
+        tpm = sum(r[2] for r in results if r[1] == STATUS_OK)
+        tpm_exact = _count(results, STATUS_LIMITED) > 0
+        if tpm_exact:
+            log(f"   ✅ TPM hiệu dụng: {tpm:,} tokens/phút")
+        else:
+            log(f"   ⚠️ Không chạm limit - TPM >= {tpm:,} tokens/phút")
+
+    return {
+        "rpm": rpm,
+        "rpm_exact": rpm_exact,
+        "scope": scope,
+        "tpm": tpm,
+        "tpm_exact": tpm_exact,
+        "keys_probed": len(scope_keys) if scope != SCOPE_UNKNOWN else 1,
+        "requests_used": requests_used,
+        "calibrated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def load_limits_profile(path=None):
+    """Đọc toàn bộ profile ({"version", "limits": {provider::model: entry}})"""
+    path = path or default_profile_path()
+    if not os.path.exists(path):
+        return {"version": PROFILE_VERSION, "limits": {}}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        data.setdefault("limits", {})
+        return data
+    except (ValueError, OSError) as e:
+        print(f"⚠️ Không thể đọc limits profile {path}: {e}")
+        return {"version": PROFILE_VERSION, "limits": {}}
+
+
+def save_limits_profile(provider, model_name, result, path=None):
+    """Ghi/cập nhật entry của provider + model vào profile (giữ các entry khác)"""
+    path = path or default_profile_path()
+    data = load_limits_profile(path)
+    data["version"] = PROFILE_VERSION
+    data["limits"][_profile_key(provider, model_name)] = dict(result, provider=provider, model=model_name)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+    with _profile_lock:
+        global _active_profile
+        _profile_cache.clear()
+        _active_profile = None
+    return path
+
+
+_profile_cache = {}
+_profile_lock = threading.Lock()
+# Profile của lần dịch hiện tại (activate_limits_profile) - không stat/đọc lại file mỗi chunk
+_active_profile = None
+
+
+def activate_limits_profile(path=None):
+    """
+    Đọc profile một lần khi bắt đầu dịch; get_calibrated_limits (không truyền path) dùng
+    bản này cho tới lần gọi kế tiếp.
+
+    Args:
+        path: File profile (model_settings["limits_profile"]), None = default_profile_path()
+    """
+    global _active_profile
+    profile = load_limits_profile(path)
+    with _profile_lock:
+        _active_profile = profile
+    return profile
+
+
+def get_calibrated_limits(provider, model_name, path=None):
+    """
+    Limits đã calibrate cho provider + model (profile của lần dịch hiện tại nếu đã
+    activate_limits_profile, nếu không thì cache theo mtime của file).
+
+    Returns:
+        Dict entry (rpm, rpm_exact, scope, tpm, tpm_exact, ...) hoặc None nếu chưa calibrate
+    """
+    with _profile_lock:
+        profile = _active_profile if path is None else None
+    if profile is None:
+        path = path or default_profile_path()
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        with _profile_lock:
+            cached = _profile_cache.get(path)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, load_limits_profile(path))
+                _profile_cache[path] = cached
+        profile = cached[1]
+    entry = profile["limits"].get(_profile_key(provider, model_name))
+    if not entry or not entry.get("rpm"):
+        return None
+    return entry
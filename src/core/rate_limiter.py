@@ -11,6 +11,11 @@ import threading
 from collections import deque
 from datetime import datetime, timedelta
 
+try:
+    from .clock import SYSTEM_CLOCK
+except ImportError:
+    from clock import SYSTEM_CLOCK
+
 
 class MultiThreadRateLimiter:
     """
@@ -27,14 +32,16 @@ class MultiThreadRateLimiter:
     - Non-blocking acquire cho multi-threading
     """
     
-    def __init__(self, requests_per_minute=10, window_seconds=60):
+    def __init__(self, requests_per_minute=10, window_seconds=60, clock=None):
         """
         Initialize rate limiter
         
         Args:
             requests_per_minute: Số requests tối đa mỗi phút
             window_seconds: Kích thước cửa sổ thời gian (mặc định 60s)
+            clock: Đồng hồ (mặc định SYSTEM_CLOCK; VirtualClock cho simulator)
         """
+        self.clock = clock or SYSTEM_CLOCK
         self.base_max_requests = requests_per_minute
         self.max_requests = requests_per_minute
         self.window_seconds = window_seconds
@@ -58,7 +65,7 @@ class MultiThreadRateLimiter:
         
         while attempt < max_attempts:
             with self.lock:
-                now = datetime.now()
+                now = self.clock.now()
                 self._cleanup_old_requests(now)
                 
                 # Kiểm tra xem có slot available không
@@ -88,22 +95,22 @@ class MultiThreadRateLimiter:
                 if attempt == 0:  # Chỉ log lần đầu
                     print(f"🚦 Thread {thread_id}: Rate limit, đợi {actual_sleep:.1f}s...")
                 
-                time.sleep(actual_sleep)
+                self.clock.sleep(actual_sleep)
             else:
                 # Ngắn sleep để tránh busy waiting
-                time.sleep(0.1)
+                self.clock.sleep(0.1)
             
             attempt += 1
         
         # Fallback: nếu không get được slot sau max_attempts
         print(f"⚠️ Thread {threading.current_thread().ident}: Fallback acquire after {max_attempts} attempts")
         with self.lock:
-            self.requests.append(datetime.now())
+            self.requests.append(self.clock.now())
     
     def _calculate_wait_time(self):
         """Tính wait time mà không block threads khác"""
         with self.lock:
-            now = datetime.now()
+            now = self.clock.now()
             self._cleanup_old_requests(now)
             
             if len(self.requests) < self.max_requests:
@@ -123,7 +130,7 @@ class MultiThreadRateLimiter:
     def get_current_usage(self):
         """Get current number of requests in the window"""
         with self.lock:
-            now = datetime.now()
+            now = self.clock.now()
             self._cleanup_old_requests(now)
             return len(self.requests)
     
@@ -135,7 +142,7 @@ class MultiThreadRateLimiter:
         """Gọi khi gặp rate limit error để adaptive throttling"""
         with self.lock:
             self.consecutive_errors += 1
-            self.last_error_time = datetime.now()
+            self.last_error_time = self.clock.now()
             
             # Giảm throttle factor
             if self.consecutive_errors == 1:
@@ -157,7 +164,7 @@ class MultiThreadRateLimiter:
         with self.lock:
             if self.consecutive_errors > 0:
                 # Chỉ recovery sau 30s không có lỗi
-                if self.last_error_time and (datetime.now() - self.last_error_time).total_seconds() > 30:
+                if self.last_error_time and (self.clock.now() - self.last_error_time).total_seconds() > 30:
                     self.consecutive_errors = max(0, self.consecutive_errors - 1)
                     
                     # Tăng dần throttle factor
@@ -287,7 +294,7 @@ def clear_rate_limiters():
 
 
 # Exponential backoff cho retry khi gặp rate limit errors
-def exponential_backoff_sleep(retry_count: int, base_delay: float = 1.0, max_delay: float = 60.0):
+def exponential_backoff_sleep(retry_count: int, base_delay: float = 1.0, max_delay: float = 60.0, clock=None):
     """
     Sleep với exponential backoff
     
@@ -295,10 +302,11 @@ def exponential_backoff_sleep(retry_count: int, base_delay: float = 1.0, max_del
         retry_count: Số lần retry hiện tại (0-indexed)
         base_delay: Delay cơ bản (giây)
         max_delay: Delay tối đa (giây)
+        clock: Đồng hồ (mặc định SYSTEM_CLOCK)
     """
     delay = min(base_delay * (2 ** retry_count), max_delay)
     print(f"⏱️ Exponential backoff: đợi {delay:.1f}s (retry #{retry_count + 1})")
-    time.sleep(delay)
+    (clock or SYSTEM_CLOCK).sleep(delay)
 
 
 def is_rate_limit_error(error_message: str) -> bool:
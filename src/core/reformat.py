@@ -1,13 +1,103 @@
 import re
 import os
 
+REFORMAT_BLOCK_SIZE = 1024 * 1024  # Đọc file theo block 1M ký tự khi reformat file có sẵn
+
+_BLANK_RUN_PATTERN = re.compile(r'\n{3,}')
+
+
+class StreamingReformatter:
+    """
+    Reformat dạng stream, áp dụng cho từng chunk ngay khi ghi ra file:
+    1. Xóa các ký tự ** (markdown bold markers)
+    2. Thay 3+ ký tự xuống dòng liên tiếp bằng \n\n (kể cả khi chuỗi xuống dòng
+       nằm vắt qua ranh giới giữa hai chunk)
+    3. Bỏ khoảng trắng thừa ở đầu/cuối file, kết thúc bằng đúng một \n (finish())
+
+    Kết quả nối lại giống hệt fix_text_format chạy trên toàn bộ file, nhưng bộ nhớ
+    chỉ O(chunk): phần chưa chắc chắn (khoảng trắng cuối chunk, chuỗi * cuối chunk)
+    được giữ lại và ghép vào chunk sau.
+    """
+
+    def __init__(self, started=False, held="", stars=""):
+        """
+        Args:
+            started: Đã ghi nội dung (khác khoảng trắng) ra file chưa
+            held: Khoảng trắng cuối chunk trước, chưa ghi
+            stars: Chuỗi * cuối chunk trước, chưa ghi (có thể ghép với * đầu chunk sau)
+        """
+        self.started = started
+        self.held = held
+        self.stars = stars
+        self.bold_markers = 0
+        self.blank_runs = 0
+        self.chars_in = 0
+        self.chars_out = 0
+
+    def _emit(self, text):
+        text = self.held + text
+        body = text.rstrip()
+        self.held = text[len(body):]
+        body, runs = _BLANK_RUN_PATTERN.subn('\n\n', body)
+        self.blank_runs += runs
+        if not self.started:
+            body = body.lstrip()
+            self.started = bool(body)
+        self.chars_out += len(body)
+        return body
+
+    def feed(self, text):
+        """Nhận một chunk, trả về phần text đã reformat có thể ghi ngay"""
+        self.chars_in += len(text)
+        text = self.stars + text
+        body = text.rstrip('*')
+        self.stars = text[len(body):]
+        self.bold_markers += body.count('**')
+        return self._emit(body.replace('**', ''))
+
+    def finish(self):
+        """Phần text cuối cùng (phần * còn lẻ + \n kết thúc file)"""
+        self.bold_markers += self.stars.count('**')
+        tail = self._emit(self.stars.replace('**', ''))
+        self.stars = ""
+        self.held = ""
+        if self.started:
+            tail += '\n'
+            self.chars_out += 1
+        return tail
+
+    def get_state(self):
+        """Trạng thái cần lưu cùng tiến độ để resume"""
+        return {"started": self.started, "held": self.held, "stars": self.stars}
+
+    @classmethod
+    def from_state(cls, state):
+        """Khôi phục từ get_state(); không có state (tiến độ cũ) -> coi như đã ghi nội dung"""
+        if not state:
+            return cls(started=True)
+        return cls(started=bool(state.get("started", True)), held=state.get("held", ""),
+                   stars=state.get("stars", ""))
+
+    def print_stats(self):
+        if self.bold_markers > 0:
+            print(f"🔧 Đã xóa {self.bold_markers} ký tự ** (markdown bold)")
+        if self.blank_runs > 0:
+            print(f"🔧 Đã chuẩn hóa {self.blank_runs} vị trí có 3+ dòng trống")
+        size_diff = self.chars_in - self.chars_out
+        if size_diff > 0 and self.chars_in:
+            print(f"✂️ Đã giảm {size_diff} ký tự ({size_diff / self.chars_in * 100:.1f}%)")
+
+
 def fix_text_format(filepath):
     """
-    Sửa lỗi định dạng file text:
+    Sửa lỗi định dạng file text (dùng cho file có sẵn; khi dịch, translate_file_optimized
+    reformat trực tiếp từng chunk bằng StreamingReformatter):
     1. Thay thế 3 hoặc nhiều hơn ký tự xuống dòng liên tiếp (ví dụ: \n\n\n)
        bằng 2 ký tự xuống dòng liên tiếp (\n\n) để phân cách đoạn đúng chuẩn.
     2. Xóa các ký tự ** (markdown bold markers)
     3. Xử lý path có dấu ngoặc kép
+
+    File được đọc theo block và ghi ra file tạm rồi os.replace (không mất file gốc nếu lỗi giữa chừng).
     """
     # Xử lý path có dấu ngoặc kép
     if filepath.startswith('"') and filepath.endswith('"'):
@@ -24,55 +114,26 @@ def fix_text_format(filepath):
 
     print(f"Đang xử lý file: '{filepath}'...")
 
+    temp_path = filepath + ".reformat.tmp"
     try:
-        # Bước 1: Đọc toàn bộ nội dung file
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        print(f"📊 Kích thước file gốc: {len(content)} ký tự")
-        
-        # Đếm số lượng trước khi xử lý
-        bold_markers_count = content.count('**')
-        newlines_count = len(re.findall(r'\n{3,}', content))
-        
-        # Bước 2: Xóa các ký tự ** (markdown bold markers)
-        # Thay thế ** bằng chuỗi rỗng
-        fixed_content = content.replace('**', '')
-        
-        if bold_markers_count > 0:
-            print(f"🔧 Đã xóa {bold_markers_count} ký tự ** (markdown bold)")
-
-        # Bước 3: Chuẩn hóa xuống dòng
-        # Sử dụng biểu thức chính quy (regex) để tìm kiếm và thay thế:
-        # r'\n{3,}' tìm 3 hoặc nhiều hơn ký tự xuống dòng liên tiếp
-        # '\n\n' sẽ thay thế chúng bằng 2 ký tự xuống dòng liên tiếp
-        fixed_content = re.sub(r'\n{3,}', '\n\n', fixed_content)
-        
-        if newlines_count > 0:
-            print(f"🔧 Đã chuẩn hóa {newlines_count} vị trí có 3+ dòng trống")
-
-        # Bước 4: Loại bỏ các dòng trống thừa ở đầu và cuối file (nếu có)
-        # và đảm bảo kết thúc bằng một dòng trống đúng chuẩn (nếu cần)
-        fixed_content = fixed_content.strip() # Xóa dòng trống đầu/cuối
-        if fixed_content: # Nếu nội dung không rỗng, đảm bảo có một dòng trống cuối cùng (để phân cách đoạn cuối)
-            fixed_content += '\n' # re.sub có thể đã để lại một \n hoặc không, strip() sẽ xóa tất cả.
-                                  # Thêm lại một \n để đảm bảo định dạng file text đúng chuẩn
-                                  # (thường các file text kết thúc bằng một ký tự xuống dòng).
-
-        # Bước 5: Ghi nội dung đã sửa vào file gốc
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(fixed_content)
-
-        # Thống kê
-        size_diff = len(content) - len(fixed_content)
-        print(f"📊 Kích thước file sau reformat: {len(fixed_content)} ký tự")
-        if size_diff > 0:
-            print(f"✂️ Đã giảm {size_diff} ký tự ({size_diff / len(content) * 100:.1f}%)")
-        
+        reformatter = StreamingReformatter()
+        with open(filepath, 'r', encoding='utf-8') as src, open(temp_path, 'w', encoding='utf-8') as dst:
+            while True:
+                block = src.read(REFORMAT_BLOCK_SIZE)
+                if not block:
+                    break
+                dst.write(reformatter.feed(block))
+            dst.write(reformatter.finish())
+        os.replace(temp_path, filepath)
+
+        print(f"📊 Kích thước file: {reformatter.chars_in} -> {reformatter.chars_out} ký tự")
+        reformatter.print_stats()
         print(f"✅ Hoàn tất sửa lỗi định dạng cho file '{os.path.basename(filepath)}'.")
         return True
 
     except Exception as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
         print(f"❌ Đã xảy ra lỗi trong quá trình xử lý: {e}")
         return False
 
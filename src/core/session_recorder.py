@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ghi lại (record) và phát lại (replay) phiên gọi API thật
+
+Record: mỗi lần provider dịch một chunk được ghi thành một dòng JSONL (nén gzip):
+fingerprint nội dung chunk, thời điểm bắt đầu, latency, status code, response
+hoặc lỗi (kèm loại lỗi ERROR_* đã phân loại). Bật bằng model_settings["record_session"].
+Mỗi dòng là một gzip member riêng nên file vẫn đọc được khi process bị kill giữa
+chừng (và khi ghi nối tiếp sau lần bị kill); đọc file bị cắt ngang thì giữ các bản
+ghi đã đọc được.
+
+Replay: provider "Replay" đọc file ghi, trả lại đúng response/lỗi của từng chunk
+(theo thứ tự các lần thử) sau đúng latency gốc, đi qua process_chunk như provider
+thật - dùng để tái hiện một đêm dịch lỗi và benchmark thay đổi scheduler/retry.
+Request không được bắt đầu sớm hơn thời điểm gốc ("t") so với request đầu tiên nên
+mức concurrency của phiên gốc cũng được tái hiện.
+    model_settings = {"replay_path": "book.txt.session.jsonl.gz", "replay_speed": 1.0}
+    translate_file_optimized(..., provider="Replay", model_settings=model_settings)
+
+File ghi cũng đọc được bởi simulator.load_trace (trường "t" và "latency").
+"""
+
+import os
+import re
+import gzip
+import json
+import time
+import zlib
+import hashlib
+import threading
+from collections import deque
+
+try:
+    from .providers import BaseProvider, register_provider, ERROR_OTHER
+except ImportError:
+    from providers import BaseProvider, register_provider, ERROR_OTHER
+
+
+SESSION_FILE_SUFFIX = ".session.jsonl.gz"
+SESSION_FORMAT_VERSION = 1
+
+_STATUS_CODE_PATTERN = re.compile(r'\b([45]\d\d)\b')
+
+
+def chunk_fingerprint(chunk_lines):
+    """Fingerprint nội dung chunk (không gồm system instruction - replay được với prompt khác)"""
+    return hashlib.sha1("\n".join(chunk_lines).encode("utf-8")).hexdigest()[:16]
+
+
+def _key_hash(api_key):
+    return hashlib.md5(str(api_key or "").encode()).hexdigest()[:8]
+
+
+def open_session_file(path, mode="rt"):
+    """Mở file phiên (.gz -> gzip, còn lại JSONL thường)"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    return open(path, mode.replace("t", ""), encoding="utf-8")
+
+
+def _iter_session_lines(path, damaged=None):
+    """
+    Các dòng JSON (chưa parse) của file phiên. File bị cắt ngang (process bị kill khi
+    đang ghi -> thiếu end-of-stream marker của gzip) không làm lỗi: dừng ở chỗ cắt và
+    giữ các dòng đã đọc. damaged: list - thêm True vào nếu file bị cắt ngang.
+    """
+    count = 0
+    with open_session_file(path, "rt") as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    count += 1
+                    yield line
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            print(f"⚠️ File phiên {path} bị cắt ngang ({e}) - dùng {count} dòng đã đọc được")
+            if damaged is not None:
+                damaged.append(True)
+
+
+def iter_session_records(path):
+    """
+    Đọc từng bản ghi (dict) của file phiên; dòng JSON dở dang bị bỏ qua.
+
+    "t" của các phiên ghi nối tiếp (dịch tiếp sau khi dừng) được cộng dồn để tăng dần
+    trên cả file thay vì bắt đầu lại từ 0.
+    """
+    offset = 0.0
+    last_t = None
+    for line in _iter_session_lines(path):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict):
+            continue
+        if record.get("type") == "session" and last_t is not None:
+            offset = last_t
+        t = record.get("t")
+        if isinstance(t, (int, float)):
+            record["t"] = t + offset
+            last_t = record["t"] if last_t is None else max(last_t, record["t"])
+        yield record
+
+
+def repair_session_file(path):
+    """
+    File .gz bị cắt ngang -> ghi lại các dòng đọc được thành gzip hoàn chỉnh (để ghi
+    nối tiếp phía sau vẫn đọc được). Trả về True nếu đã sửa.
+    """
+    if not path.endswith(".gz") or not os.path.exists(path):
+        return False
+    damaged = []
+    lines = list(_iter_session_lines(path, damaged))
+    if not damaged:
+        return False
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        for line in lines:
+            f.write(gzip.compress((line + "\n").encode("utf-8")))
+    os.replace(temp_path, path)
+    return True
+
+
+class SessionRecorder:
+    """Ghi các request của một phiên dịch vào file JSONL.gz (thread-safe)"""
+
+    def __init__(self, path, provider="", model_name=""):
+        self.path = path
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.records = 0
+        self.compress = path.endswith(".gz")
+        if repair_session_file(path):
+            print(f"🛠️ Đã sửa file phiên bị cắt ngang {path} trước khi ghi tiếp")
+        self._file = open(path, "ab")
+        self._write({
+            "type": "session", "version": SESSION_FORMAT_VERSION, "provider": provider,
+            "model": model_name, "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        })
+
+    def _write(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        if self.compress:
+            # Một gzip member / dòng: phần đã ghi luôn là gzip hoàn chỉnh
+            line = gzip.compress(line)
+        with self.lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+
+    def record(self, provider_impl, api_key, chunk_index, chunk_lines, started, latency,
+               result=None, error=None):
+        """Ghi một request: result = (text, is_safety_blocked, is_bad) hoặc error = exception"""
+        record = {
+            "type": "request",
+            "t": round(started - self.start, 4),
+            "latency": round(latency, 4),
+            "fp": chunk_fingerprint(chunk_lines),
+            "chunk": chunk_index,
+            "lines": len(chunk_lines),
+            "key": _key_hash(api_key),
+            "provider": provider_impl.name,
+            "model": provider_impl.model_name,
+        }
+        if error is None:
+            text, is_safety_blocked, is_bad = result
+            record.update(status=200, text=text, blocked=bool(is_safety_blocked), bad=bool(is_bad))
+        else:
+            message = str(error)
+            match = _STATUS_CODE_PATTERN.search(message)
+            record.update(status=int(match.group(1)) if match else 0, error=message,
+                          kind=provider_impl.classify_error(message))
+        self._write(record)
+        with self.lock:
+            self.records += 1
+
+    def wrap(self, provider_impl, chunk_index, api_key):
+        """Bọc provider để mọi lần translate_chunk (kể cả khi chia nhỏ) đều được ghi"""
+        return RecordingProvider(provider_impl, self, chunk_index, api_key)
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def print_stats(self):
+        print(f"\n🎙️ Session recorder: đã ghi {self.records} requests vào {self.path}")
+
+
+class RecordingProvider:
+    """Proxy quanh provider thật: ghi lại timing + kết quả, giữ nguyên hành vi"""
+
+    def __init__(self, inner, recorder, chunk_index, api_key):
+        self._inner = inner
+        self._recorder = recorder
+        self._chunk_index = chunk_index
+        self._api_key = api_key
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def _call(self, chunk_lines, fn):
+        started = time.monotonic()
+        try:
+            result = fn()
+        except Exception as e:
+            self._recorder.record(self._inner, self._api_key, self._chunk_index, chunk_lines,
+                                  started, time.monotonic() - started, error=e)
+            raise
+        self._recorder.record(self._inner, self._api_key, self._chunk_index, chunk_lines,
+                              started, time.monotonic() - started, result=result)
+        return result
+
+    def translate_chunk(self, system_instruction, chunk_lines, context="modern", stream_config=None, prompt_context=None):
+        return self._call(chunk_lines, lambda: self._inner.translate_chunk(
+            system_instruction, chunk_lines, context, stream_config=stream_config, prompt_context=prompt_context))
+
+
+_session_recorder = None
+_session_recorder_lock = threading.Lock()
+
+
+def get_session_recorder():
+    """Recorder của phiên đang chạy (None nếu không ghi)"""
+    return _session_recorder
+
+
+def set_session_recorder(recorder):
+    global _session_recorder
+    with _session_recorder_lock:
+        _session_recorder = recorder
+
+
+def create_session_recorder(model_settings, input_file, provider="", model_name=""):
+    """
+    Tạo SessionRecorder từ model_settings.
+
+    Keys hỗ trợ:
+        record_session: bool - bật ghi phiên (mặc định False)
+        session_record_path: file ghi (mặc định <input>.session.jsonl.gz, ghi nối tiếp)
+
+    Returns:
+        SessionRecorder hoặc None nếu tắt
+    """
+    if not model_settings or not model_settings.get("record_session", False):
+        return None
+    path = model_settings.get("session_record_path") or f"{input_file}{SESSION_FILE_SUFFIX}"
+    try:
+        return SessionRecorder(path, provider, model_name)
+    except OSError as e:
+        print(f"⚠️ Không thể tạo file ghi phiên {path}: {e}")
+        return None
+
+
+class ReplaySession:
+    """Các bản ghi của một file phiên, nhóm theo fingerprint và phát lại theo thứ tự"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.queues = {}       # {fp: deque[record]}
+        self.last_ok = {}      # {fp: record} - dùng lại khi hết bản ghi (scheduler gửi nhiều hơn phiên gốc)
+        self.kinds = {}        # {error message: ERROR_*}
+        self.served = 0
+        self.missing = 0
+        self.first_t = None    # "t" nhỏ nhất trong phiên gốc
+        self.started = None    # Thời điểm (monotonic) replay nhận request đầu tiên
+        for record in iter_session_records(path):
+            if record.get("type") != "request" or "fp" not in record:
+                continue
+            self.queues.setdefault(record["fp"], deque()).append(record)
+            if record.get("error"):
+                self.kinds[record["error"]] = record.get("kind", ERROR_OTHER)
+            t = record.get("t")
+            if isinstance(t, (int, float)) and (self.first_t is None or t < self.first_t):
+                self.first_t = t
+        print(f"▶️ Replay: đã tải {sum(len(q) for q in self.queues.values())} requests "
+              f"({len(self.queues)} chunks) từ {path}")
+
+    def next_record(self, fp):
+        with self.lock:
+            queue = self.queues.get(fp)
+            if queue:
+                record = queue.popleft()
+                if record.get("status") == 200:
+                    self.last_ok[fp] = record
+                self.served += 1
+                return record
+            record = self.last_ok.get(fp)
+            if record is None:
+                self.missing += 1
+            return record
+
+    def arrival_delay(self, record, speed):
+        """Số giây cần chờ để request bắt đầu đúng thời điểm gốc (tính từ request đầu tiên của replay)"""
+        with self.lock:
+            now = time.monotonic()
+            if self.started is None:
+                self.started = now
+            t = record.get("t")
+            if self.first_t is None or not isinstance(t, (int, float)):
+                return 0.0
+            return max(0.0, self.started + (t - self.first_t) * speed - now)
+
+
+_replay_sessions = {}
+_replay_lock = threading.Lock()
+
+
+def get_replay_session(path):
+    with _replay_lock:
+        if path not in _replay_sessions:
+            _replay_sessions[path] = ReplaySession(path)
+        return _replay_sessions[path]
+
+
+def clear_replay_sessions():
+    with _replay_lock:
+        _replay_sessions.clear()
+
+
+class ReplayProvider(BaseProvider):
+    """
+    Provider "Replay": phát lại file phiên đã ghi.
+
+    model_settings:
+        replay_path: file phiên (.session.jsonl.gz)
+        replay_speed: hệ số thời gian chờ (1.0 = thời điểm bắt đầu + latency gốc, 0 = không chờ)
+    """
+
+    name = "Replay"
+
+    def setup(self, system_instruction, use_prompt_cache=False):
+        super().setup(system_instruction, use_prompt_cache)
+        path = self.model_settings.get("replay_path")
+        if not path:
+            raise ImportError("Replay provider cần model_settings['replay_path']")
+        self.session = get_replay_session(path)
+        self.speed = float(self.model_settings.get("replay_speed", 1.0))
+
+    def translate_chunk(self, system_instruction, chunk_lines, context="modern", stream_config=None, prompt_context=None):
+        record = self.session.next_record(chunk_fingerprint(chunk_lines))
+        if record is None:
+            raise RuntimeError("[REPLAY] Không có bản ghi cho chunk này trong file phiên")
+        if self.speed > 0:
+            time.sleep(self.session.arrival_delay(record, self.speed) + record.get("latency", 0.0) * self.speed)
+        if record.get("status") != 200:
+            raise RuntimeError(record.get("error", "Replay error"))
+        return (record.get("text", ""), record.get("blocked", False), record.get("bad", False))
+
+    def classify_error(self, error_message):
+        # Dùng đúng loại lỗi đã phân loại lúc ghi (provider gốc)
+        kind = self.session.kinds.get(error_message) if hasattr(self, "session") else None
+        return kind or super().classify_error(error_message)
+
+    def validate(self):
+        path = self.model_settings.get("replay_path")
+        if not path:
+            return False, "Replay provider cần model_settings['replay_path']"
+        try:
+            get_replay_session(path)
+        except (OSError, ValueError, EOFError) as e:
+            return False, f"Không đọc được file phiên: {e}"
+        return True, "Replay session sẵn sàng"
+
+
+register_provider("Replay", ReplayProvider)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Simulator thời gian ảo cho rate limiter + AdaptiveThreadManager
+
+Phát lại trace request (tổng hợp hoặc ghi lại từ phiên dịch thật) qua
+EnhancedRateLimiter và AdaptiveThreadManager trên VirtualClock:
+cửa sổ RPM 60s, cooldown scale 30s, backoff... trôi qua trong vài giây thật.
+Server giả lập áp quota RPM thật (sliding window 60s) và trả 429 khi vượt.
+
+Dùng để tinh chỉnh hệ số safe_rpm và ngưỡng scaling:
+    python simulator.py --server-rpm 15 --requests 300 --workers 10 --safety 0.7,0.85,1.0
+    python simulator.py --trace session.jsonl --server-rpm 10
+"""
+
+import io
+import json
+import math
+import queue
+import random
+import argparse
+import threading
+import contextlib
+from collections import deque
+
+try:
+    from .clock import VirtualClock
+    from .enhanced_rate_limiter import EnhancedRateLimiter
+    from .rate_limiter import exponential_backoff_sleep
+    from .session_recorder import iter_session_records
+except ImportError:
+    from clock import VirtualClock
+    from enhanced_rate_limiter import EnhancedRateLimiter
+    from rate_limiter import exponential_backoff_sleep
+    from session_recorder import iter_session_records
+
+
+class SimulatedServer:
+    """Quota phía server: tối đa server_rpm requests trong cửa sổ 60s ảo"""
+
+    def __init__(self, clock, server_rpm, window_seconds=60):
+        self.clock = clock
+        self.server_rpm = server_rpm
+        self.window_seconds = window_seconds
+        self.timestamps = deque()
+        self.lock = threading.Lock()
+
+    def admit(self):
+        now = self.clock.monotonic()
+        with self.lock:
+            while self.timestamps and now - self.timestamps[0] >= self.window_seconds:
+                self.timestamps.popleft()
+            if len(self.timestamps) >= self.server_rpm:
+                return False
+            self.timestamps.append(now)
+            return True
+
+
+def synthetic_trace(num_requests, mean_latency=3.0, sigma=0.5, arrival_rate=None, seed=0):
+    """
+    Trace tổng hợp: latency lognormal (trung bình ~mean_latency), thời điểm đến
+    Poisson nếu có arrival_rate (requests/giây), mặc định tất cả sẵn sàng từ đầu (dịch cả file).
+
+    Returns:
+        List[{"t": thời điểm sẵn sàng, "latency": giây}]
+    """
+    rng = random.Random(seed)
+    mu = math.log(max(mean_latency, 1e-6)) - sigma * sigma / 2
+    t = 0.0
+    trace = []
+    for _ in range(num_requests):
+        if arrival_rate:
+            t += rng.expovariate(arrival_rate)
+        trace.append({"t": t, "latency": rng.lognormvariate(mu, sigma)})
+    return trace
+
+
+def load_trace(path):
+    """
+    Đọc trace JSONL (hoặc file phiên .session.jsonl.gz của session_recorder): mỗi dòng có
+    "latency" (giây) và tùy chọn "t" (thời điểm sẵn sàng). Dòng thiếu latency bị bỏ qua.
+    """
+    trace = []
+    for record in iter_session_records(path):
+        try:
+            trace.append({"t": float(record.get("t", 0.0)), "latency": float(record["latency"])})
+        except (ValueError, KeyError, TypeError):
+            continue
+    if trace:
+        start = min(item["t"] for item in trace)
+        for item in trace:
+            item["t"] -= start
+    return trace
+
+
+def simulate(trace, server_rpm, workers=10, safety=0.85, limiter_rpm=None, adaptive=True,
+             backoff_base=8.0, backoff_max=300.0, max_retries=10, quiet=True):
+    """
+    Chạy trace qua rate limiter + thread manager trên đồng hồ ảo.
+
+    Args:
+        trace: List[{"t", "latency"}]
+        server_rpm: Quota RPM thật của server
+        workers: Số worker threads ban đầu
+        safety: Hệ số safe_rpm = int(server_rpm * safety) (bỏ qua nếu có limiter_rpm)
+        adaptive: Dùng AdaptiveThreadManager để scale số worker đang hoạt động
+        quiet: Ẩn log của limiter/thread manager
+
+    Returns:
+        Dict thống kê (thời gian ảo, throughput, utilization, số 429, idle time...)
+    """
+    try:
+        from .translate import AdaptiveThreadManager
+    except ImportError:
+        from translate import AdaptiveThreadManager
+
+    clock = VirtualClock()
+    server = SimulatedServer(clock, server_rpm)
+    rpm = limiter_rpm or max(1, int(server_rpm * safety))
+    limiter = EnhancedRateLimiter(requests_per_minute=rpm, clock=clock)
+    manager = AdaptiveThreadManager(workers, min_threads=1, max_threads=workers, clock=clock) if adaptive else None
+
+    pending = queue.Queue()
+    for index, item in enumerate(sorted(trace, key=lambda item: item["t"])):
+        pending.put((index, item))
+
+    stats_lock = threading.Lock()
+    stats = {"requests": 0, "ok": 0, "429": 0, "failed": 0, "busy": 0.0, "idle": 0.0,
+             "min_active_threads": workers, "completion_times": []}
+
+    def record(**updates):
+        with stats_lock:
+            for key, value in updates.items():
+                stats[key] += value
+
+    def worker(worker_index):
+        try:
+            while True:
+                # Worker vượt quá số threads hiện tại của thread manager -> tạm nghỉ
+                active = manager.get_current_threads() if manager else workers
+                with stats_lock:
+                    stats["min_active_threads"] = min(stats["min_active_threads"], active)
+                if worker_index >= active:
+                    if pending.empty():
+                        return
+                    clock.sleep(1.0)
+                    continue
+
+                try:
+                    index, item = pending.get_nowait()
+                except queue.Empty:
+                    return
+
+                wait_start = clock.monotonic()
+                if item["t"] > wait_start:
+                    clock.sleep(item["t"] - wait_start)
+
+                for retry in range(max_retries + 1):
+                    idle_start = clock.monotonic()
+                    limiter.acquire()
+                    record(idle=clock.monotonic() - idle_start, requests=1)
+
+                    admitted = server.admit()
+                    busy_start = clock.monotonic()
+                    clock.sleep(item["latency"] if admitted else 0.2)
+                    record(busy=clock.monotonic() - busy_start)
+
+                    if admitted:
+                        limiter.on_success()
+                        if manager:
+                            manager.report_success()
+                        record(ok=1)
+                        with stats_lock:
+                            stats["completion_times"].append(clock.monotonic())
+                        break
+
+                    record(**{"429": 1})
+                    limiter.on_rate_limit_error()
+                    if manager:
+                        manager.report_rate_limit()
+                    idle_start = clock.monotonic()
+                    exponential_backoff_sleep(retry, base_delay=backoff_base, max_delay=backoff_max, clock=clock)
+                    record(idle=clock.monotonic() - idle_start)
+                else:
+                    record(failed=1)
+        finally:
+            clock.unregister()
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log) if quiet else contextlib.nullcontext():
+        threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(workers)]
+        for thread in threads:
+            # Đăng ký trước khi start: thời gian ảo không được trôi khi còn worker chưa chạy
+            clock.register()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    elapsed = max(stats["completion_times"]) if stats["completion_times"] else clock.elapsed
+    minutes = elapsed / 60.0 if elapsed > 0 else 0.0
+    worker_time = (stats["busy"] + stats["idle"]) or 1.0
+    return {
+        "server_rpm": server_rpm,
+        "limiter_rpm": rpm,
+        "safety": safety,
+        "workers": workers,
+        "virtual_seconds": elapsed,
+        "requests": stats["requests"],
+        "ok": stats["ok"],
+        "rate_limited": stats["429"],
+        "failed": stats["failed"],
+        "throughput_rpm": stats["ok"] / minutes if minutes else 0.0,
+        "utilization": (stats["ok"] / minutes) / server_rpm if minutes else 0.0,
+        "idle_ratio": stats["idle"] / worker_time,
+        "final_threads": manager.get_current_threads() if manager else workers,
+        "min_active_threads": stats["min_active_threads"],
+        "final_throttle": limiter.throttle_factor,
+    }
+
+
+def print_result(result):
+    print(f"\n🧪 safety={result['safety']:.2f} (limiter {result['limiter_rpm']}/{result['server_rpm']} RPM, "
+          f"{result['workers']} workers)")
+    print(f"   ⏱️ {result['virtual_seconds']:.0f}s ảo, {result['ok']}/{result['requests']} requests OK, "
+          f"429: {result['rate_limited']}, thất bại: {result['failed']}")
+    print(f"   📈 Throughput: {result['throughput_rpm']:.1f} RPM (utilization {result['utilization']:.0%}), "
+          f"idle {result['idle_ratio']:.0%}")
+    print(f"   🧵 Threads: cuối {result['final_threads']}, thấp nhất {result['min_active_threads']}; "
+          f"throttle {result['final_throttle']:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulator thời gian ảo cho rate limiter và thread scaling")
+    parser.add_argument("--server-rpm", type=int, default=15, help="Quota RPM thật của server")
+    parser.add_argument("--requests", type=int, default=200, help="Số requests (trace tổng hợp)")
+    parser.add_argument("--latency", type=float, default=3.0, help="Latency trung bình (giây)")
+    parser.add_argument("--trace", help="File trace JSONL (latency, t) thay cho trace tổng hợp")
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--safety", default="0.7,0.85,1.0", help="Các hệ số safe_rpm cần so sánh")
+    parser.add_argument("--no-adaptive", action="store_true", help="Tắt AdaptiveThreadManager")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace) if args.trace else synthetic_trace(args.requests, args.latency, seed=args.seed)
+    print(f"🧪 Mô phỏng {len(trace)} requests, server {args.server_rpm} RPM, {args.workers} workers")
+
+    results = []
+    for factor in [float(v) for v in args.safety.split(",") if v.strip()]:
+        result = simulate(trace, args.server_rpm, workers=args.workers, safety=factor,
+                          adaptive=not args.no_adaptive)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Đã lưu kết quả: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming response guard cho các provider (OpenRouter / Google AI)
+
+Đọc tokens ngay khi chúng về thay vì chờ toàn bộ body, và hủy request sớm khi:
+- Quá thời gian chờ token đầu tiên (time-to-first-token)
+- Quá thời gian chờ giữa 2 tokens (inter-token idle)
+- Phát hiện câu từ chối ("i'm sorry", "as an ai", ...) ở phần đầu output
+- Output vượt quá độ dài dự kiến (response chạy loạn / lặp vô hạn)
+
+TTFT / idle được kiểm tra theo timer (iter_guarded đọc stream trong thread riêng),
+không phụ thuộc việc có chunk mới về hay không; deadline của cả request
+(total_timeout) chỉ là backstop rộng cho output dài.
+
+Các request bị hủy sớm sẽ được đánh dấu bad translation để process_chunk retry.
+"""
+
+import time
+import queue
+import threading
+
+
+# Thời gian chờ mặc định (giây)
+DEFAULT_TTFT_TIMEOUT = 60.0
+DEFAULT_IDLE_TIMEOUT = 30.0
+# Deadline của cả request streaming - output dài vẫn hợp lệ khi tokens còn về đều
+DEFAULT_TOTAL_TIMEOUT = 900.0
+# Chu kỳ kiểm tra TTFT / idle của watchdog (giây)
+MIN_POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 1.0
+
+# Output dài hơn input quá nhiều lần -> coi là response chạy loạn
+DEFAULT_MAX_OUTPUT_RATIO = 3.0
+# Luôn cho phép tối thiểu chừng này ký tự (chunk rất ngắn như tiêu đề chương)
+MIN_OUTPUT_CHARS_BOUND = 2000
+
+# Chỉ quét refusal trong phần đầu output - câu từ chối luôn nằm ở đầu response,
+# quét toàn bộ dễ nhầm với lời thoại trong truyện ("Tôi xin lỗi...")
+REFUSAL_SCAN_CHARS = 300
+
+REFUSAL_PATTERNS = [
+    "tôi không thể dịch",
+    "xin lỗi, tôi không",
+    "as an ai",
+    "as a language model",
+    "i am unable",
+    "i cannot",
+    "i'm sorry",
+    "i can't",
+]
+
+
+class StreamAborted(Exception):
+    """Stream bị hủy sớm bởi StreamGuard"""
+
+    def __init__(self, reason, partial_text=""):
+        super().__init__(reason)
+        self.reason = reason
+        self.partial_text = partial_text
+
+
+class StreamGuard:
+    """
+    Theo dõi một response đang stream và quyết định có hủy sớm hay không.
+
+    Dùng:
+        guard = StreamGuard(input_length=len(text))
+        guard.start()
+        for piece in stream:
+            guard.feed(piece)      # raise StreamAborted nếu cần hủy
+        translated_text = guard.text
+    """
+
+    def __init__(self, input_length=0, ttft_timeout=DEFAULT_TTFT_TIMEOUT,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, max_output_ratio=DEFAULT_MAX_OUTPUT_RATIO,
+                 refusal_patterns=None, clock=time.monotonic, total_timeout=DEFAULT_TOTAL_TIMEOUT):
+        """
+        Args:
+            input_length: Số ký tự của văn bản gốc (để tính giới hạn độ dài output)
+            ttft_timeout: Thời gian tối đa chờ token đầu tiên (giây)
+            idle_timeout: Thời gian tối đa giữa 2 tokens liên tiếp (giây)
+            total_timeout: Deadline của cả request (giây) - truyền cho RPC/HTTP client làm backstop
+            max_output_ratio: Output tối đa = input_length × ratio (None = không giới hạn)
+            refusal_patterns: Danh sách cụm từ từ chối (mặc định REFUSAL_PATTERNS)
+            clock: Hàm trả về thời gian hiện tại (monotonic)
+        """
+        self.ttft_timeout = ttft_timeout
+        self.idle_timeout = idle_timeout
+        self.total_timeout = total_timeout
+        self.refusal_patterns = [p.lower() for p in (refusal_patterns or REFUSAL_PATTERNS)]
+        self.clock = clock
+
+        if max_output_ratio:
+            self.max_output_chars = max(int(input_length * max_output_ratio), MIN_OUTPUT_CHARS_BOUND)
+        else:
+            self.max_output_chars = None
+
+        self._pieces = []
+        self._length = 0
+        self._head = ""  # Phần đầu output (lowercase) để quét refusal
+        self.start_time = None
+        self.first_token_time = None
+        self.last_token_time = None
+
+    @property
+    def read_timeout(self):
+        """
+        Timeout cho MỖI lần đọc socket (requests: timeout=(connect, read)) - backstop khi server
+        im lặng hoàn toàn. Không dùng làm deadline của cả request (xem total_timeout).
+        """
+        return max(self.ttft_timeout or 0, self.idle_timeout or 0) or None
+
+    @property
+    def poll_interval(self):
+        """Chu kỳ watchdog kiểm tra TTFT / idle"""
+        limits = [t for t in (self.ttft_timeout, self.idle_timeout) if t]
+        if not limits:
+            return MAX_POLL_INTERVAL
+        return min(max(min(limits) / 10, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+
+    @property
+    def text(self):
+        return "".join(self._pieces)
+
+    @property
+    def ttft(self):
+        """Time-to-first-token (giây) hoặc None nếu chưa có token"""
+        if self.first_token_time is None or self.start_time is None:
+            return None
+        return self.first_token_time - self.start_time
+
+    def start(self):
+        self.start_time = self.clock()
+        self.last_token_time = self.start_time
+
+    def tick(self):
+        """
+        Kiểm tra timeout khi nhận được keep-alive / chunk rỗng.
+        Raise StreamAborted nếu quá TTFT hoặc idle timeout.
+        """
+        if self.start_time is None:
+            self.start()
+        now = self.clock()
+
+        if self.first_token_time is None:
+            if self.ttft_timeout and now - self.start_time > self.ttft_timeout:
+                raise StreamAborted(f"quá {self.ttft_timeout:.0f}s chưa có token đầu tiên", self.text)
+        elif self.idle_timeout and now - self.last_token_time > self.idle_timeout:
+            raise StreamAborted(f"quá {self.idle_timeout:.0f}s không có token mới", self.text)
+
+    def feed(self, piece):
+        """
+        Nhận một đoạn text mới từ stream.
+        Raise StreamAborted nếu phát hiện refusal, vượt độ dài, hoặc timeout.
+        """
+        self.tick()
+        if not piece:
+            return
+
+        now = self.clock()
+        if self.first_token_time is None:
+            self.first_token_time = now
+        self.last_token_time = now
+
+        self._pieces.append(piece)
+        self._length += len(piece)
+
+        # Quét refusal trong phần đầu output
+        if len(self._head) < REFUSAL_SCAN_CHARS:
+            self._head = (self._head + piece.lower())[:REFUSAL_SCAN_CHARS]
+            for pattern in self.refusal_patterns:
+                if pattern in self._head:
+                    raise StreamAborted(f"phát hiện từ chối '{pattern}'", self.text)
+
+        if self.max_output_chars and self._length > self.max_output_chars:
+            raise StreamAborted(
+                f"output vượt giới hạn {self.max_output_chars} ký tự (response chạy loạn)",
+                self.text
+            )
+
+
+def close_stream(stream):
+    """Đóng / hủy stream đang đọc (best effort: grpc .cancel(), generator / HTTP response .close())"""
+    for target in (stream, getattr(stream, "_iterator", None)):
+        for method in ("cancel", "close"):
+            func = getattr(target, method, None)
+            if callable(func):
+                try:
+                    func()
+                except Exception:
+                    pass
+
+
+def iter_guarded(open_stream, guard, on_abort=close_stream):
+    """
+    Đọc stream trong thread riêng và yield từng phần tử; luồng gọi kiểm tra TTFT / idle
+    theo timer (guard.tick mỗi guard.poll_interval) nên stream im lặng cũng bị hủy đúng hạn.
+
+    Args:
+        open_stream: Hàm không tham số trả về iterable (gọi trong thread đọc - request
+            mở stream cũng được tính vào TTFT)
+        guard: StreamGuard (guard.start() được gọi ở đây)
+        on_abort: on_abort(stream) đóng stream khi hủy sớm / khi người gọi dừng đọc giữa chừng
+
+    Raises:
+        StreamAborted: quá TTFT / idle timeout
+        Exception: lỗi từ open_stream / stream được raise lại ở luồng gọi
+    """
+    items = queue.Queue()
+    done = object()
+    opened = {}
+
+    def reader():
+        try:
+            opened["stream"] = open_stream()
+            for item in opened["stream"]:
+                items.put((item, None))
+        except BaseException as e:
+            items.put((done, e))
+            return
+        items.put((done, None))
+
+    guard.start()
+    threading.Thread(target=reader, name="stream-reader", daemon=True).start()
+    finished = False
+    try:
+        while True:
+            try:
+                item, error = items.get(timeout=guard.poll_interval)
+            except queue.Empty:
+                guard.tick()
+                continue
+            if item is done:
+                finished = True
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # Hủy sớm (timeout, refusal từ guard.feed...) - không để thread đọc tiếp cả response
+        if not finished and on_abort is not None and "stream" in opened:
+            try:
+                on_abort(opened["stream"])
+            except Exception:
+                pass
+
+
+def build_stream_config(model_settings):
+    """
+    Đọc cấu hình streaming từ model_settings.
+
+    Keys hỗ trợ:
+        streaming: bool - bật streaming mode
+        stream_ttft_timeout: giây chờ token đầu tiên
+        stream_idle_timeout: giây chờ giữa 2 tokens
+        stream_max_output_ratio: output tối đa so với input (0 = không giới hạn)
+        stream_total_timeout: deadline của cả request (giây), backstop cho output dài
+
+    Returns:
+        dict cấu hình hoặc None nếu streaming tắt
+    """
+    if not model_settings or not model_settings.get("streaming", False):
+        return None
+
+    def _float(key, default):
+        try:
+            value = float(model_settings.get(key, default))
+            return value if value > 0 else None
+        except (ValueError, TypeError):
+            return default
+
+    return {
+        "ttft_timeout": _float("stream_ttft_timeout", DEFAULT_TTFT_TIMEOUT),
+        "idle_timeout": _float("stream_idle_timeout", DEFAULT_IDLE_TIMEOUT),
+        "max_output_ratio": _float("stream_max_output_ratio", DEFAULT_MAX_OUTPUT_RATIO),
+        "total_timeout": _float("stream_total_timeout", DEFAULT_TOTAL_TIMEOUT),
+    }
+
+
+def create_stream_guard(stream_config, input_text):
+    """Tạo StreamGuard từ stream_config (kết quả của build_stream_config)"""
+    return StreamGuard(
+        input_length=len(input_text or ""),
+        ttft_timeout=stream_config.get("ttft_timeout"),
+        idle_timeout=stream_config.get("idle_timeout"),
+        max_output_ratio=stream_config.get("max_output_ratio"),
+        total_timeout=stream_config.get("total_timeout", DEFAULT_TOTAL_TIMEOUT),
+    )
@@ -7,8 +7,10 @@ import concurrent.futures
 import threading
 from multiprocessing import cpu_count
 import math
+import functools
 from typing import Optional
 from itertools import cycle
+from datetime import datetime, timedelta
 
 # Import ENHANCED rate limiter for Google AI (with TPM/RPD tracking)
 try:
@@ -52,11 +54,128 @@ except ImportError:
             import hashlib
             return hashlib.md5(api_key.encode()).hexdigest()[:8]
 
+try:
+    from .clock import SYSTEM_CLOCK
+except ImportError:
+    from clock import SYSTEM_CLOCK
+
+# Import limits profile (calibrate_quota.py)
+try:
+    from .quota_calibration import (
+        activate_limits_profile, get_calibrated_limits, make_google_probe, RATE_LIMIT_WINDOW_SECONDS,
+        SCOPE_KEY, SCOPE_UNKNOWN, STATUS_AUTH, STATUS_LIMITED, STATUS_OK
+    )
+except ImportError:
+    from quota_calibration import (
+        activate_limits_profile, get_calibrated_limits, make_google_probe, RATE_LIMIT_WINDOW_SECONDS,
+        SCOPE_KEY, SCOPE_UNKNOWN, STATUS_AUTH, STATUS_LIMITED, STATUS_OK
+    )
+
+# Import record/replay phiên gọi API
+try:
+    from .session_recorder import create_session_recorder, get_session_recorder, set_session_recorder
+except ImportError:
+    from session_recorder import create_session_recorder, get_session_recorder, set_session_recorder
+
+# Import writer nền cho debug responses
+try:
+    from .debug_writer import configure_debug_writers, get_debug_writer, close_debug_writers
+except ImportError:
+    from debug_writer import configure_debug_writers, get_debug_writer, close_debug_writers
+
+# Import dựng EPUB trong lúc dịch
+try:
+    from .epub_writer import create_incremental_epub_builder
+except ImportError:
+    from epub_writer import create_incremental_epub_builder
+
+# Import nhận diện tiêu đề chương (regex biên dịch một lần, dùng chung với exporter/tool)
+try:
+    from .chapter_index import SECTION_HEADING_PATTERN
+except ImportError:
+    from chapter_index import SECTION_HEADING_PATTERN
+
+# Import streaming guard (hủy sớm khi timeout/refusal/runaway)
+try:
+    from .streaming import build_stream_config
+except ImportError:
+    from streaming import build_stream_config
+
+# Import hedged requests (request dự phòng cho chunk đầu hàng bị chậm)
+try:
+    from .hedging import create_hedge_controller, iter_completed
+except ImportError:
+    from hedging import create_hedge_controller, iter_completed
+
+# Import passthrough + dedup chunk trùng lặp
+try:
+    from .chunk_dedup import create_chunk_deduplicator
+except ImportError:
+    from chunk_dedup import create_chunk_deduplicator
+
+# Import translation memory (dùng lại bản dịch giữa các tập)
+try:
+    from .translation_memory import create_translation_memory
+except ImportError:
+    from translation_memory import create_translation_memory
+
+# Import glossary (chỉ chèn các mục xuất hiện trong chunk)
+try:
+    from .glossary import load_glossary
+except ImportError:
+    from glossary import load_glossary
+
+# Import validate key song song + cache kết quả
+try:
+    from .key_validation import mark_invalid_keys, validate_api_keys
+except ImportError:
+    from key_validation import mark_invalid_keys, validate_api_keys
+
+# Import prompt/context caching cho prefix cố định (system_instruction)
+try:
+    from .prompt_cache import (
+        is_prompt_cache_enabled, needs_explicit_cache_control, print_prompt_cache_stats, release_prompt_caches,
+        split_text_header
+    )
+except ImportError:
+    from prompt_cache import (
+        is_prompt_cache_enabled, needs_explicit_cache_control, print_prompt_cache_stats, release_prompt_caches,
+        split_text_header
+    )
+
+# Import provider interface (build/send/parse/classify error) + phân loại lỗi
+try:
+    from .providers import (
+        BaseProvider, ERROR_AUTH, ERROR_CONTEXT_LENGTH, ERROR_MODERATION, ERROR_OTHER, ERROR_QUOTA, ERROR_RATE_LIMIT,
+        ERROR_SERVICE, ERROR_TIMEOUT, check_context_length_error, check_openrouter_api_key_error,
+        check_openrouter_moderation_error, check_openrouter_quota_error, check_openrouter_rate_limit_error,
+        check_openrouter_service_error, check_openrouter_timeout_error, create_provider, print_usage_stats,
+        register_provider, OpenAICompatibleProvider, ProviderResponse
+    )
+except ImportError:
+    from providers import (
+        BaseProvider, ERROR_AUTH, ERROR_CONTEXT_LENGTH, ERROR_MODERATION, ERROR_OTHER, ERROR_QUOTA, ERROR_RATE_LIMIT,
+        ERROR_SERVICE, ERROR_TIMEOUT, check_context_length_error, check_openrouter_api_key_error,
+        check_openrouter_moderation_error, check_openrouter_quota_error, check_openrouter_rate_limit_error,
+        check_openrouter_service_error, check_openrouter_timeout_error, create_provider, print_usage_stats,
+        register_provider, OpenAICompatibleProvider, ProviderResponse
+    )
+
+# Import provider router (chia chunks cho nhiều provider/model cùng lúc)
+try:
+    from .provider_router import ProviderRoute, ProviderRouter, parse_retry_delay
+    from .rate_limiter import MultiThreadRateLimiter
+except ImportError:
+    from provider_router import ProviderRoute, ProviderRouter, parse_retry_delay
+    from rate_limiter import MultiThreadRateLimiter
+
 # Import reformat function
 try:
-    from .reformat import fix_text_format
+    try:
+        from .reformat import fix_text_format, StreamingReformatter
+    except ImportError:
+        from reformat import fix_text_format, StreamingReformatter
     CAN_REFORMAT = True
-    print("Da import thanh cong chuc nang reformat")
 except ImportError:
     CAN_REFORMAT = False
     print("Khong the import reformat.py - chuc nang reformat se bi tat")
@@ -65,13 +184,13 @@ except ImportError:
 MAX_RETRIES_ON_SAFETY_BLOCK = 5
 MAX_RETRIES_ON_BAD_TRANSLATION = 5
 MAX_RETRIES_ON_RATE_LIMIT = 5  # Tăng số lần retry khi gặp rate limit để xử lý tốt hơn
+MAX_RETRIES_ON_TRANSIENT_ERROR = 5  # 429 / timeout / 502-503 từ provider (ngoài vòng retry rate limit)
 RETRY_DELAY_SECONDS = 2
 PROGRESS_FILE_SUFFIX = ".progress.json"
 CHUNK_SIZE = 1024 * 1024  # 1MB (Không còn dùng trực tiếp CHUNK_SIZE cho việc đọc file nữa)
 
 # --- DEBUG RESPONSE LOGGING ---
-DEBUG_RESPONSE_ENABLED = True  # Bật/tắt debug logging
-DEBUG_RESPONSE_LOCK = threading.Lock()
+DEBUG_RESPONSE_ENABLED = True  # Bật/tắt debug logging (ghi bất đồng bộ qua debug_writer)
 
 def save_debug_response(chunk_index, response_text, chunk_lines, input_file, provider="Unknown", model_name="Unknown", key_hash="Unknown"):
     """
@@ -98,27 +217,27 @@ def save_debug_response(chunk_index, response_text, chunk_lines, input_file, pro
         
         debug_file = os.path.join(input_dir, f"{input_name}_debug_responses.txt")
         
-        # Lưu vào file với thread-safe
-        with DEBUG_RESPONSE_LOCK:
-            with open(debug_file, 'a', encoding='utf-8') as f:
-                # Thêm separator và metadata
-                f.write("\n" + "="*80 + "\n")
-                f.write(f"CHUNK #{chunk_index} - {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"Provider: {provider} | Model: {model_name} | Key: ***{key_hash}\n")
-                f.write("-"*80 + "\n")
-                
-                # Ghi nội dung gốc
-                f.write("【ORIGINAL TEXT】:\n")
-                f.write("\n".join(chunk_lines[:3]))  # Chỉ lưu 3 dòng đầu để tham khảo
-                if len(chunk_lines) > 3:
-                    f.write(f"\n... ({len(chunk_lines) - 3} more lines)")
-                f.write("\n\n")
-                
-                # Ghi response
-                f.write("【API RESPONSE】:\n")
-                f.write(response_text)
-                f.write("\n")
-                f.write("="*80 + "\n\n")
+        # Dựng bản ghi rồi đẩy cho writer nền (worker không chờ I/O đĩa)
+        parts = [
+            "\n" + "="*80 + "\n",
+            f"CHUNK #{chunk_index} - {time.strftime('%Y-%m-%d %H:%M:%S')}\n",
+            f"Provider: {provider} | Model: {model_name} | Key: ***{key_hash}\n",
+            "-"*80 + "\n",
+            # Ghi nội dung gốc
+            "【ORIGINAL TEXT】:\n",
+            "\n".join(chunk_lines[:3]),  # Chỉ lưu 3 dòng đầu để tham khảo
+        ]
+        if len(chunk_lines) > 3:
+            parts.append(f"\n... ({len(chunk_lines) - 3} more lines)")
+        parts.extend([
+            "\n\n",
+            # Ghi response
+            "【API RESPONSE】:\n",
+            response_text,
+            "\n",
+            "="*80 + "\n\n",
+        ])
+        get_debug_writer(debug_file).write("".join(parts))
         
         # Log thông báo (chỉ log lần đầu)
         if chunk_index <= 1:
@@ -132,7 +251,8 @@ class AdaptiveThreadManager:
     """
     Quản lý adaptive thread scaling - tự động điều chỉnh threads dựa trên rate limit
     """
-    def __init__(self, initial_threads, min_threads=2, max_threads=50):
+    def __init__(self, initial_threads, min_threads=2, max_threads=50, clock=None):
+        self.clock = clock or SYSTEM_CLOCK
         self.current_threads = initial_threads
         self.initial_threads = initial_threads
         self.min_threads = min_threads
@@ -177,14 +297,12 @@ class AdaptiveThreadManager:
     
     def _evaluate_scaling(self):
         """Đánh giá và thực hiện scaling nếu cần"""
-        import time
-        
         # Chỉ đánh giá sau khi có đủ data
         if self.total_requests < self.min_requests_for_scaling:
             return
             
         # Kiểm tra cooldown
-        current_time = time.time()
+        current_time = self.clock.time()
         if current_time - self.last_scale_time < self.scale_cooldown:
             return
         
@@ -241,12 +359,18 @@ TRANSLATE_TAG_END = "</translate_this>"
 # Số dòng gom lại thành một chunk để dịch
 CHUNK_SIZE_LINES = 100
 
+# OpenRouter (endpoint OpenAI-compatible)
+OPENROUTER_API_BASE = "https://openrouter.ai/api/v1"
+
 # Global stop event để dừng tiến trình dịch
 _stop_event = threading.Event()
 
 # Global quota exceeded flag
 _quota_exceeded = threading.Event()
 
+# Quota handler theo thread (provider router / fallback tiers)
+_quota_context = threading.local()
+
 # Key rotation class for Google AI multiple keys
 class KeyRotator:
     """
@@ -280,6 +404,15 @@ class KeyRotator:
             self.key_usage[key] += 1
             return key
     
+    def mark_invalid(self, key, reason=None):
+        """Bỏ key lỗi thật (validate thất bại) khỏi vòng xoay, giữ lại ít nhất 1 key"""
+        with self.lock:
+            remaining = [k for k in self.keys if k != key]
+            if remaining and len(remaining) < len(self.keys):
+                self.keys = remaining
+                self.key_iterator = cycle(self.keys)
+                print(f"⚠️ Key ***{key[-8:]} bị loại khỏi rotation: {reason or 'invalid'}")
+    
     def get_usage_stats(self):
         """Get usage statistics for all keys"""
         with self.lock:
@@ -338,9 +471,14 @@ def is_translation_stopped():
     global _stop_event
     return _stop_event.is_set()
 
-def set_quota_exceeded():
-    """Đánh dấu API đã hết quota"""
+def set_quota_exceeded(error_message=None):
+    """Đánh dấu API đã hết quota (error_message: lỗi gốc, để router lấy thời gian reset)"""
     global _quota_exceeded, _stop_event
+    # Dịch qua provider router: route hết quota nhưng còn fallback -> chỉ dừng chunk hiện tại
+    handler = getattr(_quota_context, "handler", None)
+    if handler is not None and handler(error_message):
+        _quota_context.exceeded = True
+        return
     _quota_exceeded.set()
     _stop_event.set()  # Cũng dừng dịch
     print("API đã hết quota - dừng tiến trình dịch")
@@ -348,96 +486,7 @@ def set_quota_exceeded():
 def is_quota_exceeded():
     """Kiểm tra xem API có hết quota không"""
     global _quota_exceeded
-    return _quota_exceeded.is_set()
-
-def check_openrouter_rate_limit_error(error_message):
-    """Kiểm tra lỗi Rate Limit (429) - có thể retry"""
-    error_str = str(error_message).lower()
-    rate_limit_keywords = [
-        "rate limit exceeded",
-        "rate_limit_exceeded", 
-        "429",
-        "too many requests",
-        "requests per minute",
-        "requests per second"
-    ]
-    return any(keyword in error_str for keyword in rate_limit_keywords)
-
-def check_openrouter_quota_error(error_message):
-    """Kiểm tra lỗi Quota/Credit Insufficient (402) - cần nạp credit"""
-    error_str = str(error_message).lower()
-    quota_keywords = [
-        "402",
-        "insufficient credits",
-        "insufficient_credits",
-        "exceeded your current quota", 
-        "quota exceeded",
-        "billing",
-        "please check your plan",
-        "credits",
-        "balance"
-    ]
-    # KHÔNG BAO GỒM "429" và "rate limit" - đó là lỗi khác!
-    return any(keyword in error_str for keyword in quota_keywords)
-
-def check_openrouter_api_key_error(error_message):
-    """Kiểm tra lỗi API Key không hợp lệ (401)"""
-    error_str = str(error_message).lower()
-    api_key_keywords = [
-        "401",
-        "unauthorized", 
-        "invalid credentials",
-        "invalid_credentials",
-        "api key not valid", 
-        "invalid api key", 
-        "authentication failed",
-        "api_key_invalid", 
-        "invalid_api_key", 
-        "api key is invalid", 
-        "bad api key"
-    ]
-    return any(keyword in error_str for keyword in api_key_keywords)
-
-def check_openrouter_moderation_error(error_message):
-    """Kiểm tra lỗi Moderation (403) - nội dung bị cấm"""
-    error_str = str(error_message).lower()
-    moderation_keywords = [
-        "403",
-        "moderation",
-        "content policy",
-        "content_policy",
-        "policy violation",
-        "blocked content",
-        "inappropriate content"
-    ]
-    return any(keyword in error_str for keyword in moderation_keywords)
-
-def check_openrouter_timeout_error(error_message):
-    """Kiểm tra lỗi Timeout (408) - có thể retry"""
-    error_str = str(error_message).lower()
-    timeout_keywords = [
-        "408",
-        "timeout",
-        "request timeout",
-        "gateway timeout",
-        "timed out"
-    ]
-    return any(keyword in error_str for keyword in timeout_keywords)
-
-def check_openrouter_service_error(error_message):
-    """Kiểm tra lỗi Service (502, 503) - có thể retry"""
-    error_str = str(error_message).lower()
-    service_keywords = [
-        "502",
-        "503", 
-        "bad gateway",
-        "service unavailable",
-        "server error",
-        "internal server error",
-        "model unavailable",
-        "provider unavailable"
-    ]
-    return any(keyword in error_str for keyword in service_keywords)
+    return _quota_exceeded.is_set() or getattr(_quota_context, "exceeded", False)
 
 # Legacy functions for backward compatibility
 def check_quota_error(error_message):
@@ -448,26 +497,25 @@ def check_api_key_error(error_message):
     """Legacy function - sử dụng check_openrouter_api_key_error thay thế"""
     return check_openrouter_api_key_error(error_message)
 
-def validate_api_key_before_translation(api_key, model_name, provider="OpenRouter"):
-    """Validate API key trước khi bắt đầu translation"""
+def validate_api_key_before_translation(api_key, model_name, provider="OpenRouter", model_settings=None):
+    """Validate API key trước khi bắt đầu translation (model_settings: cho provider cần base_url, ...)"""
     try:
         if provider == "Google AI":
-            # Test Google AI API
-            import google.generativeai as genai
+            # Test Google AI qua REST (1 output token) thay vì genai.configure - cấu hình
+            # global không an toàn khi nhiều key được validate song song
+            status, _, detail = make_google_probe(model_name, timeout=30)(api_key, "Hello, test quota")
             
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel(model_name)
-            
-            # Test với content nhỏ để kiểm tra quota
-            test_content = "Hello, test quota"
-            response = model.generate_content(test_content)
-            
-            if response and response.text:
-                # Thêm thông tin về project ID nếu có thể
+            if status == STATUS_OK:
                 masked_key = api_key[:10] + "***" + api_key[-10:] if len(api_key) > 20 else "***"
                 return True, f"Google AI API key hợp lệ ({masked_key})"
+            elif status == STATUS_LIMITED:
+                return False, f"Google AI API bị rate limit / hết quota (429) - thử lại sau: {detail}"
+            elif status == STATUS_AUTH:
+                return False, f"Google AI API Key không hợp lệ: {detail}"
+            elif detail.startswith("HTTP "):
+                return False, f"Lỗi Google AI API: {detail}"
             else:
-                return False, "Google AI API trả về response rỗng"
+                return False, f"Lỗi kết nối Google AI API: {detail}"
                 
         elif provider == "OpenRouter":
             # Test OpenRouter API
@@ -508,7 +556,11 @@ def validate_api_key_before_translation(api_key, model_name, provider="OpenRoute
             else:
                 return False, f"Lỗi OpenRouter API: HTTP {response.status_code}"
         else:
-            return False, f"Provider không hợp lệ: {provider}"
+            # Provider đăng ký trong providers.py (OpenAI Compatible, ...)
+            provider_impl = create_provider(provider, api_key, model_name, model_settings)
+            if provider_impl is None:
+                return False, f"Provider không hợp lệ: {provider}"
+            return provider_impl.validate()
             
     except Exception as e:
         error_msg = str(e)
@@ -519,6 +571,70 @@ def validate_api_key_before_translation(api_key, model_name, provider="OpenRoute
         else:
             return False, f"Lỗi kết nối API: {error_msg}"
 
+def check_api_key_access(api_key, model_name, provider="OpenRouter", model_settings=None):
+    """
+    Kiểm tra key bằng request metadata, không sinh nội dung (không tốn RPM/RPD của key) - dùng khi
+    bắt đầu dịch để validate nhiều key cùng lúc:
+    - Google AI: models.get (key + model)
+    - OpenRouter: GET /key (key + credit còn lại)
+    - OpenAI Compatible: GET {base_url}/models
+    Provider khác (hoặc server không có /models): validate_api_key_before_translation.
+    Returns (is_valid, message) như validate_api_key_before_translation.
+    """
+    settings = model_settings or {}
+    try:
+        if provider == "Google AI":
+            import requests
+            model_path = model_name if model_name.startswith("models/") else f"models/{model_name}"
+            response = requests.get(f"https://generativelanguage.googleapis.com/v1beta/{model_path}",
+                                    headers={"x-goog-api-key": api_key}, timeout=30)
+            masked_key = api_key[:10] + "***" + api_key[-10:] if len(api_key) > 20 else "***"
+            if response.status_code == 200:
+                return True, f"Google AI API key hợp lệ ({masked_key})"
+            elif response.status_code in (400, 401, 403):
+                return False, f"Google AI API Key không hợp lệ (HTTP {response.status_code}): {response.text[:200]}"
+            elif response.status_code == 404:
+                return False, f"Google AI không có model {model_name} (404)"
+            elif response.status_code == 429:
+                return False, "Google AI API bị rate limit (429) - thử lại sau"
+            elif response.status_code >= 500:
+                return False, f"Google AI service tạm thời lỗi ({response.status_code}) - thử lại sau"
+            return False, f"Lỗi Google AI API: HTTP {response.status_code}"
+
+        elif provider == "OpenRouter":
+            import requests
+            response = requests.get("https://openrouter.ai/api/v1/key",
+                                    headers={"Authorization": f"Bearer {api_key}"}, timeout=30)
+            if response.status_code == 200:
+                data = (response.json() or {}).get("data") or {}
+                remaining = data.get("limit_remaining")
+                if remaining is not None and remaining <= 0:
+                    return False, "Tài khoản OpenRouter hết credit (402: Insufficient Credits)"
+                return True, "OpenRouter API key hợp lệ"
+            elif response.status_code == 401:
+                return False, "OpenRouter API Key không hợp lệ (401: Invalid Credentials)"
+            elif response.status_code == 429:
+                return False, "OpenRouter API bị rate limit (429: Too Many Requests) - thử lại sau"
+            elif response.status_code in (502, 503):
+                return False, f"OpenRouter service tạm thời lỗi ({response.status_code}) - thử lại sau"
+            return False, f"Lỗi OpenRouter API: HTTP {response.status_code}"
+
+        elif provider == "OpenAI Compatible":
+            import requests
+            base_url = (settings.get("base_url") or "http://localhost:8080/v1").rstrip("/")
+            headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+            response = requests.get(f"{base_url}/models", headers=headers, timeout=30)
+            if response.status_code == 200:
+                return True, f"OpenAI Compatible ({base_url}) hợp lệ"
+            elif response.status_code in (401, 403):
+                return False, f"OpenAI Compatible ({base_url}): API Key không hợp lệ (HTTP {response.status_code})"
+            # Server không có /models - kiểm tra bằng request dịch thử
+
+    except Exception as e:
+        return False, f"Lỗi kết nối API: {e}"
+
+    return validate_api_key_before_translation(api_key, model_name, provider, model_settings)
+
 def get_optimal_threads(num_api_keys=1, provider="OpenRouter"):
     """
     Tự động tính toán số threads tối ưu dựa trên cấu hình máy và số lượng API keys.
@@ -593,6 +709,32 @@ _enhanced_rate_limiters = {}
 _enhanced_lock = threading.Lock()
 
 
+def _get_calibrated_provider_limiter(provider, model_name, api_key, calibrated):
+    """Rate limiter cho provider khác Google AI - chỉ từ limits đã calibrate (không có bảng tĩnh / RPD)"""
+    with _enhanced_lock:
+        if calibrated.get("scope") == SCOPE_KEY and api_key:
+            limiter_key = f"{provider}:{model_name}_{_get_key_hash(api_key)}"
+        else:
+            limiter_key = f"{provider}:{model_name}_GLOBAL"
+        
+        if limiter_key not in _enhanced_rate_limiters:
+            # Safety factor 85%; TPM không chạm limit khi đo chỉ là cận dưới - không áp dụng
+            safe_rpm = max(1, int(calibrated["rpm"] * 0.85))
+            tpm = calibrated.get("tpm")
+            safe_tpm = int(tpm * 0.85) if tpm and calibrated.get("tpm_exact") else None
+            tpm_display = f", {safe_tpm:,} TPM" if safe_tpm else ""
+            print(f"📐 [{provider}] Dùng limits đã calibrate ({calibrated.get('calibrated_at', '?')}) cho {model_name}: "
+                  f"{safe_rpm} RPM{tpm_display} (85%), phạm vi {calibrated.get('scope', SCOPE_UNKNOWN)}")
+            _enhanced_rate_limiters[limiter_key] = EnhancedRateLimiter(
+                requests_per_minute=safe_rpm,
+                tokens_per_minute=safe_tpm,
+                requests_per_day=None,
+                window_seconds=60
+            )
+        
+        return _enhanced_rate_limiters[limiter_key]
+
+
 def get_enhanced_rate_limiter(model_name: str, provider: str = "Google AI", api_key: str = None, is_paid_key: bool = False, desired_rpm: Optional[int] = None):
     """
     Get hoặc tạo ENHANCED rate limiter với TPM/RPD tracking
@@ -609,8 +751,11 @@ def get_enhanced_rate_limiter(model_name: str, provider: str = "Google AI", api_
     Returns:
         EnhancedRateLimiter instance hoặc None nếu không cần rate limiting
     """
-    # Chỉ rate limit cho Google AI
-    if provider != "Google AI":
+    # Limits đo bằng calibrate_quota.py (ưu tiên hơn bảng tĩnh bên dưới)
+    calibrated = get_calibrated_limits(provider, model_name)
+    
+    # Chỉ rate limit cho Google AI (provider khác chỉ khi đã calibrate)
+    if provider != "Google AI" and calibrated is None:
         return None
     
     # Fallback nếu không có EnhancedRateLimiter
@@ -618,10 +763,15 @@ def get_enhanced_rate_limiter(model_name: str, provider: str = "Google AI", api_
         print("⚠️ EnhancedRateLimiter not available, skipping rate limiting")
         return None
     
+    if provider != "Google AI":
+        return _get_calibrated_provider_limiter(provider, model_name, api_key, calibrated)
+    
     with _enhanced_lock:
         # 🚨 CRITICAL: Free keys use GLOBAL limiter (per-project rate limit)
         # Paid keys can use per-key limiter (higher limits)
-        if is_paid_key and api_key:
+        # Calibrate xác nhận limit độc lập theo key -> mỗi key một limiter
+        per_key = is_paid_key or (calibrated is not None and calibrated.get("scope") == SCOPE_KEY)
+        if per_key and api_key:
             key_hash = _get_key_hash(api_key)
             limiter_key = f"{model_name}_{key_hash}"
         else:
@@ -634,13 +784,14 @@ def get_enhanced_rate_limiter(model_name: str, provider: str = "Google AI", api_
             tpm = None
             rpd = None
             
-            if is_paid_key:
+            if is_paid_key and calibrated is None:
                 # Paid keys: Very high limits
                 rpm = 900
                 tpm = 4000000  # 4M TPM
                 rpd = None  # Unlimited
                 safe_rpm = rpm
                 safe_tpm = tpm
+                safe_rpd = None
                 
                 key_display = f"key_***{key_hash}" if api_key else "default"
                 print(f"🔧 [Enhanced] Tạo rate limiter cho model: {model_name} ({key_display})")
@@ -666,6 +817,17 @@ def get_enhanced_rate_limiter(model_name: str, provider: str = "Google AI", api_
                 else:
                     rpm, tpm, rpd = 15, 1000000, 200  # Default safe
                 
+                if calibrated is not None:
+                    table_tpm = tpm
+                    rpm = calibrated["rpm"]
+                    if calibrated.get("tpm"):
+                        # TPM không chạm limit khi đo chỉ là cận dưới - không hạ thấp hơn bảng
+                        tpm = calibrated["tpm"] if calibrated.get("tpm_exact") else max(calibrated["tpm"], table_tpm or 0)
+                    if is_paid_key:
+                        rpd = None
+                    print(f"📐 Dùng limits đã calibrate ({calibrated.get('calibrated_at', '?')}): "
+                          f"{rpm} RPM, TPM {tpm:,}, phạm vi {calibrated.get('scope', SCOPE_UNKNOWN)}")
+                
                 # Safety factor 85%
                 safe_rpm = int(rpm * 0.85)
                 safe_tpm = int(tpm * 0.85) if tpm else None
@@ -744,7 +906,23 @@ def estimate_tokens(text: str) -> int:
 
 
 # Default values
-NUM_WORKERS = get_optimal_threads()  # Tự động tính theo máy
+_default_workers = None
+
+
+def get_default_workers():
+    """Số threads mặc định theo máy (tính ở lần dùng đầu tiên, không chạy lúc import module)"""
+    global _default_workers
+    if _default_workers is None:
+        _default_workers = get_optimal_threads()
+    return _default_workers
+
+
+def __getattr__(name):
+    # NUM_WORKERS giữ tương thích cho code bên ngoài, giá trị chỉ được tính khi truy cập
+    if name == "NUM_WORKERS":
+        return get_default_workers()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def format_error_chunk(error_type: str, error_message: str, original_lines: list, line_range: str) -> str:
     """
@@ -772,6 +950,11 @@ def format_error_chunk(error_type: str, error_message: str, original_lines: list
     return error_output
 
 
+def is_error_chunk_text(text: str) -> bool:
+    """Kiểm tra text trả về từ process_chunk có phải error chunk (format_error_chunk) không"""
+    return text.startswith('[') and ('HẾT QUOTA' in text or 'LỖI' in text)
+
+
 def threads_from_rpm(rpm: int, avg_latency_s: float = 2.0, safety: float = 0.85, max_threads: int = 50, min_threads: int = 1) -> int:
     """
     Tính số threads đề xuất dựa trên RPM mục tiêu để tránh rate limit.
@@ -803,6 +986,10 @@ def threads_from_rpm(rpm: int, avg_latency_s: float = 2.0, safety: float = 0.85,
     return max(min_threads, min(max_threads, concurrency))
 
 
+# Từ khóa cho biết chunk là nội dung có chương (ngưỡng kiểm tra linh hoạt hơn)
+CHAPTER_KEYWORDS = ('chương', 'chapter', '第', 'phần', 'tập')
+
+
 def is_bad_translation(text, input_text=None):
     """
     Kiểm tra xem bản dịch của chunk có đạt yêu cầu không.
@@ -870,26 +1057,14 @@ def is_bad_translation(text, input_text=None):
     is_chapter_title = False
     is_chapter_content = False
     
-    # Các pattern tiêu đề chương (thường ở đầu dòng)
-    chapter_patterns = [
-        r'^chương\s+\d+',          # "chương 1", "chương 23"
-        r'^chương\s+[ivxlc]+',     # "chương i", "chương iv"  
-        r'^chapter\s+\d+',         # "chapter 1", "chapter 23"
-        r'^第\d+章',                # "第1章", "第23章"
-        r'^phần\s+\d+',            # "phần 1", "phần 2"
-        r'^tập\s+\d+',             # "tập 1", "tập 2"
-    ]
-    
-    # Kiểm tra xem có phải tiêu đề chương thuần túy không (ngắn, chỉ có tiêu đề)
-    for pattern in chapter_patterns:
-        if re.search(pattern, text_lower) and len(text_stripped) < 200:
-            is_chapter_title = True
-            break
+    # Kiểm tra xem có phải tiêu đề chương thuần túy không (ngắn, chỉ có tiêu đề):
+    # "chương 1", "chương iv", "chapter 1", "第1章", "phần 1", "tập 1"
+    if len(text_stripped) < 200 and SECTION_HEADING_PATTERN.match(text_lower):
+        is_chapter_title = True
     
     # Nếu không phải tiêu đề chương thuần túy, kiểm tra có phải nội dung chứa chương không
     if not is_chapter_title:
-        chapter_keywords = ['chương', 'chapter', '第', 'phần', 'tập']
-        for keyword in chapter_keywords:
+        for keyword in CHAPTER_KEYWORDS:
             if keyword in text_lower:
                 is_chapter_content = True
                 break
@@ -945,8 +1120,7 @@ def is_bad_translation(text, input_text=None):
         if not (is_chapter_content or is_chapter_title):
             text_lower = text_stripped.lower()
             input_lower = input_text.lower()
-            chapter_keywords = ['chương', 'chapter', '第', 'phần', 'tập']
-            for keyword in chapter_keywords:
+            for keyword in CHAPTER_KEYWORDS:
                 if keyword in text_lower or keyword in input_lower:
                     is_chapter_content = True
                     break
@@ -982,91 +1156,233 @@ def is_bad_translation(text, input_text=None):
     
     return False
 
-def translate_chunk(model, chunk_lines, system_instruction, context="modern"):
+@functools.lru_cache(maxsize=128)
+def check_bad_translation(text, input_text=None):
     """
-    Dịch một chunk gồm nhiều dòng văn bản.
-    chunk_lines: danh sách các dòng văn bản
-    context: "modern" (hiện đại) hoặc "ancient" (cổ đại)
-    system_instruction: Chỉ dẫn hệ thống đầy đủ từ GUI
-    Trả về (translated_text, is_safety_blocked_flag, is_bad_translation_flag).
+    is_bad_translation có nhớ kết quả: provider kiểm tra bản dịch, sau đó translation memory
+    kiểm tra lại đúng bản dịch đó trước khi học - lần thứ hai dùng lại kết quả, không in cảnh báo lần nữa.
     """
-    # Gom các dòng thành một chuỗi lớn để gửi đi
-    full_text_to_translate = "\n".join(chunk_lines)
-    
-    # Bỏ qua các chunk chỉ chứa các dòng trống hoặc chỉ trắng
-    if not full_text_to_translate.strip():
-        return ("", False, False) # Trả về chuỗi rỗng, không bị chặn, không bad translation
+    return is_bad_translation(text, input_text)
 
+def _response_text(response):
+    """Lấy text từ response / chunk streaming của Google AI (bị chặn thì không có parts)"""
     try:
-        # Sử dụng system_instruction được truyền vào và thêm văn bản cần dịch
-        # Điều này đảm bảo prompt từ GUI được sử dụng
-        prompt = f"{system_instruction}\n\n{full_text_to_translate}"
-        
-        response = model.generate_content(
-            contents=[{
-                "role": "user",
-                "parts": [prompt],
-            }],
-            generation_config={
-                "response_mime_type": "text/plain",
-                # Có thể thêm các tham số khác nếu cần
-                # "temperature": 0.5,
-                # "top_p": 0.95,
-                # "top_k": 64,
-                # "max_output_tokens": 8192,
-            },
-        )
+        return response.text
+    except (ValueError, AttributeError, IndexError):
+        return ""
+
+def _blocked_categories(safety_ratings):
+    return ", ".join(rating.category.name for rating in safety_ratings or [] if rating.blocked)
 
-        # 1. Kiểm tra xem prompt (đầu vào) có bị chặn không
-        if response.prompt_feedback and response.prompt_feedback.safety_ratings:
-            blocked_categories = [
-                rating.category.name for rating in response.prompt_feedback.safety_ratings
-                if rating.blocked
-            ]
+class GoogleAIProvider(BaseProvider):
+    """Google AI (google.generativeai)"""
+
+    name = "Google AI"
+    error_label = "GOOGLE AI ERROR"
+    supports_streaming = True
+
+    def __init__(self, api_key, model_name, model_settings=None, is_bad=None):
+        super().__init__(api_key, model_name, model_settings, is_bad)
+        self.model = None
+        self.prefix_cached = False  # model tạo từ cached content chứa prefix -> không gửi lại prefix
+
+    def setup(self, system_instruction, use_prompt_cache=False):
+        super().setup(system_instruction, use_prompt_cache)
+        try:
+            import google.generativeai as genai
+        except ImportError:
+            raise ImportError("Google AI module không tìm thấy. Vui lòng cài đặt: pip install google-generativeai")
+        genai.configure(api_key=self.api_key)
+        
+        # Build generation config với thinking mode support
+        generation_config = {
+            "temperature": 0.7,
+            "top_p": 0.95,
+            "top_k": 40,
+            "max_output_tokens": 8192,
+        }
+        
+        # Add thinking config nếu enabled (chỉ cho Gemini 2.5+)
+        thinking_budget = self.model_settings.get("thinking_budget", 0)
+        if self.model_settings.get("thinking_mode", False) and thinking_budget > 0:
+            generation_config["thinking_config"] = {
+                "thinking_budget": thinking_budget
+            }
+        
+        safety_settings = {
+            "HARM_CATEGORY_HARASSMENT": "BLOCK_NONE",
+            "HARM_CATEGORY_HATE_SPEECH": "BLOCK_NONE",
+            "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_NONE",
+            "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_NONE",
+        }
+        
+        # Context caching: system_instruction (không kèm tiêu đề "Văn bản cần dịch:") nằm trong
+        # cached content (theo key + model); tiêu đề được gửi cùng văn bản của từng chunk
+        # Cache bị xóa phía server thì BaseProvider invalidate handle và gọi lại setup để tạo cache mới
+        self.cache_handle = None
+        if use_prompt_cache:
+            prefix, _ = split_text_header(system_instruction)
+            self.cache_handle = self.get_cache_manager().get(self.model_name, self.api_key, prefix)
+        self.prefix_cached = self.cache_handle is not None
+        
+        if self.cache_handle is not None:
+            self.model = genai.GenerativeModel.from_cached_content(
+                cached_content=self.cache_handle.ref,
+                generation_config=generation_config,
+                safety_settings=safety_settings
+            )
+        else:
+            self.model = genai.GenerativeModel(
+                model_name=self.model_name,
+                generation_config=generation_config,
+                safety_settings=safety_settings
+            )
+
+    def build_request(self, system_instruction, chunk_lines, context="modern", prompt_context=None):
+        # Prefix cố định luôn ở đầu để cache được; glossary / bản dịch tham khảo đứng trước tiêu đề
+        prefix, chunk_prompt = self.split_prompt(system_instruction, chunk_lines, prompt_context)
+        prompt = chunk_prompt if self.prefix_cached else f"{prefix}\n\n{chunk_prompt}"
+        return {
+            "contents": [{"role": "user", "parts": [prompt]}],
+            "generation_config": {"response_mime_type": "text/plain"},
+        }
+
+    def send(self, request):
+        return self.model.generate_content(**request)
+
+    def open_stream(self, request, guard):
+        # TTFT / idle do watchdog của iter_guarded kiểm tra; timeout của RPC chỉ là deadline
+        # rộng cho cả request (output dài vẫn chạy tiếp khi tokens còn về)
+        request_options = {"timeout": guard.total_timeout} if guard.total_timeout else None
+        return self.model.generate_content(stream=True, request_options=request_options, **request)
+
+    def _read(self, raw, response):
+        """Cập nhật response từ GenerateContentResponse (cả response thường và từng chunk streaming)"""
+        usage = getattr(raw, "usage_metadata", None)
+        if usage is not None:
+            response.prompt_tokens = getattr(usage, "prompt_token_count", 0)
+            response.completion_tokens = getattr(usage, "candidates_token_count", 0)
+            response.cached_tokens = getattr(usage, "cached_content_token_count", 0)
+
+        # 1. Prompt (đầu vào) bị chặn
+        feedback = getattr(raw, "prompt_feedback", None)
+        if feedback and feedback.safety_ratings:
+            blocked_categories = _blocked_categories(feedback.safety_ratings)
             if blocked_categories:
-                return (f"[NỘI DUNG GỐC BỊ CHẶN BỞI BỘ LỌC AN TOÀN - PROMPT: {', '.join(blocked_categories)}]", True, False)
-
-        # 2. Kiểm tra xem có bất kỳ ứng cử viên nào được tạo ra không
-        if not response.candidates:
-            return ("[NỘI DỊCH BỊ CHẶN HOÀN TOÀN BỞI BỘ LỌC AN TOÀN - KHÔNG CÓ ỨNG CỬ VIÊN]", True, False)
-
-        # 3. Kiểm tra lý do kết thúc của ứng cử viên đầu tiên (nếu có)
-        first_candidate = response.candidates[0]
-        if first_candidate.finish_reason == 'SAFETY':
-            blocked_categories = [
-                rating.category.name for rating in first_candidate.safety_ratings
-                if rating.blocked
-            ]
-            return (f"[NỘI DỊCH BỊ CHẶN BỞI BỘ LỌC AN TOÀN - OUTPUT: {', '.join(blocked_categories)}]", True, False)
-        
-        # 4. Kiểm tra nếu response bị cắt do vượt quá max_tokens
-        finish_reason_name = str(first_candidate.finish_reason)
-        if 'MAX_TOKENS' in finish_reason_name or finish_reason_name == 'LENGTH':
-            print(f"⚠️ Cảnh báo Google AI: Response bị cắt (finish_reason={finish_reason_name})")
-            translated_text = response.text
-            # Đánh dấu là bad translation để trigger re-chunk logic
-            return (translated_text + " [BỊ CẮT - CẦN CHUNK NHỎ HƠN]", False, True)
-
-        # Nếu không bị chặn, trả về văn bản dịch
-        translated_text = response.text
-        is_bad = is_bad_translation(translated_text, full_text_to_translate)
-        
-        # 🐛 DEBUG: Lưu response ngay lập tức (sẽ được gọi từ process_chunk với metadata đầy đủ)
-        # Note: chunk_index sẽ được truyền từ process_chunk
-        
-        return (translated_text, False, is_bad)
+                response.blocked = f"[NỘI DUNG GỐC BỊ CHẶN BỞI BỘ LỌC AN TOÀN - PROMPT: {blocked_categories}]"
+
+        candidates = getattr(raw, "candidates", None)
+        if not candidates:
+            return False
+        # 2. Lý do kết thúc của ứng cử viên đầu tiên: output bị chặn / bị cắt do max_tokens
+        first_candidate = candidates[0]
+        finish_reason = getattr(first_candidate.finish_reason, "name", str(first_candidate.finish_reason))
+        if finish_reason == "SAFETY":
+            response.blocked = (f"[NỘI DỊCH BỊ CHẶN BỞI BỘ LỌC AN TOÀN - OUTPUT: "
+                                f"{_blocked_categories(first_candidate.safety_ratings)}]")
+        elif "MAX_TOKENS" in finish_reason or finish_reason == "LENGTH":
+            response.finish_reason = "length"
+        return True
+
+    def parse(self, raw):
+        response = ProviderResponse()
+        if not self._read(raw, response) and not response.blocked:
+            response.blocked = "[NỘI DỊCH BỊ CHẶN HOÀN TOÀN BỞI BỘ LỌC AN TOÀN - KHÔNG CÓ ỨNG CỬ VIÊN]"
+        if not response.blocked:
+            response.text = _response_text(raw)
+        return response
+
+    def parse_stream_event(self, event, response):
+        self._read(event, response)
+        return _response_text(event)
+
+    def classify_error(self, error_message):
+        if check_quota_error(error_message):
+            return ERROR_QUOTA
+        if is_rate_limit_error(error_message):
+            return ERROR_RATE_LIMIT
+        return super().classify_error(error_message)
 
+
+def translate_chunk(model, chunk_lines, system_instruction, context="modern", stream_config=None, prompt_context=None, prefix_cached=False):
+    """
+    Dịch một chunk bằng Google AI model có sẵn (chia nhỏ recursive, retry với key khác).
+    chunk_lines: danh sách các dòng văn bản
+    context: "modern" (hiện đại) hoặc "ancient" (cổ đại)
+    system_instruction: Chỉ dẫn hệ thống đầy đủ từ GUI
+    stream_config: cấu hình streaming (từ build_stream_config), None = tắt
+    prompt_context: phần prompt thay đổi theo chunk (glossary, bản dịch tham khảo), đặt sau prefix cố định
+    prefix_cached: model được tạo từ cached content chứa system_instruction -> không gửi lại prefix
+    Trả về (translated_text, is_safety_blocked_flag, is_bad_translation_flag); lỗi API trả về dạng chuỗi.
+    """
+    provider_impl = GoogleAIProvider(None, getattr(model, "model_name", None), is_bad=is_bad_translation)
+    provider_impl.model = model
+    provider_impl.prefix_cached = prefix_cached
+    try:
+        return provider_impl.translate_chunk(system_instruction, chunk_lines, context,
+                                             stream_config=stream_config, prompt_context=prompt_context)
     except Exception as e:
         # Bắt các lỗi khác (ví dụ: lỗi mạng, lỗi API)
         error_message = str(e)
         
         # Kiểm tra lỗi quota exceeded
         if check_quota_error(error_message):
-            set_quota_exceeded()
+            set_quota_exceeded(error_message)
             return (f"[API HẾT QUOTA]", False, True)
         
         return (f"[LỖI API KHI DỊCH CHUNK: {e}]", False, True)
 
+
+class OpenRouterProvider(OpenAICompatibleProvider):
+    """OpenRouter - endpoint OpenAI-compatible với prompt theo bối cảnh + cache_control tường minh"""
+
+    name = "OpenRouter"
+
+    def __init__(self, api_key, model_name, model_settings=None, is_bad=None):
+        super().__init__(api_key, model_name, model_settings, is_bad)
+        self.base_url = OPENROUTER_API_BASE
+        self.name = OpenRouterProvider.name
+
+    def setup(self, system_instruction, use_prompt_cache=False):
+        super().setup(system_instruction, use_prompt_cache)
+        try:
+            from .open_router_translate import build_messages
+        except ImportError:
+            try:
+                from open_router_translate import build_messages
+            except ImportError:
+                raise ImportError("OpenRouter module không tìm thấy")
+        self.build_messages = build_messages
+
+    def build_headers(self):
+        headers = super().build_headers()
+        headers["HTTP-Referer"] = "https://github.com/TranslateNovelAI"
+        headers["X-Title"] = "TranslateNovelAI"
+        return headers
+
+    def request_timeout(self, request):
+        # 2 phút cơ bản + 1 giây mỗi 1000 ký tự, tối đa 5 phút
+        input_size = sum(len(str(message["content"])) for message in request["messages"])
+        return min(120 + input_size // 1000, 300)
+
+    def build_request(self, system_instruction, chunk_lines, context="modern", prompt_context=None):
+        explicit_cache = self.use_prompt_cache and needs_explicit_cache_control(self.model_name)
+        return {
+            "model": self.model_name,
+            "messages": self.build_messages(system_instruction, "\n".join(chunk_lines), context,
+                                            prompt_context, explicit_cache),
+            "temperature": 0.3,
+            "max_tokens": 8000,
+            "top_p": 1,
+            "frequency_penalty": 0,
+            "presence_penalty": 0,
+            "stream": False,
+        }
+
+
+register_provider("Google AI", GoogleAIProvider)
+register_provider("OpenRouter", OpenRouterProvider)
+
 def get_progress(progress_file_path):
     """Đọc tiến độ dịch từ file (số chunk đã hoàn thành)."""
     if os.path.exists(progress_file_path):
@@ -1348,7 +1664,7 @@ def split_and_translate_recursive(model, chunk_lines, system_instruction, contex
     
     return (combined, success)
 
-def process_chunk(api_key, model_name, system_instruction, chunk_data, provider="OpenRouter", log_callback=None, key_rotator=None, context="modern", is_paid_key=False, adaptive_thread_manager=None, input_file=None, model_settings=None):
+def process_chunk(api_key, model_name, system_instruction, chunk_data, provider="OpenRouter", log_callback=None, key_rotator=None, context="modern", is_paid_key=False, adaptive_thread_manager=None, input_file=None, model_settings=None, cancel_event=None, prompt_context=None):
     """
     Xử lý dịch một chunk với retry logic, rate limiting và re-chunking.
     chunk_data: tuple (chunk_index, chunk_lines, chunk_start_line_index)
@@ -1359,6 +1675,8 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
         context: "modern" (hiện đại) hoặc "ancient" (cổ đại) để xác định danh xưng người kể chuyện
         input_file: Đường dẫn file input (dùng cho debug logging)
         model_settings: Dict chứa các cài đặt model (thinking_mode, thinking_budget, etc.)
+        cancel_event: threading.Event - được set khi lần thử khác của chunk (hedge) đã xong trước
+        prompt_context: Phần prompt riêng của chunk (glossary, bản dịch tham khảo) - đặt sau system_instruction
     """
     chunk_index, chunk_lines, chunk_start_line_index = chunk_data
     
@@ -1368,6 +1686,8 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
     
     thinking_mode = model_settings.get("thinking_mode", False)
     thinking_budget = model_settings.get("thinking_budget", 0)
+    stream_config = build_stream_config(model_settings)
+    use_prompt_cache = is_prompt_cache_enabled(model_settings)
     
     # Tính toán line range cho chunk hiện tại
     chunk_end_line_index = chunk_start_line_index + len(chunk_lines) - 1
@@ -1376,11 +1696,11 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
     # Get current API key (from rotator if available)
     current_api_key = key_rotator.get_next_key() if key_rotator else api_key
     
-    # Get ENHANCED rate limiter cho Google AI với specific key (None cho OpenRouter)
+    # Get ENHANCED rate limiter với specific key (Google AI, hoặc provider khác đã calibrate - None nếu không có)
     rate_limiter = get_enhanced_rate_limiter(
         model_name, 
         provider, 
-        current_api_key if provider == "Google AI" else None, 
+        current_api_key, 
         is_paid_key=is_paid_key,
         desired_rpm=model_settings.get("target_rpm") if provider == "Google AI" else None
     )
@@ -1390,7 +1710,7 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
     estimated_tokens = estimate_tokens(chunk_text) if rate_limiter else 0
     
     # Debug logging với detailed state
-    if rate_limiter and provider == "Google AI":
+    if rate_limiter:
         stats = rate_limiter.get_stats()
         rpm_usage = stats.get('rpm_usage', 0)
         rpm_max = stats.get('rpm_max', 0)
@@ -1400,13 +1720,19 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
         
         # Show stats periodically or when high utilization
         if rpm_usage > 0 and (chunk_index % 20 == 0 or rpm_utilization > 0.8):
-            print(f"⏱️ Chunk {chunk_index}: RPM {rpm_usage}/{rpm_max} ({rpm_utilization:.0%}), TPM {tpm_usage:,}/{tpm_max:,}, Est: {estimated_tokens} tokens")
+            tpm_display = f"{tpm_usage:,}/{tpm_max:,}" if tpm_max else f"{tpm_usage:,}"
+            print(f"⏱️ Chunk {chunk_index}: RPM {rpm_usage}/{rpm_max} ({rpm_utilization:.0%}), TPM {tpm_display}, Est: {estimated_tokens} tokens")
             
             # Debug detailed state khi rate limit gần full
             if rpm_utilization > 0.9:
                 print(f"⚠️ WARNING: RPM usage at {rpm_utilization:.0%} - detailed debug:")
                 rate_limiter.debug_state()
     
+    # Lần thử khác của chunk này đã hoàn thành (hedging) - không cần gọi API nữa
+    if cancel_event is not None and cancel_event.is_set():
+        error_text = format_error_chunk("HỦY BỞI HEDGE", "Lần thử khác của chunk đã hoàn thành trước", chunk_lines, line_range)
+        return (chunk_index, error_text, len(chunk_lines), line_range)
+    
     # Kiểm tra flag dừng và quota exceeded trước khi bắt đầu
     if is_translation_stopped() or is_quota_exceeded():
         if is_quota_exceeded():
@@ -1416,64 +1742,46 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
             error_text = format_error_chunk("DỪNG BỞI NGƯỜI DÙNG", "Người dùng đã dừng quá trình dịch", chunk_lines, line_range)
             return (chunk_index, error_text, len(chunk_lines), line_range)
     
-    # Determine which API to use based on provider
+    # Provider (Google AI, OpenRouter hoặc provider đăng ký trong providers.py)
     use_google_ai = (provider == "Google AI")
-    use_openrouter = (provider == "OpenRouter")
+    provider_impl = create_provider(provider, current_api_key, model_name, model_settings, is_bad=check_bad_translation)
+    if provider_impl is None:
+        error_text = format_error_chunk("PROVIDER ERROR", f"Provider không được hỗ trợ: {provider}", chunk_lines, line_range)
+        return (chunk_index, error_text, len(chunk_lines), line_range)
     
-    # Khởi tạo biến openrouter_translate_chunk trước (để tránh lỗi UnboundLocalError)
-    openrouter_translate_chunk = None
-    
-    if use_google_ai:
-        # Setup Google AI (với current API key từ rotator)
-        try:
-            import google.generativeai as genai
-            genai.configure(api_key=current_api_key)
-            
-            # Build generation config với thinking mode support
-            generation_config = {
-                "temperature": 0.7,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 8192,
-            }
-            
-            # Add thinking config nếu enabled (chỉ cho Gemini 2.5+)
-            if thinking_mode and thinking_budget > 0:
-                generation_config["thinking_config"] = {
-                    "thinking_budget": thinking_budget
-                }
-                print(f"🧠 Chunk {chunk_index}: Thinking Mode enabled (budget: {thinking_budget} tokens)")
-            
-            model = genai.GenerativeModel(
-                model_name=model_name,
-                generation_config=generation_config,
-                safety_settings={
-                    "HARM_CATEGORY_HARASSMENT": "BLOCK_NONE",
-                    "HARM_CATEGORY_HATE_SPEECH": "BLOCK_NONE",
-                    "HARM_CATEGORY_SEXUALLY_EXPLICIT": "BLOCK_NONE",
-                    "HARM_CATEGORY_DANGEROUS_CONTENT": "BLOCK_NONE",
-                }
-            )
-        except ImportError:
-            error_text = format_error_chunk("IMPORT ERROR", "Google AI module không tìm thấy. Vui lòng cài đặt: pip install google-generativeai", chunk_lines, line_range)
-            return (chunk_index, error_text, len(chunk_lines), line_range)
+    try:
+        provider_impl.setup(system_instruction, use_prompt_cache)
+    except ImportError as e:
+        error_text = format_error_chunk("IMPORT ERROR", str(e), chunk_lines, line_range)
+        return (chunk_index, error_text, len(chunk_lines), line_range)
+    
+    # Ghi phiên (model_settings["record_session"]) để replay/benchmark sau
+    session_recorder = get_session_recorder()
+    if session_recorder is not None:
+        provider_impl = session_recorder.wrap(provider_impl, chunk_index, current_api_key)
+    
+    if use_google_ai and thinking_mode and thinking_budget > 0:
+        print(f"🧠 Chunk {chunk_index}: Thinking Mode enabled (budget: {thinking_budget} tokens)")
+    
+    # Chia nhỏ recursive: Google AI dùng model trực tiếp (để đổi key được), provider khác dịch qua provider_impl
+    model = getattr(provider_impl, "model", None)
+    split_translate_fn = (
+        lambda _key, _model, instruction, lines, ctx="modern", **kwargs: provider_impl.translate_chunk(instruction, lines, ctx)
+    )
     
-    if use_openrouter:
-        # Import OpenRouter translate function - dùng tên tạm để tránh UnboundLocalError
-        try:
-            from .open_router_translate import translate_chunk as _openrouter_func
-            openrouter_translate_chunk = _openrouter_func
-        except ImportError:
-            try:
-                from open_router_translate import translate_chunk as _openrouter_func
-                openrouter_translate_chunk = _openrouter_func
-            except ImportError:
-                error_text = format_error_chunk("IMPORT ERROR", "OpenRouter module không tìm thấy", chunk_lines, line_range)
-                return (chunk_index, error_text, len(chunk_lines), line_range)
+    def _split_recursive(reason):
+        return split_and_translate_recursive(
+            model, chunk_lines, system_instruction, context, chunk_index, reason,
+            level=1, max_level=3, use_google_ai=use_google_ai, use_openrouter=not use_google_ai,
+            api_key=current_api_key, model_name=model_name, openrouter_translate_chunk=split_translate_fn,
+            key_rotator=key_rotator
+        )
     
     # Thử lại với lỗi bảo mật
     safety_retries = 0
     is_safety_blocked = False  # Khởi tạo biến
+    # Lỗi tạm thời (429 / timeout / 5xx) của cả chunk - có backoff và giới hạn số lần
+    transient_retries = 0
     while safety_retries < MAX_RETRIES_ON_SAFETY_BLOCK:
         # Kiểm tra flag dừng và quota exceeded trong quá trình retry
         if is_translation_stopped() or is_quota_exceeded():
@@ -1487,6 +1795,10 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
         # Thử lại với bản dịch xấu  
         bad_translation_retries = 0
         while bad_translation_retries < MAX_RETRIES_ON_BAD_TRANSLATION:
+            if cancel_event is not None and cancel_event.is_set():
+                error_text = format_error_chunk("HỦY BỞI HEDGE", "Lần thử khác của chunk đã hoàn thành trước", chunk_lines, line_range)
+                return (chunk_index, error_text, len(chunk_lines), line_range)
+            
             # Kiểm tra flag dừng và quota exceeded trong quá trình retry
             if is_translation_stopped() or is_quota_exceeded():
                 if is_quota_exceeded():
@@ -1501,65 +1813,40 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
                 rate_limit_retry = 0
                 while rate_limit_retry <= MAX_RETRIES_ON_RATE_LIMIT:
                     try:
-                        # Rate limit cho Google AI - Multi-threading safe với TPM tracking
-                        if rate_limiter and use_google_ai:
+                        # Rate limit (Google AI / provider đã calibrate) - Multi-threading safe với TPM tracking
+                        if rate_limiter:
                             rate_limiter.acquire(estimated_tokens=estimated_tokens)  # Enhanced acquire với TPM
                         
-                        if use_google_ai:
-                            # Dịch với Google AI sử dụng hàm translate_chunk với system_instruction đầy đủ
-                            translated_text, is_safety_blocked, is_bad = translate_chunk(model, chunk_lines, system_instruction, context)
-                            
-                            # 🐛 DEBUG: Lưu response ngay lập tức
-                            key_hash = _get_key_hash(current_api_key) if current_api_key else "unknown"
-                            if input_file:
-                                save_debug_response(
-                                    chunk_index=chunk_index,
-                                    response_text=translated_text,
-                                    chunk_lines=chunk_lines,
-                                    input_file=input_file,
-                                    provider=provider,
-                                    model_name=model_name,
-                                    key_hash=key_hash
-                                )
-                            
-                            # Báo success cho adaptive throttling
-                            if rate_limiter:
-                                rate_limiter.on_success()
-                            
-                            # Báo success cho key rotator (ImprovedKeyRotator)
-                            if key_rotator and hasattr(key_rotator, 'report_success'):
-                                key_rotator.report_success(current_api_key)
-                            
-                            # Báo success cho adaptive thread manager
-                            if adaptive_thread_manager:
-                                adaptive_thread_manager.report_success()
-                            
-                            break  # Success, thoát khỏi rate limit retry loop
-                                
-                        elif use_openrouter:
-                            translated_text, is_safety_blocked, is_bad = openrouter_translate_chunk(api_key, model_name, system_instruction, chunk_lines, context)
-                            
-                            # 🐛 DEBUG: Lưu response ngay lập tức
-                            key_hash = _get_key_hash(api_key) if api_key else "unknown"
-                            if input_file:
-                                save_debug_response(
-                                    chunk_index=chunk_index,
-                                    response_text=translated_text,
-                                    chunk_lines=chunk_lines,
-                                    input_file=input_file,
-                                    provider=provider,
-                                    model_name=model_name,
-                                    key_hash=key_hash
-                                )
-                            
-                            # Báo success cho adaptive thread manager
-                            if adaptive_thread_manager:
-                                adaptive_thread_manager.report_success()
-                            
-                            break  # Success, thoát khỏi rate limit retry loop
-                        else:
-                            error_text = format_error_chunk("PROVIDER ERROR", f"Provider không được hỗ trợ: {provider}", chunk_lines, line_range)
-                            return (chunk_index, error_text, len(chunk_lines), line_range)
+                        translated_text, is_safety_blocked, is_bad = provider_impl.translate_chunk(
+                            system_instruction, chunk_lines, context, stream_config=stream_config, prompt_context=prompt_context
+                        )
+                        
+                        # 🐛 DEBUG: Lưu response ngay lập tức
+                        key_hash = _get_key_hash(current_api_key) if current_api_key else "unknown"
+                        if input_file:
+                            save_debug_response(
+                                chunk_index=chunk_index,
+                                response_text=translated_text,
+                                chunk_lines=chunk_lines,
+                                input_file=input_file,
+                                provider=provider,
+                                model_name=model_name,
+                                key_hash=key_hash
+                            )
+                        
+                        # Báo success cho adaptive throttling
+                        if rate_limiter:
+                            rate_limiter.on_success()
+                        
+                        # Báo success cho key rotator (ImprovedKeyRotator)
+                        if key_rotator and hasattr(key_rotator, 'report_success'):
+                            key_rotator.report_success(current_api_key)
+                        
+                        # Báo success cho adaptive thread manager
+                        if adaptive_thread_manager:
+                            adaptive_thread_manager.report_success()
+                        
+                        break  # Success, thoát khỏi rate limit retry loop
                             
                     except Exception as rate_error:
                         error_msg = str(rate_error)
@@ -1571,7 +1858,7 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
                             print(f"📝 Error detail: {error_msg[:200]}...")  # Log chi tiết lỗi
                             
                             # Báo rate limit error cho adaptive throttling
-                            if rate_limiter and use_google_ai:
+                            if rate_limiter:
                                 rate_limiter.on_rate_limit_error()
                             
                             # Báo rate limit error cho key rotator (ImprovedKeyRotator)
@@ -1612,16 +1899,11 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
                 bad_translation_retries += 1
                 
                 # Kiểm tra nếu bị cắt do max_tokens - chia nhỏ ngay lập tức với recursive 3 level
-                if "[BỊ CẮT - CẦN CHUNK NHỎ HƠN]" in translated_text and len(chunk_lines) > 3:
+                if "[BỊ CẮT - CẦN CHUNK NHỎ HƠN]" in translated_text and len(chunk_lines) > 3 and provider_impl.supports_split:
                     print(f"🔄 Chunk {chunk_index} bị cắt (max_tokens), sử dụng recursive splitting...")
                     
                     # Sử dụng recursive splitting với key_rotator support
-                    combined_result, success = split_and_translate_recursive(
-                        model, chunk_lines, system_instruction, context, chunk_index, "cut",
-                        level=1, max_level=3, use_google_ai=use_google_ai, use_openrouter=use_openrouter,
-                        api_key=api_key, model_name=model_name, openrouter_translate_chunk=openrouter_translate_chunk,
-                        key_rotator=key_rotator
-                    )
+                    combined_result, success = _split_recursive("cut")
                     
                     if success:
                         print(f"✅ Chunk {chunk_index} đã được chia nhỏ recursive và dịch thành công")
@@ -1635,16 +1917,11 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
                     time.sleep(RETRY_DELAY_SECONDS)
                 else:
                     # Hết lần thử bad translation, thử chia nhỏ chunk với recursive 3 level
-                    if len(chunk_lines) > 3:
+                    if len(chunk_lines) > 3 and provider_impl.supports_split:
                         print(f"🔄 Chunk {chunk_index} vẫn bad sau {MAX_RETRIES_ON_BAD_TRANSLATION} lần thử, sử dụng recursive splitting...")
                         
                         # Sử dụng recursive splitting với key_rotator support
-                        combined_result, success = split_and_translate_recursive(
-                            model, chunk_lines, system_instruction, context, chunk_index, "bad",
-                            level=1, max_level=3, use_google_ai=use_google_ai, use_openrouter=use_openrouter,
-                            api_key=api_key, model_name=model_name, openrouter_translate_chunk=openrouter_translate_chunk,
-                            key_rotator=key_rotator
-                        )
+                        combined_result, success = _split_recursive("bad")
                         
                         if success:
                             print(f"✅ Chunk {chunk_index} đã được chia nhỏ recursive và dịch thành công")
@@ -1660,93 +1937,73 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
             except Exception as e:
                 error_msg = str(e)
                 
-                # Xử lý lỗi theo provider
-                if use_google_ai:
-                    # Google AI specific error handling
-                    if check_quota_error(error_msg):
-                        # Google AI quota exceeded
-                        set_quota_exceeded()
-                        
-                        # Báo error cho key rotator
-                        if key_rotator and hasattr(key_rotator, 'report_error'):
-                            key_rotator.report_error(current_api_key, is_rate_limit=False)
-                        
-                        error_text = format_error_chunk("API HẾT QUOTA", f"Google AI hết quota: {error_msg}", chunk_lines, line_range)
-                        return (chunk_index, error_text, len(chunk_lines), line_range)
-                    elif is_rate_limit_error(error_msg):
-                        # Google AI rate limit - có thể retry
-                        print(f"⚠️ Google AI rate limit tại chunk {chunk_index}, sẽ retry...")
-                        
-                        # Báo rate limit error cho key rotator
-                        if key_rotator and hasattr(key_rotator, 'report_error'):
-                            key_rotator.report_error(current_api_key, is_rate_limit=True)
-                        
-                        continue
-                    elif "context_length" in error_msg.lower() or "too long" in error_msg.lower() or "maximum" in error_msg.lower():
-                        # Context length error - chia nhỏ chunk với recursive 3 level
-                        if len(chunk_lines) > 3:
-                            print(f"🔄 Chunk {chunk_index} quá lớn cho Google AI (context_length), sử dụng recursive splitting...")
-                            
-                            # Sử dụng recursive splitting với key_rotator support
-                            combined_result, success = split_and_translate_recursive(
-                                model, chunk_lines, system_instruction, context, chunk_index, "ctx",
-                                level=1, max_level=3, use_google_ai=use_google_ai, use_openrouter=use_openrouter,
-                                api_key=api_key, model_name=model_name, openrouter_translate_chunk=openrouter_translate_chunk,
-                                key_rotator=key_rotator
-                            )
-                            
-                            if success:
-                                print(f"✅ Chunk {chunk_index} context_length đã được xử lý thành công")
-                            else:
-                                print(f"⚠️ Chunk {chunk_index} context_length xử lý nhưng có một số phần thất bại")
-                            
-                            return (chunk_index, combined_result, len(chunk_lines), line_range)
-                        else:
-                            # Chunk quá nhỏ nhưng vẫn context_length error - lỗi nghiêm trọng
-                            error_text = format_error_chunk("CONTEXT LENGTH ERROR", f"Chunk quá nhỏ ({len(chunk_lines)} dòng) nhưng vẫn bị context_length: {error_msg}", chunk_lines, line_range)
-                            return (chunk_index, error_text, len(chunk_lines), line_range)
-                    else:
-                        # Google AI generic error
-                        error_text = format_error_chunk("GOOGLE AI ERROR", f"Lỗi Google AI: {error_msg}", chunk_lines, line_range)
-                        return (chunk_index, error_text, len(chunk_lines), line_range)
-                
-                elif use_openrouter:
-                    # OpenRouter specific error handling (existing logic)
-                    if check_openrouter_quota_error(error_msg):
-                        # 402: Insufficient Credits - dừng hoàn toàn
-                        set_quota_exceeded()
-                        error_text = format_error_chunk("API HẾT QUOTA", f"OpenRouter hết credit (402): {error_msg}", chunk_lines, line_range)
-                        return (chunk_index, error_text, len(chunk_lines), line_range)
+                # Phân loại lỗi theo provider
+                error_kind = provider_impl.classify_error(error_msg)
                 
-                    elif check_openrouter_api_key_error(error_msg):
-                        # 401: Invalid Credentials - dừng hoàn toàn
-                        error_text = format_error_chunk("API KEY ERROR", f"API key không hợp lệ (401): {error_msg}", chunk_lines, line_range)
-                        return (chunk_index, error_text, len(chunk_lines), line_range)
+                if error_kind == ERROR_QUOTA:
+                    # Hết quota / credit - dừng hoàn toàn
+                    set_quota_exceeded(error_msg)
+                    
+                    # Báo error cho key rotator
+                    if key_rotator and hasattr(key_rotator, 'report_error'):
+                        key_rotator.report_error(current_api_key, is_rate_limit=False)
+                    
+                    error_text = format_error_chunk("API HẾT QUOTA", f"{provider_impl.name} hết quota: {error_msg}", chunk_lines, line_range)
+                    return (chunk_index, error_text, len(chunk_lines), line_range)
                 
-                    elif check_openrouter_rate_limit_error(error_msg):
-                        # 429: Rate Limit - có thể retry
-                        print(f"⚠️ Rate limit (429) tại chunk {chunk_index}, sẽ retry...")
-                        # Để tiếp tục retry loop thay vì return ngay
-                        continue
+                elif error_kind == ERROR_AUTH:
+                    # 401: Invalid Credentials - dừng hoàn toàn
+                    error_text = format_error_chunk("API KEY ERROR", f"API key không hợp lệ (401): {error_msg}", chunk_lines, line_range)
+                    return (chunk_index, error_text, len(chunk_lines), line_range)
                 
-                    elif check_openrouter_moderation_error(error_msg):
-                        # 403: Moderation - content bị block
-                        error_text = format_error_chunk("MODERATION ERROR", f"Nội dung vi phạm chính sách (403): {error_msg}", chunk_lines, line_range)
+                elif error_kind in (ERROR_RATE_LIMIT, ERROR_TIMEOUT, ERROR_SERVICE):
+                    # 429 / 408 / 502, 503 - retry với exponential backoff, hết lượt thì lưu chunk lỗi
+                    error_labels = {
+                        ERROR_RATE_LIMIT: ("Rate limit (429)", "API RATE LIMIT"),
+                        ERROR_TIMEOUT: ("Timeout (408)", "API TIMEOUT"),
+                        ERROR_SERVICE: ("Service error (502/503)", "API SERVICE ERROR"),
+                    }
+                    error_name, error_type = error_labels[error_kind]
+                    
+                    if error_kind == ERROR_RATE_LIMIT and key_rotator and hasattr(key_rotator, 'report_error'):
+                        key_rotator.report_error(current_api_key, is_rate_limit=True)
+                    
+                    if transient_retries >= MAX_RETRIES_ON_TRANSIENT_ERROR:
+                        error_text = format_error_chunk(error_type, f"{provider_impl.name}: {error_name} sau {MAX_RETRIES_ON_TRANSIENT_ERROR} lần retry: {error_msg}", chunk_lines, line_range)
                         return (chunk_index, error_text, len(chunk_lines), line_range)
+                    
+                    transient_retries += 1
+                    print(f"⚠️ {error_name} tại chunk {chunk_index} ({provider_impl.name}), retry {transient_retries}/{MAX_RETRIES_ON_TRANSIENT_ERROR}...")
+                    exponential_backoff_sleep(transient_retries - 1)
+                    continue
                 
-                    elif check_openrouter_timeout_error(error_msg):
-                        # 408: Timeout - có thể retry
-                        print(f"⚠️ Timeout (408) tại chunk {chunk_index}, sẽ retry...")
-                        continue
+                elif error_kind == ERROR_MODERATION:
+                    # 403: Moderation - content bị block
+                    error_text = format_error_chunk("MODERATION ERROR", f"Nội dung vi phạm chính sách (403): {error_msg}", chunk_lines, line_range)
+                    return (chunk_index, error_text, len(chunk_lines), line_range)
                 
-                    elif check_openrouter_service_error(error_msg):
-                        # 502, 503: Service errors - có thể retry
-                        print(f"⚠️ Service error (502/503) tại chunk {chunk_index}, sẽ retry...")
-                        continue
+                elif error_kind == ERROR_CONTEXT_LENGTH:
+                    # Context length error - chia nhỏ chunk với recursive 3 level
+                    if len(chunk_lines) > 3 and provider_impl.supports_split:
+                        print(f"🔄 Chunk {chunk_index} quá lớn cho {provider_impl.name} (context_length), sử dụng recursive splitting...")
+                        
+                        # Sử dụng recursive splitting với key_rotator support
+                        combined_result, success = _split_recursive("ctx")
+                        
+                        if success:
+                            print(f"✅ Chunk {chunk_index} context_length đã được xử lý thành công")
+                        else:
+                            print(f"⚠️ Chunk {chunk_index} context_length xử lý nhưng có một số phần thất bại")
+                        
+                        return (chunk_index, combined_result, len(chunk_lines), line_range)
+                    else:
+                        # Chunk quá nhỏ nhưng vẫn context_length error - lỗi nghiêm trọng
+                        error_text = format_error_chunk("CONTEXT LENGTH ERROR", f"Chunk quá nhỏ ({len(chunk_lines)} dòng) nhưng vẫn bị context_length: {error_msg}", chunk_lines, line_range)
+                        return (chunk_index, error_text, len(chunk_lines), line_range)
                 
                 else:
-                    # Generic error cho cả hai provider
-                    error_text = format_error_chunk("API ERROR", f"Lỗi khi gọi API: {error_msg}", chunk_lines, line_range)
+                    # Lỗi khác - không retry
+                    error_text = format_error_chunk(provider_impl.error_label, f"Lỗi {provider_impl.name}: {error_msg}", chunk_lines, line_range)
                     return (chunk_index, error_text, len(chunk_lines), line_range)
         
         # Nếu bị chặn safety, thử lại
@@ -1763,6 +2020,198 @@ def process_chunk(api_key, model_name, system_instruction, chunk_data, provider=
     error_text = format_error_chunk("UNKNOWN ERROR", "Không thể dịch chunk sau tất cả các lần thử", chunk_lines, line_range)
     return (chunk_index, error_text, len(chunk_lines), line_range)
 
+def _build_route(entry, base_settings, tier, label):
+    """Tạo ProviderRoute từ một dict cấu hình (extra_providers / fallback_tiers). None nếu không hợp lệ."""
+    route_provider = entry.get("provider", "OpenRouter")
+    route_model = entry.get("model")
+    route_keys = entry.get("api_key")
+    # Server tự host (OpenAI Compatible) có thể không cần key
+    if not route_model or (not route_keys and route_provider in ("Google AI", "OpenRouter")):
+        print(f"⚠️ {label}: thiếu model hoặc api_key, bỏ qua")
+        return None
+
+    keys = route_keys if isinstance(route_keys, list) else [route_keys or ""]
+    route_settings = dict(base_settings)
+    route_settings.pop("target_rpm", None)
+    route_settings.update(entry.get("settings") or {})
+    if entry.get("base_url"):
+        route_settings["base_url"] = entry["base_url"]
+
+    results = validate_api_keys(keys, route_model, route_provider, check_api_key_access, route_settings)
+    if not any(result.is_valid for result in results):
+        print(f"❌ {label} ({route_provider}:{route_model}): {results[0].message} - bỏ qua")
+        return None
+
+    route_key_rotator = None
+    if route_provider == "Google AI" and len(keys) > 1:
+        route_key_rotator = create_key_rotator(keys, same_project=False)
+        mark_invalid_keys(route_key_rotator, results)
+
+    # Google AI đã có EnhancedRateLimiter trong process_chunk; limiter riêng cho provider khác
+    route_limiter = None
+    if entry.get("rpm") and route_provider != "Google AI":
+        route_limiter = MultiThreadRateLimiter(requests_per_minute=int(entry["rpm"]))
+
+    route = ProviderRoute(
+        name=f"{route_provider}:{route_model}",
+        provider=route_provider,
+        model_name=route_model,
+        api_key=keys[0],
+        is_paid_key=bool(entry.get("is_paid_key", False)),
+        max_concurrency=entry.get("max_concurrency", 4),
+        key_rotator=route_key_rotator,
+        rate_limiter=route_limiter,
+        model_settings=route_settings,
+        tier=tier,
+    )
+    print(f"✅ {label}: {route.name} (tier {tier}, concurrency {route.max_concurrency})")
+    return route
+
+def build_provider_router(api_key, model_name, provider, is_paid_key, key_rotator, model_settings, num_workers):
+    """
+    Tạo ProviderRouter từ provider chính + model_settings["extra_providers"] + model_settings["fallback_tiers"].
+
+    Mỗi phần tử của extra_providers là một dict:
+        {
+            "provider": "OpenRouter" | "Google AI" | "OpenAI Compatible",
+            "base_url": "http://localhost:8080/v1",  # OpenAI Compatible
+            "model": "google/gemini-2.0-flash-001",
+            "api_key": "sk-or-..." hoặc ["key1", "key2"],
+            "is_paid_key": false,        # Google AI
+            "max_concurrency": 4,        # số request đồng thời trên route
+            "rpm": 60,                   # giới hạn RPM riêng (tùy chọn)
+            "settings": {...}            # ghi đè model_settings cho route (tùy chọn)
+        }
+
+    fallback_tiers là danh sách có thứ tự; mỗi tier là một dict như trên hoặc list các dict.
+    Tier chỉ được dùng khi mọi route của các tier trước đã hết quota / hết RPD / chậm kéo dài.
+
+    Returns:
+        ProviderRouter hoặc None nếu không có extra provider / fallback tier hợp lệ
+    """
+    extra_providers = model_settings.get("extra_providers") or []
+    fallback_tiers = model_settings.get("fallback_tiers") or []
+    if not extra_providers and not fallback_tiers:
+        return None
+
+    # Cài đặt chung cho mọi route (bỏ các key cấu hình router)
+    base_settings = {k: v for k, v in model_settings.items() if k not in ("extra_providers", "fallback_tiers")}
+
+    primary_key = api_key[0] if isinstance(api_key, list) else api_key
+    routes = [ProviderRoute(
+        name=f"{provider}:{model_name}",
+        provider=provider,
+        model_name=model_name,
+        api_key=primary_key,
+        is_paid_key=is_paid_key,
+        max_concurrency=num_workers,
+        key_rotator=key_rotator,
+        model_settings=base_settings,
+    )]
+
+    for i, entry in enumerate(extra_providers, 1):
+        route = _build_route(entry, base_settings, 0, f"Extra provider #{i}")
+        if route:
+            routes.append(route)
+
+    for tier, tier_entries in enumerate(fallback_tiers, 1):
+        if isinstance(tier_entries, dict):
+            tier_entries = [tier_entries]
+        for entry in tier_entries:
+            route = _build_route(entry, base_settings, tier, f"Fallback tier {tier}")
+            if route:
+                routes.append(route)
+
+    if len(routes) < 2:
+        return None
+
+    try:
+        latency_factor = float(model_settings.get("fallback_latency_factor", 3.0))
+        latency_window = int(model_settings.get("fallback_latency_window", 5))
+    except (ValueError, TypeError):
+        latency_factor, latency_window = 3.0, 5
+    return ProviderRouter(routes, latency_factor=latency_factor, latency_window=latency_window)
+
+def _seconds_until_next_day(now):
+    """Số giây từ now (datetime) tới 0h hôm sau - mốc reset RPD của limiter"""
+    next_day = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (next_day - now).total_seconds()
+
+def _route_quota_cooldown(route, error_message=None):
+    """
+    Cooldown (giây) cho route hết quota: retry delay trong lỗi, mốc reset nếu là quota
+    theo ngày, cửa sổ RPM nếu provider/model đã calibrate; None = cooldown mặc định của router.
+    """
+    delay = parse_retry_delay(error_message)
+    if delay is not None:
+        return delay
+    lowered = str(error_message or "").lower()
+    if any(marker in lowered for marker in ("perday", "per day", "per_day", "daily")):
+        return _seconds_until_next_day(datetime.now())
+    if get_calibrated_limits(route.provider, route.model_name):
+        return RATE_LIMIT_WINDOW_SECONDS
+    return None
+
+def process_chunk_routed(router, system_instruction, chunk_data, context="modern", adaptive_thread_manager=None, input_file=None, cancel_event=None, prompt_context=None):
+    """
+    Dịch một chunk trên route do ProviderRouter chọn (thay cho process_chunk khi có nhiều provider).
+    Nếu route hết quota / hết RPD mà vẫn còn route fallback, chunk được dịch lại trên route khác.
+    Trả về cùng format với process_chunk: (chunk_index, translated_text, lines_count, line_range)
+    """
+    chunk_index, chunk_lines, chunk_start_line_index = chunk_data
+    line_range = f"{chunk_start_line_index + 1}:{chunk_start_line_index + len(chunk_lines)}"
+
+    while True:
+        route = router.acquire(stop_check=is_translation_stopped)
+        if route is None:
+            if router.active_tier() is None:
+                error_text = format_error_chunk("API HẾT QUOTA", "Tất cả provider/fallback tiers đã hết quota", chunk_lines, line_range)
+            else:
+                error_text = format_error_chunk("DỪNG BỞI NGƯỜI DÙNG", "Người dùng đã dừng quá trình dịch", chunk_lines, line_range)
+            return (chunk_index, error_text, len(chunk_lines), line_range)
+
+        # Hết RPD trên route Google AI -> chuyển tier trước khi gọi API
+        if route.provider == "Google AI" and router.has_fallback(route):
+            limiter = get_enhanced_rate_limiter(route.model_name, route.provider, route.api_key,
+                                                is_paid_key=route.is_paid_key,
+                                                desired_rpm=route.model_settings.get("target_rpm"))
+            if limiter is not None and limiter.get_rpd_remaining() == 0:
+                router.release(route, 0, 0, record=False)
+                router.demote(route, "hết RPD hôm nay", cooldown=_seconds_until_next_day(limiter.clock.now()))
+                continue
+
+        def _on_quota_exceeded(error_message=None, route=route):
+            # Còn route khác -> chỉ hạ cấp route này (tới mốc reset), không dừng cả lần dịch
+            if router.has_fallback(route):
+                router.demote(route, "hết quota", cooldown=_route_quota_cooldown(route, error_message))
+                return True
+            return False
+
+        request_start = time.time()
+        result = None
+        quota_handled = False
+        _quota_context.handler = _on_quota_exceeded
+        try:
+            if route.rate_limiter is not None:
+                route.rate_limiter.acquire()
+            result = process_chunk(route.api_key, route.model_name, system_instruction, chunk_data, route.provider,
+                                   None, route.key_rotator, context, route.is_paid_key, adaptive_thread_manager,
+                                   input_file, route.model_settings, cancel_event=cancel_event, prompt_context=prompt_context)
+        finally:
+            quota_handled = getattr(_quota_context, "exceeded", False)
+            _quota_context.handler = None
+            _quota_context.exceeded = False
+
+            is_error = result is None or is_error_chunk_text(result[1])
+            # Lần thử bị hủy (hedge thua) không phản ánh chất lượng route
+            cancelled = cancel_event is not None and cancel_event.is_set()
+            router.release(route, time.time() - request_start, len(chunk_lines), is_error, record=not cancelled)
+
+        if quota_handled and not is_translation_stopped():
+            print(f"🔁 Chunk {chunk_index + 1}: dịch lại trên route fallback")
+            continue
+        return result
+
 def retry_failed_chunks(input_file, output_file, progress_file_path, api_key, model_name, system_instruction, provider="OpenRouter", context="modern", is_paid_key=False):
     """
     Retry các chunks đã failed từ lần dịch trước
@@ -1819,6 +2268,80 @@ def generate_output_filename(input_filepath):
     else:
         return new_name
 
+class OutputWriter:
+    """
+    Ghi bản dịch vào file output theo thứ tự chunk: reformat từng chunk ngay khi ghi
+    (StreamingReformatter) và feed EPUB dựng song song. Dùng chung cho chế độ thường và batch mode.
+
+    Khi dịch tiếp (completed_chunks > 0), chunk_info là 'current_chunk' của file tiến độ
+    (chứa reformat_state / epub_state do add_states() lưu).
+    """
+
+    def __init__(self, output_file, model_settings, completed_chunks=0, chunk_info=None):
+        chunk_info = chunk_info or {}
+        self.output_file = output_file
+        self.mode = 'a' if completed_chunks > 0 else 'w'  # Append nếu có tiến độ cũ, write nếu bắt đầu mới
+        self.outfile = None
+
+        # Reformat từng chunk ngay khi ghi (xóa **, gộp dòng trống) thay vì đọc lại cả file sau khi dịch
+        self.reformatter = None
+        if CAN_REFORMAT and model_settings.get("auto_reformat", True):
+            if completed_chunks > 0:
+                self.reformatter = StreamingReformatter.from_state(chunk_info.get('reformat_state'))
+            else:
+                self.reformatter = StreamingReformatter()
+
+        # Dựng EPUB song song: chương nào xong (đã ghi hết) được render ngay vào staging
+        self.epub_builder = create_incremental_epub_builder(model_settings, output_file)
+        if self.epub_builder and completed_chunks > 0:
+            self.epub_builder.resume(output_file, chunk_info.get('epub_state'))
+
+    def __enter__(self):
+        # newline='\n': byte ghi ra đúng bằng text đưa cho epub_builder (offset resume không lệch
+        # do Windows đổi \n thành \r\n)
+        self.outfile = open(self.output_file, self.mode, encoding='utf-8', newline='\n')
+        self.mode = 'a'
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.outfile.close()
+        self.outfile = None
+        return False
+
+    def write_output(self, text):
+        self.outfile.write(text)
+        self.outfile.flush()
+        if self.epub_builder:
+            self.epub_builder.feed(text)
+
+    def write_chunk(self, chunk_text):
+        if not chunk_text.endswith('\n'):
+            chunk_text += '\n'
+        self.write_output(self.reformatter.feed(chunk_text) if self.reformatter else chunk_text)
+
+    def add_states(self, chunk_info):
+        """Trạng thái reformat/EPUB của phần đã ghi - lưu cùng tiến độ để resume nối tiếp đúng"""
+        if self.reformatter:
+            chunk_info['reformat_state'] = self.reformatter.get_state()
+        if self.epub_builder:
+            chunk_info['epub_state'] = self.epub_builder.get_state()
+        return chunk_info
+
+    def finish(self):
+        """Ghi phần cuối của reformat (bỏ dòng trống cuối file) và hoàn thành EPUB. Gọi khi file đang mở."""
+        if self.reformatter:
+            self.write_output(self.reformatter.finish())
+            print("\n🔧 Reformat (stream) hoàn thành:")
+            self.reformatter.print_stats()
+        elif not CAN_REFORMAT:
+            print("⚠️ Chức năng reformat không khả dụng")
+
+        if self.epub_builder:
+            try:
+                self.epub_builder.finish()
+            except Exception as e:
+                print(f"⚠️ Lỗi khi hoàn thành EPUB: {e}")
+
 def translate_file_optimized(input_file, output_file=None, api_key=None, model_name="gemini-2.0-flash", system_instruction=None, num_workers=None, chunk_size_lines=None, provider="OpenRouter", context="modern", is_paid_key=False, model_settings=None):
     """
     Phiên bản dịch file với multi-threading chunks.
@@ -1836,6 +2359,10 @@ def translate_file_optimized(input_file, output_file=None, api_key=None, model_n
     if model_settings is None:
         model_settings = {}
     
+    # Limits đã calibrate (rate_limits_profile.json trong thư mục cấu hình, hoặc
+    # model_settings["limits_profile"]): đọc một lần cho cả lần dịch
+    activate_limits_profile(model_settings.get("limits_profile"))
+    
     thinking_mode = model_settings.get("thinking_mode", False)
     thinking_budget = model_settings.get("thinking_budget", 0)
     
@@ -1845,6 +2372,38 @@ def translate_file_optimized(input_file, output_file=None, api_key=None, model_n
     else:
         print(f"🧠 Thinking Mode: TẮT")
     
+    stream_config = build_stream_config(model_settings)
+    if stream_config:
+        print(f"📡 Streaming Mode: BẬT (TTFT {stream_config['ttft_timeout']}s, idle {stream_config['idle_timeout']}s, max ratio {stream_config['max_output_ratio']})")
+    
+    def _hedge_budget_available():
+        """Chỉ hedge khi rate limiter còn dư (hedge cũng bị tính vào RPM/RPD)"""
+        if provider != "Google AI":
+            return True
+        keys = api_key if isinstance(api_key, list) else [api_key]
+        for key in keys:
+            limiter = get_enhanced_rate_limiter(model_name, provider, key, is_paid_key=is_paid_key,
+                                                desired_rpm=model_settings.get("target_rpm"))
+            if limiter is None or limiter.get_stats().get('rpm_utilization', 0) < 0.8:
+                return True
+        return False
+    
+    hedge_controller = create_hedge_controller(model_settings, budget_check=_hedge_budget_available)
+    if hedge_controller:
+        print(f"🪁 Hedging: BẬT (p{hedge_controller.percentile:g}, tối đa {hedge_controller.max_hedge_ratio:.0%} requests)")
+    
+    if is_prompt_cache_enabled(model_settings):
+        print("🗄️ Prompt Cache: BẬT (system instruction được cache phía provider, phần riêng của chunk gửi sau)")
+    
+    chunk_deduplicator = create_chunk_deduplicator(model_settings, is_error=is_error_chunk_text, stop_check=is_translation_stopped)
+    
+    translation_memory = create_translation_memory(
+        model_settings, input_file,
+        validate=lambda text, source: not is_error_chunk_text(text) and not check_bad_translation(text, source)
+    )
+    
+    glossary = load_glossary(model_settings["glossary_path"]) if model_settings.get("glossary_path") else None
+    
     # Setup key rotator nếu có multiple Google AI keys
     key_rotator = None
     if provider == "Google AI" and isinstance(api_key, list) and len(api_key) > 1:
@@ -1861,7 +2420,7 @@ def translate_file_optimized(input_file, output_file=None, api_key=None, model_n
     
     # Validate và thiết lập parameters
     if num_workers is None:
-        num_workers = NUM_WORKERS
+        num_workers = get_default_workers()
     else:
         num_workers = validate_threads(num_workers)
     
@@ -1892,6 +2451,12 @@ def translate_file_optimized(input_file, output_file=None, api_key=None, model_n
             else:
                 base_rpm = 10  # Default safe
             
+            # Limits đã calibrate (rate_limits_profile.json) thay cho bảng trên
+            calibrated = get_calibrated_limits(provider, model_name)
+            per_key_scope = calibrated is not None and calibrated.get("scope") == SCOPE_KEY
+            if calibrated is not None:
+                base_rpm = calibrated["rpm"]
+            
             # 🚨 FORCE AUTO-CALCULATE: User input bị bỏ qua!
             # Calculate safe RPM (same logic as rate limiter)
             safe_rpm = int(base_rpm * 0.85)
@@ -1901,23 +2466,29 @@ def translate_file_optimized(input_file, output_file=None, api_key=None, model_n
             # 🌐 GLOBAL RATE LIMIT (per-project, not per-key!)
             # Multiple keys from SAME project share the SAME rate limit
             # → Threads = safe_rpm (NOT multiplied by num_keys!)
-            optimal_threads = safe_rpm
+            # Trừ khi calibrate xác nhận limit độc lập theo key → nhân với số keys
+            total_rpm = safe_rpm * num_keys if per_key_scope else safe_rpm
+            optimal_threads = total_rpm
             
             # Minimum: at least 1 thread per 2 keys (for rotation)
             min_threads = max(1, num_keys // 2)
             optimal_threads = max(optimal_threads, min_threads)
             
-            # Maximum: never exceed safe_rpm (no benefit, causes rate limit)
-            optimal_threads = min(optimal_threads, safe_rpm)
+            # Maximum: never exceed total RPM (no benefit, causes rate limit)
+            optimal_threads = validate_threads(min(optimal_threads, total_rpm))
             
             print(f"🔧 Google AI Free Keys - AUTO MODE (User input BỊ BỎ QUA)")
             print(f"   📊 Model: {model_name}")
             print(f"   🔑 Keys: {num_keys} keys")
-            print(f"   📈 Base RPM: {base_rpm}, Safe RPM: {safe_rpm} (×0.85)")
-            print(f"   🌐 GLOBAL LIMIT: Tất cả keys chia sẻ {safe_rpm} RPM")
-            print(f"   🎯 Auto-calculated threads: {optimal_threads}")
-            print(f"   💡 Formula: safe_rpm = {safe_rpm} (KHÔNG nhân với số keys!)")
-            print(f"   ⚠️  Multiple keys CHỈ để rotate/failover, KHÔNG tăng throughput")
+            print(f"   📈 Base RPM: {base_rpm}{' (calibrated)' if calibrated else ''}, Safe RPM: {safe_rpm} (×0.85)")
+            if per_key_scope:
+                print(f"   🔑 PER-KEY LIMIT (đã calibrate): {num_keys} keys × {safe_rpm} RPM = {total_rpm} RPM")
+                print(f"   🎯 Auto-calculated threads: {optimal_threads}")
+            else:
+                print(f"   🌐 GLOBAL LIMIT: Tất cả keys chia sẻ {safe_rpm} RPM")
+                print(f"   🎯 Auto-calculated threads: {optimal_threads}")
+                print(f"   💡 Formula: safe_rpm = {safe_rpm} (KHÔNG nhân với số keys!)")
+                print(f"   ⚠️  Multiple keys CHỈ để rotate/failover, KHÔNG tăng throughput")
             
             if num_workers != optimal_threads:
                 print(f"   ⚠️  User input ({num_workers}) → OVERRIDDEN → {optimal_threads} threads")
@@ -1961,22 +2532,34 @@ def translate_file_optimized(input_file, output_file=None, api_key=None, model_n
     # Validate API key trước khi bắt đầu translation
     print("🔑 Đang kiểm tra API key...")
     
-    # Test từng key riêng biệt để xác định quota isolation
+    # Keys được test song song bằng request metadata, kết quả cache theo TTL (resume / chạy lại không test lại)
     if isinstance(api_key, list) and len(api_key) > 1:
-        print(f"🧪 Testing quota isolation với {len(api_key)} keys...")
-        for i, key in enumerate(api_key[:3], 1):  # Test 3 keys đầu
-            is_valid, validation_message = validate_api_key_before_translation(key, model_name, provider)
-            if is_valid:
-                print(f"✅ Key #{i}: {validation_message}")
-            else:
-                print(f"❌ Key #{i}: {validation_message}")
+        print(f"🧪 Kiểm tra song song {len(api_key)} keys...")
+        results = validate_api_keys(api_key, model_name, provider, check_api_key_access, model_settings)
+        for result in results:
+            icon = "✅" if result.is_valid else ("⏳" if result.transient else "❌")
+            cached_note = " (cache)" if result.cached else ""
+            print(f"{icon} Key #{result.index}: {result.message}{cached_note}")
+        if all(result.is_invalid for result in results):
+            print("❌ Không có API key nào hợp lệ")
+            return False
+        # Key lỗi thật (401, hết credit...) không nhận request nào
+        invalid_count = mark_invalid_keys(key_rotator, results)
+        if invalid_count:
+            print(f"⚠️ Đã loại {invalid_count}/{len(api_key)} keys không hợp lệ khỏi rotation")
     else:
-        is_valid, validation_message = validate_api_key_before_translation(validation_key, model_name, provider)
-        if not is_valid:
-            print(f"❌ {validation_message}")
+        result = validate_api_keys([validation_key], model_name, provider, check_api_key_access, model_settings)[0]
+        if not result.is_valid:
+            print(f"❌ {result.message}")
             return False
         else:
-            print(f"✅ {validation_message}")
+            print(f"✅ {result.message}{' (cache)' if result.cached else ''}")
+
+    # Fan-out sang nhiều provider/model cùng lúc (model_settings["extra_providers"])
+    provider_router = build_provider_router(api_key, model_name, provider, is_paid_key, key_rotator, model_settings, num_workers)
+    if provider_router:
+        num_workers = provider_router.total_concurrency()
+        print(f"🔀 Provider Router: {len(provider_router.routes)} routes, tổng {num_workers} worker threads")
 
     progress_file_path = f"{input_file}{PROGRESS_FILE_SUFFIX}"
 
@@ -2020,6 +2603,21 @@ Văn bản cần dịch:
     
     print(f"🎯 System instruction: {system_instruction[:100]}...")  # Log first 100 chars
 
+    # Batch mode: dịch offline qua batch job của provider (sách rất lớn, không cần kết quả ngay)
+    if model_settings.get("batch_mode", False):
+        try:
+            from .batch_mode import translate_file_batch
+        except ImportError:
+            from batch_mode import translate_file_batch
+        return translate_file_batch(input_file, output_file, api_key, model_name, system_instruction,
+                                    chunk_size_lines, provider, model_settings)
+
+    configure_debug_writers(model_settings)
+    session_recorder = create_session_recorder(model_settings, input_file, provider, model_name)
+    set_session_recorder(session_recorder)
+    if session_recorder:
+        print(f"🎙️ Ghi phiên: {session_recorder.path}")
+
     try:
         # Đọc toàn bộ file và chia thành chunks
         with open(input_file, 'r', encoding='utf-8', errors='replace') as infile:
@@ -2040,6 +2638,17 @@ Văn bản cần dịch:
         # Kiểm tra nếu đã dịch hết file rồi
         if completed_chunks >= total_chunks:
             print(f"✅ File đã được dịch hoàn toàn ({completed_chunks}/{total_chunks} chunks).")
+            reformat_state = progress_data.get('current_chunk', {}).get('reformat_state')
+            if CAN_REFORMAT and reformat_state:
+                # Lần chạy trước dừng sau chunk cuối nhưng chưa ghi phần kết thúc của reformat
+                with open(output_file, 'a', encoding='utf-8', newline='\n') as outfile:
+                    outfile.write(StreamingReformatter.from_state(reformat_state).finish())
+            epub_state = progress_data.get('current_chunk', {}).get('epub_state')
+            epub_builder = create_incremental_epub_builder(model_settings, output_file) if epub_state else None
+            if epub_builder:
+                # EPUB đang dựng dở của lần chạy trước
+                epub_builder.resume(output_file, epub_state)
+                epub_builder.finish()
             if os.path.exists(progress_file_path):
                 os.remove(progress_file_path)
                 print(f"Đã xóa file tiến độ: {os.path.basename(progress_file_path)}")
@@ -2052,9 +2661,9 @@ Văn bản cần dịch:
             max_threads=num_workers * 2  # Tối đa 2x threads ban đầu
         )
         
-        # Mở file output để ghi kết quả
-        mode = 'a' if completed_chunks > 0 else 'w'  # Append nếu có tiến độ cũ, write nếu bắt đầu mới
-        with open(output_file, mode, encoding='utf-8') as outfile:
+        # Mở file output để ghi kết quả (reformat + EPUB song song, xem OutputWriter)
+        writer = OutputWriter(output_file, model_settings, completed_chunks, progress_data.get('current_chunk', {}))
+        with writer:
             
             # Loop chính với adaptive thread management
             current_workers = num_workers
@@ -2069,139 +2678,185 @@ Văn bản cần dịch:
                 next_expected_chunk_to_write = completed_chunks
                 total_lines_processed = completed_chunks * chunk_size_lines
 
-                with concurrent.futures.ThreadPoolExecutor(max_workers=current_workers) as executor:
+                # Pool riêng cho hedge để không phải xếp hàng sau các chunks đang chờ
+                hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2) if hedge_controller else None
+
+                try:
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=current_workers) as executor:
                     
-                    futures = {} # Lưu trữ các future: {future_object: chunk_index}
+                        futures = {} # Lưu trữ các future: {future_object: chunk_index}
                     
-                    # Gửi các chunks cần dịch đến thread pool
-                    chunks_to_process = chunks[completed_chunks:]  # Chỉ xử lý chunks chưa hoàn thành
+                        # Gửi các chunks cần dịch đến thread pool
+                        chunks_to_process = chunks[completed_chunks:]  # Chỉ xử lý chunks chưa hoàn thành
                     
-                    # Context đã được truyền từ GUI
-                    print(f"🎯 Sử dụng context: {context} ({'hiện đại - tôi' if context == 'modern' else 'cổ đại - ta'})")
+                        # Context đã được truyền từ GUI
+                        print(f"🎯 Sử dụng context: {context} ({'hiện đại - tôi' if context == 'modern' else 'cổ đại - ta'})")
                     
-                    print(f"Gửi {len(chunks_to_process)} chunks đến thread pool...")
+                        print(f"Gửi {len(chunks_to_process)} chunks đến thread pool...")
                     
-                    for chunk_data in chunks_to_process:
-                        # Kiểm tra flag dừng trước khi submit
-                        if is_translation_stopped():
-                            print("🛑 Dừng gửi chunks mới do người dùng yêu cầu")
-                            break
-                            
-                        # Submit với key_rotator, context, adaptive_thread_manager và input_file
-                        future = executor.submit(process_chunk, api_key, model_name, system_instruction, chunk_data, provider, None, key_rotator, context, is_paid_key, adaptive_thread_manager, input_file, model_settings)
-                        futures[future] = chunk_data[0]  # chunk_index
+                        def _translate_job(chunk_data, prompt_context=None, cancel_event=None):
+                            """Dịch một chunk (qua router nếu có nhiều provider); prompt_context đặt sau system_instruction cố định"""
+                            if glossary:
+                                glossary_block = glossary.build_block("".join(chunk_data[1]))
+                                if glossary_block:
+                                    prompt_context = f"{glossary_block}\n\n{prompt_context}" if prompt_context else glossary_block
+                            if provider_router:
+                                return process_chunk_routed(provider_router, system_instruction, chunk_data, context, adaptive_thread_manager, input_file, cancel_event=cancel_event, prompt_context=prompt_context)
+                            return process_chunk(api_key, model_name, system_instruction, chunk_data, provider, None, key_rotator, context, is_paid_key, adaptive_thread_manager, input_file, model_settings, cancel_event=cancel_event, prompt_context=prompt_context)
+                    
+                        def _chunk_call(chunk_data, is_hedge=False):
+                            """Hàm dịch + tham số cho một chunk (qua translation memory và dedup nếu bật)"""
+                            if translation_memory:
+                                chunk_fn, chunk_args = translation_memory.run, (chunk_data, _translate_job)
+                            else:
+                                chunk_fn, chunk_args = _translate_job, (chunk_data,)
+                            # Hedge không đi qua dedup (nếu không sẽ chỉ chờ chính request chậm đang chạy)
+                            if chunk_deduplicator and not is_hedge:
+                                return chunk_deduplicator.run, (chunk_data, chunk_fn) + chunk_args
+                            return chunk_fn, chunk_args
                     
-                    # Thu thập kết quả khi các threads hoàn thành
-                    for future in concurrent.futures.as_completed(futures):
-                        # Kiểm tra flag dừng và quota exceeded
-                        if is_translation_stopped():
-                            if is_quota_exceeded():
-                                print("Dừng xử lý kết quả do API hết quota")
+                        for chunk_data in chunks_to_process:
+                            # Kiểm tra flag dừng trước khi submit
+                            if is_translation_stopped():
+                                print("🛑 Dừng gửi chunks mới do người dùng yêu cầu")
+                                break
+                            
+                            # Submit với key_rotator, context, adaptive_thread_manager và input_file
+                            chunk_fn, chunk_args = _chunk_call(chunk_data)
+                            if hedge_controller:
+                                future = hedge_controller.submit(executor, chunk_data[0], chunk_fn, *chunk_args)
                             else:
-                                print("🛑 Dừng xử lý kết quả do người dùng yêu cầu")
+                                future = executor.submit(chunk_fn, *chunk_args)
+                            futures[future] = chunk_data[0]  # chunk_index
+                    
+                        def _submit_hedge():
+                            """Gửi request dự phòng cho chunk đầu hàng nếu nó chạy quá percentile latency"""
+                            head = next_expected_chunk_to_write
+                            if head >= total_chunks or is_translation_stopped() or not hedge_controller.should_hedge(head):
+                                return []
+                            # key_rotator (hoặc router) sẽ chọn key/route tiếp theo cho lần thử này
+                            chunk_fn, chunk_args = _chunk_call(chunks[head], is_hedge=True)
+                            hedge_future = hedge_controller.submit(hedge_executor, head, chunk_fn, *chunk_args, is_hedge=True)
+                            futures[hedge_future] = head
+                            return [hedge_future]
+                    
+                        # Thu thập kết quả khi các threads hoàn thành
+                        for future in iter_completed(futures, on_idle=_submit_hedge if hedge_controller else None):
+                            # Kiểm tra flag dừng và quota exceeded
+                            if is_translation_stopped():
+                                if is_quota_exceeded():
+                                    print("Dừng xử lý kết quả do API hết quota")
+                                else:
+                                    print("🛑 Dừng xử lý kết quả do người dùng yêu cầu")
                             
-                            # Hủy các future chưa hoàn thành
-                            for f in futures:
-                                if not f.done():
-                                    f.cancel()
-                            break
+                                # Hủy các future chưa hoàn thành
+                                for f in futures:
+                                    if not f.done():
+                                        f.cancel()
+                                break
                             
-                        chunk_index = futures[future]
-                        try:
-                            result = future.result()  # (chunk_index, translated_text, lines_count, line_range)
+                            chunk_index = futures[future]
+                            try:
+                                result = future.result()  # (chunk_index, translated_text, lines_count, line_range)
                             
-                            # Handle result với line info
-                            if len(result) == 4:  # New format with line_range
-                                processed_chunk_index, translated_text, lines_count, line_range = result
-                            else:  # Old format fallback
-                                processed_chunk_index, translated_text, lines_count = result
-                                # Tính toán line_range từ chunk data
-                                chunk_data = chunks[processed_chunk_index]
-                                start_line = chunk_data[2]
-                                line_range = f"{start_line + 1}:{start_line + len(chunk_data[1])}"
+                                # Handle result với line info
+                                if len(result) == 4:  # New format with line_range
+                                    processed_chunk_index, translated_text, lines_count, line_range = result
+                                else:  # Old format fallback
+                                    processed_chunk_index, translated_text, lines_count = result
+                                    # Tính toán line_range từ chunk data
+                                    chunk_data = chunks[processed_chunk_index]
+                                    start_line = chunk_data[2]
+                                    line_range = f"{start_line + 1}:{start_line + len(chunk_data[1])}"
                             
-                            # Check for errors
-                            if translated_text.startswith('[') and ('HẾT QUOTA' in translated_text or 'LỖI' in translated_text):
-                                # Lưu lỗi với line info
-                                error_info = {
-                                    'message': translated_text,
-                                    'chunk_index': processed_chunk_index,
-                                    'line_range': line_range,
-                                    'timestamp': time.time()
-                                }
-                                save_progress_with_line_info(progress_file_path, next_expected_chunk_to_write, None, error_info)
-                                print(f"❌ Lỗi tại chunk {processed_chunk_index + 1} (lines {line_range}): {translated_text}")
+                                # Hedging: chỉ giữ kết quả về trước, bỏ qua lần thử còn lại
+                                if hedge_controller:
+                                    is_error_result = is_error_chunk_text(translated_text)
+                                    resolved = hedge_controller.resolve(processed_chunk_index, future, (processed_chunk_index, translated_text, lines_count, line_range), is_error_result)
+                                    if resolved is None:
+                                        continue
+                                    processed_chunk_index, translated_text, lines_count, line_range = resolved
+                            
+                                # Check for errors
+                                if translated_text.startswith('[') and ('HẾT QUOTA' in translated_text or 'LỖI' in translated_text):
+                                    # Lưu lỗi với line info
+                                    error_info = {
+                                        'message': translated_text,
+                                        'chunk_index': processed_chunk_index,
+                                        'line_range': line_range,
+                                        'timestamp': time.time()
+                                    }
+                                    save_progress_with_line_info(progress_file_path, next_expected_chunk_to_write, writer.add_states({}), error_info)
+                                    print(f"❌ Lỗi tại chunk {processed_chunk_index + 1} (lines {line_range}): {translated_text}")
                                 
-                                # Nếu là lỗi quota thì dừng ngay
-                                if 'HẾT QUOTA' in translated_text:
-                                    set_quota_exceeded()
-                                    break
-                                # Các lỗi khác vẫn lưu vào buffer để ghi (với error message)
+                                    # Nếu là lỗi quota thì dừng ngay
+                                    if 'HẾT QUOTA' in translated_text:
+                                        set_quota_exceeded()
+                                        break
+                                    # Các lỗi khác vẫn lưu vào buffer để ghi (với error message)
                             
-                            # Lưu kết quả vào buffer tạm chờ ghi theo thứ tự (bao gồm cả lỗi)
-                            translated_chunks_results[processed_chunk_index] = (translated_text, lines_count, line_range)
+                                # Lưu kết quả vào buffer tạm chờ ghi theo thứ tự (bao gồm cả lỗi)
+                                translated_chunks_results[processed_chunk_index] = (translated_text, lines_count, line_range)
                             
-                            print(f"✅ Hoàn thành chunk {processed_chunk_index + 1}/{total_chunks}")
+                                print(f"✅ Hoàn thành chunk {processed_chunk_index + 1}/{total_chunks}")
                             
-                            # Ghi các chunks đã hoàn thành vào file output theo đúng thứ tự
-                            while next_expected_chunk_to_write in translated_chunks_results:
-                                chunk_text, chunk_lines_count, chunk_line_range = translated_chunks_results.pop(next_expected_chunk_to_write)
-                                outfile.write(chunk_text)
-                                if not chunk_text.endswith('\n'):
-                                    outfile.write('\n')
-                                outfile.flush()
+                                # Ghi các chunks đã hoàn thành vào file output theo đúng thứ tự
+                                while next_expected_chunk_to_write in translated_chunks_results:
+                                    chunk_text, chunk_lines_count, chunk_line_range = translated_chunks_results.pop(next_expected_chunk_to_write)
+                                    writer.write_chunk(chunk_text)
                                 
-                                # Cập nhật tiến độ
-                                next_expected_chunk_to_write += 1
-                                total_lines_processed += chunk_lines_count
+                                    # Cập nhật tiến độ
+                                    next_expected_chunk_to_write += 1
+                                    total_lines_processed += chunk_lines_count
                                 
-                                # Lưu tiến độ sau mỗi chunk hoàn thành với line info
-                                current_chunk_info = {
-                                    'chunk_index': next_expected_chunk_to_write - 1,
-                                    'line_range': chunk_line_range,
-                                    'lines_count': chunk_lines_count
-                                }
-                                save_progress_with_line_info(progress_file_path, next_expected_chunk_to_write, current_chunk_info)
+                                    # Lưu tiến độ sau mỗi chunk hoàn thành với line info
+                                    current_chunk_info = {
+                                        'chunk_index': next_expected_chunk_to_write - 1,
+                                        'line_range': chunk_line_range,
+                                        'lines_count': chunk_lines_count
+                                    }
+                                    save_progress_with_line_info(progress_file_path, next_expected_chunk_to_write, writer.add_states(current_chunk_info))
                                 
-                                # Hiển thị thông tin tiến độ
-                                current_time = time.time()
-                                elapsed_time = current_time - start_time
-                                progress_percent = (next_expected_chunk_to_write / total_chunks) * 100
-                                avg_speed = total_lines_processed / elapsed_time if elapsed_time > 0 else 0
+                                    # Hiển thị thông tin tiến độ
+                                    current_time = time.time()
+                                    elapsed_time = current_time - start_time
+                                    progress_percent = (next_expected_chunk_to_write / total_chunks) * 100
+                                    avg_speed = total_lines_processed / elapsed_time if elapsed_time > 0 else 0
                                 
-                                print(f"Tiến độ: {next_expected_chunk_to_write}/{total_chunks} chunks ({progress_percent:.1f}%) - {avg_speed:.1f} dòng/giây")
+                                    print(f"Tiến độ: {next_expected_chunk_to_write}/{total_chunks} chunks ({progress_percent:.1f}%) - {avg_speed:.1f} dòng/giây")
                                 
-                        except Exception as e:
-                            print(f"❌ Lỗi khi xử lý chunk {chunk_index}: {e}")
+                            except Exception as e:
+                                print(f"❌ Lỗi khi xử lý chunk {chunk_index}: {e}")
                     
-                    # Ghi nốt các chunks còn sót lại trong buffer (nếu có)
-                    if translated_chunks_results:
-                        print("⚠️ Ghi các chunks còn sót lại...")
-                        sorted_remaining_chunks = sorted(translated_chunks_results.items())
-                        for chunk_idx, chunk_data in sorted_remaining_chunks:
-                            try:
-                                if len(chunk_data) == 3:  # New format with line_range
-                                    chunk_text, chunk_lines_count, chunk_line_range = chunk_data
-                                else:  # Old format fallback
-                                    chunk_text, chunk_lines_count = chunk_data
-                                    chunk_line_range = f"unknown"
+                        # Ghi nốt các chunks còn sót lại trong buffer (nếu có)
+                        if translated_chunks_results:
+                            print("⚠️ Ghi các chunks còn sót lại...")
+                            sorted_remaining_chunks = sorted(translated_chunks_results.items())
+                            for chunk_idx, chunk_data in sorted_remaining_chunks:
+                                try:
+                                    if len(chunk_data) == 3:  # New format with line_range
+                                        chunk_text, chunk_lines_count, chunk_line_range = chunk_data
+                                    else:  # Old format fallback
+                                        chunk_text, chunk_lines_count = chunk_data
+                                        chunk_line_range = f"unknown"
                                 
-                                outfile.write(chunk_text)
-                                if not chunk_text.endswith('\n'):
-                                    outfile.write('\n')
-                                outfile.flush()
-                                next_expected_chunk_to_write += 1
+                                    writer.write_chunk(chunk_text)
+                                    next_expected_chunk_to_write += 1
                                 
-                                # Lưu progress với line info
-                                current_chunk_info = {
-                                    'chunk_index': chunk_idx,
-                                    'line_range': chunk_line_range,
-                                    'lines_count': chunk_lines_count
-                                }
-                                save_progress_with_line_info(progress_file_path, next_expected_chunk_to_write, current_chunk_info)
-                                print(f"✅ Ghi chunk bị sót: {chunk_idx + 1} (lines {chunk_line_range})")
-                            except Exception as e:
-                                print(f"❌ Lỗi khi ghi chunk {chunk_idx}: {e}")
+                                    # Lưu progress với line info
+                                    current_chunk_info = {
+                                        'chunk_index': chunk_idx,
+                                        'line_range': chunk_line_range,
+                                        'lines_count': chunk_lines_count
+                                    }
+                                    save_progress_with_line_info(progress_file_path, next_expected_chunk_to_write, writer.add_states(current_chunk_info))
+                                    print(f"✅ Ghi chunk bị sót: {chunk_idx + 1} (lines {chunk_line_range})")
+                                except Exception as e:
+                                    print(f"❌ Lỗi khi ghi chunk {chunk_idx}: {e}")
+                finally:
+                    # Không chờ các hedge thua đang chạy dở (kể cả khi vòng dịch thoát do exception)
+                    if hedge_executor:
+                        hedge_executor.shutdown(wait=False, cancel_futures=True)
                 
                 # Sau khi ThreadPoolExecutor hoàn thành, kiểm tra xem đã dịch hết chưa
                 if next_expected_chunk_to_write >= total_chunks:
@@ -2256,6 +2911,26 @@ Văn bản cần dịch:
                         print(f"   Overall success rate: {summary['success_rate']:.1f}%")
                         print()
                 
+                if hedge_controller:
+                    hedge_controller.print_stats()
+                
+                if provider_router:
+                    provider_router.print_stats()
+                
+                if chunk_deduplicator:
+                    chunk_deduplicator.print_stats()
+                
+                if translation_memory:
+                    translation_memory.print_stats()
+                
+                if glossary:
+                    glossary.print_stats()
+                
+                if is_prompt_cache_enabled(model_settings):
+                    print_prompt_cache_stats()
+                
+                print_usage_stats()
+                
                 # Print ENHANCED rate limiter stats for Google AI
                 if provider == "Google AI" and key_rotator:
                     print("\n📊 Enhanced Rate Limiter Statistics:")
@@ -2277,22 +2952,14 @@ Văn bản cần dịch:
                                 print(f"     Throttle: {stats['throttle_factor']:.1%} (errors: {stats['consecutive_errors']})")
                     print()
 
+                # Ghi phần cuối của reformat / hoàn thành EPUB trước khi xóa tiến độ
+                writer.finish()
+                
                 # Xóa file tiến độ khi hoàn thành
                 if os.path.exists(progress_file_path):
                     os.remove(progress_file_path)
                     print(f"Đã xóa file tiến độ: {os.path.basename(progress_file_path)}")
                 
-                # Tự động reformat file sau khi dịch xong
-                if CAN_REFORMAT:
-                    print("\n🔧 Bắt đầu reformat file đã dịch...")
-                    try:
-                        fix_text_format(output_file)
-                        print("✅ Reformat hoàn thành!")
-                    except Exception as e:
-                        print(f"⚠️ Lỗi khi reformat: {e}")
-                else:
-                    print("⚠️ Chức năng reformat không khả dụ")
-                
                 # Kết thúc ThreadPoolExecutor - hoàn thành
                 print(f"✅ Dịch hoàn thành!")
                 return True  # Exit function successfully
@@ -2307,6 +2974,14 @@ Văn bản cần dịch:
         print(f"❌ Đã xảy ra lỗi không mong muốn: {e}")
         print("Tiến độ đã được lưu. Bạn có thể chạy lại chương trình để tiếp tục.")
         return False
+    finally:
+        close_debug_writers()
+        if is_prompt_cache_enabled(model_settings):
+            release_prompt_caches()
+        if session_recorder:
+            set_session_recorder(None)
+            session_recorder.close()
+            session_recorder.print_stats()
 
 
 def load_api_key():
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Translation Memory (TM) dùng chung giữa các tập truyện
+
+Truyện dài kỳ lặp lại rất nhiều: đoạn tóm tắt tập trước, mô tả kỹ năng, thông
+báo hệ thống... Cache theo hash chính xác bỏ sót hầu hết các trường hợp này.
+
+TM lưu cặp gốc -> bản dịch vào file JSONL và đánh index bằng MinHash trên
+character 3-grams + LSH (banding):
+- Chunk trùng khớp chính xác cả chunk, hoặc mọi đoạn đều khớp -> dùng lại bản
+  dịch, không gọi API
+- Đoạn gần giống (Jaccard ước lượng >= ngưỡng) -> đưa vào prompt làm bản dịch
+  tham khảo (few-shot) để giữ thống nhất tên riêng/thuật ngữ
+
+Học từ chunk dịch thành công:
+- Luôn lưu cả chunk (gốc -> bản dịch nguyên vẹn), không cần ghép cặp.
+- Chỉ lưu từng đoạn khi các dòng thật sự tương ứng 1-1 (lines_aligned): số đoạn
+  bằng nhau chưa đủ vì gộp dòng + tách dòng có thể bù trừ nhau, nên mỗi cặp còn
+  phải khớp tỷ lệ độ dài, chữ số và dấu mở lời thoại.
+Mỗi mục ghi nguồn (file + dòng) để xóa mục sai bằng forget() /
+manage_translation_memory.py.
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import random
+import hashlib
+import threading
+import unicodedata
+
+
+NUM_PERM = 32                 # Số hàm hash MinHash
+LSH_BANDS = 8                 # 8 bands × 4 rows -> ngưỡng ứng viên ~ (1/8)^(1/4) ≈ 0.6
+LSH_ROWS = NUM_PERM // LSH_BANDS
+SHINGLE_SIZE = 3
+
+MIN_EXACT_CHARS = 10          # Đoạn quá ngắn ("Ừ.", "Vâng.") phụ thuộc ngữ cảnh, không tái sử dụng
+MIN_FUZZY_CHARS = 30
+DEFAULT_FUZZY_THRESHOLD = 0.7
+MAX_HINTS = 5
+MAX_HINT_CHARS = 2000
+
+# Loại mục trong TM
+KIND_LINE = "line"            # Một đoạn (dòng) - dùng cho khớp chính xác + bản dịch tham khảo
+KIND_CHUNK = "chunk"          # Cả chunk - chỉ khớp chính xác (quá dài để làm bản dịch tham khảo)
+
+# Tỷ lệ độ dài (dịch/gốc) của mỗi dòng được lệch tối đa bao nhiêu lần so với tỷ lệ của cả chunk
+ALIGN_RATIO_TOLERANCE = 2.5
+_NUMBER_PATTERN = re.compile(r"\d+")
+_QUOTE_CHARS = "\"'“”‘’「」『』«»"
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# Seed cố định: chữ ký đã lưu trong file phải dùng cùng bộ hoán vị
+_rng = random.Random(20240601)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+
+def normalize_paragraph(text):
+    """Chuẩn hóa đoạn văn để so khớp: NFKC, lowercase, gộp khoảng trắng"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _paragraph_key(normalized):
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def minhash_signature(normalized):
+    """Chữ ký MinHash (NUM_PERM giá trị) trên tập character n-grams của đoạn đã chuẩn hóa"""
+    if len(normalized) <= SHINGLE_SIZE:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    hashes = [zlib.crc32(s.encode("utf-8")) for s in shingles]
+    return [min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def estimate_similarity(sig_a, sig_b):
+    """Ước lượng Jaccard similarity từ 2 chữ ký MinHash"""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / float(len(sig_a))
+
+
+def lines_aligned(sources, targets):
+    """
+    Các dòng gốc / dịch có tương ứng 1-1 không. Số dòng bằng nhau chưa đủ (gộp một chỗ,
+    tách một chỗ vẫn bù trừ), nên mỗi cặp còn phải khớp:
+    - tỷ lệ độ dài gần với tỷ lệ của cả chunk (bỏ qua dòng quá ngắn)
+    - cùng các số (chữ số Ả Rập)
+    - cùng là / không là lời thoại (mở đầu bằng dấu ngoặc kép)
+    """
+    if not sources or len(sources) != len(targets):
+        return False
+    chunk_ratio = sum(len(t) for t in targets) / float(max(1, sum(len(s) for s in sources)))
+    for source, target in zip(sources, targets):
+        source_norm, target_norm = normalize_paragraph(source), normalize_paragraph(target)
+        if len(source_norm) >= MIN_EXACT_CHARS:
+            ratio = len(target_norm) / float(len(source_norm))
+            if not chunk_ratio / ALIGN_RATIO_TOLERANCE <= ratio <= chunk_ratio * ALIGN_RATIO_TOLERANCE:
+                return False
+        if sorted(_NUMBER_PATTERN.findall(source_norm)) != sorted(_NUMBER_PATTERN.findall(target_norm)):
+            return False
+        if (source_norm[:1] in _QUOTE_CHARS) != (target_norm[:1] in _QUOTE_CHARS):
+            return False
+    return True
+
+
+class TranslationMemory:
+    """
+    Translation memory lưu trên đĩa (JSONL), thread-safe.
+
+    Dùng:
+        tm = TranslationMemory("series.tm.jsonl", source_name="tap-01.txt")
+        result = tm.run(chunk_data, translate_fn)
+    """
+
+    def __init__(self, path, fuzzy_threshold=DEFAULT_FUZZY_THRESHOLD, validate=None, source_name=None):
+        """
+        Args:
+            path: File JSONL lưu TM
+            fuzzy_threshold: Ngưỡng similarity để đưa đoạn gần giống vào prompt
+            validate: Callable(translated_text, source_text) -> bool, chỉ học bản dịch hợp lệ
+            source_name: Tên file đang dịch - ghi vào nguồn của mục mới (để xóa mục sai theo file)
+        """
+        self.path = path
+        self.fuzzy_threshold = fuzzy_threshold
+        self.validate = validate or (lambda translated, source: True)
+        self.source_name = source_name
+        self.lock = threading.Lock()
+
+        self.records = []    # Bản ghi như trong file (src, tgt, sig, kind, origin, t)
+        self.entries = []    # [(source, target, signature)] - cùng chỉ số với records
+        self.exact = {}      # {paragraph_key: entry_id}
+        self.buckets = {}    # {(band, band_hash): [entry_id]}
+
+        self.served_chunks = 0
+        self.served_paragraphs = 0
+        self.hinted_chunks = 0
+        self.learned = 0
+
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        loaded = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        if self._index(json.loads(line)):
+                            loaded += 1
+                    except (ValueError, KeyError):
+                        continue
+            print(f"📚 Translation memory: đã tải {loaded} đoạn từ {os.path.basename(self.path)}")
+        except Exception as e:
+            print(f"⚠️ Không thể tải translation memory: {e}")
+
+    def _index(self, record):
+        """
+        Thêm một bản ghi vào index (gọi khi đang giữ lock hoặc lúc khởi tạo).
+        Bản ghi cũ không có kind/origin được coi là mục một đoạn, không rõ nguồn.
+        Trả về False nếu nguồn đã có trong TM.
+        """
+        normalized = normalize_paragraph(record["src"])
+        key = _paragraph_key(normalized)
+        if key in self.exact:
+            return False
+        signature = None
+        if record.get("kind", KIND_LINE) == KIND_LINE:
+            signature = record.get("sig")
+            if not signature or len(signature) != NUM_PERM:
+                signature = minhash_signature(normalized)
+                record["sig"] = signature
+
+        entry_id = len(self.entries)
+        self.records.append(record)
+        self.entries.append((record["src"], record["tgt"], signature))
+        self.exact[key] = entry_id
+        if signature and len(normalized) >= MIN_FUZZY_CHARS:
+            for band in range(LSH_BANDS):
+                band_key = (band, tuple(signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]))
+                self.buckets.setdefault(band_key, []).append(entry_id)
+        return True
+
+    def lookup_exact(self, paragraph):
+        normalized = normalize_paragraph(paragraph)
+        if len(normalized) < MIN_EXACT_CHARS:
+            return None
+        with self.lock:
+            entry_id = self.exact.get(_paragraph_key(normalized))
+            return self.entries[entry_id][1] if entry_id is not None else None
+
+    def lookup_fuzzy(self, paragraph):
+        """
+        Tìm đoạn gần giống nhất trong TM.
+
+        Returns:
+            (similarity, source, target) hoặc None
+        """
+        normalized = normalize_paragraph(paragraph)
+        if len(normalized) < MIN_FUZZY_CHARS:
+            return None
+        signature = minhash_signature(normalized)
+        best = None
+        with self.lock:
+            candidates = set()
+            for band in range(LSH_BANDS):
+                band_key = (band, tuple(signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]))
+                candidates.update(self.buckets.get(band_key, ()))
+            for entry_id in candidates:
+                source, target, entry_sig = self.entries[entry_id]
+                if entry_sig is None:
+                    continue
+                similarity = estimate_similarity(signature, entry_sig)
+                if similarity >= self.fuzzy_threshold and (best is None or similarity > best[0]):
+                    best = (similarity, source, target)
+        return best
+
+    def learn(self, source_lines, translated_text, line_range=None):
+        """
+        Lưu cả chunk (gốc -> bản dịch nguyên vẹn) và, nếu các dòng tương ứng 1-1
+        (lines_aligned), từng cặp đoạn gốc - đoạn dịch.
+
+        Args:
+            line_range: Dòng của chunk trong file nguồn ("123:223") - ghi vào nguồn của mục
+        """
+        sources = [line.strip() for line in source_lines if line.strip()]
+        targets = [line.strip() for line in translated_text.splitlines() if line.strip()]
+        if not sources or not targets:
+            return 0
+
+        origin = {"file": self.source_name, "lines": line_range}
+        now = int(time.time())
+        candidates = [{"src": "\n".join(sources), "tgt": translated_text.strip(), "kind": KIND_CHUNK}]
+        if len(sources) > 1 and lines_aligned(sources, targets):
+            candidates.extend({"src": source, "tgt": target, "kind": KIND_LINE}
+                              for source, target in zip(sources, targets))
+
+        new_records = []
+        with self.lock:
+            for record in candidates:
+                if len(normalize_paragraph(record["src"])) < MIN_EXACT_CHARS:
+                    continue
+                record.update(origin=origin, t=now)
+                if self._index(record):
+                    new_records.append(record)
+
+            if new_records:
+                try:
+                    with open(self.path, 'a', encoding='utf-8') as f:
+                        for record in new_records:
+                            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                except Exception as e:
+                    print(f"⚠️ Không thể ghi translation memory: {e}")
+                self.learned += len(new_records)
+        return len(new_records)
+
+    def forget(self, source_file=None, line_range=None, contains=None):
+        """
+        Xóa các mục sai khỏi TM (và ghi lại file JSONL).
+
+        Args:
+            source_file: Chỉ xóa mục học từ file này (tên file như lúc dịch)
+            line_range: Chỉ xóa mục của chunk này ("123:223"), dùng cùng source_file
+            contains: Chỉ xóa mục mà bản gốc hoặc bản dịch chứa chuỗi này
+
+        Returns:
+            Số mục đã xóa
+        """
+        if source_file is None and line_range is None and contains is None:
+            raise ValueError("Cần ít nhất một điều kiện (source_file / line_range / contains)")
+
+        def matches(record):
+            origin = record.get("origin") or {}
+            if source_file is not None and origin.get("file") != source_file:
+                return False
+            if line_range is not None and origin.get("lines") != line_range:
+                return False
+            if contains is not None and contains not in record["src"] and contains not in record["tgt"]:
+                return False
+            return True
+
+        with self.lock:
+            kept = [record for record in self.records if not matches(record)]
+            removed = len(self.records) - len(kept)
+            if not removed:
+                return 0
+            self.records, self.entries, self.exact, self.buckets = [], [], {}, {}
+            for record in kept:
+                self._index(record)
+
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                for record in self.records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            os.replace(temp_path, self.path)
+        return removed
+
+    def sources(self):
+        """Thống kê số mục theo nguồn: {(file, kind): count}"""
+        counts = {}
+        with self.lock:
+            for record in self.records:
+                key = ((record.get("origin") or {}).get("file"), record.get("kind", KIND_LINE))
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def build_hint_block(self, hints):
+        """Khối bản dịch tham khảo (compact) để chèn vào prompt"""
+        lines = ["BẢN DỊCH THAM KHẢO (các đoạn giống/gần giống đã dịch trước đây - giữ thống nhất tên riêng, thuật ngữ):"]
+        total = 0
+        for source, target in hints[:MAX_HINTS]:
+            pair = f"- {source} => {target}"
+            if total + len(pair) > MAX_HINT_CHARS:
+                break
+            lines.append(pair)
+            total += len(pair)
+        return "\n".join(lines)
+
+    def run(self, chunk_data, translate_fn, cancel_event=None):
+        """
+        Phục vụ chunk từ TM nếu mọi đoạn khớp chính xác; nếu không thì gọi
+        translate_fn(chunk_data, prompt_context, cancel_event=...) với bản dịch tham khảo
+        làm prompt_context (đặt sau system_instruction để không phá prompt cache).
+
+        Returns:
+            (chunk_index, translated_text, lines_count, line_range) như process_chunk
+        """
+        chunk_index, chunk_lines, chunk_start_line_index = chunk_data
+        line_range = f"{chunk_start_line_index + 1}:{chunk_start_line_index + len(chunk_lines)}"
+
+        paragraphs = [line for line in chunk_lines if line.strip()]
+
+        # Cả chunk đã dịch trước đây (đoạn tóm tắt, thông báo hệ thống lặp lại...)
+        whole = self.lookup_exact("\n".join(line.strip() for line in paragraphs)) if len(paragraphs) > 1 else None
+        if whole is not None:
+            with self.lock:
+                self.served_chunks += 1
+                self.served_paragraphs += len(paragraphs)
+            print(f"📚 Chunk {chunk_index + 1}: lấy cả chunk từ translation memory, không gọi API")
+            return (chunk_index, whole + "\n", len(chunk_lines), line_range)
+
+        exact_hits = {}
+        for paragraph in paragraphs:
+            target = self.lookup_exact(paragraph)
+            if target is not None:
+                exact_hits[paragraph] = target
+
+        if paragraphs and len(exact_hits) == len(paragraphs):
+            # Toàn bộ chunk có trong TM - ghép bản dịch, giữ nguyên dòng trống
+            output = "".join((exact_hits[line] + "\n") if line.strip() else line for line in chunk_lines)
+            with self.lock:
+                self.served_chunks += 1
+                self.served_paragraphs += len(paragraphs)
+            print(f"📚 Chunk {chunk_index + 1}: lấy từ translation memory ({len(paragraphs)} đoạn), không gọi API")
+            return (chunk_index, output, len(chunk_lines), line_range)
+
+        hints = [(paragraph.strip(), target) for paragraph, target in exact_hits.items()]
+        for paragraph in paragraphs:
+            if paragraph in exact_hits or len(hints) >= MAX_HINTS:
+                continue
+            match = self.lookup_fuzzy(paragraph)
+            if match:
+                hints.append((match[1], match[2]))
+
+        prompt_context = None
+        if hints:
+            with self.lock:
+                self.hinted_chunks += 1
+            prompt_context = self.build_hint_block(hints)
+
+        result = translate_fn(chunk_data, prompt_context, cancel_event=cancel_event)
+        # Cùng bản gốc provider dùng khi kiểm tra bản dịch (validate có thể dùng lại kết quả đó)
+        if result is not None and self.validate(result[1], "\n".join(chunk_lines)):
+            self.learn(chunk_lines, result[1], line_range)
+        return result
+
+    def print_stats(self):
+        print(f"\n📚 Translation memory: {self.served_chunks} chunks lấy từ TM ({self.served_paragraphs} đoạn), "
+              f"{self.hinted_chunks} chunks có bản dịch tham khảo, học thêm {self.learned} đoạn")
+
+
+def create_translation_memory(model_settings, input_file, validate=None):
+    """
+    Tạo TranslationMemory từ model_settings.
+
+    Keys hỗ trợ:
+        translation_memory: bool - bật TM (mặc định False)
+        translation_memory_path: file JSONL (mặc định .translation_memory.jsonl cạnh file input,
+                                 các tập trong cùng thư mục dùng chung)
+        tm_fuzzy_threshold: ngưỡng similarity cho bản dịch tham khảo (mặc định 0.7)
+
+    Returns:
+        TranslationMemory hoặc None nếu tắt
+    """
+    if not model_settings or not model_settings.get("translation_memory", False):
+        return None
+
+    path = model_settings.get("translation_memory_path")
+    if not path:
+        path = os.path.join(os.path.dirname(os.path.abspath(input_file)), ".translation_memory.jsonl")
+
+    try:
+        threshold = float(model_settings.get("tm_fuzzy_threshold", DEFAULT_FUZZY_THRESHOLD))
+    except (ValueError, TypeError):
+        threshold = DEFAULT_FUZZY_THRESHOLD
+
+    return TranslationMemory(path, fuzzy_threshold=threshold, validate=validate,
+                             source_name=os.path.basename(input_file))
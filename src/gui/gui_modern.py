@@ -67,6 +67,7 @@ try:
     from ..core.translate import translate_file_optimized, generate_output_filename, set_stop_translation, clear_stop_translation, is_translation_stopped, is_quota_exceeded, validate_api_key_before_translation, threads_from_rpm
     from ..core.reformat import fix_text_format
     from ..core.ConvertEpub import txt_to_docx, docx_to_epub
+    from ..core.epub_writer import txt_to_epub
     TRANSLATE_AVAILABLE = True
     EPUB_AVAILABLE = True
 except ImportError:
@@ -76,6 +77,7 @@ except ImportError:
         from core.translate import translate_file_optimized, generate_output_filename, set_stop_translation, clear_stop_translation, is_translation_stopped, is_quota_exceeded, validate_api_key_before_translation, threads_from_rpm
         from core.reformat import fix_text_format
         from core.ConvertEpub import txt_to_docx, docx_to_epub
+        from core.epub_writer import txt_to_epub
         TRANSLATE_AVAILABLE = True
         EPUB_AVAILABLE = True
     except ImportError as e:
@@ -119,6 +121,10 @@ except ImportError:
         def docx_to_epub(*args, **kwargs):
             print("❌ Chức năng convert EPUB không khả dụng")
             return False
+            
+        def txt_to_epub(*args, **kwargs):
+            print("❌ Chức năng convert EPUB không khả dụng")
+            return False
 
 class LogCapture:
     """Class để capture print statements và chuyển về GUI"""
@@ -1558,7 +1564,7 @@ CHỈ TRẢ VỀ BẢN DỊCH!""",
                     output_file = self.output_file_var.get()
                     if output_file and os.path.exists(output_file):
                         try:
-                            self.convert_to_epub(output_file)
+                            self.ensure_epub(output_file)
                         except Exception as e:
                             self.log(f"❌ Lỗi khi convert EPUB: {e}")
                     else:
@@ -1577,6 +1583,25 @@ CHỈ TRẢ VỀ BẢN DỊCH!""",
         if hasattr(self, 'translation_thread'):
             self.translation_thread = None
     
+    def get_incremental_epub_settings(self, txt_file):
+        """model_settings để core dựng EPUB trong lúc dịch"""
+        return {
+            "incremental_epub": True,
+            "epub_path": os.path.splitext(txt_file)[0] + ".epub",
+            "epub_title": self.book_title_var.get() or os.path.splitext(os.path.basename(txt_file))[0],
+            "epub_author": self.book_author_var.get() or "Unknown Author",
+            "epub_chapter_pattern": self.get_chapter_pattern(),
+        }
+    
+    def ensure_epub(self, txt_file):
+        """Dùng EPUB đã dựng trong lúc dịch nếu có (mới hơn file TXT), nếu không thì convert"""
+        epub_file = os.path.splitext(txt_file)[0] + ".epub"
+        if os.path.exists(epub_file) and os.path.getmtime(epub_file) >= os.path.getmtime(txt_file):
+            self.log(f"✅ EPUB đã được dựng trong lúc dịch: {epub_file}")
+            return
+        self.log("📚 Bắt đầu convert EPUB...")
+        self.convert_to_epub(txt_file)
+    
     def convert_to_epub(self, txt_file):
         """Convert file to EPUB"""
         if not EPUB_AVAILABLE:
@@ -1586,7 +1611,6 @@ CHỈ TRẢ VỀ BẢN DỊCH!""",
         try:
             # Generate file paths
             base_name = os.path.splitext(txt_file)[0]
-            docx_file = base_name + ".docx"
             epub_file = base_name + ".epub"
             
             # Get book info
@@ -1594,19 +1618,12 @@ CHỈ TRẢ VỀ BẢN DỊCH!""",
             author = self.book_author_var.get() or "Unknown Author"
             pattern = self.get_chapter_pattern()
             
-            # Convert TXT to DOCX
-            self.log("📄 Đang convert TXT → DOCX...")
-            if txt_to_docx(txt_file, docx_file, title, pattern):
-                self.log("✅ Convert TXT → DOCX hoàn thành!")
-                
-                # Convert DOCX to EPUB
-                self.log("📚 Đang convert DOCX → EPUB...")
-                if docx_to_epub(docx_file, epub_file, title, author):
-                    self.log(f"✅ Convert EPUB hoàn thành: {epub_file}")
-                else:
-                    self.log("❌ Convert DOCX → EPUB thất bại")
+            # Convert TXT trực tiếp sang EPUB (không qua DOCX/Pandoc)
+            self.log("📚 Đang convert TXT → EPUB...")
+            if txt_to_epub(txt_file, epub_file, title, author, pattern):
+                self.log(f"✅ Convert EPUB hoàn thành: {epub_file}")
             else:
-                self.log("❌ Convert TXT → DOCX thất bại")
+                self.log("❌ Convert TXT → EPUB thất bại")
                 
         except Exception as e:
             self.log(f"❌ Lỗi convert EPUB: {e}")
@@ -1927,6 +1944,12 @@ CHỈ TRẢ VỀ BẢN DỊCH!""",
                     model_settings = dict(model_settings)  # shallow copy to avoid mutating stored default
                     model_settings["target_rpm"] = rpm_val
             
+            # Reformat được áp dụng trực tiếp khi ghi từng chunk (core)
+            model_settings["auto_reformat"] = self.auto_reformat_var.get()
+            # Dựng EPUB trong lúc dịch: chương nào xong được render ngay, EPUB xong ngay sau chunk cuối
+            if self.auto_convert_epub_var.get():
+                model_settings.update(self.get_incremental_epub_settings(output_file))
+            
             # Use regular translation
             success = translate_file_optimized(
                 input_file=input_file,
@@ -1956,19 +1979,9 @@ CHỈ TRẢ VỀ BẢN DỊCH!""",
                     except Exception as e:
                         self.log(f"⚠️ Không thể xóa file tiến độ: {e}")
 
-                # Auto reformat
-                if self.auto_reformat_var.get():
-                    self.log("🔧 Bắt đầu reformat file đã dịch...")
-                    try:
-                        fix_text_format(output_file)
-                        self.log("✅ Reformat hoàn thành!")
-                    except Exception as e:
-                        self.log(f"⚠️ Lỗi khi reformat: {e}")
-                
                 # Auto convert to EPUB
                 if self.auto_convert_epub_var.get():
-                    self.log("📚 Bắt đầu convert EPUB...")
-                    self.convert_to_epub(output_file)
+                    self.ensure_epub(output_file)
             
         except Exception as e:
             self.log(f"❌ Lỗi nghiêm trọng trong thread dịch: {e}")
@@ -2259,6 +2272,9 @@ File tiến độ đã được lưu, bạn có thể tiếp tục dịch ngay s
         return {
             "thinking_mode": False,
             "thinking_budget": 0,  # 0 = tắt thinking mode, >0 = bật với budget tương ứng
+            "streaming": False,  # True = nhận tokens dần, hủy sớm khi treo/từ chối
+            "hedging": False,  # True = gửi request dự phòng cho chunk đầu hàng bị chậm
+            "prompt_cache": False,  # True = cache prefix cố định (system instruction) phía provider
             "top_p": 1.0,
             "temperature": 1.0,
             "max_tokens": 4096,
@@ -2362,6 +2378,45 @@ File tiến độ đã được lưu, bạn có thể tiếp tục dịch ngay s
         
         row += 1
 
+        # Streaming mode (checkbox) - hủy request sớm khi timeout/từ chối/chạy loạn
+        streaming_label = ctk.CTkLabel(settings_frame, text="Streaming:", font=ctk.CTkFont(weight="bold"))
+        streaming_label.grid(row=row, column=0, padx=10, pady=5, sticky="w")
+        
+        streaming_var = ctk.BooleanVar(value=current_settings.get("streaming", False))
+        self.settings_widgets["streaming"] = ctk.CTkCheckBox(
+            settings_frame,
+            text="Nhận tokens dần, hủy sớm khi treo/từ chối",
+            variable=streaming_var
+        )
+        self.settings_widgets["streaming"].grid(row=row, column=1, padx=10, pady=5, sticky="w")
+        row += 1
+
+        # Hedged requests (checkbox) - gửi request dự phòng khi chunk đầu hàng chạy quá p95
+        hedging_label = ctk.CTkLabel(settings_frame, text="Hedging:", font=ctk.CTkFont(weight="bold"))
+        hedging_label.grid(row=row, column=0, padx=10, pady=5, sticky="w")
+        
+        hedging_var = ctk.BooleanVar(value=current_settings.get("hedging", False))
+        self.settings_widgets["hedging"] = ctk.CTkCheckBox(
+            settings_frame,
+            text="Gửi request dự phòng khi chunk đầu hàng bị chậm",
+            variable=hedging_var
+        )
+        self.settings_widgets["hedging"].grid(row=row, column=1, padx=10, pady=5, sticky="w")
+        row += 1
+
+        # Prompt caching (checkbox) - cache system instruction phía provider
+        prompt_cache_label = ctk.CTkLabel(settings_frame, text="Prompt Cache:", font=ctk.CTkFont(weight="bold"))
+        prompt_cache_label.grid(row=row, column=0, padx=10, pady=5, sticky="w")
+        
+        prompt_cache_var = ctk.BooleanVar(value=current_settings.get("prompt_cache", False))
+        self.settings_widgets["prompt_cache"] = ctk.CTkCheckBox(
+            settings_frame,
+            text="Cache system instruction (giảm input tokens mỗi request)",
+            variable=prompt_cache_var
+        )
+        self.settings_widgets["prompt_cache"].grid(row=row, column=1, padx=10, pady=5, sticky="w")
+        row += 1
+
         # Temperature
         temp_label = ctk.CTkLabel(settings_frame, text="Temperature:", font=ctk.CTkFont(weight="bold"))
         temp_label.grid(row=row, column=0, padx=10, pady=5, sticky="w")
@@ -2521,8 +2576,29 @@ File tiến độ đã được lưu, bạn có thể tiếp tục dịch ngay s
             self.settings_widgets["thinking_budget_var"].set(default_settings["thinking_budget"])
             self.settings_widgets["thinking_budget_label"].configure(text=f"{default_settings['thinking_budget']} tokens")
         
+        # Update streaming checkbox
+        if "streaming" in self.settings_widgets:
+            if default_settings.get("streaming", False):
+                self.settings_widgets["streaming"].select()
+            else:
+                self.settings_widgets["streaming"].deselect()
+        
+        # Update hedging checkbox
+        if "hedging" in self.settings_widgets:
+            if default_settings.get("hedging", False):
+                self.settings_widgets["hedging"].select()
+            else:
+                self.settings_widgets["hedging"].deselect()
+        
+        # Update prompt cache checkbox
+        if "prompt_cache" in self.settings_widgets:
+            if default_settings.get("prompt_cache", False):
+                self.settings_widgets["prompt_cache"].select()
+            else:
+                self.settings_widgets["prompt_cache"].deselect()
+        
         # Update other widgets
-        skip_keys = ["thinking_mode", "thinking_budget_var", "thinking_budget_label", "thinking_budget"]
+        skip_keys = ["thinking_mode", "thinking_budget_var", "thinking_budget_label", "thinking_budget", "streaming", "hedging", "prompt_cache"]
         for key, widget in self.settings_widgets.items():
             if key not in skip_keys:
                 if hasattr(widget, 'delete'):  # Entry widget
@@ -2537,7 +2613,8 @@ File tiến độ đã được lưu, bạn có thể tiếp tục dịch ngay s
     def _save_model_settings(self, model_name):
         """Lưu cài đặt model."""
         try:
-            settings = {}
+            # Giữ lại các key nâng cao không có trên dialog (chỉnh tay trong settings.json)
+            settings = dict(self.model_settings.get(model_name, {}))
             
             # Get thinking mode
             settings["thinking_mode"] = self.settings_widgets["thinking_mode"].get()
@@ -2548,6 +2625,18 @@ File tiến độ đã được lưu, bạn có thể tiếp tục dịch ngay s
             else:
                 settings["thinking_budget"] = 0
             
+            # Get streaming mode
+            if "streaming" in self.settings_widgets:
+                settings["streaming"] = bool(self.settings_widgets["streaming"].get())
+            
+            # Get hedging mode
+            if "hedging" in self.settings_widgets:
+                settings["hedging"] = bool(self.settings_widgets["hedging"].get())
+            
+            # Get prompt cache mode
+            if "prompt_cache" in self.settings_widgets:
+                settings["prompt_cache"] = bool(self.settings_widgets["prompt_cache"].get())
+            
             # Get numeric values
             numeric_fields = ["temperature", "top_p", "frequency_penalty", "presence_penalty", "repetition_penalty", "min_p"]
             integer_fields = ["max_tokens", "top_k"]
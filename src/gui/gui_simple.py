@@ -15,6 +15,7 @@ try:
     from ..core.translate import translate_file_optimized, generate_output_filename
     from ..core.reformat import fix_text_format
     from ..core.ConvertEpub import txt_to_docx, docx_to_epub
+    from ..core.epub_writer import txt_to_epub
     TRANSLATE_AVAILABLE = True
     EPUB_AVAILABLE = True
 except ImportError as e:
@@ -476,14 +477,13 @@ class TranslateNovelAI:
         
         info_content = """
 📚 Chuyển đổi EPUB:
-• Chuyển đổi từ TXT → DOCX → EPUB
+• Chuyển đổi trực tiếp từ TXT → EPUB3
 • Tự động nhận diện chương dựa trên pattern regex
 • Hỗ trợ metadata (tiêu đề, tác giả)
 • Tạo mục lục tự động
 
 ⚙️ Yêu cầu:
-• Cài đặt Pandoc (https://pandoc.org/installing.html)
-• Cập nhật đường dẫn Pandoc trong file ConvertEpub.py
+• Không cần Pandoc hay python-docx
 
 🔧 Pattern mặc định:
 • ^Chương\\s+\\d+:\\s+.*$ (Chương 1: Tên chương)
@@ -901,32 +901,39 @@ class TranslateNovelAI:
         try:
             self.start_time = time.time()
             
+            model_settings = {"auto_reformat": self.auto_reformat_var.get()}  # Reformat khi ghi từng chunk
+            epub_file = os.path.splitext(output_file)[0] + ".epub"
+            if self.auto_convert_epub_var.get() and EPUB_AVAILABLE:
+                # Dựng EPUB trong lúc dịch, chương nào xong được render ngay
+                model_settings.update({
+                    "incremental_epub": True,
+                    "epub_path": epub_file,
+                    "epub_title": self.book_title_var.get() or os.path.splitext(os.path.basename(output_file))[0],
+                    "epub_author": self.book_author_var.get() or "Unknown Author",
+                    "epub_chapter_pattern": self.chapter_pattern_var.get() or r"^Chương\s+\d+:\s+.*$",
+                })
+            
             # Call translate function (logs will be captured automatically)
             success = translate_file_optimized(
                 input_file=input_file,
                 output_file=output_file,
                 api_key=api_key,
                 model_name=model_name,
-                system_instruction=system_instruction
+                system_instruction=system_instruction,
+                model_settings=model_settings
             )
             
             if success:
                 self.log("✅ Dịch hoàn thành!")
                 
-                # Auto reformat if enabled
-                if self.auto_reformat_var.get():
-                    self.log("🔄 Đang reformat file...")
-                    try:
-                        fix_text_format(output_file)
-                        self.log("✅ Reformat hoàn thành!")
-                    except Exception as e:
-                        self.log(f"⚠️ Lỗi reformat: {e}")
-                
                 # Auto convert to EPUB if enabled
                 if self.auto_convert_epub_var.get() and EPUB_AVAILABLE:
-                    self.log("📚 Đang convert sang EPUB...")
                     try:
-                        self.convert_to_epub(output_file)
+                        if os.path.exists(epub_file) and os.path.getmtime(epub_file) >= os.path.getmtime(output_file):
+                            self.log(f"✅ EPUB đã được dựng trong lúc dịch: {epub_file}")
+                        else:
+                            self.log("📚 Đang convert sang EPUB...")
+                            self.convert_to_epub(output_file)
                     except Exception as e:
                         self.log(f"⚠️ Lỗi convert EPUB: {e}")
                 
@@ -966,7 +973,6 @@ class TranslateNovelAI:
         try:
             # Generate file paths
             base_name = os.path.splitext(txt_file)[0]
-            docx_file = base_name + ".docx"
             epub_file = base_name + ".epub"
             
             # Get book info
@@ -974,19 +980,12 @@ class TranslateNovelAI:
             author = self.book_author_var.get() or "Unknown Author"
             pattern = self.chapter_pattern_var.get() or r"^Chương\s+\d+:\s+.*$"
             
-            # Convert TXT to DOCX
-            self.log("📄 Đang convert TXT → DOCX...")
-            if txt_to_docx(txt_file, docx_file, title, pattern):
-                self.log("✅ Convert TXT → DOCX hoàn thành!")
-                
-                # Convert DOCX to EPUB
-                self.log("📚 Đang convert DOCX → EPUB...")
-                if docx_to_epub(docx_file, epub_file, title, author):
-                    self.log(f"✅ Convert EPUB hoàn thành: {epub_file}")
-                else:
-                    self.log("❌ Convert DOCX → EPUB thất bại")
+            # Convert TXT trực tiếp sang EPUB (không qua DOCX/Pandoc)
+            self.log("📚 Đang convert TXT → EPUB...")
+            if txt_to_epub(txt_file, epub_file, title, author, pattern):
+                self.log(f"✅ Convert EPUB hoàn thành: {epub_file}")
             else:
-                self.log("❌ Convert TXT → DOCX thất bại")
+                self.log("❌ Convert TXT → EPUB thất bại")
                 
         except Exception as e:
             self.log(f"❌ Lỗi convert EPUB: {e}")
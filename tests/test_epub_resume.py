@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IncrementalEpubBuilder: dịch tiếp (resume từ epub_state) phải cho EPUB giống hệt
+lần dựng liền một mạch, kể cả khi bản dịch có xuống dòng \\r\\n.
+"""
+
+import os
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "core"))
+
+from epub_writer import IncrementalEpubBuilder
+
+# Model trả về lẫn \r\n và \n; chương 2 bị cắt ngang giữa 2 chunk
+CHUNKS = [
+    "Chương 1: Mở màn\r\n1: A\r\n\r\n1: B\r\n\r\nChương 2: Làng\n2: A\n",
+    "\n2: B\r\n\r\n2: C\n",
+    "Chương 3: Kết\r\n3: A\n",
+]
+
+
+def _write_chunks(builder, output_file, chunks, mode):
+    # Giống translate_file_optimized: output mở với newline="\n", feed đúng text vừa ghi
+    with open(output_file, mode, encoding="utf-8", newline="\n") as outfile:
+        for chunk in chunks:
+            outfile.write(chunk)
+            outfile.flush()
+            builder.feed(chunk)
+
+
+def _chapters(epub_path):
+    with zipfile.ZipFile(epub_path) as epub:
+        return {name: epub.read(name) for name in sorted(epub.namelist())
+                if name.endswith(".xhtml") and not name.endswith("nav.xhtml")}
+
+
+def _build(directory, interrupt_after=None):
+    output_file = os.path.join(directory, "book.txt")
+    epub_path = os.path.join(directory, "book.epub")
+    builder = IncrementalEpubBuilder(epub_path, "Book", preview_interval=0)
+    if interrupt_after is None:
+        _write_chunks(builder, output_file, CHUNKS, "w")
+    else:
+        _write_chunks(builder, output_file, CHUNKS[:interrupt_after], "w")
+        state = builder.get_state()   # Lưu cùng tiến độ, process bị dừng ở đây
+        builder = IncrementalEpubBuilder(epub_path, "Book", preview_interval=0)
+        builder.resume(output_file, state)
+        _write_chunks(builder, output_file, CHUNKS[interrupt_after:], "a")
+    return builder.finish()
+
+
+def test_resume_matches_uninterrupted_build(tmp_path):
+    expected = _chapters(_build(str(tmp_path / "full")))
+    assert len(expected) == 3
+
+    for interrupt_after in (1, 2):
+        directory = tmp_path / f"resume_{interrupt_after}"
+        assert _chapters(_build(str(directory), interrupt_after)) == expected
+
+
+def test_output_bytes_match_fed_offsets(tmp_path):
+    output_file = str(tmp_path / "book.txt")
+    builder = IncrementalEpubBuilder(str(tmp_path / "book.epub"), "Book", preview_interval=0)
+    _write_chunks(builder, output_file, CHUNKS, "w")
+    assert builder.offset == os.path.getsize(output_file)
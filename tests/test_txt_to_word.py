@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+txt_to_word: render song song theo chương (process pool) phải cho cùng các đoạn văn /
+tiêu đề như render tuần tự bằng python-docx.
+"""
+
+import os
+import sys
+
+import pytest
+
+docx = pytest.importorskip("docx")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "PyTool"))
+
+from txt_to_word import txt_to_word
+
+BOOK = (
+    "Lời giới thiệu của dịch giả.\n"
+    "\n"
+    "Chương 1: Mở màn\n"
+    "Dòng đầu của đoạn một.\n"
+    "Dòng hai của đoạn một.\n"
+    "\n"
+    "Đoạn hai.\n"
+    "\n"
+    "Chương 2\n"
+    "\n"
+    "Thân chương hai.\n"
+    "\n"
+    "Tiêu đề phụ\n"
+    "\n"
+    "Chương 3: Kết\r\n"
+    "\r\n"
+    "Đoạn cuối, có xuống dòng CRLF.\r\n"
+)
+
+
+def _paragraphs(docx_path):
+    return [(paragraph.text, paragraph.style.name) for paragraph in docx.Document(docx_path).paragraphs]
+
+
+def test_parallel_matches_sequential(tmp_path):
+    txt_path = tmp_path / "book.txt"
+    txt_path.write_bytes(BOOK.encode("utf-8"))
+
+    ok, sequential_path, error = txt_to_word(str(txt_path), str(tmp_path / "sequential"), workers=1)
+    assert ok, error
+    ok, parallel_path, error = txt_to_word(str(txt_path), str(tmp_path / "parallel"), workers=2)
+    assert ok, error
+
+    expected = _paragraphs(sequential_path)
+    assert ("Chương 1: Mở màn\nDòng đầu của đoạn một.\nDòng hai của đoạn một.", "Normal") in expected
+    assert ("Chương 2", "Heading 2") in expected
+    assert _paragraphs(parallel_path) == expected
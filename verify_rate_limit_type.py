@@ -79,3 +79,8 @@ print("   - Keys only for failover")
 print("\n❓ WAITING FOR USER CONFIRMATION:")
 print("   'Tất cả 11 keys của bạn có từ CÙNG 1 project không?'")
 print("="*70)
+
+print("\n📐 ĐO TỰ ĐỘNG:")
+print("   python calibrate_quota.py --keys KEY1,KEY2,KEY3 --model gemini-2.5-flash")
+print("   → Đo RPM/TPM thực tế + per-key/per-project, ghi rate_limits_profile.json")
+print("   → Rate limiter tự dùng profile này thay cho bảng tĩnh")